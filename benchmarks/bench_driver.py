@@ -0,0 +1,491 @@
+"""
+End to end benchmark suite of L3HeavenlyCloudShellDriver.
+
+Drives the driver commands through synthetic contexts and request json against an in process FakeHeavenlyCloud
+and a fake CloudShell API session, and reports latency percentiles and throughput per scenario.
+
+usage:
+    python benchmarks/bench_driver.py                                   run every scenario
+    python benchmarks/bench_driver.py -s deploy -s get_vm_details_1000  run scenarios whose name starts with ...
+    python benchmarks/bench_driver.py --save-baseline                   store results in benchmarks/baselines
+    python benchmarks/bench_driver.py --compare                         compare with the stored baseline
+    python benchmarks/bench_driver.py --fake-config benchmarks/fake_heavenly_cloud.json --time-scale 0.01
+"""
+
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from multiprocessing.pool import ThreadPool
+
+import driver_harness
+import request_factory
+
+from cpu_work_pool import cpu_work_pool
+from deployed_app_index import deployed_app_index, DeployedAppRecord
+from sandbox_reconciler import LIVE_STATUS_ONLINE
+from vm_details_cache import vm_details_cache
+from warm_pool import instance_pool, key_pair_pool, subnet_pool
+from sdk.fake_heavenly_cloud import FakeHeavenlyCloud, LatencyDistribution, OperationProfile
+from sdk.heavenly_cloud_service import HeavenlyCloudService, POWER_STATE_STOPPED
+
+BASELINES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines')
+DEFAULT_BASELINE = 'driver'
+
+# a scenario is slower than its baseline when its p50 or p90 grew by more than this ratio
+DEFAULT_REGRESSION_THRESHOLD = 0.25
+
+
+class Scenario(object):
+    def __init__(self, name, setup, iterations, concurrency=1, cpu_workers=None):
+        """
+        :param str name:
+        :param setup: function(driver, fake_cloud) -> command, a function running one command invocation
+        :param int iterations: number of command invocations
+        :param int concurrency: number of invocations running at the same time
+        :param int cpu_workers: processes of the driver cpu work pool, by default HEAVENLY_CLOUD_CPU_WORKERS decides
+        """
+        self.name = name
+        self.setup = setup
+        self.iterations = iterations
+        self.concurrency = concurrency
+        self.cpu_workers = cpu_workers
+
+
+class ScenarioResult(object):
+    def __init__(self, name, latencies, wall_time, errors):
+        """
+        :param str name:
+        :param list[float] latencies: seconds per invocation
+        :param float wall_time: seconds the whole scenario took
+        :param int errors: number of failed invocations
+        """
+        self.name = name
+        self.count = len(latencies)
+        self.errors = errors
+        latencies = sorted(latencies)
+        self.p50_ms = percentile(latencies, 50) * 1000
+        self.p90_ms = percentile(latencies, 90) * 1000
+        self.p99_ms = percentile(latencies, 99) * 1000
+        self.max_ms = (latencies[-1] if latencies else 0) * 1000
+        self.throughput_per_s = self.count / wall_time if wall_time else 0
+
+    def to_dict(self):
+        return {'count': self.count, 'errors': self.errors, 'p50_ms': self.p50_ms, 'p90_ms': self.p90_ms,
+                'p99_ms': self.p99_ms, 'max_ms': self.max_ms, 'throughput_per_s': self.throughput_per_s}
+
+
+def percentile(sorted_values, percent):
+    """
+    nearest rank percentile
+    """
+    if not sorted_values:
+        return 0
+    rank = int(math.ceil(percent / 100.0 * len(sorted_values))) - 1
+    return sorted_values[min(max(rank, 0), len(sorted_values) - 1)]
+
+
+# region scenarios
+
+def _deploy(deployment_path, subnet_count, provider_latency=None, warm_pool_max_size='0'):
+    """
+    :param float provider_latency: seconds the fake provider takes to create an instance
+    :param str warm_pool_max_size: Warm Instance Pool Max Size of the cloud provider resource
+    """
+    def setup(driver, fake_cloud):
+        request = request_factory.deploy_request(subnet_count, deployment_path=deployment_path)
+        attributes = driver_harness.cloud_provider_attributes(**{'Warm Instance Pool Max Size': warm_pool_max_size})
+        if provider_latency:
+            for operation_name in ('create_angel_instance', 'create_man_instance', 'create_stopped_angel_instance',
+                                   'create_stopped_man_instance'):
+                fake_cloud.operation_profiles[operation_name] = OperationProfile(
+                    latency=LatencyDistribution.constant(provider_latency))
+            # activating a stopped instance renames it, attaches its network interfaces and powers it on
+            fake_cloud.operation_profiles['activate_instance'] = OperationProfile(
+                latency=LatencyDistribution.constant(provider_latency / 10))
+
+        return lambda: driver.Deploy(driver_harness.resource_context(attributes=attributes), request,
+                                     driver_harness.cancellation_context())
+
+    return setup
+
+
+def _get_vm_details(item_count, cached=True):
+    """
+    :param bool cached: False to build every VmDetailsData again, as on the first open of the VM details panel
+    """
+    def setup(driver, fake_cloud):
+        request = driver_harness.vm_details_request(fake_cloud.seed_instances(item_count))
+
+        def command():
+            if not cached:
+                vm_details_cache.clear()
+            return driver.GetVmDetails(driver_harness.resource_context(), request,
+                                       driver_harness.cancellation_context())
+
+        return command
+
+    return setup
+
+
+def _prepare_sandbox_infra(subnet_count, provider_latency=None, warm_pool_size='0'):
+    """
+    :param float provider_latency: seconds the fake provider takes to create a subnet or a key pair
+    :param str warm_pool_size: Warm Subnet Pool Size and Warm Key Pair Pool Size of the cloud provider resource
+    """
+    def setup(driver, fake_cloud):
+        request = request_factory.prepare_sandbox_infra_request(subnet_count)
+        attributes = driver_harness.cloud_provider_attributes(**{'Warm Subnet Pool Size': warm_pool_size,
+                                                                 'Warm Key Pair Pool Size': warm_pool_size})
+        if provider_latency:
+            for operation_name in ('prepare_subnet', 'create_unassigned_subnet', 'get_or_create_ssh_key',
+                                   'create_ssh_key'):
+                fake_cloud.operation_profiles[operation_name] = OperationProfile(
+                    latency=LatencyDistribution.constant(provider_latency))
+            # assigning a ready subnet only updates its cidr
+            fake_cloud.operation_profiles['assign_subnet'] = OperationProfile(
+                latency=LatencyDistribution.constant(provider_latency / 10))
+
+        return lambda: driver.PrepareSandboxInfra(driver_harness.resource_context(attributes=attributes), request,
+                                                  driver_harness.cancellation_context())
+
+    return setup
+
+
+def _recycled_driver_get_vm_details(driver, fake_cloud):
+    """
+    CloudShell destroys and creates drivers often, every invocation runs on a new driver
+    """
+    request = driver_harness.vm_details_request(fake_cloud.seed_instances(10))
+
+    def command():
+        recycled_driver = driver_harness.create_driver()
+        try:
+            return recycled_driver.GetVmDetails(driver_harness.resource_context(), request,
+                                                driver_harness.cancellation_context())
+        finally:
+            recycled_driver.cleanup()
+
+    return command
+
+
+def _get_inventory(driver, fake_cloud):
+    return lambda: driver.get_inventory(driver_harness.autoload_context())
+
+
+def _power(command_name, provider_rate_limit=None, api_rate_limit=''):
+    """
+    :param float provider_rate_limit: power operations per second the fake provider serves before throttling
+    :param str api_rate_limit: API Rate Limit attribute of the cloud provider resource
+    """
+    def setup(driver, fake_cloud):
+        instances = fake_cloud.seed_instances(50)
+        counter = [0]
+        lock = threading.Lock()
+        attributes = driver_harness.cloud_provider_attributes(**{'API Rate Limit': api_rate_limit})
+        if provider_rate_limit:
+            for operation_name in ('power_on', 'power_off'):
+                fake_cloud.operation_profiles[operation_name] = OperationProfile(rate_limit=provider_rate_limit,
+                                                                                 burst=10)
+
+        def command():
+            with lock:
+                instance = instances[counter[0] % len(instances)]
+                counter[0] += 1
+            getattr(driver, command_name)(driver_harness.remote_context(instance.name, instance.id,
+                                                                        instance.private_ip, instance.public_ip,
+                                                                        attributes=attributes),
+                                          [])
+
+        return command
+
+    return setup
+
+
+def _remote_refresh_ip(driver, fake_cloud):
+    instances = fake_cloud.seed_instances(50)
+
+    def command():
+        instance = instances[0]
+        driver.remote_refresh_ip(driver_harness.remote_context(instance.name, instance.id, '0.0.0.0'), [],
+                                 driver_harness.cancellation_context())
+
+    return command
+
+
+def _reconcile_sandbox(app_count, mode, drifting_apps):
+    def setup(driver, fake_cloud):
+        instances = fake_cloud.seed_instances(app_count)
+        reservation_id = str(uuid.uuid4())
+        cloudshell_session = driver_harness.FakeCloudShellSession()
+        for instance in instances:
+            cloudshell_session.add_deployed_app(reservation_id, instance.name, instance.id, instance.private_ip)
+        deployed_app_index.put_all([DeployedAppRecord(instance.name, instance.id, instance.private_ip,
+                                                      instance.public_ip, reservation_id,
+                                                      driver_harness.CLOUD_PROVIDER_NAME, LIVE_STATUS_ONLINE)
+                                    for instance in instances])
+        counter = [0]
+
+        def command():
+            # a few instances change between two runs, like in a sandbox people work in
+            for _ in range(drifting_apps):
+                instance = instances[counter[0] % len(instances)]
+                counter[0] += 1
+                fake_cloud.change_instance(instance.id, power_state=POWER_STATE_STOPPED)
+            with driver_harness.fake_cloudshell_session(cloudshell_session):
+                driver.ReconcileSandbox(driver_harness.resource_context(reservation_id), mode)
+
+        return command
+
+    return setup
+
+
+SCENARIOS = [
+    Scenario('deploy_angel', _deploy(request_factory.ANGEL_DEPLOYMENT_PATH, 2), 200),
+    Scenario('deploy_man', _deploy(request_factory.MAN_DEPLOYMENT_PATH, 2), 200),
+    Scenario('deploy_angel_concurrent_8', _deploy(request_factory.ANGEL_DEPLOYMENT_PATH, 2), 200, concurrency=8),
+    Scenario('deploy_angel_64_nics', _deploy(request_factory.ANGEL_DEPLOYMENT_PATH, 64), 100),
+    Scenario('deploy_angel_slow_provider', _deploy(request_factory.ANGEL_DEPLOYMENT_PATH, 2, provider_latency=0.02),
+             50),
+    Scenario('deploy_angel_warm_pool', _deploy(request_factory.ANGEL_DEPLOYMENT_PATH, 2, provider_latency=0.02,
+                                               warm_pool_max_size='8'), 50),
+    Scenario('get_vm_details_10', _get_vm_details(10), 200),
+    Scenario('get_vm_details_100', _get_vm_details(100), 50),
+    Scenario('get_vm_details_1000', _get_vm_details(1000), 10),
+    Scenario('get_vm_details_10000', _get_vm_details(10000), 3),
+    Scenario('get_vm_details_1000_uncached', _get_vm_details(1000, cached=False), 10),
+    Scenario('get_vm_details_10_recycled_driver', _recycled_driver_get_vm_details, 200),
+    Scenario('get_vm_details_100_duplicates_8', _get_vm_details(100, cached=False), 80, concurrency=8),
+    Scenario('prepare_sandbox_infra_100', _prepare_sandbox_infra(100), 20),
+    Scenario('prepare_sandbox_infra_1000', _prepare_sandbox_infra(1000), 5),
+    Scenario('prepare_infra_1000_concurrent_8', _prepare_sandbox_infra(1000), 16, concurrency=8,
+             cpu_workers=0),
+    Scenario('prepare_infra_1000_cpu_pool_8', _prepare_sandbox_infra(1000), 16, concurrency=8,
+             cpu_workers=multiprocessing.cpu_count()),
+    Scenario('prepare_sandbox_infra_4_slow_provider', _prepare_sandbox_infra(4, provider_latency=0.01), 20),
+    Scenario('prepare_sandbox_infra_4_warm_pools', _prepare_sandbox_infra(4, provider_latency=0.01,
+                                                                          warm_pool_size='8'), 20),
+    Scenario('get_inventory', _get_inventory, 200),
+    Scenario('power_on', _power('PowerOn'), 200),
+    Scenario('power_off', _power('PowerOff'), 200),
+    Scenario('power_on_concurrent_8', _power('PowerOn'), 200, concurrency=8),
+    Scenario('power_on_throttled_8', _power('PowerOn', provider_rate_limit=500, api_rate_limit='450'), 200,
+             concurrency=8),
+    Scenario('remote_refresh_ip', _remote_refresh_ip, 200),
+    Scenario('reconcile_1000_full', _reconcile_sandbox(1000, 'full', 10), 20),
+    Scenario('reconcile_1000_incremental', _reconcile_sandbox(1000, 'incremental', 10), 20),
+]
+
+# endregion
+
+
+def run_scenario(scenario, fake_cloud, iterations=None):
+    """
+    :param Scenario scenario:
+    :param FakeHeavenlyCloud fake_cloud:
+    :param int iterations: overrides the scenario iterations
+    :rtype: ScenarioResult
+    """
+    cpu_workers = cpu_work_pool.processes
+    if scenario.cpu_workers is not None:
+        cpu_work_pool.configure(scenario.cpu_workers)
+    try:
+        return _run_scenario(scenario, fake_cloud, iterations)
+    finally:
+        if scenario.cpu_workers is not None:
+            cpu_work_pool.configure(cpu_workers)
+        # the ready subnets, key pairs and instances belong to the fake cloud of this scenario
+        subnet_pool.close()
+        key_pair_pool.close()
+        instance_pool.close()
+
+
+def _run_scenario(scenario, fake_cloud, iterations):
+    driver = driver_harness.create_driver()
+    command = scenario.setup(driver, fake_cloud)
+    iterations = iterations or scenario.iterations
+    errors = [0]
+    errors_lock = threading.Lock()
+
+    def timed(_):
+        start = time.time()
+        try:
+            command()
+        except Exception:
+            with errors_lock:
+                errors[0] += 1
+        return time.time() - start
+
+    # warm up caches, loggers and lazy imports outside of the measurement
+    timed(None)
+
+    start = time.time()
+    if scenario.concurrency > 1:
+        pool = ThreadPool(scenario.concurrency)
+        try:
+            latencies = pool.map(timed, range(iterations))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        latencies = [timed(i) for i in range(iterations)]
+    wall_time = time.time() - start
+
+    driver.cleanup()
+    return ScenarioResult(scenario.name, latencies, wall_time, errors[0])
+
+
+def select_scenarios(prefixes=None):
+    """
+    :param list[str] prefixes: scenario name prefixes, all the scenarios when empty
+    :rtype: list[Scenario]
+    """
+    return [scenario for scenario in SCENARIOS
+            if not prefixes or any(scenario.name.startswith(prefix) for prefix in prefixes)]
+
+
+def run(scenarios=None, fake_config=None, time_scale=None, iterations=None):
+    """
+    :param list[Scenario] scenarios: scenarios to run, all of them by default
+    :param dict fake_config: FakeHeavenlyCloud config, zero latency by default to measure the driver itself
+    :param float time_scale: overrides the fake config time scale
+    :param int iterations: overrides the iterations of every scenario
+    :rtype: list[ScenarioResult]
+    """
+    results = []
+    with driver_harness.fake_cloudshell_session():
+        for scenario in scenarios or SCENARIOS:
+            fake_cloud = FakeHeavenlyCloud.from_config(fake_config)
+            if time_scale is not None:
+                fake_cloud.time_scale = time_scale
+            HeavenlyCloudService.set_backend(fake_cloud)
+            try:
+                results.append(run_scenario(scenario, fake_cloud, iterations))
+            finally:
+                HeavenlyCloudService.set_backend(None)
+
+    driver_harness.flush_cloudshell_logs()
+    return results
+
+
+# region baselines
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except Exception:
+        return 'unknown'
+
+
+def baseline_path(name):
+    return os.path.join(BASELINES_DIR, name + '.json')
+
+
+def save_baseline(results, name=DEFAULT_BASELINE):
+    if not os.path.isdir(BASELINES_DIR):
+        os.makedirs(BASELINES_DIR)
+
+    path = baseline_path(name)
+    baseline = load_baseline(name) or {'scenarios': {}}
+    baseline['commit'] = _git_commit()
+    baseline['python'] = platform.python_version()
+    baseline['platform'] = platform.platform()
+    baseline['scenarios'].update((result.name, result.to_dict()) for result in results)
+
+    with open(path, 'w') as baseline_file:
+        json.dump(baseline, baseline_file, indent=2, sort_keys=True, separators=(',', ': '))
+    return path
+
+
+def load_baseline(name=DEFAULT_BASELINE):
+    path = baseline_path(name)
+    if not os.path.exists(path):
+        return None
+    with open(path) as baseline_file:
+        return json.load(baseline_file)
+
+
+def compare(results, baseline, threshold=DEFAULT_REGRESSION_THRESHOLD):
+    """
+    :return: (result, baseline of its scenario or None, regressed) per result
+    :rtype: list[tuple[ScenarioResult, dict, bool]]
+    """
+    comparison = []
+    for result in results:
+        base = baseline['scenarios'].get(result.name)
+        regressed = bool(base) and any(getattr(result, key) > base[key] * (1 + threshold)
+                                       for key in ('p50_ms', 'p90_ms'))
+        comparison.append((result, base, regressed))
+    return comparison
+
+# endregion
+
+
+def print_results(results):
+    print('{0:<32}{1:>7}{2:>7}{3:>11}{4:>11}{5:>11}{6:>11}{7:>12}'.format('scenario', 'count', 'errors', 'p50 ms',
+                                                                          'p90 ms', 'p99 ms', 'max ms', 'ops/s'))
+    for result in results:
+        print('{0:<32}{1:>7}{2:>7}{3:>11.2f}{4:>11.2f}{5:>11.2f}{6:>11.2f}{7:>12.1f}'.format(
+            result.name, result.count, result.errors, result.p50_ms, result.p90_ms, result.p99_ms, result.max_ms,
+            result.throughput_per_s))
+
+
+def print_comparison(baseline, comparison):
+    print('\ncompared with baseline of commit {0}'.format(baseline.get('commit')))
+    print('{0:<32}{1:>14}{2:>14}{3:>14}{4:>14}'.format('scenario', 'p50 ms', 'base p50', 'p90 ms', 'base p90'))
+    for result, base, regressed in comparison:
+        if not base:
+            print('{0:<32}{1:>14.2f}{2:>14}'.format(result.name, result.p50_ms, '-'))
+            continue
+        print('{0:<32}{1:>14.2f}{2:>14.2f}{3:>14.2f}{4:>14.2f}{5}'.format(result.name, result.p50_ms,
+                                                                        base['p50_ms'], result.p90_ms,
+                                                                        base['p90_ms'],
+                                                                        '  REGRESSION' if regressed else ''))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='L3HeavenlyCloudShellDriver benchmark suite')
+    parser.add_argument('-s', '--scenario', action='append', help='run scenarios whose name starts with this')
+    parser.add_argument('-n', '--iterations', type=int, help='override the iterations of every scenario')
+    parser.add_argument('--fake-config', help='FakeHeavenlyCloud json config, zero latency by default')
+    parser.add_argument('--time-scale', type=float, help='multiply the fake provider latencies')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='baseline name under benchmarks/baselines')
+    parser.add_argument('--save-baseline', action='store_true', help='store the results as the baseline')
+    parser.add_argument('--compare', action='store_true', help='compare with the baseline, exit 1 on regression')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_REGRESSION_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    fake_config = None
+    if args.fake_config:
+        with open(args.fake_config) as config_file:
+            fake_config = json.load(config_file)
+
+    results = run(select_scenarios(args.scenario), fake_config, args.time_scale, args.iterations)
+    print_results(results)
+
+    if args.compare:
+        baseline = load_baseline(args.baseline)
+        if baseline is None:
+            print('\nno baseline named ' + args.baseline)
+        else:
+            comparison = compare(results, baseline, args.threshold)
+            print_comparison(baseline, comparison)
+            if any(regressed for _, _, regressed in comparison):
+                return 1
+
+    if args.save_baseline:
+        print('\nbaseline saved to ' + save_baseline(results, args.baseline))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
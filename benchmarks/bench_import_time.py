@@ -0,0 +1,101 @@
+"""
+Cold start cost of importing the driver, reported like python 3 -X importtime: the self and cumulative time of
+every module import, indented by nesting, measured in a fresh interpreter by wrapping __import__.
+
+usage:
+    python benchmarks/bench_import_time.py                    report for 'driver'
+    python benchmarks/bench_import_time.py driver data_model   report for other modules
+    python benchmarks/bench_import_time.py --top 20            only the 20 slowest imports
+    python benchmarks/bench_import_time.py --repeat 5          median total of 5 fresh interpreters
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(os.path.dirname(BENCHMARKS_DIR), 'src')
+
+# runs in the fresh interpreter, prints the import records as json
+_PROFILER = r'''
+import sys
+import time
+import __builtin__
+
+records = []
+stack = []
+original_import = __builtin__.__import__
+
+
+def timed_import(name, globals=None, locals=None, fromlist=None, level=-1):
+    before = set(sys.modules)
+    record = [name, len(stack), time.time(), 0.0, 0.0]
+    stack.append(record)
+    try:
+        return original_import(name, globals, locals, fromlist, level)
+    finally:
+        stack.pop()
+        record[3] = time.time() - record[2]
+        if set(sys.modules) - before:
+            # only imports that loaded a module are reported, the nested ones are charged to their parent
+            records.append(record)
+            if stack:
+                stack[-1][4] += record[3]
+
+
+__builtin__.__import__ = timed_import
+start = time.time()
+for module_name in sys.argv[1:]:
+    __import__(module_name)
+total = time.time() - start
+__builtin__.__import__ = original_import
+
+import json
+sys.stdout.write(json.dumps({'total': total, 'modules': len(sys.modules),
+                             'imports': [(name, depth, cumulative, cumulative - nested, start_time)
+                                         for name, depth, start_time, cumulative, nested in records]}))
+'''
+
+
+def measure(module_names):
+    """
+    :param list[str] module_names: modules to import in a fresh interpreter
+    :return: total seconds, number of loaded modules and (name, depth, cumulative, self, start) per import
+    :rtype: dict
+    """
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [SRC_DIR, env.get('PYTHONPATH')]))
+    # -B so stale .pyc files are not written, compiled files already on disk are used like in production
+    output = subprocess.check_output([sys.executable, '-B', '-c', _PROFILER] + module_names, env=env,
+                                     cwd=SRC_DIR)
+    return json.loads(output)
+
+
+def print_report(result, top=None):
+    imports = sorted(result['imports'], key=lambda record: record[4])
+    if top:
+        slowest = set(id(record) for record in sorted(imports, key=lambda record: -record[3])[:top])
+        imports = [record for record in imports if id(record) in slowest]
+
+    print('{0:>12} | {1:>12} | {2}'.format('self [us]', 'cumulative', 'imported package'))
+    for name, depth, cumulative, self_time, _ in imports:
+        print('{0:>12} | {1:>12} | {2}{3}'.format(int(self_time * 1e6), int(cumulative * 1e6), '  ' * depth, name))
+    print('\n{0:.1f} ms, {1} modules loaded'.format(result['total'] * 1000, result['modules']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='driver import time report')
+    parser.add_argument('modules', nargs='*', default=['driver'])
+    parser.add_argument('--top', type=int, help='only report the slowest imports')
+    parser.add_argument('--repeat', type=int, default=1, help='fresh interpreters to measure, the median is shown')
+    args = parser.parse_args(argv)
+
+    results = sorted((measure(args.modules) for _ in range(args.repeat)), key=lambda result: result['total'])
+    print_report(results[len(results) // 2], args.top)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,89 @@
+"""
+Compares the original DriverRequestParser flow (convert everything, then scan the action list per type with
+single/filter) with the IndexedDriverRequestParser front end on requests with thousands of subnet actions.
+
+usage: python benchmarks/bench_request_parser.py [subnet_count ...]
+"""
+
+import sys
+import timeit
+
+import request_factory
+
+from cloudshell.cp.core import DriverRequestParser
+from cloudshell.cp.core.models import DeployApp, ConnectSubnet, PrepareCloudInfra, CreateKeys, PrepareSubnet
+from cloudshell.cp.core.utils import single
+
+from data_model import HeavenlyCloudAngelDeploymentModel, HeavenlyCloudManDeploymentModel
+from driver_request_index import IndexedDriverRequestParser
+
+REPEAT = 5
+
+
+def _create_parser(parser_cls):
+    parser = parser_cls()
+    parser.add_deployment_model(HeavenlyCloudAngelDeploymentModel)
+    parser.add_deployment_model(HeavenlyCloudManDeploymentModel)
+    return parser
+
+
+def original_deploy(parser, request):
+    actions = parser.convert_driver_request_to_actions(request)
+    single(actions, lambda x: isinstance(x, DeployApp))
+    list(filter(lambda x: isinstance(x, ConnectSubnet), actions))
+
+
+def indexed_deploy(parser, request):
+    actions = parser.parse(request)
+    actions.single(DeployApp)
+    actions.of_type(ConnectSubnet)
+
+
+def original_prepare_sandbox_infra(parser, request):
+    actions = parser.convert_driver_request_to_actions(request)
+    single(actions, lambda x: isinstance(x, PrepareCloudInfra))
+    single(actions, lambda x: isinstance(x, CreateKeys))
+    list(filter(lambda x: isinstance(x, PrepareSubnet), actions))
+
+
+def indexed_prepare_sandbox_infra(parser, request):
+    actions = parser.parse(request)
+    actions.single(PrepareCloudInfra)
+    actions.single(CreateKeys)
+    actions.of_type(PrepareSubnet)
+
+
+def indexed_deploy_action_only(parser, request):
+    # e.g. validating the deployment path before touching the subnet actions
+    parser.parse(request).single(DeployApp)
+
+
+def _best_of(func, parser, request):
+    return min(timeit.repeat(lambda: func(parser, request), number=1, repeat=REPEAT))
+
+
+def run(subnet_counts):
+    original_parser = _create_parser(DriverRequestParser)
+    indexed_parser = _create_parser(IndexedDriverRequestParser)
+
+    print('{0:<40}{1:>10}{2:>14}{3:>14}{4:>10}'.format('scenario', 'actions', 'original ms', 'indexed ms',
+                                                         'speedup'))
+    for subnet_count in subnet_counts:
+        deploy_request = request_factory.deploy_request(subnet_count)
+        infra_request = request_factory.prepare_sandbox_infra_request(subnet_count)
+
+        scenarios = [('Deploy', original_deploy, indexed_deploy, deploy_request),
+                     ('Deploy (DeployApp only)', original_deploy, indexed_deploy_action_only, deploy_request),
+                     ('PrepareSandboxInfra', original_prepare_sandbox_infra, indexed_prepare_sandbox_infra,
+                      infra_request)]
+
+        for name, original, indexed, request in scenarios:
+            original_time = _best_of(original, original_parser, request)
+            indexed_time = _best_of(indexed, indexed_parser, request)
+            print('{0:<40}{1:>10}{2:>14.2f}{3:>14.2f}{4:>9.1f}x'.format(name, subnet_count, original_time * 1000,
+                                                                       indexed_time * 1000,
+                                                                       original_time / indexed_time))
+
+
+if __name__ == '__main__':
+    run([int(arg) for arg in sys.argv[1:]] or [1000, 5000, 10000])
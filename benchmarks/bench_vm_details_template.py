@@ -0,0 +1,86 @@
+"""
+Compares building the VM details of many instances property by property, the way extract_vm_instance_data and
+extract_vm_instance_network_data did before VmDetailsTemplate, with building them from the precompiled template.
+Reports build time and the objects the built details keep alive, counted with the gc module since tracemalloc is
+not available on python 2.
+
+usage: python benchmarks/bench_vm_details_template.py [instance_count ...]
+"""
+
+import gc
+import sys
+import timeit
+import uuid
+
+import request_factory  # puts src on sys.path
+
+from cloudshell.cp.core.models import VmDetailsData, VmDetailsProperty, VmDetailsNetworkInterface
+
+from data_model import HeavenResidentInstance
+from vm_details_template import DEFAULT_TEMPLATE
+
+REPEAT = 5
+
+
+def per_instance_details(vm_instance):
+    vm_instance_data = [
+        VmDetailsProperty(key='Cloud Size', value='not so big'),
+        VmDetailsProperty(key='Instance Name', value='dummy' if not vm_instance else vm_instance.name),
+        VmDetailsProperty(key='Hidden stuff', value='something not for UI', hidden=True),
+    ]
+
+    vm_network_data = []
+    for i in range(2):
+        network_data = [
+            VmDetailsProperty(key='Device Index', value=str(i)),
+            VmDetailsProperty(key='MAC Address', value=str(uuid.uuid4())),
+            VmDetailsProperty(key='Speed', value='1KB'),
+        ]
+        vm_network_data.append(VmDetailsNetworkInterface(interfaceId=i, networkId=i, isPrimary=i == 0,
+                                                         isPredefined=False, networkData=network_data,
+                                                         privateIpAddress='10.0.0.' + str(i),
+                                                         publicIpAddress='8.8.8.' + str(i)))
+
+    return VmDetailsData(vmInstanceData=vm_instance_data, vmNetworkData=vm_network_data, appName=vm_instance.name)
+
+
+def template_details(vm_instance):
+    return VmDetailsData(vmInstanceData=DEFAULT_TEMPLATE.instance_data(vm_instance),
+                         vmNetworkData=DEFAULT_TEMPLATE.network_data(vm_instance), appName=vm_instance.name)
+
+
+def _build_all(build, vm_instances):
+    return [build(vm_instance) for vm_instance in vm_instances]
+
+
+def _retained_objects(build, vm_instances):
+    gc.collect()
+    before = len(gc.get_objects())
+    details = _build_all(build, vm_instances)
+    gc.collect()
+    retained = len(gc.get_objects()) - before
+    del details
+    return retained
+
+
+def _best_of(build, vm_instances):
+    return min(timeit.repeat(lambda: _build_all(build, vm_instances), number=1, repeat=REPEAT))
+
+
+def run(instance_counts):
+    print('{0:>10}{1:>14}{2:>14}{3:>10}{4:>18}{5:>18}'.format('instances', 'per inst ms', 'template ms', 'speedup',
+                                                              'per inst objects', 'template objects'))
+    for instance_count in instance_counts:
+        vm_instances = [HeavenResidentInstance('vm{0}'.format(i), 'description', 'image', 'cloud', str(uuid.uuid4()),
+                                               '10.0.0.1', '8.8.8.8')
+                        for i in range(instance_count)]
+
+        per_instance_time = _best_of(per_instance_details, vm_instances)
+        template_time = _best_of(template_details, vm_instances)
+        print('{0:>10}{1:>14.2f}{2:>14.2f}{3:>9.1f}x{4:>18}{5:>18}'.format(
+            instance_count, per_instance_time * 1000, template_time * 1000, per_instance_time / template_time,
+            _retained_objects(per_instance_details, vm_instances), _retained_objects(template_details, vm_instances)))
+
+
+if __name__ == '__main__':
+    run([int(arg) for arg in sys.argv[1:]] or [1000, 10000])
@@ -0,0 +1,270 @@
+"""
+Synthetic CloudShell contexts and a fake CloudShell API session to drive L3HeavenlyCloudShellDriver offline
+"""
+
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import request_factory
+
+from mock import patch
+
+from cloudshell.shell.core.driver_context import ResourceCommandContext, ResourceRemoteCommandContext, \
+    AutoLoadCommandContext, InitCommandContext, ConnectivityContext, ResourceContextDetails, \
+    ReservationContextDetails, AppContext, CancellationContext
+
+CLOUD_PROVIDER_NAME = 'heavenly cloud'
+CLOUD_PROVIDER_MODEL = 'L3HeavenlyCloudShell'
+
+# keep the cloudshell loggers of benchmark runs away from the package folder
+os.environ.setdefault('LOG_PATH', os.path.join(tempfile.gettempdir(), 'heavenly_cloud_benchmark_logs'))
+# and the deployed app index of benchmark runs away from the one of real driver runs on the same machine,
+# every run starts from an empty index so the results do not depend on the apps earlier runs deployed
+if 'HEAVENLY_CLOUD_APP_INDEX' not in os.environ:
+    os.environ['HEAVENLY_CLOUD_APP_INDEX'] = os.path.join(tempfile.gettempdir(),
+                                                          'heavenly_cloud_benchmark_deployed_apps.sqlite')
+    for index_file in glob.glob(os.environ['HEAVENLY_CLOUD_APP_INDEX'] + '*'):
+        os.remove(index_file)
+
+
+def cloud_provider_attributes(**overrides):
+    attributes = {
+        'L3HeavenlyCloudShell.User': 'admin',
+        'L3HeavenlyCloudShell.Password': 'encrypted_password',
+        'L3HeavenlyCloudShell.Heaven cloud color': 'white',
+        'L3HeavenlyCloudShell.Region': 'narnia',
+        'L3HeavenlyCloudShell.Default storage': 'cloud',
+        'L3HeavenlyCloudShell.Networking type': 'L3',
+    }
+    attributes.update(('L3HeavenlyCloudShell.' + name, value) for name, value in overrides.items())
+    return attributes
+
+
+def _connectivity():
+    return ConnectivityContext(server_address='localhost', cloudshell_api_port='8029', quali_api_port='9000',
+                               admin_auth_token='token', cloudshell_version='8.3', cloudshell_api_scheme='http')
+
+
+def _cloud_provider_details(attributes=None, app_context=None):
+    return ResourceContextDetails(id=CLOUD_PROVIDER_NAME, name=CLOUD_PROVIDER_NAME, fullname=CLOUD_PROVIDER_NAME,
+                                  type='Resource', address='heaven.example.com', model=CLOUD_PROVIDER_MODEL,
+                                  family='Cloud Provider', description='', attributes=attributes or
+                                  cloud_provider_attributes(), app_context=app_context, networks_info=None,
+                                  shell_standard='cloudshell_cloud_provider_standard',
+                                  shell_standard_version='1.0.0')
+
+
+def _reservation(reservation_id):
+    return ReservationContextDetails(environment_name='benchmark', environment_path='benchmark', domain='Global',
+                                     description='', owner_user='admin', owner_email='',
+                                     reservation_id=reservation_id)
+
+
+def init_context(attributes=None):
+    return InitCommandContext(_connectivity(), _cloud_provider_details(attributes))
+
+
+def autoload_context(attributes=None):
+    return AutoLoadCommandContext(_connectivity(), _cloud_provider_details(attributes))
+
+
+def resource_context(reservation_id='reservation', attributes=None):
+    return ResourceCommandContext(_connectivity(), _cloud_provider_details(attributes), _reservation(reservation_id),
+                                  [])
+
+
+def deployed_app_json(name, vm_uid, address='192.168.0.1', public_ip='8.8.8.1', deployment_path=None):
+    return json.dumps({
+        'name': name,
+        'family': 'Generic App Family',
+        'model': 'Generic App Model',
+        'address': address,
+        'attributes': [{'name': 'User', 'value': 'admin'},
+                       {'name': 'Password', 'value': 'encrypted_password'},
+                       {'name': 'Public IP', 'value': public_ip}],
+        'vmdetails': {'id': str(uuid.uuid4()), 'uid': vm_uid, 'cloudProviderId': CLOUD_PROVIDER_NAME,
+                      'vmCustomParams': [{'name': 'Reservation Id', 'value': 'reservation'}],
+                      'deploymentPath': deployment_path or request_factory.ANGEL_DEPLOYMENT_PATH}
+    })
+
+
+def remote_context(app_name, vm_uid, address='192.168.0.1', public_ip='8.8.8.1', reservation_id='reservation',
+                   attributes=None):
+    app_json = deployed_app_json(app_name, vm_uid, address, public_ip)
+    endpoint = ResourceContextDetails(id=app_name, name=app_name, fullname=app_name, type='Resource', address=address,
+                                      model='Generic App Model', family='Generic App Family', description='',
+                                      attributes={}, app_context=AppContext('', app_json), networks_info=None,
+                                      shell_standard='', shell_standard_version='')
+    return ResourceRemoteCommandContext(_connectivity(), _cloud_provider_details(attributes),
+                                        _reservation(reservation_id), [endpoint])
+
+
+def vm_details_request(vm_instances, deployment_path=None):
+    """
+    :param list vm_instances: objects with id, name and private_ip, e.g. FakeInstance
+    :rtype: str
+    """
+    return json.dumps({'items': [{'appRequestJson': {'deploymentService': {
+                                      'model': deployment_path or request_factory.ANGEL_DEPLOYMENT_PATH}},
+                                  'deployedAppJson': json.loads(deployed_app_json(instance.name, instance.id,
+                                                                                  instance.private_ip))}
+                                 for instance in vm_instances]})
+
+
+def cancellation_context():
+    return CancellationContext()
+
+
+class _DecryptedValue(object):
+    def __init__(self, value):
+        self.Value = value
+
+
+class _ReservedResource(object):
+    def __init__(self, name, address, vm_uid, cloud_provider):
+        self.Name = name
+        self.FullAddress = address
+        self.VmDetails = _VmDetails(vm_uid, cloud_provider)
+
+
+class _VmDetails(object):
+    def __init__(self, vm_uid, cloud_provider):
+        self.UID = vm_uid
+        self.CloudProviderFullName = cloud_provider
+
+
+class _ResourceLiveStatus(object):
+    def __init__(self, name, description):
+        self.liveStatusName = name
+        self.liveStatusDescription = description
+
+
+class _ReservationDetails(object):
+    def __init__(self, resources):
+        self.ReservationDescription = _ReservationDescription(resources)
+
+
+class _ReservationDescription(object):
+    def __init__(self, resources):
+        self.Resources = resources
+
+
+class FakeCloudShellSession(object):
+    """
+    The CloudShell API calls the driver makes, answered locally
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.resource_addresses = {}
+        self.attribute_values = {}
+        self.live_statuses = {}
+        self.reserved_resources = {}  # reservation id -> list of _ReservedResource
+        self.calls = {}
+
+    def add_deployed_app(self, reservation_id, name, vm_uid, address='192.168.0.1',
+                         cloud_provider=CLOUD_PROVIDER_NAME, live_status='Online'):
+        """
+        Adds a deployed app to the reservation details
+        """
+        self.reserved_resources.setdefault(reservation_id, []).append(
+            _ReservedResource(name, address, vm_uid, cloud_provider))
+        self.resource_addresses[name] = address
+        self.live_statuses[name] = (live_status, '')
+
+    def _record(self, method_name):
+        with self._lock:
+            self.calls[method_name] = self.calls.get(method_name, 0) + 1
+
+    def DecryptPassword(self, encryptedString=''):
+        self._record('DecryptPassword')
+        return _DecryptedValue('decrypted_' + encryptedString)
+
+    def GetReservationDetails(self, reservationId=''):
+        self._record('GetReservationDetails')
+        # the addresses CloudShell holds now, e.g. after UpdateResourceAddress
+        return _ReservationDetails([_ReservedResource(resource.Name,
+                                                      self.resource_addresses.get(resource.Name, resource.FullAddress),
+                                                      resource.VmDetails.UID, resource.VmDetails.CloudProviderFullName)
+                                    for resource in self.reserved_resources.get(reservationId, [])])
+
+    def GetResourceLiveStatus(self, resourceFullPath=''):
+        self._record('GetResourceLiveStatus')
+        return _ResourceLiveStatus(*self.live_statuses.get(resourceFullPath, ('', '')))
+
+    def UpdateResourceAddress(self, resourceFullPath='', resourceAddress=''):
+        self._record('UpdateResourceAddress')
+        self.resource_addresses[resourceFullPath] = resourceAddress
+
+    def SetAttributeValue(self, resourceFullPath='', attributeName='', attributeValue=''):
+        self._record('SetAttributeValue')
+        self.attribute_values[(resourceFullPath, attributeName)] = attributeValue
+
+    def SetResourceLiveStatus(self, resourceFullName='', liveStatusName='', additionalInfo=''):
+        self._record('SetResourceLiveStatus')
+        self.live_statuses[resourceFullName] = (liveStatusName, additionalInfo)
+
+
+class _FakeCloudShellSessionContext(object):
+    session = None
+
+    def __init__(self, context):
+        pass
+
+    def __enter__(self):
+        return _FakeCloudShellSessionContext.session
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+@contextmanager
+def fake_cloudshell_session(session=None):
+    """
+    Replaces the CloudShell API session the driver opens with a FakeCloudShellSession
+    :rtype: FakeCloudShellSession
+    """
+    outer_session = _FakeCloudShellSessionContext.session
+    _FakeCloudShellSessionContext.session = session or FakeCloudShellSession()
+    try:
+        with patch('driver.CloudShellSessionContext', _FakeCloudShellSessionContext):
+            yield _FakeCloudShellSessionContext.session
+    finally:
+        _FakeCloudShellSessionContext.session = outer_session
+
+
+def create_driver(attributes=None):
+    """
+    :rtype: driver.L3HeavenlyCloudShellDriver
+    """
+    from driver import L3HeavenlyCloudShellDriver
+
+    driver = L3HeavenlyCloudShellDriver()
+    driver.initialize(init_context(attributes))
+    return driver
+
+
+def flush_cloudshell_logs(timeout=10):
+    """
+    Waits for the cloudshell interprocess log handlers to write their queued records, so the interpreter does not
+    exit while their daemon threads still write
+    """
+    from cloudshell.core.logger import qs_logger
+    from cloudshell.core.logger.interprocess_logger import MultiProcessingLog
+
+    deadline = time.time() + timeout
+    for logger in qs_logger._LOGGER_CONTAINER.values():
+        for handler in logger.handlers:
+            if isinstance(handler, MultiProcessingLog):
+                # records wait in the feeder thread buffer before they reach the pipe the queue reports on
+                while (handler.queue._buffer or not handler.queue.empty()) and time.time() < deadline:
+                    time.sleep(0.01)
+
+    # the receiving thread may still be writing the last record
+    time.sleep(0.2)
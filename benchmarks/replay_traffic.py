@@ -0,0 +1,206 @@
+"""
+Replays driver traffic recorded with HEAVENLY_CLOUD_RECORD_FILE against L3HeavenlyCloudShellDriver.
+
+Runs the recorded commands with their recorded context and arguments against an in process FakeHeavenlyCloud and a
+fake CloudShell API session, at the recorded pace or faster, and reports the latency percentiles per command next to
+the recorded ones. The instances the recorded remote commands and GetVmDetails requests refer to are added to the
+fake provider first.
+
+usage:
+    python benchmarks/replay_traffic.py traffic.jsonl.gz                  replay at the recorded pace
+    python benchmarks/replay_traffic.py traffic.jsonl.gz --speed 10       10 times faster
+    python benchmarks/replay_traffic.py traffic.jsonl.gz --speed 0 -j 16  as fast as 16 threads can
+    python benchmarks/replay_traffic.py traffic.jsonl.gz -c Deploy --fake-config benchmarks/fake_heavenly_cloud.json
+"""
+
+import argparse
+import json
+import sys
+import threading
+import time
+import types
+from multiprocessing.pool import ThreadPool
+
+import bench_driver
+import driver_harness
+
+from cloudshell.shell.core import driver_context
+
+from sdk.fake_heavenly_cloud import FakeHeavenlyCloud
+from sdk.heavenly_cloud_service import HeavenlyCloudService
+from traffic_recorder import decode, read_records, traffic_recorder
+
+DEFAULT_CONCURRENCY = 8
+
+
+class ReplayResult(object):
+    def __init__(self, results, recorded, max_lag):
+        """
+        :param list[bench_driver.ScenarioResult] results: replayed latencies per command
+        :param dict[str, bench_driver.ScenarioResult] recorded: command name -> recorded latencies
+        :param float max_lag: seconds the latest command started after its scheduled time, high when the
+        concurrency is too low for the pace
+        """
+        self.results = results
+        self.recorded = recorded
+        self.max_lag = max_lag
+
+
+def _context_classes():
+    return dict((name, value) for name, value in vars(driver_context).items()
+                if isinstance(value, (type, types.ClassType)))
+
+
+def recorded_instances(record):
+    """
+    :param dict record: a recorded command
+    :return: (vm id, name, address) of the deployed apps the command refers to
+    :rtype: list[tuple]
+    """
+    deployed_apps = []
+    for endpoint in record['context'].get('remote_endpoints') or []:
+        app_context = endpoint.get('app_context') or {}
+        if app_context.get('deployed_app_json'):
+            deployed_apps.append(json.loads(app_context['deployed_app_json']))
+    if record['command'] == 'GetVmDetails' and record['args']:
+        deployed_apps.extend(item['deployedAppJson'] for item in json.loads(record['args'][0])['items'])
+
+    return [(app['vmdetails']['uid'], app['name'], app.get('address')) for app in deployed_apps
+            if app.get('vmdetails', {}).get('uid')]
+
+
+def seed_recorded_instances(fake_cloud, records):
+    """
+    :param FakeHeavenlyCloud fake_cloud:
+    :param list[dict] records:
+    """
+    for record in records:
+        for vm_id, name, address in recorded_instances(record):
+            if vm_id not in fake_cloud.instances:
+                fake_cloud.add_instance(vm_id, name, address or None)
+
+
+def recorded_results(records):
+    """
+    :rtype: dict[str, bench_driver.ScenarioResult]
+    """
+    if not records:
+        return {}
+    wall_time = records[-1]['ts'] + records[-1]['duration'] - records[0]['ts']
+    results = {}
+    for command_name in sorted(set(record['command'] for record in records)):
+        command_records = [record for record in records if record['command'] == command_name]
+        results[command_name] = bench_driver.ScenarioResult(
+            command_name, [record['duration'] for record in command_records], wall_time,
+            len([record for record in command_records if record['error']]))
+    return results
+
+
+def replay(records, speed=1.0, concurrency=DEFAULT_CONCURRENCY, fake_config=None, time_scale=None):
+    """
+    :param list[dict] records: recorded commands, see traffic_recorder.read_records
+    :param float speed: 1 for the recorded pace, 10 for 10 times faster, 0 to run every command as soon as a thread
+    is free
+    :param int concurrency: commands running at the same time at most
+    :param dict fake_config: FakeHeavenlyCloud config, zero latency by default to measure the driver itself
+    :param float time_scale: overrides the fake config time scale
+    :rtype: ReplayResult
+    """
+    classes = _context_classes()
+    commands = [(record['command'], decode(record['context'], classes), decode(record['args'], classes))
+                for record in records]
+    offsets = [(record['ts'] - records[0]['ts']) / speed if speed else 0 for record in records]
+
+    fake_cloud = FakeHeavenlyCloud.from_config(fake_config)
+    if time_scale is not None:
+        fake_cloud.time_scale = time_scale
+    seed_recorded_instances(fake_cloud, records)
+
+    latencies = [None] * len(commands)
+    errors = [False] * len(commands)
+    lags = [0.0]
+    lock = threading.Lock()
+
+    # the replayed commands are not recorded again
+    record_path = traffic_recorder.path
+    traffic_recorder.configure(None)
+    with driver_harness.fake_cloudshell_session():
+        HeavenlyCloudService.set_backend(fake_cloud)
+        driver = driver_harness.create_driver()
+        try:
+            start = time.time()
+
+            def run_command(index):
+                command_name, context, args = commands[index]
+                delay = start + offsets[index] - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                with lock:
+                    lags[0] = max(lags[0], -delay)
+
+                command_start = time.time()
+                try:
+                    getattr(driver, command_name)(context, *args)
+                except Exception:
+                    errors[index] = True
+                latencies[index] = time.time() - command_start
+
+            pool = ThreadPool(concurrency)
+            try:
+                # one command per task so the commands start in the recorded order
+                pool.map(run_command, range(len(commands)), chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+            wall_time = time.time() - start
+        finally:
+            driver.cleanup()
+            HeavenlyCloudService.set_backend(None)
+            traffic_recorder.configure(record_path)
+
+    driver_harness.flush_cloudshell_logs()
+
+    results = []
+    for command_name in sorted(set(command[0] for command in commands)):
+        indexes = [index for index, command in enumerate(commands) if command[0] == command_name]
+        results.append(bench_driver.ScenarioResult(command_name, [latencies[index] for index in indexes], wall_time,
+                                                   len([index for index in indexes if errors[index]])))
+    return ReplayResult(results, recorded_results(records), lags[0])
+
+
+def print_replay(replay_result):
+    bench_driver.print_results(replay_result.results)
+    print('\nrecorded')
+    bench_driver.print_results([replay_result.recorded[result.name] for result in replay_result.results])
+    print('\nlatest command start {0:.2f} ms after its schedule'.format(replay_result.max_lag * 1000))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='replay recorded L3HeavenlyCloudShellDriver traffic')
+    parser.add_argument('traffic_file', help='file HEAVENLY_CLOUD_RECORD_FILE pointed to')
+    parser.add_argument('-c', '--command', action='append', help='replay only these commands')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='pace multiplier, 1 for the recorded pace, 0 for as fast as possible')
+    parser.add_argument('-j', '--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help='commands running at the same time at most')
+    parser.add_argument('--fake-config', help='FakeHeavenlyCloud json config, zero latency by default')
+    parser.add_argument('--time-scale', type=float, help='multiply the fake provider latencies')
+    args = parser.parse_args(argv)
+
+    records = [record for record in read_records(args.traffic_file)
+               if not args.command or record['command'] in args.command]
+    if not records:
+        print('no recorded commands to replay')
+        return 1
+
+    fake_config = None
+    if args.fake_config:
+        with open(args.fake_config) as config_file:
+            fake_config = json.load(config_file)
+
+    print_replay(replay(records, args.speed, args.concurrency, fake_config, args.time_scale))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
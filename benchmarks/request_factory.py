@@ -0,0 +1,93 @@
+"""
+Builders of synthetic driver request json used by the benchmarks
+"""
+
+import json
+import os
+import sys
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src'))
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+
+ANGEL_DEPLOYMENT_PATH = 'L3HeavenlyCloudShell.HeavenlyCloudAngelDeployment'
+MAN_DEPLOYMENT_PATH = 'L3HeavenlyCloudShell.HeavenlyCloudManDeployment'
+
+
+def _attributes(attributes_dict):
+    return [{'type': 'attribute', 'attributeName': name, 'attributeValue': value}
+            for name, value in sorted(attributes_dict.items())]
+
+
+def deploy_app_action(app_name='app', deployment_path=ANGEL_DEPLOYMENT_PATH, password='encrypted_password'):
+    if deployment_path == ANGEL_DEPLOYMENT_PATH:
+        deployment_attributes = {'wing_count': '2', 'flight_speed': '9.5', 'cloud_size': 'big',
+                                 'cloud_image_id': 'centos'}
+    else:
+        deployment_attributes = {'height': '180', 'weight': '80', 'cloud_size': 'small', 'cloud_image_id': 'centos'}
+
+    return {
+        'type': 'deployApp',
+        'actionId': 'deploy_' + app_name,
+        'actionParams': {
+            'type': 'deployAppParams',
+            'appName': app_name,
+            'deployment': {
+                'type': 'deployAppDeploymentInfo',
+                'deploymentPath': deployment_path,
+                'attributes': _attributes(dict((deployment_path + '.' + name, value)
+                                               for name, value in deployment_attributes.items()))
+            },
+            'appResource': {
+                'type': 'appResourceInfo',
+                'attributes': _attributes({'User': 'admin', 'Password': password, 'Public IP': ''})
+            }
+        }
+    }
+
+
+def connect_subnet_action(index, vnic_name=''):
+    return {
+        'type': 'connectSubnet',
+        'actionId': 'connect_subnet_{0}'.format(index),
+        'actionParams': {
+            'type': 'connectToSubnetParams',
+            'cidr': '10.{0}.{1}.0/24'.format(index // 256, index % 256),
+            'subnetId': 'subnet_{0}'.format(index),
+            'isPublic': False,
+            'vnicName': vnic_name,
+            'subnetServiceAttributes': _attributes({'Public': 'False', 'Allocated CIDR': ''})
+        }
+    }
+
+
+def prepare_subnet_action(index):
+    return {
+        'type': 'prepareSubnet',
+        'actionId': 'prepare_subnet_{0}'.format(index),
+        'actionParams': {
+            'type': 'prepareSubnetParams',
+            'cidr': '10.{0}.{1}.0/24'.format(index // 256, index % 256),
+            'isPublic': index % 2 == 0,
+            'alias': 'subnet {0}'.format(index),
+            'subnetServiceAttributes': _attributes({'Public': 'False', 'Allocated CIDR': ''})
+        }
+    }
+
+
+def deploy_request(subnet_count=0, app_name='app', deployment_path=ANGEL_DEPLOYMENT_PATH):
+    actions = [deploy_app_action(app_name, deployment_path)]
+    actions.extend(connect_subnet_action(index) for index in range(subnet_count))
+    return json.dumps({'driverRequest': {'actions': actions}})
+
+
+def prepare_sandbox_infra_request(subnet_count=0, cidr='10.0.0.0/8'):
+    actions = [{'type': 'prepareCloudInfra', 'actionId': 'prepare_infra',
+                'actionParams': {'type': 'prepareCloudInfraParams', 'cidr': cidr}},
+               {'type': 'createKeys', 'actionId': 'create_keys'}]
+    actions.extend(prepare_subnet_action(index) for index in range(subnet_count))
+    return json.dumps({'driverRequest': {'actions': actions}})
+
+
+def cleanup_sandbox_infra_request():
+    return json.dumps({'driverRequest': {'actions': [{'type': 'cleanupNetwork', 'actionId': 'cleanup'}]}})
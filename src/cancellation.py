@@ -0,0 +1,514 @@
+import Queue
+import sys
+import thread
+import threading
+import time
+from contextlib import contextmanager
+
+from tracing import tracer
+
+# seconds between two checks of the cancellation contexts of the running commands, bounds the time a cancelled
+# command keeps waiting for a provider operation
+DEFAULT_POLL_INTERVAL = 0.1
+
+# seconds an operation thread waits for work before it exits
+OPERATION_THREAD_IDLE_SECONDS = 60
+
+# seconds close waits for the operation threads still running an abandoned operation, they are daemon threads
+CLOSE_TIMEOUT_SECONDS = 10
+
+# provider operations whose abandoned calls still create an instance, it is deleted once the call returns.
+# the warm instance pool deletes the instance of an activate_instance that failed or was abandoned itself, its
+# create_stopped_* refills run on pool threads outside of any scope
+INSTANCE_CREATING_OPERATIONS = ('create_angel_instance', 'create_man_instance')
+
+
+class OperationCancelledException(Exception):
+    def __init__(self, rollback_report=None, message='Operation cancelled'):
+        """
+        :param compensation_log.RollbackReport rollback_report: what was rolled back before raising, if anything
+        """
+        super(OperationCancelledException, self).__init__(message)
+        self.rollback_report = rollback_report
+
+
+class DeadlineExceededException(OperationCancelledException):
+    def __init__(self, deadline, rollback_report=None):
+        """
+        Raised once a command spent its time budget, it is rolled back like a cancelled command
+        :param deadline.Deadline deadline: of the command
+        :param compensation_log.RollbackReport rollback_report: what was rolled back before raising, if anything
+        """
+        super(DeadlineExceededException, self).__init__(
+            rollback_report, '{0} timed out after {1:g} seconds'.format(deadline.command_name, deadline.seconds))
+        self.deadline = deadline
+
+
+class CancellationScope(object):
+    def __init__(self, cancellation_context, deadline=None):
+        """
+        The running part of a command that can be cancelled or has a deadline, the threads waiting for it are woken
+        up on cancellation
+        :param CancellationContext cancellation_context: None for commands that cannot be cancelled
+        :param deadline.Deadline deadline: None for commands without timeout
+        """
+        self.cancellation_context = cancellation_context
+        self.deadline = deadline
+        self.cancelled = False
+        self.timed_out = False
+        self._lock = threading.Lock()
+        self._waiters = set()  # type: set[threading.Event]
+
+    @property
+    def is_cancelled(self):
+        return self.cancelled or (self.cancellation_context is not None and self.cancellation_context.is_cancelled)
+
+    @property
+    def is_expired(self):
+        return self.deadline is not None and self.deadline.expired
+
+    def remaining(self):
+        """
+        :return: seconds left to the command, None without deadline
+        :rtype: float
+        """
+        return self.deadline.remaining() if self.deadline is not None else None
+
+    def check(self):
+        """
+        Raises OperationCancelledException if the command is cancelled, DeadlineExceededException once its deadline
+        passed
+        """
+        if self.is_cancelled:
+            raise OperationCancelledException()
+        if self.is_expired:
+            raise self.deadline_exceeded()
+
+    def deadline_exceeded(self, rollback_report=None):
+        """
+        :param compensation_log.RollbackReport rollback_report: what was rolled back before raising, if anything
+        :return: the exception the command raises once its deadline passed
+        :rtype: DeadlineExceededException
+        """
+        self.timed_out = True
+        return DeadlineExceededException(self.deadline, rollback_report)
+
+    def add_waiter(self, event):
+        """
+        :param threading.Event event: set when the scope is cancelled, right away if it already is
+        """
+        with self._lock:
+            if self.cancelled:
+                event.set()
+            else:
+                self._waiters.add(event)
+
+    def remove_waiter(self, event):
+        with self._lock:
+            self._waiters.discard(event)
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            waiters, self._waiters = self._waiters, set()
+        for event in waiters:
+            event.set()
+
+
+class _NoScope(object):
+    """
+    Context manager of the commands that cannot be cancelled and have no deadline
+    """
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+
+_NO_SCOPE = _NoScope()
+
+# queued to an idle operation thread to end it
+_STOP = object()
+
+
+class _Operation(object):
+    def __init__(self, watcher, scope, proceed, cleanup):
+        """
+        A provider operation run on an operation thread while the command thread waits for it or its cancellation
+        :param CancellationWatcher watcher:
+        :param CancellationScope scope: of the command, current on the operation thread while the operation runs
+        along with the open spans of the command
+        :param proceed: function running the operation
+        :param cleanup: function of the operation result removing what it created, called if the operation
+        completes after it was abandoned, or None
+        """
+        self.watcher = watcher
+        self.scope = scope
+        # the command thread, also when an operation runs another one
+        self.command_thread_id = watcher._command_thread_id()
+        self.spans = tracer.open_spans()
+        self.proceed = proceed
+        self.cleanup = cleanup
+        self.finished = threading.Event()
+        self.done = False
+        self.abandoned = False
+        self.result = None
+        self.exc_info = None
+        self._lock = threading.Lock()
+
+    def run(self):
+        self.watcher._local.scope = self.scope
+        self.watcher._run_for(self.command_thread_id)
+        try:
+            with tracer.continued(self.spans):
+                result, exc_info = self.proceed(), None
+        except BaseException:
+            result, exc_info = None, sys.exc_info()
+        finally:
+            self.watcher._local.scope = None
+            self.watcher._run_for(None)
+
+        with self._lock:
+            self.done = True
+            self.result, self.exc_info = result, exc_info
+            abandoned = self.abandoned
+        self.finished.set()
+
+        if abandoned and exc_info is None and self.cleanup is not None:
+            self.watcher._cleanup_abandoned(self.cleanup, result)
+
+    def abandon(self):
+        """
+        :return: False when the operation completed in the meantime and its result can still be used
+        :rtype: bool
+        """
+        with self._lock:
+            if self.done:
+                return False
+            self.abandoned = True
+            return True
+
+
+class _OperationThreads(object):
+    def __init__(self, idle_seconds=OPERATION_THREAD_IDLE_SECONDS):
+        """
+        Daemon threads running the provider operations of cancellable commands. A thread is added whenever none is
+        idle, so the operations abandoned by cancelled commands never delay the others
+        :param float idle_seconds: seconds a thread waits for work before it exits
+        """
+        self.idle_seconds = idle_seconds
+        self._lock = threading.Lock()
+        self._queue = Queue.Queue()
+        self._idle = 0
+        self._workers = set()  # type: set[threading.Thread]
+        self._closed = False
+        self.threads = 0
+
+    def submit(self, func):
+        with self._lock:
+            if self._idle:
+                # the put is under the lock so an idle thread timing out sees the work before it exits
+                self._idle -= 1
+                self._queue.put(func)
+                return
+            self.threads += 1
+            thread = threading.Thread(target=self._work, args=(func,), name='provider-operation')
+            thread.daemon = True
+            self._workers.add(thread)
+        thread.start()
+
+    def _exit(self):
+        # called with self._lock held
+        self.threads -= 1
+        self._workers.discard(threading.current_thread())
+
+    def _work(self, func):
+        while True:
+            func()
+            with self._lock:
+                if self._closed:
+                    self._exit()
+                    return
+                self._idle += 1
+            func = None
+            while func is None:
+                try:
+                    func = self._queue.get(timeout=self.idle_seconds)
+                except Queue.Empty:
+                    with self._lock:
+                        if self._queue.empty():
+                            self._idle -= 1
+                            self._exit()
+                            return
+            if func is _STOP:
+                with self._lock:
+                    self._exit()
+                return
+
+    def close(self, timeout=CLOSE_TIMEOUT_SECONDS):
+        """
+        Ends the idle threads and waits for them, the threads running an operation exit once it returns
+        :param float timeout: seconds to wait for the threads altogether
+        """
+        with self._lock:
+            self._closed = True
+            # the work already queued was handed to idle threads, it is ahead of their stops
+            idle, self._idle = self._idle, 0
+            for _ in range(idle):
+                self._queue.put(_STOP)
+            workers = list(self._workers)
+
+        end = time.time() + timeout
+        for thread in workers:
+            thread.join(max(end - time.time(), 0))
+
+
+class CancellationWatcher(object):
+    """
+    Propagates the cancellation and the deadline of a command to the work it waits for. The commands run in a scope
+    of their CancellationContext and Deadline, a watcher thread polls the contexts of the running scopes and wakes
+    up their waiting threads once one is cancelled.
+    Registered as the innermost HeavenlyCloudService interceptor it runs the provider operations of a scope on
+    operation threads and waits for each at most the time left to the command. A cancelled command stops waiting
+    for its operation within the poll interval and raises OperationCancelledException, a command past its deadline
+    raises DeadlineExceededException. The abandoned operation runs to its end on its thread, an instance it created
+    is deleted. Waits for the cpu work pool and the latency of the fake provider end early the same way.
+    """
+
+    def __init__(self, poll_interval=DEFAULT_POLL_INTERVAL):
+        """
+        :param float poll_interval: seconds between two checks of the cancellation contexts
+        """
+        self.poll_interval = poll_interval
+        self._local = threading.local()
+        self._condition = threading.Condition()
+        self._scopes = set()  # type: set[CancellationScope]
+        self._thread = None
+        self._stop = None
+        self._command_thread_ids = {}  # type: dict[int, int]  # operation thread id -> command thread id
+        self._operation_threads = _OperationThreads()
+        self.cancelled_scopes = 0
+        self.expired_scopes = 0
+        self.abandoned_operations = 0
+        self.abandoned_cleanups = 0
+        self.abandoned_cleanup_errors = 0
+
+    def current(self):
+        """
+        :return: scope of the command running on this thread, None if it cannot be cancelled and has no deadline
+        :rtype: CancellationScope
+        """
+        return getattr(self._local, 'scope', None)
+
+    def _command_thread_id(self):
+        thread_id = thread.get_ident()
+        with self._condition:
+            return self._command_thread_ids.get(thread_id, thread_id)
+
+    def _run_for(self, command_thread_id):
+        thread_id = thread.get_ident()
+        with self._condition:
+            if command_thread_id is None:
+                self._command_thread_ids.pop(thread_id, None)
+            else:
+                self._command_thread_ids[thread_id] = command_thread_id
+
+    def operation_thread_ids(self, command_thread_id):
+        """
+        :param int command_thread_id: thread.get_ident() of a command thread
+        :return: ids of the threads running a provider operation of the command right now
+        :rtype: list[int]
+        """
+        with self._condition:
+            return [thread_id for thread_id, command_thread in self._command_thread_ids.items()
+                    if command_thread == command_thread_id]
+
+    def scope(self, cancellation_context, deadline=None):
+        """
+        :param CancellationContext cancellation_context: of the command, None for commands that cannot be cancelled
+        :param deadline.Deadline deadline: of the command, None for commands without timeout
+        :return: context manager running the command it wraps in a scope of the cancellation context and deadline
+        """
+        if cancellation_context is None and deadline is None:
+            return _NO_SCOPE
+        return self._scope(cancellation_context, deadline)
+
+    @contextmanager
+    def _scope(self, cancellation_context, deadline):
+        scope = CancellationScope(cancellation_context, deadline)
+        outer_scope = self.current()
+        self._local.scope = scope
+        with self._condition:
+            self._scopes.add(scope)
+            if self._thread is None:
+                self._stop = threading.Event()
+                self._thread = threading.Thread(target=self._watch, args=(self._stop,), name='cancellation-watcher')
+                self._thread.daemon = True
+                self._thread.start()
+            self._condition.notify()
+        try:
+            yield scope
+        finally:
+            with self._condition:
+                self._scopes.discard(scope)
+                if scope.timed_out:
+                    self.expired_scopes += 1
+            self._local.scope = outer_scope
+
+    @contextmanager
+    def shielded(self):
+        """
+        Runs the code it wraps out of the scope of the command, e.g. the rollback of a cancelled command
+        """
+        scope = self.current()
+        self._local.scope = None
+        try:
+            yield
+        finally:
+            self._local.scope = scope
+
+    def check(self):
+        """
+        Raises OperationCancelledException if the command running on this thread is cancelled,
+        DeadlineExceededException once its deadline passed
+        """
+        scope = self.current()
+        if scope is not None:
+            scope.check()
+
+    def remaining(self):
+        """
+        :return: seconds left to the command running on this thread, None without deadline. Provider calls that
+        take a timeout should not be given more
+        :rtype: float
+        """
+        scope = self.current()
+        return scope.remaining() if scope is not None else None
+
+    def _watch(self, stop):
+        while True:
+            with self._condition:
+                while not self._scopes and not stop.is_set():
+                    self._condition.wait()
+                if stop.is_set():
+                    return
+                scopes = list(self._scopes)
+
+            for scope in scopes:
+                if not scope.cancelled and scope.cancellation_context is not None and \
+                        scope.cancellation_context.is_cancelled:
+                    scope.cancel()
+                    with self._condition:
+                        self.cancelled_scopes += 1
+            stop.wait(self.poll_interval)
+
+    def close(self, timeout=CLOSE_TIMEOUT_SECONDS):
+        """
+        Ends the watcher thread and the operation threads and waits for them, the next scope starts them again.
+        The scopes still running are no longer polled
+        :param float timeout: seconds to wait for the operation threads still running an abandoned operation
+        """
+        with self._condition:
+            thread, self._thread = self._thread, None
+            if thread is not None:
+                self._stop.set()
+                self._condition.notify_all()
+            operation_threads, self._operation_threads = self._operation_threads, _OperationThreads()
+        if thread is not None:
+            thread.join()
+        operation_threads.close(timeout)
+
+    def __call__(self, operation_name, cloud_provider_resource, proceed):
+        scope = self.current()
+        if scope is None:
+            return proceed()
+        scope.check()
+
+        cleanup = None
+        if operation_name in INSTANCE_CREATING_OPERATIONS:
+            cleanup = lambda instance: _delete_instance(cloud_provider_resource, instance)
+        operation = _Operation(self, scope, proceed, cleanup)
+
+        scope.add_waiter(operation.finished)
+        try:
+            self._operation_threads.submit(operation.run)
+            operation.finished.wait(scope.remaining())
+        finally:
+            scope.remove_waiter(operation.finished)
+
+        if operation.abandon():
+            with self._condition:
+                self.abandoned_operations += 1
+            scope.check()
+            raise scope.deadline_exceeded()
+        if operation.exc_info is not None:
+            raise operation.exc_info[0], operation.exc_info[1], operation.exc_info[2]
+        return operation.result
+
+    def _cleanup_abandoned(self, cleanup, result):
+        try:
+            cleanup(result)
+            with self._condition:
+                self.abandoned_cleanups += 1
+        except Exception:
+            with self._condition:
+                self.abandoned_cleanup_errors += 1
+
+    def wait_result(self, async_result):
+        """
+        :param multiprocessing.pool.AsyncResult async_result: e.g. of the cpu work pool
+        :return: the result, raises OperationCancelledException if the command is cancelled first,
+        DeadlineExceededException if its deadline passes first. The worker finishes the task, its result is dropped
+        """
+        scope = self.current()
+        while scope is not None and not async_result.ready():
+            scope.check()
+            remaining = scope.remaining()
+            async_result.wait(self.poll_interval if remaining is None else min(self.poll_interval, remaining))
+        return async_result.get()
+
+    def sleep(self, seconds):
+        """
+        time.sleep that the cancellation of the command ends early with OperationCancelledException, its deadline
+        with DeadlineExceededException
+        """
+        scope = self.current()
+        if scope is None:
+            time.sleep(seconds)
+            return
+
+        remaining = scope.remaining()
+        event = threading.Event()
+        scope.add_waiter(event)
+        try:
+            event.wait(seconds if remaining is None else min(seconds, remaining))
+        finally:
+            scope.remove_waiter(event)
+        if scope.cancelled:
+            raise OperationCancelledException()
+        if remaining is not None and remaining < seconds:
+            raise scope.deadline_exceeded()
+
+    def stats(self):
+        """
+        :rtype: dict
+        """
+        with self._condition:
+            return {'running_scopes': len(self._scopes),
+                    'cancelled_scopes': self.cancelled_scopes,
+                    'expired_scopes': self.expired_scopes,
+                    'operation_threads': self._operation_threads.threads,
+                    'abandoned_operations': self.abandoned_operations,
+                    'abandoned_cleanups': self.abandoned_cleanups,
+                    'abandoned_cleanup_errors': self.abandoned_cleanup_errors}
+
+
+def _delete_instance(cloud_provider_resource, instance):
+    from sdk.heavenly_cloud_service import HeavenlyCloudService
+
+    HeavenlyCloudService.delete_instance(cloud_provider_resource, instance.id)
+
+
+cancellation_watcher = CancellationWatcher()
@@ -0,0 +1,299 @@
+import socket
+import struct
+import threading
+from bisect import bisect_right
+
+# prefix length of the subnets handed out for PrepareSubnet actions the server sent without a cidr
+DEFAULT_SUBNET_PREFIX_LENGTH = 24
+
+
+class CidrConflictError(Exception):
+    pass
+
+
+def parse_cidr(cidr):
+    """
+    :param str cidr: IPv4 cidr, e.g. 10.0.1.0/24, host bits are ignored
+    :return: first and last address of the range as integers
+    :rtype: (int, int)
+    """
+    address, _, prefix_length = cidr.strip().partition('/')
+    prefix_length = int(prefix_length) if prefix_length else 32
+    if not 0 <= prefix_length <= 32:
+        raise ValueError('invalid cidr {0}'.format(cidr))
+    try:
+        first = struct.unpack('!I', socket.inet_aton(address))[0]
+    except socket.error:
+        raise ValueError('invalid cidr {0}'.format(cidr))
+    size = 1 << (32 - prefix_length)
+    first &= ~(size - 1) & 0xFFFFFFFF
+    return first, first + size - 1
+
+
+def prefix_length(first, last):
+    """
+    :param int first:
+    :param int last: first and last address of a range of a power of two size
+    :rtype: int
+    """
+    return 33 - (last - first + 1).bit_length()
+
+
+def format_cidr(first, last):
+    """
+    :param int first:
+    :param int last: first and last address of a range of a power of two size aligned on its size
+    :rtype: str
+    """
+    return '{0}/{1}'.format(socket.inet_ntoa(struct.pack('!I', first)), prefix_length(first, last))
+
+
+class RangeSet(object):
+    """
+    Non overlapping address ranges sorted by their first address. Since the ranges never overlap, the only range
+    that can overlap a new one is the last range starting at or before the new range ends, so a binary search finds
+    it in O(log n) like a query of an interval tree would.
+    """
+
+    def __init__(self):
+        self._firsts = []
+        self._lasts = []
+        self._values = []
+
+    def __len__(self):
+        return len(self._firsts)
+
+    def overlapping(self, first, last):
+        """
+        :param int first:
+        :param int last:
+        :return: index of the range overlapping first..last, None if it is free
+        :rtype: int
+        """
+        index = bisect_right(self._firsts, last) - 1
+        if index >= 0 and self._lasts[index] >= first:
+            return index
+        return None
+
+    def range_at(self, index):
+        """
+        :rtype: (int, int, object)
+        """
+        return self._firsts[index], self._lasts[index], self._values[index]
+
+    def add(self, first, last, value):
+        """
+        :param int first:
+        :param int last:
+        :param value: stored with the range
+        """
+        if self.overlapping(first, last) is not None:
+            raise CidrConflictError('{0} overlaps a reserved range'.format(format_cidr(first, last)))
+        index = bisect_right(self._firsts, first)
+        self._firsts.insert(index, first)
+        self._lasts.insert(index, last)
+        self._values.insert(index, value)
+
+    def remove(self, first):
+        """
+        :param int first: first address of the range
+        :return: value stored with the removed range, None if there was none
+        """
+        index = bisect_right(self._firsts, first) - 1
+        if index < 0 or self._firsts[index] != first:
+            return None
+        del self._firsts[index]
+        del self._lasts[index]
+        return self._values.pop(index)
+
+    def find_free(self, size, first, last):
+        """
+        :param int size: power of two size of the wanted range, it is aligned on its size
+        :param int first:
+        :param int last: the free range is searched within first..last
+        :return: first address of the lowest free range, None if there is none
+        :rtype: int
+        """
+        candidate = (first + size - 1) & ~(size - 1)
+        index = max(bisect_right(self._firsts, candidate) - 1, 0)
+        # walks the gaps between the ranges inside first..last
+        while candidate + size - 1 <= last:
+            if index >= len(self._firsts) or self._firsts[index] > candidate + size - 1:
+                return candidate
+            if self._lasts[index] >= candidate:
+                candidate = (self._lasts[index] + size) & ~(size - 1)
+            index += 1
+        return None
+
+
+class _SandboxNetwork(object):
+    def __init__(self, cidr, reservation_id):
+        self.cidr = cidr
+        self.reservation_id = reservation_id
+        self.subnets = RangeSet()  # subnet ranges -> subnet cidr
+
+
+class CidrAllocator(object):
+    """
+    Address ranges handed to the cloud provider by the sandboxes of this process, per cloud provider resource.
+    The sandbox network cidr of a reservation may not overlap the network of another reservation on the same cloud
+    provider resource and the subnets of a sandbox must be inside its network and not overlap each other, conflicts
+    are detected before the cloud provider is called. PrepareSubnet actions without a cidr are given the lowest free
+    range of the sandbox network. Ranges are released by CleanupSandboxInfra or when their creation is rolled back.
+    Ranges are kept in memory, the sandboxes prepared before the process started are not known to it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._networks = {}  # cloud provider resource name -> RangeSet of _SandboxNetwork
+        self._reservations = {}  # (cloud provider resource name, reservation id) -> first addresses of its networks
+        self.conflicts = 0
+
+    def _space(self, cloud_provider_name):
+        space = self._networks.get(cloud_provider_name)
+        if space is None:
+            space = self._networks[cloud_provider_name] = RangeSet()
+        return space
+
+    def _sandbox_network(self, cloud_provider_name, reservation_id, first, last):
+        # called with self._lock held, the network of the reservation containing first..last
+        space = self._space(cloud_provider_name)
+        index = space.overlapping(first, last)
+        if index is not None:
+            network_first, network_last, network = space.range_at(index)
+            if network.reservation_id == reservation_id and network_first <= first and last <= network_last:
+                return network
+        self.conflicts += 1
+        raise CidrConflictError('{0} is not inside the sandbox network of reservation {1}'.format(
+            format_cidr(first, last), reservation_id))
+
+    def reserve_network(self, cloud_provider_name, reservation_id, cidr):
+        """
+        :param str cloud_provider_name:
+        :param str reservation_id:
+        :param str cidr: sandbox network cidr
+        :return: False if the reservation already holds this network
+        :rtype: bool
+        """
+        first, last = parse_cidr(cidr)
+        with self._lock:
+            space = self._space(cloud_provider_name)
+            index = space.overlapping(first, last)
+            if index is not None:
+                network_first, network_last, network = space.range_at(index)
+                if network.reservation_id == reservation_id and (network_first, network_last) == (first, last):
+                    return False
+                self.conflicts += 1
+                raise CidrConflictError('sandbox cidr {0} overlaps {1} of reservation {2} on {3}'.format(
+                    cidr, network.cidr, network.reservation_id, cloud_provider_name))
+            space.add(first, last, _SandboxNetwork(cidr, reservation_id))
+            self._reservations.setdefault((cloud_provider_name, reservation_id), set()).add(first)
+            return True
+
+    def reserve_subnet(self, cloud_provider_name, reservation_id, cidr):
+        """
+        :param str cloud_provider_name:
+        :param str reservation_id:
+        :param str cidr: subnet cidr inside the sandbox network of the reservation
+        :return: False if the sandbox already holds this subnet
+        :rtype: bool
+        """
+        first, last = parse_cidr(cidr)
+        with self._lock:
+            network = self._sandbox_network(cloud_provider_name, reservation_id, first, last)
+            index = network.subnets.overlapping(first, last)
+            if index is not None:
+                subnet_first, subnet_last, subnet_cidr = network.subnets.range_at(index)
+                if (subnet_first, subnet_last) == (first, last):
+                    return False
+                self.conflicts += 1
+                raise CidrConflictError('subnet cidr {0} overlaps subnet {1} of reservation {2}'.format(
+                    cidr, subnet_cidr, reservation_id))
+            network.subnets.add(first, last, cidr)
+            return True
+
+    def allocate_subnet(self, cloud_provider_name, reservation_id, prefix_length=DEFAULT_SUBNET_PREFIX_LENGTH):
+        """
+        :param str cloud_provider_name:
+        :param str reservation_id:
+        :param int prefix_length:
+        :return: cidr of the lowest free range of this size in the sandbox network, reserved for the reservation
+        :rtype: str
+        """
+        size = 1 << (32 - prefix_length)
+        with self._lock:
+            networks = [network for _, _, network in self._reservation_networks(cloud_provider_name, reservation_id)]
+            for network in networks:
+                network_first, network_last = parse_cidr(network.cidr)
+                first = network.subnets.find_free(size, network_first, network_last)
+                if first is not None:
+                    cidr = format_cidr(first, first + size - 1)
+                    network.subnets.add(first, first + size - 1, cidr)
+                    return cidr
+            self.conflicts += 1
+            raise CidrConflictError('no free /{0} subnet left in the sandbox network of reservation {1}'.format(
+                prefix_length, reservation_id))
+
+    def _reservation_networks(self, cloud_provider_name, reservation_id):
+        # called with self._lock held
+        space = self._space(cloud_provider_name)
+        firsts = sorted(self._reservations.get((cloud_provider_name, reservation_id), ()))
+        return [space.range_at(space.overlapping(first, first)) for first in firsts]
+
+    def release(self, cloud_provider_name, reservation_id, cidr):
+        """
+        Releases a sandbox network, with its subnets, or a subnet of the reservation
+        :param str cloud_provider_name:
+        :param str reservation_id:
+        :param str cidr:
+        """
+        first, last = parse_cidr(cidr)
+        with self._lock:
+            space = self._space(cloud_provider_name)
+            index = space.overlapping(first, last)
+            if index is None:
+                return
+            network_first, network_last, network = space.range_at(index)
+            if network.reservation_id != reservation_id:
+                return
+            if (network_first, network_last) == (first, last):
+                space.remove(first)
+                self._discard_reservation_network(cloud_provider_name, reservation_id, first)
+            else:
+                network.subnets.remove(first)
+
+    def _discard_reservation_network(self, cloud_provider_name, reservation_id, first):
+        # called with self._lock held
+        key = (cloud_provider_name, reservation_id)
+        firsts = self._reservations.get(key, set())
+        firsts.discard(first)
+        if not firsts:
+            self._reservations.pop(key, None)
+
+    def release_reservation(self, cloud_provider_name, reservation_id):
+        """
+        :param str cloud_provider_name:
+        :param str reservation_id:
+        :return: cidrs of the released sandbox networks
+        :rtype: list[str]
+        """
+        with self._lock:
+            space = self._space(cloud_provider_name)
+            released = self._reservation_networks(cloud_provider_name, reservation_id)
+            for first, _, _ in released:
+                space.remove(first)
+            self._reservations.pop((cloud_provider_name, reservation_id), None)
+            return [network.cidr for _, _, network in released]
+
+    def stats(self):
+        """
+        :rtype: dict
+        """
+        with self._lock:
+            networks = [space.range_at(index)[2] for space in self._networks.values() for index in range(len(space))]
+            return {'networks': len(networks),
+                    'subnets': sum(len(network.subnets) for network in networks),
+                    'conflicts': self.conflicts}
+
+
+cidr_allocator = CidrAllocator()
@@ -0,0 +1,302 @@
+import cProfile
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import tracemalloc
+except ImportError:
+    # python 2 has it only with the pytracemalloc patched interpreter
+    tracemalloc = None
+
+# comma separated commands to profile, '*' for all of them, on top of the Profile Commands attribute
+PROFILE_COMMANDS_ENV_VAR = 'HEAVENLY_CLOUD_PROFILE_COMMANDS'
+# overrides the Profiler attribute
+PROFILER_ENV_VAR = 'HEAVENLY_CLOUD_PROFILER'
+# overrides the Profile Allocations attribute
+PROFILE_ALLOCATIONS_ENV_VAR = 'HEAVENLY_CLOUD_PROFILE_ALLOCATIONS'
+PROFILE_DIR_ENV_VAR = 'HEAVENLY_CLOUD_PROFILE_DIR'
+PROFILE_MAX_MB_ENV_VAR = 'HEAVENLY_CLOUD_PROFILE_MAX_MB'
+
+DEFAULT_PROFILE_DIR_NAME = 'heavenly_cloud_profiles'
+DEFAULT_MAX_MB = 100
+
+SAMPLING = 'sampling'
+CPROFILE = 'cprofile'
+
+# seconds between two stack samples of a command
+DEFAULT_SAMPLE_INTERVAL = 0.005
+
+# commands whose allocations can be snapshot, the ones building large responses from many small objects
+ALLOCATION_COMMANDS = ('GetVmDetails', 'get_inventory')
+
+# frames kept per allocation traceback
+ALLOCATION_FRAMES = 25
+
+# <time>_<command>_<reservation id>.<ext> of the profiles, the max size only counts and removes these files
+PROFILE_FILE_NAME = re.compile(r'\d{8}-\d{6}-\d{3}_\w+_[\w.-]+\.(?:folded|prof|tracemalloc)$')
+
+
+def _command_names(value):
+    return set(name.strip() for name in (value or '').split(',') if name.strip())
+
+
+def _bool_attribute(value):
+    return str(value).strip().lower() == 'true'
+
+
+def _reservation_id(context):
+    reservation = getattr(context, 'reservation', None) or getattr(context, 'remote_reservation', None)
+    return getattr(reservation, 'reservation_id', None) or 'no_reservation'
+
+
+class _NoProfile(object):
+    """
+    Context manager of the commands that are not profiled
+    """
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+
+_NO_PROFILE = _NoProfile()
+
+
+class StackSampler(object):
+    """
+    Samples the stack of one thread, and of the threads it runs its provider operations on, from a background
+    thread, its cost on the sampled threads is the GIL switches
+    """
+
+    def __init__(self, thread_id, interval=DEFAULT_SAMPLE_INTERVAL, operation_thread_ids=None):
+        """
+        :param int thread_id: thread.get_ident() of the sampled thread
+        :param float interval: seconds between two samples
+        :param operation_thread_ids: function of the sampled thread id to the ids of the threads running its provider
+        operations, their stacks are sampled under a provider-operation root frame
+        """
+        self.thread_id = thread_id
+        self.interval = interval
+        self.operation_thread_ids = operation_thread_ids
+        self.stacks = {}  # type: dict[str, int]
+        self.samples = 0
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler')
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frames = sys._current_frames()
+            frame = frames.get(self.thread_id)
+            if frame is None:
+                continue
+            self._sample(frame, [])
+            if self.operation_thread_ids is not None:
+                for thread_id in self.operation_thread_ids(self.thread_id):
+                    if thread_id in frames:
+                        self._sample(frames[thread_id], ['provider-operation'])
+            self.samples += 1
+
+    def _sample(self, frame, root):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append('{0} ({1}:{2})'.format(code.co_name, os.path.basename(code.co_filename),
+                                                code.co_firstlineno))
+            frame = frame.f_back
+        stack = ';'.join(root + list(reversed(names)))
+        self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+    def write(self, profile_file):
+        """
+        Writes the samples in the collapsed stack format of flamegraph.pl and speedscope, one "stack count" per line
+        """
+        for stack, count in sorted(self.stacks.items()):
+            profile_file.write('{0} {1}\n'.format(stack, count))
+
+
+class CommandProfiler(object):
+    """
+    Profiles the driver commands named by the Profile Commands attribute of the cloud provider resource or the
+    HEAVENLY_CLOUD_PROFILE_COMMANDS environment variable, so production commands can be profiled without redeploying
+    the shell. Each profiled command writes <time>_<command>_<reservation id>.<ext> to the profile directory:
+    .folded collapsed stacks of the sampling profiler, .prof pstats of cProfile and, for GetVmDetails and
+    get_inventory with Profile Allocations, a .tracemalloc snapshot. Once its profiles take more than the max size
+    the oldest are removed, the other files of the directory are left alone.
+    """
+
+    def __init__(self, directory=None, max_bytes=None, commands=None, profiler=None, allocations=None,
+                 sample_interval=DEFAULT_SAMPLE_INTERVAL):
+        """
+        :param str directory: by default HEAVENLY_CLOUD_PROFILE_DIR or a folder in the temp directory
+        :param int max_bytes: disk the profiles may use, by default HEAVENLY_CLOUD_PROFILE_MAX_MB megabytes
+        :param str commands: comma separated commands to profile whatever the resource attributes say, by default
+        HEAVENLY_CLOUD_PROFILE_COMMANDS
+        :param str profiler: 'sampling' or 'cprofile', by default HEAVENLY_CLOUD_PROFILER or the Profiler attribute
+        :param str allocations: 'True' or 'False', by default HEAVENLY_CLOUD_PROFILE_ALLOCATIONS or the Profile
+        Allocations attribute
+        :param float sample_interval: seconds between two stack samples
+        """
+        self.directory = directory or os.environ.get(PROFILE_DIR_ENV_VAR) or \
+            os.path.join(tempfile.gettempdir(), DEFAULT_PROFILE_DIR_NAME)
+        if max_bytes is None:
+            try:
+                max_bytes = int(float(os.environ.get(PROFILE_MAX_MB_ENV_VAR) or DEFAULT_MAX_MB) * 1024 * 1024)
+            except ValueError:
+                max_bytes = DEFAULT_MAX_MB * 1024 * 1024
+        self.max_bytes = max_bytes
+        self.commands = _command_names(commands if commands is not None else
+                                       os.environ.get(PROFILE_COMMANDS_ENV_VAR))
+        self.profiler = profiler or os.environ.get(PROFILER_ENV_VAR)
+        self.allocations = allocations or os.environ.get(PROFILE_ALLOCATIONS_ENV_VAR)
+        self.sample_interval = sample_interval
+        self._lock = threading.Lock()
+        self._tracing_allocations = 0
+        self.profiles = 0
+        self.removed = 0
+        self.write_errors = 0
+
+    def _settings(self, command_name, cloud_provider_resource):
+        """
+        :return: (profiler, allocations) for the command, profiler None when it is not profiled
+        :rtype: tuple[str, bool]
+        """
+        commands = self.commands | _command_names(cloud_provider_resource.profile_commands)
+        if command_name not in commands and '*' not in commands:
+            return None, False
+
+        profiler = (self.profiler or cloud_provider_resource.profiler or SAMPLING).strip().lower()
+        allocations = _bool_attribute(self.allocations or cloud_provider_resource.profile_allocations)
+        return profiler, allocations and command_name in ALLOCATION_COMMANDS and tracemalloc is not None
+
+    def profile(self, command_name, context, cloud_provider_resource=None):
+        """
+        :param str command_name: driver method name
+        :param context: the command context, its resource attributes tell if the command is profiled
+        :param data_model.L3HeavenlyCloudShell cloud_provider_resource: the resource of the context, read from the
+        context when not given
+        :return: context manager profiling the command it wraps, a no-op one when the command is not profiled
+        """
+        if cloud_provider_resource is None:
+            from data_model import L3HeavenlyCloudShell
+
+            cloud_provider_resource = L3HeavenlyCloudShell.create_from_context(context)
+        profiler, allocations = self._settings(command_name, cloud_provider_resource)
+        if profiler is None:
+            return _NO_PROFILE
+        return self._profile(command_name, _reservation_id(context), profiler, allocations)
+
+    @contextmanager
+    def _profile(self, command_name, reservation_id, profiler, allocations):
+        if allocations:
+            self._start_allocations()
+        sampler = None
+        cprofile = None
+        if profiler == CPROFILE:
+            cprofile = cProfile.Profile()
+            cprofile.enable()
+        else:
+            from cancellation import cancellation_watcher
+
+            sampler = StackSampler(threading.current_thread().ident, self.sample_interval,
+                                   cancellation_watcher.operation_thread_ids)
+            sampler.start()
+
+        try:
+            yield
+        finally:
+            snapshot = None
+            if cprofile is not None:
+                cprofile.disable()
+            else:
+                sampler.stop()
+            if allocations:
+                snapshot = tracemalloc.take_snapshot()
+                self._stop_allocations()
+
+            self._write(command_name, reservation_id, sampler, cprofile, snapshot)
+
+    def _start_allocations(self):
+        # tracemalloc is process wide, it runs while any profiled command snapshots allocations
+        with self._lock:
+            if not self._tracing_allocations and not tracemalloc.is_tracing():
+                tracemalloc.start(ALLOCATION_FRAMES)
+                self._tracing_allocations = 1
+            elif self._tracing_allocations:
+                self._tracing_allocations += 1
+
+    def _stop_allocations(self):
+        with self._lock:
+            if self._tracing_allocations:
+                self._tracing_allocations -= 1
+                if not self._tracing_allocations:
+                    tracemalloc.stop()
+
+    def _path(self, command_name, reservation_id, extension):
+        now = time.time()
+        name = '{0}-{1:03d}_{2}_{3}.{4}'.format(time.strftime('%Y%m%d-%H%M%S', time.localtime(now)),
+                                                int(now * 1000) % 1000, command_name, reservation_id, extension)
+        return os.path.join(self.directory, re.sub(r'[^\w.-]', '_', name))
+
+    def _write(self, command_name, reservation_id, sampler, cprofile, snapshot):
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            if cprofile is not None:
+                cprofile.dump_stats(self._path(command_name, reservation_id, 'prof'))
+            else:
+                with open(self._path(command_name, reservation_id, 'folded'), 'w') as profile_file:
+                    sampler.write(profile_file)
+            if snapshot is not None:
+                snapshot.dump(self._path(command_name, reservation_id, 'tracemalloc'))
+            with self._lock:
+                self.profiles += 1
+            self._enforce_max_bytes()
+        except (IOError, OSError):
+            with self._lock:
+                self.write_errors += 1
+
+    def _enforce_max_bytes(self):
+        with self._lock:
+            profiles = []
+            for file_name in os.listdir(self.directory):
+                path = os.path.join(self.directory, file_name)
+                if PROFILE_FILE_NAME.match(file_name) and os.path.isfile(path):
+                    stat = os.stat(path)
+                    profiles.append((stat.st_mtime, file_name, stat.st_size))
+            total = sum(size for _, _, size in profiles)
+            # names start with the time, they order the profiles written in the same mtime tick
+            for _, file_name, size in sorted(profiles):
+                if total <= self.max_bytes:
+                    break
+                os.remove(os.path.join(self.directory, file_name))
+                total -= size
+                self.removed += 1
+
+    def stats(self):
+        """
+        :rtype: dict
+        """
+        with self._lock:
+            return {'directory': self.directory,
+                    'commands': sorted(self.commands),
+                    'profiles': self.profiles,
+                    'removed': self.removed,
+                    'write_errors': self.write_errors}
+
+
+command_profiler = CommandProfiler()
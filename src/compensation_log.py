@@ -0,0 +1,139 @@
+import threading
+import time
+import traceback
+from multiprocessing.pool import ThreadPool
+
+from cancellation import cancellation_watcher
+
+INSTANCE = 'instance'
+KEY_PAIR = 'key pair'
+SUBNET = 'subnet'
+NETWORK = 'network'
+
+# created cloud objects are compensated in reverse dependency order: instances, with the network interfaces they
+# were created with, before their key pairs and subnets, and subnets before the sandbox network.
+# objects of the same kind do not depend on each other so they are compensated concurrently
+ROLLBACK_ORDER = [INSTANCE, KEY_PAIR, SUBNET, NETWORK]
+
+MAX_CONCURRENT_COMPENSATIONS = 8
+
+
+class Compensation(object):
+    def __init__(self, kind, object_id, undo):
+        """
+        :param str kind: one of ROLLBACK_ORDER
+        :param str object_id: id of the created cloud object
+        :param undo: function removing the created object
+        """
+        self.kind = kind
+        self.object_id = object_id
+        self.undo = undo
+        self.seconds = None
+        self.error = None
+
+    def run(self):
+        start = time.time()
+        try:
+            self.undo()
+        except Exception:
+            self.error = traceback.format_exc()
+        self.seconds = time.time() - start
+        return self
+
+    def __str__(self):
+        return '{0} {1} {2:.3f}s{3}'.format(self.kind, self.object_id, self.seconds or 0,
+                                            ' (failed)' if self.error else '')
+
+
+class RollbackReport(object):
+    def __init__(self, compensations, seconds):
+        """
+        :param list[Compensation] compensations: the compensations that ran, in the order they were started
+        :param float seconds: total rollback time
+        """
+        self.compensations = compensations
+        self.seconds = seconds
+
+    @property
+    def success(self):
+        return all(compensation.error is None for compensation in self.compensations)
+
+    @property
+    def errors(self):
+        return [compensation.error for compensation in self.compensations if compensation.error]
+
+    def __str__(self):
+        if not self.compensations:
+            return 'nothing to roll back'
+        return 'rolled back {0} objects in {1:.3f}s{2}: {3}'.format(
+            len(self.compensations), self.seconds, '' if self.success else ' with errors',
+            ', '.join(str(compensation) for compensation in self.compensations))
+
+
+class CompensationLog(object):
+    def __init__(self):
+        """
+        Records every cloud object a command creates together with the way to remove it,
+        so a cancelled or failed command can leave nothing behind
+        """
+        self._lock = threading.Lock()
+        self._compensations = []  # type: list[Compensation]
+
+    def record(self, kind, object_id, undo):
+        """
+        :param str kind: one of ROLLBACK_ORDER
+        :param str object_id: id of the created cloud object
+        :param undo: function removing the created object
+        """
+        if kind not in ROLLBACK_ORDER:
+            raise ValueError('unknown cloud object kind ' + kind)
+
+        with self._lock:
+            self._compensations.append(Compensation(kind, object_id, undo))
+
+    def __len__(self):
+        return len(self._compensations)
+
+    def commit(self):
+        """
+        The command succeeded, forget the created objects
+        """
+        with self._lock:
+            self._compensations = []
+
+    def rollback(self):
+        """
+        Removes every recorded object, kind after kind in ROLLBACK_ORDER, the objects of a kind concurrently.
+        Failed compensations are reported and do not stop the rest of the rollback
+        :rtype: RollbackReport
+        """
+        with self._lock:
+            compensations, self._compensations = self._compensations, []
+
+        start = time.time()
+        completed = []
+
+        # the rollback of a cancelled command must reach the cloud provider
+        with cancellation_watcher.shielded():
+            self._rollback(compensations, completed)
+
+        return RollbackReport(completed, time.time() - start)
+
+    @staticmethod
+    def _rollback(compensations, completed):
+        for kind in ROLLBACK_ORDER:
+            # undo the newest objects first, like a stack
+            kind_compensations = [c for c in reversed(compensations) if c.kind == kind]
+            if not kind_compensations:
+                continue
+
+            if len(kind_compensations) == 1:
+                completed.append(kind_compensations[0].run())
+                continue
+
+            pool = ThreadPool(min(len(kind_compensations), MAX_CONCURRENT_COMPENSATIONS))
+            try:
+                completed.extend(pool.map(Compensation.run, kind_compensations))
+            finally:
+                pool.close()
+                pool.join()
@@ -0,0 +1,174 @@
+import json
+import multiprocessing
+import os
+import threading
+from cPickle import PicklingError
+
+from cloudshell.cp.core.models import DriverResponse
+
+from cancellation import cancellation_watcher
+from driver_request_index import IndexedDriverRequestParser, DriverRequestActions
+
+WORKERS_ENV_VAR = 'HEAVENLY_CLOUD_CPU_WORKERS'
+
+# below these sizes pickling the work to a worker process and the result back costs more than the work itself
+MIN_OFFLOAD_REQUEST_BYTES = 256 * 1024
+MIN_OFFLOAD_ITEMS = 500
+
+
+def dumps(obj):
+    """
+    The json the driver logs objects as
+    :rtype: str
+    """
+    return json.dumps(obj, default=lambda o: o.__dict__, sort_keys=True, separators=(',', ':'))
+
+
+# region worker process side
+
+_worker_parsers = {}
+
+
+def _parse_request(deployment_models, driver_request):
+    parser = _worker_parsers.get(deployment_models)
+    if parser is None:
+        parser = _worker_parsers[deployment_models] = IndexedDriverRequestParser()
+        for deployment_model in deployment_models:
+            parser.add_deployment_model(deployment_model)
+    return parser.parse(driver_request).build_all()
+
+
+def _driver_response_json(action_results):
+    return DriverResponse(action_results).to_driver_response_json()
+
+
+def _autoload_details(resource):
+    return resource.create_autoload_details()
+
+# endregion
+
+
+def _count_resources(resource):
+    return sum(1 + _count_resources(child) for child in resource.resources.values())
+
+
+class CpuWorkPool(object):
+    """
+    Runs the CPU bound stages of big sandbox commands, parsing driver requests, serializing results and building
+    autoload details, in a pool of worker processes so concurrent commands are not serialized by the GIL.
+    The pool is off unless HEAVENLY_CLOUD_CPU_WORKERS is set to a number of processes or to 'auto' for one per
+    core. Small inputs are always handled in the calling thread.
+    """
+
+    def __init__(self, processes=None, min_offload_request_bytes=MIN_OFFLOAD_REQUEST_BYTES,
+                 min_offload_items=MIN_OFFLOAD_ITEMS):
+        """
+        :param int processes: worker processes, 0 to do everything in the calling thread, read from
+        HEAVENLY_CLOUD_CPU_WORKERS by default
+        :param int min_offload_request_bytes: smallest driver request parsed in a worker
+        :param int min_offload_items: fewest action results or autoload resources handled in a worker
+        """
+        self.processes = self.default_processes() if processes is None else processes
+        self.min_offload_request_bytes = min_offload_request_bytes
+        self.min_offload_items = min_offload_items
+        self.offloaded = 0
+        self._lock = threading.Lock()
+        self._pool = None
+
+    @staticmethod
+    def default_processes():
+        value = os.environ.get(WORKERS_ENV_VAR, '').strip().lower()
+        if value == 'auto':
+            return multiprocessing.cpu_count()
+        try:
+            return max(int(value), 0)
+        except ValueError:
+            return 0
+
+    @property
+    def enabled(self):
+        return self.processes > 0
+
+    def configure(self, processes):
+        """
+        Changes the number of worker processes, the running workers are stopped
+        :param int processes:
+        """
+        self.close()
+        self.processes = processes
+
+    def close(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+    def _started_pool(self):
+        # called with self._lock held
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(self.processes)
+        return self._pool
+
+    def start(self):
+        """
+        Starts the worker processes now instead of on first use, does nothing when the pool is off
+        """
+        if self.enabled:
+            with self._lock:
+                self._started_pool()
+
+    def _run(self, func, *args):
+        with self._lock:
+            # started on first use unless started explicitly, so drivers that never see a big sandbox do not fork
+            pool = self._started_pool()
+            self.offloaded += 1
+        # a cancelled command stops waiting, the worker process finishes the task
+        return cancellation_watcher.wait_result(pool.apply_async(func, args))
+
+    def parse_request(self, parser, driver_request):
+        """
+        :param IndexedDriverRequestParser parser:
+        :param str driver_request: driver request json
+        :rtype: DriverRequestActions
+        """
+        if not self.enabled or len(driver_request) < self.min_offload_request_bytes:
+            return parser.parse(driver_request)
+
+        deployment_models = tuple(sorted(parser.models_classes.values(), key=lambda cls: cls.__deploymentModel__))
+        return DriverRequestActions(parser, {}, self._run(_parse_request, deployment_models, driver_request))
+
+    def driver_response_json(self, action_results):
+        """
+        :param list action_results:
+        :return: the DriverResponse json of the results
+        :rtype: str
+        """
+        if not self.enabled or len(action_results) < self.min_offload_items:
+            return _driver_response_json(action_results)
+        return self._run(_driver_response_json, action_results)
+
+    def dumps(self, obj):
+        """
+        :return: the json the driver logs obj as
+        :rtype: str
+        """
+        if not self.enabled or not isinstance(obj, list) or len(obj) < self.min_offload_items:
+            return dumps(obj)
+        try:
+            return self._run(dumps, obj)
+        except (PicklingError, TypeError):
+            # logging must not fail the command, some objects cannot be sent to another process
+            return dumps(obj)
+
+    def autoload_details(self, resource):
+        """
+        :param resource: data model resource, e.g. L3HeavenlyCloudShell
+        :rtype: AutoLoadDetails
+        """
+        if not self.enabled or _count_resources(resource) < self.min_offload_items:
+            return resource.create_autoload_details()
+        return self._run(_autoload_details, resource)
+
+
+cpu_work_pool = CpuWorkPool()
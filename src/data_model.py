@@ -228,6 +228,171 @@ class L3HeavenlyCloudShell(object):
         """
         self.attributes['L3HeavenlyCloudShell.Default storage'] = value
 
+    @property
+    def api_rate_limit(self):
+        """
+        :rtype: str
+        """
+        return self.attributes['L3HeavenlyCloudShell.API Rate Limit'] if 'L3HeavenlyCloudShell.API Rate Limit' in self.attributes else None
+
+    @api_rate_limit.setter
+    def api_rate_limit(self, value):
+        """
+        cloud provider API requests per second the shell sends, empty for no limit
+        :type value: str
+        """
+        self.attributes['L3HeavenlyCloudShell.API Rate Limit'] = value
+
+    @property
+    def api_burst(self):
+        """
+        :rtype: str
+        """
+        return self.attributes['L3HeavenlyCloudShell.API Burst'] if 'L3HeavenlyCloudShell.API Burst' in self.attributes else None
+
+    @api_burst.setter
+    def api_burst(self, value):
+        """
+        API requests the shell may send at once above the rate limit, defaults to the rate limit
+        :type value: str
+        """
+        self.attributes['L3HeavenlyCloudShell.API Burst'] = value
+
+    @property
+    def warm_subnet_pool_size(self):
+        """
+        :rtype: str
+        """
+        return self.attributes['L3HeavenlyCloudShell.Warm Subnet Pool Size'] if 'L3HeavenlyCloudShell.Warm Subnet Pool Size' in self.attributes else None
+
+    @warm_subnet_pool_size.setter
+    def warm_subnet_pool_size(self, value):
+        """
+        subnets of each requested size kept ready for new sandboxes, 0 to create them when the sandbox is prepared
+        :type value: str
+        """
+        self.attributes['L3HeavenlyCloudShell.Warm Subnet Pool Size'] = value
+
+    @property
+    def warm_key_pair_pool_size(self):
+        """
+        :rtype: str
+        """
+        return self.attributes['L3HeavenlyCloudShell.Warm Key Pair Pool Size'] if 'L3HeavenlyCloudShell.Warm Key Pair Pool Size' in self.attributes else None
+
+    @warm_key_pair_pool_size.setter
+    def warm_key_pair_pool_size(self, value):
+        """
+        key pairs kept ready so every sandbox gets its own, 0 to share one key pair between the sandboxes
+        :type value: str
+        """
+        self.attributes['L3HeavenlyCloudShell.Warm Key Pair Pool Size'] = value
+
+    @property
+    def warm_instance_pool_max_size(self):
+        """
+        :rtype: str
+        """
+        return self.attributes['L3HeavenlyCloudShell.Warm Instance Pool Max Size'] if 'L3HeavenlyCloudShell.Warm Instance Pool Max Size' in self.attributes else None
+
+    @warm_instance_pool_max_size.setter
+    def warm_instance_pool_max_size(self, value):
+        """
+        stopped instances kept ready per deployment configuration at most, the pool follows the deploy rate, 0 to create every instance on deploy
+        :type value: str
+        """
+        self.attributes['L3HeavenlyCloudShell.Warm Instance Pool Max Size'] = value
+
+    @property
+    def prefetch_images(self):
+        """
+        :rtype: str
+        """
+        return self.attributes['L3HeavenlyCloudShell.Prefetch Images'] if 'L3HeavenlyCloudShell.Prefetch Images' in self.attributes else None
+
+    @prefetch_images.setter
+    def prefetch_images(self, value):
+        """
+        comma separated cloud image ids of the app templates, copied to the region when a sandbox is prepared
+        :type value: str
+        """
+        self.attributes['L3HeavenlyCloudShell.Prefetch Images'] = value
+
+    @property
+    def profile_commands(self):
+        """
+        :rtype: str
+        """
+        return self.attributes['L3HeavenlyCloudShell.Profile Commands'] if 'L3HeavenlyCloudShell.Profile Commands' in self.attributes else None
+
+    @profile_commands.setter
+    def profile_commands(self, value):
+        """
+        comma separated driver commands to profile, e.g. Deploy,GetVmDetails, empty to profile none
+        :type value: str
+        """
+        self.attributes['L3HeavenlyCloudShell.Profile Commands'] = value
+
+    @property
+    def profiler(self):
+        """
+        :rtype: str
+        """
+        return self.attributes['L3HeavenlyCloudShell.Profiler'] if 'L3HeavenlyCloudShell.Profiler' in self.attributes else None
+
+    @profiler.setter
+    def profiler(self, value):
+        """
+        sampling for a low overhead stack sampler or cprofile for exact call counts and times
+        :type value: str
+        """
+        self.attributes['L3HeavenlyCloudShell.Profiler'] = value
+
+    @property
+    def profile_allocations(self):
+        """
+        :rtype: str
+        """
+        return self.attributes['L3HeavenlyCloudShell.Profile Allocations'] if 'L3HeavenlyCloudShell.Profile Allocations' in self.attributes else None
+
+    @profile_allocations.setter
+    def profile_allocations(self, value):
+        """
+        True to also snapshot the memory allocations of the profiled GetVmDetails and get_inventory commands
+        :type value: str
+        """
+        self.attributes['L3HeavenlyCloudShell.Profile Allocations'] = value
+
+    @property
+    def command_timeout(self):
+        """
+        :rtype: str
+        """
+        return self.attributes['L3HeavenlyCloudShell.Command Timeout'] if 'L3HeavenlyCloudShell.Command Timeout' in self.attributes else None
+
+    @command_timeout.setter
+    def command_timeout(self, value):
+        """
+        seconds a driver command may run, its cloud provider calls time out once they are spent, 0 for no timeout
+        :type value: str
+        """
+        self.attributes['L3HeavenlyCloudShell.Command Timeout'] = value
+
+    @property
+    def command_timeouts(self):
+        """
+        :rtype: str
+        """
+        return self.attributes['L3HeavenlyCloudShell.Command Timeouts'] if 'L3HeavenlyCloudShell.Command Timeouts' in self.attributes else None
+
+    @command_timeouts.setter
+    def command_timeouts(self, value):
+        """
+        per command overrides of Command Timeout, e.g. Deploy=1800,GetVmDetails=60
+        :type value: str
+        """
+        self.attributes['L3HeavenlyCloudShell.Command Timeouts'] = value
+
     @property
     def networking_type(self):
         """
@@ -780,7 +945,7 @@ class Cloud(object):
 
 class HeavenResidentInstance(object):
 
-    def __init__(self, name, descrpition, image, cloud, id, private_ip, public_ip):
+    def __init__(self, name, descrpition, image, cloud, id, private_ip, public_ip, power_state=None):
         self.name = name
         self.cloud = cloud
         self.image = image
@@ -788,3 +953,4 @@ class HeavenResidentInstance(object):
         self.id = id
         self.private_ip = private_ip
         self.public_ip = public_ip
+        self.power_state = power_state
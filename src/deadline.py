@@ -0,0 +1,71 @@
+import time
+
+
+def _command_timeouts(value):
+    """
+    :param str value: comma separated command=seconds, e.g. 'Deploy=1800, GetVmDetails=60'
+    :rtype: dict[str, str]
+    """
+    timeouts = {}
+    for item in (value or '').split(','):
+        command_name, _, seconds = item.partition('=')
+        if command_name.strip() and seconds.strip():
+            timeouts[command_name.strip()] = seconds.strip()
+    return timeouts
+
+
+def _seconds(value):
+    try:
+        seconds = float(value)
+    except (TypeError, ValueError):
+        return None
+    return seconds if seconds > 0 else None
+
+
+class Deadline(object):
+    def __init__(self, command_name, seconds):
+        """
+        The time budget of a command, the provider operations it runs get what is left of it as their timeout
+        :param str command_name: driver method name
+        :param float seconds: budget of the command from now
+        """
+        self.command_name = command_name
+        self.seconds = seconds
+        self.expires_at = time.time() + seconds
+
+    def remaining(self):
+        """
+        :return: seconds left before the deadline, 0 once it passed
+        :rtype: float
+        """
+        return max(self.expires_at - time.time(), 0)
+
+    @property
+    def expired(self):
+        return time.time() >= self.expires_at
+
+    def __repr__(self):
+        return 'Deadline({0}, {1:g}s, {2:.3f}s remaining)'.format(self.command_name, self.seconds, self.remaining())
+
+
+def command_deadline(command_name, context, cloud_provider_resource=None):
+    """
+    :param str command_name: driver method name
+    :param context: the command context, the Command Timeouts attribute of its resource overrides the Command
+    Timeout of the command
+    :param data_model.L3HeavenlyCloudShell cloud_provider_resource: the resource of the context, read from the
+    context when not given
+    :return: deadline of the command starting now, None when it has no timeout
+    :rtype: Deadline
+    """
+    if cloud_provider_resource is None:
+        from data_model import L3HeavenlyCloudShell
+
+        cloud_provider_resource = L3HeavenlyCloudShell.create_from_context(context)
+    seconds = _command_timeouts(cloud_provider_resource.command_timeouts).get(command_name)
+    if seconds is None:
+        seconds = cloud_provider_resource.command_timeout
+    seconds = _seconds(seconds)
+    if seconds is None:
+        return None
+    return Deadline(command_name, seconds)
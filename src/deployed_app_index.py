@@ -0,0 +1,241 @@
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+
+INDEX_PATH_ENV_VAR = 'HEAVENLY_CLOUD_APP_INDEX'
+DEFAULT_INDEX_FILE_NAME = 'heavenly_cloud_deployed_apps.sqlite'
+SCHEMA_VERSION = 1
+
+PUBLIC_IP_ATTRIBUTE = 'Public IP'
+
+_JSON_STRING = r'"((?:[^"\\]|\\.)*)"'
+_UID_PATTERN = re.compile(r'"uid"\s*:\s*' + _JSON_STRING)
+_PUBLIC_IP_PATTERNS = [
+    re.compile(r'"name"\s*:\s*"' + PUBLIC_IP_ATTRIBUTE + r'"\s*,\s*"value"\s*:\s*' + _JSON_STRING),
+    re.compile(r'"value"\s*:\s*' + _JSON_STRING + r'\s*,\s*"name"\s*:\s*"' + PUBLIC_IP_ATTRIBUTE + '"'),
+]
+
+
+def _json_string(raw):
+    # the captured text is still json escaped, only unescape when there is something to unescape
+    return json.loads('"' + raw + '"') if '\\' in raw else raw
+
+
+def extract_deployed_app_fields(deployed_app_json):
+    """
+    Reads vmdetails.uid and the Public IP attribute value out of a deployed app json without building the whole
+    json object. Falls back to a full parse whenever the text is ambiguous, e.g. a second "uid" key
+    :param str deployed_app_json:
+    :return: vm uid and public ip, the public ip is None when the app has no Public IP attribute
+    :rtype: (str, str)
+    """
+    uid_matches = _UID_PATTERN.findall(deployed_app_json)
+    public_ip_matches = [match for pattern in _PUBLIC_IP_PATTERNS for match in pattern.findall(deployed_app_json)]
+    public_ip_mentions = deployed_app_json.count('"' + PUBLIC_IP_ATTRIBUTE + '"')
+
+    if len(uid_matches) == 1 and len(public_ip_matches) == public_ip_mentions <= 1:
+        public_ip = _json_string(public_ip_matches[0]) if public_ip_matches else None
+        return _json_string(uid_matches[0]), public_ip
+
+    deployed_app_dict = json.loads(deployed_app_json)
+    public_ip = next((attribute['value'] for attribute in deployed_app_dict.get('attributes', [])
+                      if attribute['name'] == PUBLIC_IP_ATTRIBUTE), None)
+    return deployed_app_dict['vmdetails']['uid'], public_ip
+
+
+class DeployedAppRecord(object):
+    def __init__(self, fullname, vm_uid, private_ip=None, public_ip=None, reservation_id=None, cloud_provider=None,
+                 live_status=None, updated=None):
+        """
+        What CloudShell knows about a deployed app
+        :param str fullname: deployed app resource full name
+        :param str vm_uid: id of the instance in the cloud provider
+        :param str private_ip: the deployed app address
+        :param str public_ip: the deployed app Public IP attribute value
+        :param str reservation_id:
+        :param str cloud_provider: name of the cloud provider resource that deployed the app
+        :param str live_status: the live status last set on the deployed app by this shell, None when unknown
+        :param float updated: time the record was written
+        """
+        self.fullname = fullname
+        self.vm_uid = vm_uid
+        self.private_ip = private_ip
+        self.public_ip = public_ip
+        self.reservation_id = reservation_id
+        self.cloud_provider = cloud_provider
+        self.live_status = live_status
+        self.updated = updated
+
+    @staticmethod
+    def from_remote_endpoint(resource_ep, reservation_id=None, cloud_provider=None):
+        """
+        :param cloudshell.shell.core.driver_context.ResourceContextDetails resource_ep: the deployed app endpoint of
+        a remote command context
+        :param str reservation_id:
+        :param str cloud_provider:
+        :rtype: DeployedAppRecord
+        """
+        vm_uid, public_ip = extract_deployed_app_fields(resource_ep.app_context.deployed_app_json)
+        return DeployedAppRecord(resource_ep.fullname, vm_uid, resource_ep.address, public_ip, reservation_id,
+                                 cloud_provider)
+
+    def __eq__(self, other):
+        return isinstance(other, DeployedAppRecord) and self._fields() == other._fields()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return 'DeployedAppRecord{0}'.format(self._fields())
+
+    def _fields(self):
+        return (self.fullname, self.vm_uid, self.private_ip, self.public_ip, self.reservation_id, self.cloud_provider,
+                self.live_status)
+
+
+class DeployedAppIndex(object):
+    """
+    Local index of the apps deployed by this shell keyed by deployed app full name, with a reverse lookup by
+    instance id. Filled at Deploy time so reconciliation scans know the apps of a reservation and their last
+    pushed state. Remote commands do not read it, they extract the vm uid from the deployed app json of their
+    context with extract_deployed_app_fields.
+    """
+
+    _COLUMNS = 'fullname, vm_uid, private_ip, public_ip, reservation_id, cloud_provider, live_status, updated'
+
+    def __init__(self, path):
+        """
+        :param str path: sqlite database file, ':memory:' for an index private to the process
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = None
+
+    @staticmethod
+    def default_path():
+        return os.environ.get(INDEX_PATH_ENV_VAR) or os.path.join(tempfile.gettempdir(), DEFAULT_INDEX_FILE_NAME)
+
+    def _connect(self):
+        # called with self._lock held, the database is opened on first use so importing the driver stays cheap
+        if self._connection is None:
+            connection = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+            # every record can be rebuilt from a command context, so trade durability for not syncing on each write
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=OFF')
+            # the index is a cache, an index written by another version of the shell is dropped rather than migrated
+            if connection.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+                connection.execute('DROP TABLE IF EXISTS deployed_apps')
+                connection.execute('DROP TABLE IF EXISTS reconciliations')
+                connection.execute('PRAGMA user_version = {0}'.format(SCHEMA_VERSION))
+            connection.execute('CREATE TABLE IF NOT EXISTS deployed_apps ('
+                               'fullname TEXT PRIMARY KEY, vm_uid TEXT NOT NULL, private_ip TEXT, public_ip TEXT, '
+                               'reservation_id TEXT, cloud_provider TEXT, live_status TEXT, updated REAL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS deployed_apps_vm_uid ON deployed_apps (vm_uid)')
+            connection.execute('CREATE INDEX IF NOT EXISTS deployed_apps_reservation_id '
+                               'ON deployed_apps (reservation_id)')
+            connection.execute('CREATE TABLE IF NOT EXISTS reconciliations ('
+                               'reservation_id TEXT, cloud_provider TEXT, as_of REAL, '
+                               'PRIMARY KEY (reservation_id, cloud_provider))')
+            connection.commit()
+            self._connection = connection
+        return self._connection
+
+    def open(self):
+        """
+        Opens the database now instead of on first use
+        """
+        with self._lock:
+            self._connect()
+
+    def close(self):
+        with self._lock:
+            connection, self._connection = self._connection, None
+        if connection is not None:
+            connection.close()
+
+    def _execute(self, sql, parameters=()):
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                return connection.execute(sql, parameters).fetchall()
+
+    def put(self, record):
+        """
+        :param DeployedAppRecord record:
+        """
+        self.put_all([record])
+
+    def put_all(self, records):
+        """
+        Writes the records in a single transaction
+        :param list[DeployedAppRecord] records:
+        """
+        updated = time.time()
+        rows = []
+        for record in records:
+            record.updated = updated
+            rows.append(record._fields() + (updated,))
+
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.executemany('INSERT OR REPLACE INTO deployed_apps ({0}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)'
+                                       .format(self._COLUMNS), rows)
+
+    def get(self, fullname):
+        """
+        :param str fullname: deployed app resource full name
+        :rtype: DeployedAppRecord
+        """
+        rows = self._execute('SELECT {0} FROM deployed_apps WHERE fullname = ?'.format(self._COLUMNS), (fullname,))
+        return DeployedAppRecord(*rows[0]) if rows else None
+
+    def find_by_vm_uid(self, vm_uid):
+        """
+        :param str vm_uid: id of the instance in the cloud provider
+        :rtype: DeployedAppRecord
+        """
+        rows = self._execute('SELECT {0} FROM deployed_apps WHERE vm_uid = ?'.format(self._COLUMNS), (vm_uid,))
+        return DeployedAppRecord(*rows[0]) if rows else None
+
+    def for_reservation(self, reservation_id):
+        """
+        :param str reservation_id:
+        :rtype: list[DeployedAppRecord]
+        """
+        rows = self._execute('SELECT {0} FROM deployed_apps WHERE reservation_id = ? ORDER BY fullname'.format(
+            self._COLUMNS), (reservation_id,))
+        return [DeployedAppRecord(*row) for row in rows]
+
+    def remove(self, fullname):
+        """
+        :param str fullname: deployed app resource full name
+        """
+        self._execute('DELETE FROM deployed_apps WHERE fullname = ?', (fullname,))
+
+    def last_reconciled(self, reservation_id, cloud_provider):
+        """
+        :param str reservation_id:
+        :param str cloud_provider: cloud provider resource name
+        :return: provider time of the last reconciliation of the reservation apps, None if they were never reconciled
+        :rtype: float
+        """
+        rows = self._execute('SELECT as_of FROM reconciliations WHERE reservation_id = ? AND cloud_provider = ?',
+                             (reservation_id, cloud_provider))
+        return rows[0][0] if rows else None
+
+    def set_last_reconciled(self, reservation_id, cloud_provider, as_of):
+        """
+        :param str reservation_id:
+        :param str cloud_provider: cloud provider resource name
+        :param float as_of: provider time of the reconciliation
+        """
+        self._execute('INSERT OR REPLACE INTO reconciliations (reservation_id, cloud_provider, as_of) '
+                      'VALUES (?, ?, ?)', (reservation_id, cloud_provider, as_of))
+
+
+deployed_app_index = DeployedAppIndex(DeployedAppIndex.default_path())
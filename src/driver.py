@@ -1,21 +1,31 @@
-from cloudshell.cp.core import DriverRequestParser
-from cloudshell.cp.core.models import DriverResponse, DeployApp, DeployAppResult, PrepareCloudInfra, CreateKeys, \
-    PrepareSubnet, ConnectSubnet, CleanupNetwork
-from cloudshell.shell.core.resource_driver_interface import ResourceDriverInterface
-from cloudshell.cp.core.models import DriverResponse
-from cloudshell.shell.core.driver_context import InitCommandContext, AutoLoadCommandContext, ResourceCommandContext, \
-    AutoLoadAttribute, AutoLoadDetails, CancellationContext, ResourceRemoteCommandContext
-
-from cloudshell.shell.core.session.cloudshell_session import CloudShellSessionContext
+import json
+import sys
+import time
+from contextlib import contextmanager
 
-from cloudshell.shell.core.session.logging_session import LoggingSessionContext
+_import_started = time.time()
 
-from data_model import *
-from sdk.heavenly_cloud_service import *
-from heavenly_cloud_service_wrapper import HeavenlyCloudServiceWrapper
-from cloudshell.core.context.error_handling_context import ErrorHandlingContext
-import json
+from cloudshell.shell.core.resource_driver_interface import ResourceDriverInterface
 
+from driver_runtime import driver_runtime
+from lazy_import import lazy_import
+
+# command dependencies are imported on first use, or by the runtime warmup in initialize, so creating the driver
+# stays cheap
+DeployApp, PrepareCloudInfra, CreateKeys, PrepareSubnet, ConnectSubnet, CleanupNetwork = lazy_import(
+    'cloudshell.cp.core.models', 'DeployApp', 'PrepareCloudInfra', 'CreateKeys', 'PrepareSubnet', 'ConnectSubnet',
+    'CleanupNetwork')
+CloudShellSessionContext = lazy_import('cloudshell.shell.core.session.cloudshell_session', 'CloudShellSessionContext')
+LoggingSessionContext = lazy_import('cloudshell.shell.core.session.logging_session', 'LoggingSessionContext')
+ErrorHandlingContext = lazy_import('cloudshell.core.context.error_handling_context', 'ErrorHandlingContext')
+L3HeavenlyCloudShell = lazy_import('data_model', 'L3HeavenlyCloudShell')
+HeavenlyCloudService = lazy_import('sdk.heavenly_cloud_service', 'HeavenlyCloudService')
+HeavenlyCloudServiceWrapper = lazy_import('heavenly_cloud_service_wrapper', 'HeavenlyCloudServiceWrapper')
+command_deadline = lazy_import('deadline', 'command_deadline')
+DeployedAppRecord = lazy_import('deployed_app_index', 'DeployedAppRecord')
+StreamingJsonWriter = lazy_import('streaming_json_writer', 'StreamingJsonWriter')
+
+driver_runtime.record_import(__name__, time.time() - _import_started)
 
 # from data_model import *  # run 'shellfoundry generate' to generate data model classes
 
@@ -26,7 +36,9 @@ class L3HeavenlyCloudShellDriver(ResourceDriverInterface):
         """
         ctor must be without arguments, it is created with reflection at run time
         """
-        self.request_parser = DriverRequestParser()
+        # the parser, caches and pools live in the process wide runtime, they survive the driver being recycled
+        self.runtime = driver_runtime
+        self._runtime_acquired = False
 
     def initialize(self, context):
         """
@@ -34,9 +46,10 @@ class L3HeavenlyCloudShellDriver(ResourceDriverInterface):
         This is a good place to load and cache the driver configuration, initiate sessions etc.
         :param InitCommandContext context: the context the command runs on
         """
-        self.request_parser = DriverRequestParser()
-        self.request_parser.add_deployment_model(HeavenlyCloudAngelDeploymentModel)
-        self.request_parser.add_deployment_model(HeavenlyCloudManDeploymentModel)
+        # warms the runtime up unless a previous driver of this process already did
+        if not self._runtime_acquired:
+            self.runtime.acquire()
+            self._runtime_acquired = True
 
     # <editor-fold desc="Discovery">
 
@@ -46,9 +59,7 @@ class L3HeavenlyCloudShellDriver(ResourceDriverInterface):
         # return AutoLoadDetails([], [])
 
         # read from context
-        cloud_provider_resource = L3HeavenlyCloudShell.create_from_context(context)
-
-        with LoggingSessionContext(context) as logger, ErrorHandlingContext(logger):
+        with self._command('get_inventory', context) as (logger, cloud_provider_resource):
             self._log(logger, 'get_inventory_context_json', context)
 
             # validating
@@ -67,7 +78,7 @@ class L3HeavenlyCloudShellDriver(ResourceDriverInterface):
             if not cloud_provider_resource.heaven_cloud_color:
                 cloud_provider_resource.heaven_cloud_color = HeavenlyCloudService.get_prefered_cloud_color()
 
-            return cloud_provider_resource.create_autoload_details()
+            return self.runtime.cpu_work_pool.autoload_details(cloud_provider_resource)
 
     # </editor-fold>
 
@@ -82,20 +93,25 @@ class L3HeavenlyCloudShellDriver(ResourceDriverInterface):
        :return:
        :rtype: str
        """
-        with LoggingSessionContext(context) as logger, ErrorHandlingContext(logger):
-            with CloudShellSessionContext(context) as cloudshell_session:
+        with self._command('Deploy', context, request,
+                           cancellation_context=cancellation_context) as (logger, cloud_provider_resource):
+            # decrypted app passwords are shared by the concurrent deploys of the reservation and wiped once the
+            # last of them ends
+            with self._cloudshell_session(context) as cloudshell_session, \
+                    self.runtime.password_decryption_service.reservation_scope(context.reservation.reservation_id):
                 self._log(logger, 'deploy_request', request)
                 self._log(logger, 'deploy_context', context)
 
-                # parse the json strings into action objects
-                cloud_provider_resource = L3HeavenlyCloudShell.create_from_context(context)
-                actions = self.request_parser.convert_driver_request_to_actions(request)
+                # parse the json strings into actions indexed by type
+                with self.runtime.tracer.span('parse_request'):
+                    actions = self.runtime.cpu_work_pool.parse_request(self.runtime.request_parser, request)
 
                 # extract DeployApp action
-                deploy_action = single(actions, lambda x: isinstance(x, DeployApp))
+                deploy_action = actions.single(DeployApp)
+                self.runtime.tracer.annotate(action_id=deploy_action.actionId)
 
                 # extract ConnectToSubnetActions
-                connect_subnet_actions = list(filter(lambda x: isinstance(x, ConnectSubnet), actions))
+                connect_subnet_actions = actions.of_type(ConnectSubnet)
 
                 # if we have multiple supported deployment options use the 'deploymentPath' property
                 # to decide which deployment option to use.
@@ -119,8 +135,35 @@ class L3HeavenlyCloudShellDriver(ResourceDriverInterface):
 
                 self._log(logger, 'deployment_name', deployment_name)
                 self._log(logger, 'deploy_results', deploy_results)
+                self._log(logger, 'deploy_instance_pool_stats', self.runtime.instance_pool.stats())
+
+                self._index_deployed_app(logger, context, cloud_provider_resource, deploy_results)
 
-                return DriverResponse(deploy_results).to_driver_response_json()
+                with self.runtime.tracer.span('driver_response_json'):
+                    return self.runtime.cpu_work_pool.driver_response_json(deploy_results)
+
+    def _index_deployed_app(self, logger, context, cloud_provider_resource, deploy_results):
+        """
+        Remembers the deployed app, with the addresses of its instance, for the reconciliation of its reservation
+        :param logging.Logger logger:
+        :param ResourceCommandContext context:
+        :param L3HeavenlyCloudShell cloud_provider_resource:
+        :param list deploy_results:
+        """
+        deploy_result = deploy_results[0]
+        if not deploy_result.success:
+            return
+
+        # CloudShell names the deployed app resource after vmName, the index is only a cache so failing to write it
+        # must not fail a deploy that already created the instance
+        try:
+            deployed_app = DeployedAppRecord(deploy_result.vmName, deploy_result.vmUuid,
+                                             deploy_result.deployedAppAddress,
+                                             deploy_result.deployedAppAdditionalData.get('Public IP'),
+                                             context.reservation.reservation_id, cloud_provider_resource.name)
+            self.runtime.deployed_app_index.put(deployed_app)
+        except Exception:
+            logger.warning('failed to index deployed app ' + deploy_result.vmName, exc_info=True)
 
     def PowerOn(self, context, ports):
         """
@@ -128,15 +171,13 @@ class L3HeavenlyCloudShellDriver(ResourceDriverInterface):
         :param ResourceRemoteCommandContext context:
         :param ports:
         """
-        with LoggingSessionContext(context) as logger, ErrorHandlingContext(logger):
+        with self._command('PowerOn', context, ports) as (logger, cloud_provider_resource):
             self._log(logger, 'power_on_context', context)
             self._log(logger, 'power_on_ports', ports)
 
-            cloud_provider_resource = L3HeavenlyCloudShell.create_from_context(context)
-            resource_ep = context.remote_endpoints[0]
-            deployed_app_dict = json.loads(resource_ep.app_context.deployed_app_json)
+            deployed_app = DeployedAppRecord.from_remote_endpoint(context.remote_endpoints[0])
 
-            HeavenlyCloudServiceWrapper.power_on(cloud_provider_resource, deployed_app_dict['vmdetails']['uid'])
+            HeavenlyCloudServiceWrapper.power_on(cloud_provider_resource, deployed_app.vm_uid)
 
     def PowerOff(self, context, ports):
         """
@@ -144,15 +185,13 @@ class L3HeavenlyCloudShellDriver(ResourceDriverInterface):
         :param ResourceRemoteCommandContext context:
         :param ports:
         """
-        with LoggingSessionContext(context) as logger, ErrorHandlingContext(logger):
+        with self._command('PowerOff', context, ports) as (logger, cloud_provider_resource):
             self._log(logger, 'power_off_context', context)
             self._log(logger, 'power_off_ports', ports)
 
-            cloud_provider_resource = L3HeavenlyCloudShell.create_from_context(context)
-            resource_ep = context.remote_endpoints[0]
-            deployed_app_dict = json.loads(resource_ep.app_context.deployed_app_json)
+            deployed_app = DeployedAppRecord.from_remote_endpoint(context.remote_endpoints[0])
 
-            HeavenlyCloudServiceWrapper.power_off(cloud_provider_resource, deployed_app_dict['vmdetails']['uid'])
+            HeavenlyCloudServiceWrapper.power_off(cloud_provider_resource, deployed_app.vm_uid)
 
     def PowerCycle(self, context, ports, delay):
         pass
@@ -163,15 +202,14 @@ class L3HeavenlyCloudShellDriver(ResourceDriverInterface):
         :param ResourceRemoteCommandContext context:
         :param ports:
         """
-        with LoggingSessionContext(context) as logger, ErrorHandlingContext(logger):
+        with self._command('DeleteInstance', context, ports) as (logger, cloud_provider_resource):
             self._log(logger, 'DeleteInstance_context', context)
             self._log(logger, 'DeleteInstance_ports', ports)
 
-            cloud_provider_resource = L3HeavenlyCloudShell.create_from_context(context)
-            resource_ep = context.remote_endpoints[0]
-            deployed_app_dict = json.loads(resource_ep.app_context.deployed_app_json)
+            deployed_app = DeployedAppRecord.from_remote_endpoint(context.remote_endpoints[0])
 
-            HeavenlyCloudServiceWrapper.delete_instance(cloud_provider_resource, deployed_app_dict['vmdetails']['uid'])
+            HeavenlyCloudServiceWrapper.delete_instance(cloud_provider_resource, deployed_app.vm_uid)
+            self.runtime.deployed_app_index.remove(deployed_app.fullname)
 
     def GetVmDetails(self, context, requests, cancellation_context):
         """
@@ -181,15 +219,27 @@ class L3HeavenlyCloudShellDriver(ResourceDriverInterface):
         :param CancellationContext cancellation_context:
         :return:
         """
-        with LoggingSessionContext(context) as logger, ErrorHandlingContext(logger):
+        with self._command('GetVmDetails', context, requests,
+                           cancellation_context=cancellation_context) as (logger, cloud_provider_resource):
             self._log(logger, 'GetVmDetails_context', context)
             self._log(logger, 'GetVmDetails_requests', requests)
-            cloud_provider_resource = L3HeavenlyCloudShell.create_from_context(context)
-            result = HeavenlyCloudServiceWrapper.get_vm_details(cloud_provider_resource, cancellation_context,
-                                                                requests)
-            result_json = json.dumps(result, default=lambda o: o.__dict__, sort_keys=True, separators=(',', ':'))
+            vm_details_requests = json.loads(requests)
+
+            def get_vm_details():
+                # each VmDetailsData is serialized as soon as it is built instead of holding the whole result graph
+                vm_details = HeavenlyCloudServiceWrapper.iter_vm_details(cloud_provider_resource,
+                                                                         cancellation_context, vm_details_requests)
+                return StreamingJsonWriter.dumps_array(vm_details)
+
+            # the UI often asks for the details of the same apps several times at once
+            result_json = self._single_flight(('GetVmDetails', cloud_provider_resource.name,
+                                               HeavenlyCloudServiceWrapper.vm_details_request_key(
+                                                   vm_details_requests)),
+                                              cancellation_context, get_vm_details)
 
             self._log(logger, 'GetVmDetails_result', result_json)
+            self._log(logger, 'GetVmDetails_cache_stats', self.runtime.vm_details_cache.stats())
+            self._log(logger, 'GetVmDetails_single_flight_stats', self.runtime.single_flight.stats())
 
             return result_json
 
@@ -201,28 +251,61 @@ class L3HeavenlyCloudShellDriver(ResourceDriverInterface):
         :param CancellationContext cancellation_context:
         :return:
         """
-        with LoggingSessionContext(context) as logger, ErrorHandlingContext(logger):
-            with CloudShellSessionContext(context) as cloudshell_session:
+        with self._command('remote_refresh_ip', context, ports,
+                           cancellation_context=cancellation_context) as (logger, cloud_provider_resource):
+            with self._cloudshell_session(context) as cloudshell_session:
                 self._log(logger, 'remote_refresh_ip_context', context)
                 self._log(logger, 'remote_refresh_ip_ports', ports)
                 self._log(logger, 'remote_refresh_ip_cancellation_context', cancellation_context)
-                cloud_provider_resource = L3HeavenlyCloudShell.create_from_context(context)
-                deployed_app_dict = json.loads(context.remote_endpoints[0].app_context.deployed_app_json)
-                remote_ep = context.remote_endpoints[0]
-                deployed_app_private_ip = remote_ep.address
-                deployed_app_public_ip = None
 
-                public_ip_att = first_or_default(deployed_app_dict['attributes'], lambda x: x['name'] == 'Public IP')
+                # the Public IP attribute CloudShell holds now is what we compare against, so read it from the
+                # deployed app json rather than from the index
+                deployed_app = DeployedAppRecord.from_remote_endpoint(context.remote_endpoints[0],
+                                                                      context.remote_reservation.reservation_id,
+                                                                      cloud_provider_resource.name)
+
+                def refresh_ip():
+                    vm_instance = HeavenlyCloudServiceWrapper.remote_refresh_ip(cloud_provider_resource,
+                                                                                cancellation_context,
+                                                                                cloudshell_session,
+                                                                                deployed_app.fullname,
+                                                                                deployed_app.vm_uid,
+                                                                                deployed_app.private_ip,
+                                                                                deployed_app.public_ip)
+
+                    indexed_app = self.runtime.deployed_app_index.get(deployed_app.fullname)
+                    deployed_app.live_status = indexed_app.live_status if indexed_app else None
+                    deployed_app.private_ip = vm_instance.private_ip
+                    deployed_app.public_ip = vm_instance.public_ip
+                    self.runtime.deployed_app_index.put(deployed_app)
+
+                # concurrent refreshes of the same instance wait for the one in progress, it updated CloudShell
+                self._single_flight(('remote_refresh_ip', cloud_provider_resource.name, deployed_app.vm_uid),
+                                    cancellation_context, refresh_ip)
+
+    def ReconcileSandbox(self, context, mode=None):
+        """
+        Will update the addresses, Public IP and live status of all the reservation deployed apps of this cloud
+        provider whose instances changed in the cloud provider
+        :param ResourceCommandContext context:
+        :param str mode: 'full' to check every deployed app, 'incremental' (the default) to check only the instances
+        changed since the last reconciliation
+        :return: reconciliation summary
+        :rtype: str
+        """
+        from sandbox_reconciler import INCREMENTAL
 
-                if public_ip_att:
-                    deployed_app_public_ip = public_ip_att['value']
+        with self._command('ReconcileSandbox', context, mode) as (logger, cloud_provider_resource):
+            with self._cloudshell_session(context) as cloudshell_session:
+                self._log(logger, 'ReconcileSandbox_context', context)
+                self._log(logger, 'ReconcileSandbox_mode', mode)
 
-                deployed_app_fullname = remote_ep.fullname
-                vm_instance_id = deployed_app_dict['vmdetails']['uid']
+                report = self.runtime.sandbox_reconciler.reconcile(cloudshell_session, cloud_provider_resource,
+                                                                   context.reservation.reservation_id,
+                                                                   mode or INCREMENTAL)
+                logger.info(str(report))
 
-                HeavenlyCloudServiceWrapper.remote_refresh_ip(cloud_provider_resource, cancellation_context,
-                                                              cloudshell_session, deployed_app_fullname, vm_instance_id,
-                                                              deployed_app_private_ip, deployed_app_public_ip)
+                return str(report)
 
     # </editor-fold>
 
@@ -239,35 +322,39 @@ class L3HeavenlyCloudShellDriver(ResourceDriverInterface):
         :return:
         :rtype: DriverResponse
         """
-        with LoggingSessionContext(context) as logger, ErrorHandlingContext(logger):
-            with CloudShellSessionContext(context) as cloudshell_session:
+        with self._command('PrepareSandboxInfra', context, request,
+                           cancellation_context=cancellation_context) as (logger, cloud_provider_resource):
+            with self._cloudshell_session(context) as cloudshell_session:
                 self._log(logger, 'PrepareSandboxInfra_request', request)
                 self._log(logger, 'PrepareSandboxInfra_context', context)
 
-                cloud_provider_resource = L3HeavenlyCloudShell.create_from_context(context)
-
-                # parse the json strings into action objects
-                actions = self.request_parser.convert_driver_request_to_actions(request)
+                # parse the json strings into actions indexed by type
+                with self.runtime.tracer.span('parse_request'):
+                    actions = self.runtime.cpu_work_pool.parse_request(self.runtime.request_parser, request)
 
                 # extract PrepareCloudInfra action
-                prepare_infa_action = single(actions, lambda x: isinstance(x, PrepareCloudInfra))
+                prepare_infa_action = actions.single(PrepareCloudInfra)
 
                 # extract CreateKeys action
-                create_keys_action = single(actions, lambda x: isinstance(x, CreateKeys))
+                create_keys_action = actions.single(CreateKeys)
 
                 # extract PrepareSubnet actions
-                prepare_subnet_actions = list(filter(lambda x: isinstance(x, PrepareSubnet), actions))
+                prepare_subnet_actions = actions.of_type(PrepareSubnet)
 
                 action_results = HeavenlyCloudServiceWrapper.prepare_sandbox_infra(logger,
                                                                                    cloud_provider_resource,
                                                                                    prepare_infa_action,
                                                                                    create_keys_action,
                                                                                    prepare_subnet_actions,
-                                                                                   cancellation_context)
+                                                                                   cancellation_context,
+                                                                                   context.reservation.reservation_id)
 
                 self._log(logger, 'PrepareSandboxInfra_action_results', action_results)
+                self._log(logger, 'PrepareSandboxInfra_subnet_pool_stats', self.runtime.subnet_pool.stats())
+                self._log(logger, 'PrepareSandboxInfra_key_pair_pool_stats', self.runtime.key_pair_pool.stats())
 
-                return DriverResponse(action_results).to_driver_response_json()
+                with self.runtime.tracer.span('driver_response_json'):
+                    return self.runtime.cpu_work_pool.driver_response_json(action_results)
 
     def CleanupSandboxInfra(self, context, request):
         """
@@ -277,24 +364,26 @@ class L3HeavenlyCloudShellDriver(ResourceDriverInterface):
         :return:
         :rtype: str
         """
-        with LoggingSessionContext(context) as logger, ErrorHandlingContext(logger):
-            with CloudShellSessionContext(context) as cloudshell_session:
+        with self._command('CleanupSandboxInfra', context, request) as (logger, cloud_provider_resource):
+            with self._cloudshell_session(context) as cloudshell_session:
                 self._log(logger, 'CleanupSandboxInfra_request', request)
                 self._log(logger, 'CleanupSandboxInfra_context', context)
 
-                cloud_provider_resource = L3HeavenlyCloudShell.create_from_context(context)
-
-                # parse the json strings into action objects
-                actions = self.request_parser.convert_driver_request_to_actions(request)
+                # parse the json strings into actions indexed by type
+                with self.runtime.tracer.span('parse_request'):
+                    actions = self.runtime.cpu_work_pool.parse_request(self.runtime.request_parser, request)
 
                 # extract CleanupNetwork action
-                cleanup_action = single(actions, lambda x: isinstance(x, CleanupNetwork))
+                cleanup_action = actions.single(CleanupNetwork)
 
-                action_result = HeavenlyCloudServiceWrapper.cleanup_sandbox_infra(cloud_provider_resource, cleanup_action)
+                action_result = HeavenlyCloudServiceWrapper.cleanup_sandbox_infra(cloud_provider_resource,
+                                                                                  cleanup_action,
+                                                                                  context.reservation.reservation_id)
 
                 self._log(logger, 'CleanupSandboxInfra_action_result', action_result)
 
-                return DriverResponse([action_result]).to_driver_response_json()
+                with self.runtime.tracer.span('driver_response_json'):
+                    return self.runtime.cpu_work_pool.driver_response_json([action_result])
 
 
     # </editor-fold>
@@ -318,7 +407,83 @@ class L3HeavenlyCloudShellDriver(ResourceDriverInterface):
         Destroy the driver session, this function is called everytime a driver instance is destroyed
         This is a good place to close any open sessions, finish writing to log files, etc.
         """
-        pass
+        if self._runtime_acquired:
+            self._runtime_acquired = False
+            self.runtime.release()
+
+    @contextmanager
+    def _command(self, command_name, context, *args, **kwargs):
+        """
+        Runs the command it wraps recorded, profiled, in the scope of its cancellation context and deadline, logged,
+        with its errors handled and as a span of the trace. The resource is read from the context once for all of
+        them
+        :param str command_name: driver method name
+        :param context: the command context
+        :param args: the other arguments of the command, recorded for the replay
+        :param CancellationContext cancellation_context: keyword argument of the commands that can be cancelled,
+        recorded after args
+        :return: context manager yielding the logger and the cloud provider resource of the command
+        :rtype: tuple[logging.Logger, L3HeavenlyCloudShell]
+        """
+        cancellation_context = kwargs.get('cancellation_context')
+        if 'cancellation_context' in kwargs:
+            args += (cancellation_context,)
+        cloud_provider_resource = L3HeavenlyCloudShell.create_from_context(context)
+        reservation = getattr(context, 'reservation', None) or getattr(context, 'remote_reservation', None)
+        span_args = {'reservation_id': reservation.reservation_id} if reservation is not None else {}
+
+        with self.runtime.traffic_recorder.record(command_name, context, *args), \
+                self.runtime.command_profiler.profile(command_name, context, cloud_provider_resource), \
+                self.runtime.cancellation_watcher.scope(cancellation_context,
+                                                        command_deadline(command_name, context,
+                                                                         cloud_provider_resource)), \
+                LoggingSessionContext(context) as logger, ErrorHandlingContext(logger), \
+                self.runtime.tracer.span(command_name, 'command', **span_args):
+            yield logger, cloud_provider_resource
+
+    @contextmanager
+    def _cloudshell_session(self, context):
+        """
+        CloudShellSessionContext whose CloudShell API login is a span of the trace
+        :param ResourceCommandContext context:
+        :rtype: CloudShellAPISession
+        """
+        session_context = CloudShellSessionContext(context)
+        with self.runtime.tracer.span('cloudshell_session_login'):
+            cloudshell_session = session_context.__enter__()
+        try:
+            yield cloudshell_session
+        except BaseException:
+            if not session_context.__exit__(*sys.exc_info()):
+                raise
+        else:
+            session_context.__exit__(None, None, None)
+
+    def _single_flight(self, key, cancellation_context, func):
+        """
+        Runs func once for the concurrent commands with the same key, they all get the result of that execution.
+        A command sharing an execution that was cancelled or timed out half way runs func on its own, unless it is
+        cancelled or past its own deadline too
+        :param tuple key: command name and normalized request
+        :param CancellationContext cancellation_context: of the calling command
+        :param func: function without arguments running the command
+        :return: the result of func
+        """
+        from heavenly_cloud_service_wrapper import OperationCancelledException
+
+        def flight():
+            try:
+                return func(), None, cancellation_context.is_cancelled
+            except OperationCancelledException as e:
+                return None, e, True
+
+        result, cancellation, cancelled = self.runtime.single_flight.do(key, flight)
+        scope = self.runtime.cancellation_watcher.current()
+        if cancelled and not cancellation_context.is_cancelled and not (scope is not None and scope.is_expired):
+            return func()
+        if cancellation is not None:
+            raise cancellation
+        return result
 
     def _log(self, logger, name, obj):
 
@@ -327,7 +492,7 @@ class L3HeavenlyCloudShellDriver(ResourceDriverInterface):
 
         if not self._is_primitive(obj):
             name = name + '__json_serialized'
-            obj = json.dumps(obj, default=lambda o: o.__dict__, sort_keys=True, separators=(',', ':'))
+            obj = self.runtime.cpu_work_pool.dumps(obj)
 
         logger.info(name)
         logger.info(obj)
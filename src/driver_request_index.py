@@ -0,0 +1,106 @@
+import json
+
+from cloudshell.cp.core import DriverRequestParser, models
+from cloudshell.cp.core.utils import first_letter_to_upper
+
+
+class DriverRequestActions(object):
+    def __init__(self, parser, raw_actions_by_type, actions_by_type=None):
+        """
+        Actions of a single driver request indexed by their type.
+        Action objects, including the deployment custom model of DeployApp, are built only when first accessed
+        :param IndexedDriverRequestParser parser:
+        :param dict[str, list[dict]] raw_actions_by_type: action class name -> raw actions of that type
+        :param dict[str, list] actions_by_type: action class name -> actions already built, e.g. by build_all in
+        another process
+        """
+        self._parser = parser
+        self._raw_actions_by_type = raw_actions_by_type
+        self._actions_by_type = actions_by_type or {}
+
+    def of_type(self, action_cls):
+        """
+        :param type action_cls: e.g. ConnectSubnet
+        :return: all the actions of the given type, in request order
+        :rtype: list
+        """
+        type_name = action_cls.__name__
+        actions = self._actions_by_type.get(type_name)
+
+        if actions is None:
+            actions = self._actions_by_type[type_name] = \
+                [self._parser.build_action(action_cls, raw_action)
+                 for raw_action in self._raw_actions_by_type.get(type_name, [])]
+
+        return actions
+
+    def single(self, action_cls):
+        """
+        :param type action_cls: e.g. DeployApp
+        :return: the first action of the given type
+        """
+        actions = self.of_type(action_cls)
+
+        if not actions:
+            raise ValueError('driver request has no {0} action'.format(action_cls.__name__))
+
+        return actions[0]
+
+    def count(self, action_cls):
+        """
+        :param type action_cls:
+        :return: number of actions of the given type, without building them
+        :rtype: int
+        """
+        actions = self._actions_by_type.get(action_cls.__name__)
+        if actions is not None:
+            return len(actions)
+        return len(self._raw_actions_by_type.get(action_cls.__name__, []))
+
+    def build_all(self):
+        """
+        Builds the actions of every type known to cloudshell.cp.core.models
+        :return: action class name -> actions, in request order
+        :rtype: dict[str, list]
+        """
+        for type_name in self._raw_actions_by_type:
+            action_cls = getattr(models, type_name, None)
+            if action_cls is not None:
+                self.of_type(action_cls)
+        return dict(self._actions_by_type)
+
+
+class IndexedDriverRequestParser(DriverRequestParser):
+    """
+    DriverRequestParser front end that groups the request actions by type in a single pass over the request
+    instead of converting all of them up front and scanning the result again for every type
+    """
+
+    def parse(self, driver_request):
+        """
+        :param str driver_request: driver request json
+        :rtype: DriverRequestActions
+        """
+        if isinstance(driver_request, basestring):
+            driver_request = json.loads(driver_request)
+
+        raw_actions_by_type = {}
+
+        for raw_action in driver_request['driverRequest'].get('actions') or []:
+            type_name = first_letter_to_upper(raw_action.get('type'))
+            raw_actions = raw_actions_by_type.get(type_name)
+            if raw_actions is None:
+                raw_actions = raw_actions_by_type[type_name] = []
+            raw_actions.append(raw_action)
+
+        return DriverRequestActions(self, raw_actions_by_type)
+
+    def build_action(self, action_cls, raw_action):
+        """
+        :param type action_cls:
+        :param dict raw_action:
+        """
+        action = action_cls()
+        self._fill_recursive(raw_action, action)
+        return action
+
@@ -0,0 +1,299 @@
+import importlib
+import threading
+import time
+
+# seconds the runtime stays warm after the last driver using it was cleaned up, CloudShell recycles drivers often
+DEFAULT_LINGER_SECONDS = 300
+
+# imported by the warmup so the first command after initialize does not pay for them
+WARMUP_MODULES = [
+    'cloudshell.cp.core.models',
+    'cloudshell.shell.core.session.cloudshell_session',
+    'cloudshell.shell.core.session.logging_session',
+    'cloudshell.core.context.error_handling_context',
+    'data_model',
+    'heavenly_cloud_service_wrapper',
+    'streaming_json_writer',
+]
+
+
+class _Component(object):
+    def __init__(self, load):
+        """
+        Runtime attribute created on first read, the instance attribute then shadows the descriptor
+        :param load: function of the runtime to the component
+        """
+        self.load = load
+        self.name = load.__name__
+
+    def __get__(self, runtime, owner):
+        if runtime is None:
+            return self
+        with runtime._load_lock:
+            component = runtime.__dict__.get(self.name)
+            if component is None:
+                component = runtime.__dict__[self.name] = self.load(runtime)
+        return component
+
+
+def _request_parser(runtime):
+    from data_model import HeavenlyCloudAngelDeploymentModel, HeavenlyCloudManDeploymentModel
+    from driver_request_index import IndexedDriverRequestParser
+
+    request_parser = IndexedDriverRequestParser()
+    request_parser.add_deployment_model(HeavenlyCloudAngelDeploymentModel)
+    request_parser.add_deployment_model(HeavenlyCloudManDeploymentModel)
+    return request_parser
+
+
+def _deployed_app_index(runtime):
+    from deployed_app_index import deployed_app_index
+    return deployed_app_index
+
+
+def _sandbox_reconciler(runtime):
+    from sandbox_reconciler import SandboxReconciler
+    return SandboxReconciler(runtime.deployed_app_index)
+
+
+def _password_decryption_service(runtime):
+    from password_decryption_service import password_decryption_service
+    return password_decryption_service
+
+
+def _request_scheduler(runtime):
+    from request_scheduler import request_scheduler
+    return request_scheduler
+
+
+def _vm_details_cache(runtime):
+    from vm_details_cache import vm_details_cache
+    return vm_details_cache
+
+
+def _single_flight(runtime):
+    from single_flight import single_flight
+    return single_flight
+
+
+def _cidr_allocator(runtime):
+    from cidr_allocator import cidr_allocator
+    return cidr_allocator
+
+
+def _subnet_pool(runtime):
+    from warm_pool import subnet_pool
+    return subnet_pool
+
+
+def _key_pair_pool(runtime):
+    from warm_pool import key_pair_pool
+    return key_pair_pool
+
+
+def _instance_pool(runtime):
+    from warm_pool import instance_pool
+    return instance_pool
+
+
+def _image_catalog(runtime):
+    from image_catalog import image_catalog
+    return image_catalog
+
+
+def _tracer(runtime):
+    from tracing import tracer
+    return tracer
+
+
+def _traffic_recorder(runtime):
+    from traffic_recorder import traffic_recorder
+    return traffic_recorder
+
+
+def _command_profiler(runtime):
+    from command_profiler import command_profiler
+    return command_profiler
+
+
+def _cancellation_watcher(runtime):
+    from cancellation import cancellation_watcher
+    return cancellation_watcher
+
+
+def _cpu_work_pool(runtime):
+    from cpu_work_pool import cpu_work_pool
+    return cpu_work_pool
+
+
+class DriverRuntime(object):
+    """
+    Process wide state of the shell that outlives the driver instances CloudShell creates and destroys: the request
+    parser, the deployed app index, caches, the provider request scheduler, warm pools, the cpu work pool, the tracer,
+    the traffic recorder, the command profiler, the cancellation watcher and their metrics.
+    Drivers acquire it in initialize, which warms it up if it is cold, and release it in cleanup. Once no driver
+    holds it for linger seconds its pools, connections and caches are released until a driver acquires it again.
+    """
+
+    def __init__(self, linger=DEFAULT_LINGER_SECONDS):
+        """
+        :param float linger: seconds to stay warm after the last release, 0 to shut down right away
+        """
+        self.linger = linger
+        self._load_lock = threading.RLock()
+        self._lock = threading.Lock()
+        self._references = 0
+        self._shutdown_timer = None
+        self.warm = False
+        self.created = time.time()
+        self.import_seconds = {}  # module name -> seconds its import took
+        self.warmups = 0
+        self.warmup_seconds = 0.0
+        self.shutdowns = 0
+
+    # the components are imported and created on first use, at the latest by the warmup
+    request_parser = _Component(_request_parser)
+    deployed_app_index = _Component(_deployed_app_index)
+    sandbox_reconciler = _Component(_sandbox_reconciler)
+    password_decryption_service = _Component(_password_decryption_service)
+    request_scheduler = _Component(_request_scheduler)
+    vm_details_cache = _Component(_vm_details_cache)
+    single_flight = _Component(_single_flight)
+    cidr_allocator = _Component(_cidr_allocator)
+    subnet_pool = _Component(_subnet_pool)
+    key_pair_pool = _Component(_key_pair_pool)
+    instance_pool = _Component(_instance_pool)
+    image_catalog = _Component(_image_catalog)
+    tracer = _Component(_tracer)
+    traffic_recorder = _Component(_traffic_recorder)
+    command_profiler = _Component(_command_profiler)
+    cancellation_watcher = _Component(_cancellation_watcher)
+    cpu_work_pool = _Component(_cpu_work_pool)
+
+    def record_import(self, module_name, seconds):
+        """
+        :param str module_name:
+        :param float seconds: time the import of the module took, including the modules it imported
+        """
+        self.import_seconds[module_name] = seconds
+
+    def acquire(self):
+        """
+        Called by each driver initialize, warms the runtime up if it is cold
+        """
+        with self._lock:
+            self._references += 1
+            if self._shutdown_timer is not None:
+                self._shutdown_timer.cancel()
+                self._shutdown_timer = None
+            if not self.warm:
+                self._warmup()
+
+    def release(self):
+        """
+        Called by each driver cleanup, the runtime shuts down linger seconds after the last release
+        """
+        with self._lock:
+            self._references = max(self._references - 1, 0)
+            if self._references or not self.warm:
+                return
+            if not self.linger:
+                self._shutdown()
+                return
+            self._shutdown_timer = threading.Timer(self.linger, self._shutdown_if_unused)
+            self._shutdown_timer.daemon = True
+            self._shutdown_timer.start()
+
+    def _warmup(self):
+        # called with self._lock held, everything the first command would otherwise pay for
+        from sdk.heavenly_cloud_service import HeavenlyCloudService
+
+        start = time.time()
+        for module_name in WARMUP_MODULES:
+            importlib.import_module(module_name)
+        for component_name in ('request_parser', 'sandbox_reconciler', 'password_decryption_service',
+                               'vm_details_cache', 'single_flight'):
+            getattr(self, component_name)
+        # outermost, the span of a provider operation includes its wait for the rate limit
+        if self.tracer.enabled:
+            HeavenlyCloudService.add_interceptor(self.tracer, outermost=True)
+        # every provider operation of this process queues behind the rate limit of its cloud provider resource
+        HeavenlyCloudService.add_interceptor(self.request_scheduler)
+        # innermost, a cancelled or timed out command stops waiting for the provider call itself, not for its rate
+        # limit turn
+        HeavenlyCloudService.add_interceptor(self.cancellation_watcher)
+        self.deployed_app_index.open()
+        self.cpu_work_pool.start()
+        self.warm = True
+        self.warmups += 1
+        self.warmup_seconds = time.time() - start
+
+    def _shutdown_if_unused(self):
+        with self._lock:
+            if not self._references and self.warm:
+                self._shutdown()
+
+    def _shutdown(self):
+        # called with self._lock held
+        from sdk.heavenly_cloud_service import HeavenlyCloudService
+
+        self._shutdown_timer = None
+        HeavenlyCloudService.remove_interceptor(self.request_scheduler)
+        HeavenlyCloudService.remove_interceptor(self.cancellation_watcher)
+        if self.tracer.enabled:
+            HeavenlyCloudService.remove_interceptor(self.tracer)
+            self.tracer.close()
+        self.traffic_recorder.close()
+        self.cancellation_watcher.close()
+        self.cpu_work_pool.close()
+        # the subnets and instances no command claimed are deleted, the pools refill on the next claims
+        self.subnet_pool.close()
+        self.key_pair_pool.close()
+        self.instance_pool.close()
+        self.deployed_app_index.close()
+        self.vm_details_cache.clear()
+        self.image_catalog.clear()
+        self.warm = False
+        self.shutdowns += 1
+
+    def shutdown(self):
+        """
+        Releases the pools, connections and caches now, whatever driver still holds the runtime
+        """
+        with self._lock:
+            if self._shutdown_timer is not None:
+                self._shutdown_timer.cancel()
+            if self.warm:
+                self._shutdown()
+
+    def stats(self):
+        """
+        :return: lifecycle, import and warmup timings and the metrics of the runtime components
+        :rtype: dict
+        """
+        with self._lock:
+            stats = {'warm': self.warm,
+                     'references': self._references,
+                     'uptime_seconds': time.time() - self.created,
+                     'import_seconds': dict(self.import_seconds),
+                     'warmups': self.warmups,
+                     'warmup_seconds': self.warmup_seconds,
+                     'shutdowns': self.shutdowns}
+        stats['vm_details_cache'] = self.vm_details_cache.stats()
+        stats['single_flight'] = self.single_flight.stats()
+        stats['request_scheduler'] = self.request_scheduler.metrics()
+        stats['cidr_allocator'] = self.cidr_allocator.stats()
+        stats['subnet_pool'] = self.subnet_pool.stats()
+        stats['key_pair_pool'] = self.key_pair_pool.stats()
+        stats['instance_pool'] = self.instance_pool.stats()
+        stats['image_catalog'] = self.image_catalog.stats()
+        stats['tracer'] = self.tracer.stats()
+        stats['traffic_recorder'] = self.traffic_recorder.stats()
+        stats['command_profiler'] = self.command_profiler.stats()
+        stats['cancellation_watcher'] = self.cancellation_watcher.stats()
+        stats['cpu_work_pool'] = {'processes': self.cpu_work_pool.processes,
+                                  'offloaded': self.cpu_work_pool.offloaded}
+        return stats
+
+
+driver_runtime = DriverRuntime()
@@ -1,31 +1,48 @@
-import random
+import json
+import os
 import traceback
 import uuid
-import os
-from cloudshell.cp.core.models import *
-from data_model import *
-from cloudshell.shell.core.driver_context import CancellationContext
-from sdk.heavenly_cloud_service import HeavenlyCloudService
-import json
-from typing import List
 
+from cloudshell.cp.core.models import Attribute, CleanupNetworkResult, ConnectSubnet, ConnectToSubnetActionResult, \
+    CreateKeys, CreateKeysActionResult, DeployApp, DeployAppResult, PrepareCloudInfra, PrepareCloudInfraResult, \
+    PrepareSubnet, PrepareSubnetActionResult, VmDetailsData
 
-def check_cancellation_context_and_do_rollback(cancellation_context):
+from sdk.heavenly_cloud_service import HeavenlyCloudService
+from password_decryption_service import password_decryption_service
+from compensation_log import CompensationLog, INSTANCE, KEY_PAIR, SUBNET, NETWORK
+from vm_details_cache import vm_details_cache
+from cidr_allocator import cidr_allocator
+from image_catalog import UnknownImageError, image_catalog, image_ids
+from vm_details_template import template_for
+from warm_pool import instance_pool, key_pair_pool, subnet_pool
+from tracing import tracer
+from cancellation import OperationCancelledException, cancellation_watcher
+
+
+def check_cancellation_context_and_do_rollback(cancellation_context, compensation_log=None):
     """
+    Also rolls back and raises DeadlineExceededException once the deadline of the command passed
     :param CancellationContext cancellation_context:
+    :param CompensationLog compensation_log: the cloud objects created by the current executing command
     """
-    if cancellation_context.is_cancelled:
+    scope = cancellation_watcher.current()
+    is_cancelled = cancellation_context.is_cancelled
+    if is_cancelled or (scope is not None and scope.is_expired):
         # rollback what we created for current executing command then raise exception
-        # HeavenlyCloudService.rollback()
-        raise Exception('Operation cancelled')
+        rollback_report = compensation_log.rollback() if compensation_log is not None else None
+        if is_cancelled:
+            raise OperationCancelledException(rollback_report)
+        raise scope.deadline_exceeded(rollback_report)
 
 
 def check_cancellation_context(cancellation_context):
     """
+    Also raises DeadlineExceededException once the deadline of the command passed
     :param CancellationContext cancellation_context:
     """
     if cancellation_context.is_cancelled:
-        raise Exception('Operation cancelled')
+        raise OperationCancelledException()
+    cancellation_watcher.check()
 
 
 class HeavenlyCloudServiceWrapper(object):
@@ -34,89 +51,75 @@ class HeavenlyCloudServiceWrapper(object):
     def deploy_angel(context, cloudshell_session, cloud_provider_resource, deploy_app_action, connect_subnet_actions,
                      cancellation_context):
 
-        check_cancellation_context(cancellation_context)
-
         # deployment_model type : HeavenlyCloudAngelDeploymentModel
         deployment_model = deploy_app_action.actionParams.deployment.customModel
 
-        # generate unique name to avoid name collisions
-        vm_unique_name = deploy_app_action.actionParams.appName + '__' + str(uuid.uuid4())[:6]
-
-        input_user = deploy_app_action.actionParams.appResource.attributes['User']
-        encrypted_pass = deploy_app_action.actionParams.appResource.attributes['Password']
-        decrypted_input_password = cloudshell_session.DecryptPassword(encrypted_pass).Value
+        return HeavenlyCloudServiceWrapper._deploy(
+            context, cloudshell_session, cloud_provider_resource, deploy_app_action, connect_subnet_actions,
+            cancellation_context, (deployment_model.wing_count, deployment_model.flight_speed),
+            lambda: HeavenlyCloudService.create_stopped_angel_instance(cloud_provider_resource,
+                                                                       deployment_model.wing_count,
+                                                                       deployment_model.flight_speed,
+                                                                       deployment_model.cloud_size,
+                                                                       deployment_model.cloud_image_id),
+            lambda input_user, password, vm_unique_name, network_data: HeavenlyCloudService.create_angel_instance(
+                input_user, password, cloud_provider_resource, vm_unique_name, deployment_model.wing_count,
+                deployment_model.flight_speed, deployment_model.cloud_size, deployment_model.cloud_image_id,
+                network_data))
 
-        deployed_app_attributes = []
-
-        if not decrypted_input_password:
-            decrypted_input_password = HeavenlyCloudService.create_new_password(cloud_provider_resource, input_user,
-                                                                                decrypted_input_password)
-            # optional
-            # deployedAppAttributes contains the attributes on the deployed app
-            # use to override attributes default values
-            deployed_app_attributes.append(Attribute('Password', decrypted_input_password))
+    @staticmethod
+    def deploy_man(context, cloudshell_session, cloud_provider_resource, deploy_app_action, connect_subnet_actions,
+                   cancellation_context):
 
-        # convert the ConnectSubnet actions to networking metadata for cloud provider SDK
-        network_data = HeavenlyCloudService.prepare_network_for_instance(connect_subnet_actions)
+        # deployment_model type : HeavenlyCloudManDeploymentModel
+        deployment_model = deploy_app_action.actionParams.deployment.customModel
 
-        try:
-            # using cloud provider SDK, creating the instance
-            vm_instance = HeavenlyCloudService.create_angel_instance(input_user,
-                                                                     decrypted_input_password,
-                                                                     cloud_provider_resource,
-                                                                     vm_unique_name,
-                                                                     deployment_model.wing_count,
-                                                                     deployment_model.flight_speed,
+        return HeavenlyCloudServiceWrapper._deploy(
+            context, cloudshell_session, cloud_provider_resource, deploy_app_action, connect_subnet_actions,
+            cancellation_context, (deployment_model.height, deployment_model.weight),
+            lambda: HeavenlyCloudService.create_stopped_man_instance(cloud_provider_resource,
+                                                                     deployment_model.height,
+                                                                     deployment_model.weight,
                                                                      deployment_model.cloud_size,
-                                                                     deployment_model.cloud_image_id,
-                                                                     network_data)
-        except Exception as e:
-            return DeployAppResult(actionId=deploy_app_action.actionId, success=False, errorMessage=e.message)
-
-        # Creating VmDetailsData
-        vm_details_data = HeavenlyCloudServiceWrapper.extract_vm_details(vm_instance)
-
-        # result must include the action id it results for, so server can match result to action
-        action_id = deploy_app_action.actionId
-
-        # optional
-        # deployedAppAdditionalData can contain dynamic data on the deployed app
-        # similar to AWS tags
-        deployed_app_additional_data_dict = {'Reservation Id': context.reservation.reservation_id,
-                                             'CreatedBy': str(os.path.abspath(__file__))}
-
-        deploy_result = DeployAppResult(actionId=action_id, success=True, vmUuid=vm_instance.id,
-                                        vmName=vm_unique_name,
-                                        deployedAppAddress=vm_instance.private_ip,
-                                        deployedAppAttributes=deployed_app_attributes,
-                                        deployedAppAdditionalData=deployed_app_additional_data_dict,
-
-                                        vmDetailsData=vm_details_data)
-
-        connect_subnet_results = []
-        for connect_subnet_action in connect_subnet_actions:
-            connect_subnet_results.append(ConnectToSubnetActionResult(connect_subnet_action.actionId,
-                                            interface=network_data[connect_subnet_action.actionParams.subnetId]))
-
-        check_cancellation_context_and_do_rollback(cancellation_context)
-
-        return [deploy_result] + connect_subnet_results
+                                                                     deployment_model.cloud_image_id),
+            lambda input_user, password, vm_unique_name, network_data: HeavenlyCloudService.create_man_instance(
+                input_user, password, cloud_provider_resource, vm_unique_name, deployment_model.weight,
+                deployment_model.height, deployment_model.cloud_size, deployment_model.cloud_image_id,
+                network_data))
 
     @staticmethod
-    def deploy_man(context, cloudshell_session, cloud_provider_resource, deploy_app_action, connect_subnet_actions,
-                     cancellation_context):
-
+    def _deploy(context, cloudshell_session, cloud_provider_resource, deploy_app_action, connect_subnet_actions,
+                cancellation_context, configuration, create_stopped, create):
+        """
+        Deploys the app of either deployment, they differ only in their model attributes and provider operations
+        :param tuple configuration: the attributes of the deployment model the instance is created with, part of the
+        warm pool key along with the deployment path, size and image
+        :param create_stopped: function creating a stopped instance of the configuration for the warm pool,
+        returning its id
+        :param create: function(input_user, password, vm_unique_name, network_data) creating the instance
+        :rtype: list[ActionResultBase]
+        """
         check_cancellation_context(cancellation_context)
 
-        # deployment_model type : HeavenlyCloudAngelDeploymentModel
         deployment_model = deploy_app_action.actionParams.deployment.customModel
 
+        try:
+            # a bad image fails the deploy before anything is created in the cloud provider
+            with tracer.span('validate_image', image_id=deployment_model.cloud_image_id):
+                image_catalog.validate(cloud_provider_resource, deployment_model.cloud_image_id)
+        except UnknownImageError as e:
+            return HeavenlyCloudServiceWrapper.failed_deploy_results(deploy_app_action, connect_subnet_actions,
+                                                                     str(e))
+
         # generate unique name to avoid name collisions
         vm_unique_name = deploy_app_action.actionParams.appName + '__' + str(uuid.uuid4())[:6]
 
         input_user = deploy_app_action.actionParams.appResource.attributes['User']
         encrypted_pass = deploy_app_action.actionParams.appResource.attributes['Password']
-        decrypted_input_password = cloudshell_session.DecryptPassword(encrypted_pass).Value
+        with tracer.span('DecryptPassword'):
+            decrypted_input_password = password_decryption_service.decrypt(cloudshell_session,
+                                                                           context.reservation.reservation_id,
+                                                                           encrypted_pass)
 
         deployed_app_attributes = []
 
@@ -129,99 +132,113 @@ class HeavenlyCloudServiceWrapper(object):
             deployed_app_attributes.append(Attribute('Password', decrypted_input_password))
 
         # convert the ConnectSubnet actions to networking metadata for cloud provider SDK
-        network_data = HeavenlyCloudService.prepare_network_for_instance(connect_subnet_actions)
+        try:
+            with tracer.span('prepare_network_for_instance'):
+                network_plan = HeavenlyCloudService.prepare_network_for_instance(connect_subnet_actions)
+        except ValueError as e:
+            # conflicting subnet requests fail the deploy before anything is created in the cloud provider
+            return HeavenlyCloudServiceWrapper.failed_deploy_results(deploy_app_action, connect_subnet_actions,
+                                                                     str(e))
+        network_data = network_plan.network_data
 
         try:
-            # using cloud provider SDK, creating the instance
-            vm_instance = HeavenlyCloudService.create_man_instance(input_user, decrypted_input_password, cloud_provider_resource,
-                                                                   vm_unique_name,
-                                                                   deployment_model.weight,
-                                                                   deployment_model.height,
-                                                                   deployment_model.cloud_size,
-                                                                   deployment_model.cloud_image_id,
-                                                                   network_data)
+            # using cloud provider SDK, creating the instance or activating a stopped one of the warm pool
+            vm_instance = instance_pool.deploy_instance(
+                cloud_provider_resource,
+                (deploy_app_action.actionParams.deployment.deploymentPath, deployment_model.cloud_size,
+                 deployment_model.cloud_image_id) + configuration,
+                create_stopped,
+                lambda: create(input_user, decrypted_input_password, vm_unique_name, network_data),
+                input_user, decrypted_input_password, vm_unique_name, network_data)
         except Exception as e:
-            return DeployAppResult(actionId=deploy_app_action.actionId, success=False, errorMessage=e.message)
-
-        # Creating VmDetailsData
-        vm_details_data = HeavenlyCloudServiceWrapper.extract_vm_details(vm_instance)
-
-        # result must include the action id it results for, so server can match result to action
-        action_id = deploy_app_action.actionId
+            return HeavenlyCloudServiceWrapper.failed_deploy_results(deploy_app_action, connect_subnet_actions,
+                                                                     e.message)
 
-        # optional
-        # deployedAppAdditionalData can contain dynamic data on the deployed app
-        # similar to AWS tags
-        deployed_app_additional_data_dict = {'Reservation Id': context.reservation.reservation_id,
-                                             'CreatedBy': str(os.path.abspath(__file__))}
+        # every cloud object created from here on is removed if the deploy is cancelled or fails
+        compensation_log = CompensationLog()
+        compensation_log.record(INSTANCE, vm_instance.id,
+                                lambda: HeavenlyCloudService.delete_instance(cloud_provider_resource, vm_instance.id))
 
-        deploy_result = DeployAppResult(actionId=action_id, success=True, vmUuid=vm_instance.id,
-                                        vmName=vm_unique_name,
-                                        deployedAppAddress=vm_instance.private_ip,
-                                        deployedAppAttributes=deployed_app_attributes,
-                                        deployedAppAdditionalData=deployed_app_additional_data_dict,
-                                        vmDetailsData=vm_details_data)
+        try:
+            # Creating VmDetailsData
+            with tracer.span('extract_vm_details'):
+                vm_details_data = HeavenlyCloudServiceWrapper.extract_vm_details(
+                    vm_instance, deploy_app_action.actionParams.deployment.deploymentPath)
 
-        connect_subnet_results = []
-        for connect_subnet_action in connect_subnet_actions:
-            connect_subnet_results.append(
-                ConnectToSubnetActionResult(connect_subnet_action.actionId,
-                                            interface=network_data[connect_subnet_action.actionParams.subnetId]))
+            # result must include the action id it results for, so server can match result to action
+            action_id = deploy_app_action.actionId
 
-        check_cancellation_context_and_do_rollback(cancellation_context)
+            # optional
+            # deployedAppAdditionalData can contain dynamic data on the deployed app
+            # similar to AWS tags
+            deployed_app_additional_data_dict = {'Reservation Id': context.reservation.reservation_id,
+                                                 'CreatedBy': str(os.path.abspath(__file__)),
+                                                 'Public IP': vm_instance.public_ip}
+
+            deploy_result = DeployAppResult(actionId=action_id, success=True, vmUuid=vm_instance.id,
+                                            vmName=vm_unique_name,
+                                            deployedAppAddress=vm_instance.private_ip,
+                                            deployedAppAttributes=deployed_app_attributes,
+                                            deployedAppAdditionalData=deployed_app_additional_data_dict,
+
+                                            vmDetailsData=vm_details_data)
+
+            connect_subnet_results = network_plan.connect_subnet_results()
+
+            check_cancellation_context_and_do_rollback(cancellation_context, compensation_log)
+        except OperationCancelledException as e:
+            return HeavenlyCloudServiceWrapper.failed_deploy_results(deploy_app_action, connect_subnet_actions,
+                                                                     str(e), e.rollback_report)
+        except Exception:
+            error_message = traceback.format_exc()
+            return HeavenlyCloudServiceWrapper.failed_deploy_results(deploy_app_action, connect_subnet_actions,
+                                                                     error_message, compensation_log.rollback())
+
+        compensation_log.commit()
+        vm_details_cache.invalidate(cloud_provider_resource.name, vm_instance.id)
 
         return [deploy_result] + connect_subnet_results
 
     @staticmethod
-    def extract_vm_details(vm_instance):
+    def failed_deploy_results(deploy_app_action, connect_subnet_actions, error_message, rollback_report=None):
+        """
+        :param DeployApp deploy_app_action:
+        :param List[ConnectSubnet] connect_subnet_actions:
+        :param str error_message:
+        :param compensation_log.RollbackReport rollback_report: the rollback timings are reported in the info message
+        :rtype: list[ActionResultBase]
+        """
+        return HeavenlyCloudServiceWrapper.failed_action_results([deploy_app_action] + list(connect_subnet_actions),
+                                                                 error_message, rollback_report)
+
+    @staticmethod
+    def extract_vm_details(vm_instance, deployment_path=None):
         """
         :param HeavenResidentInstance vm_instance:
+        :param str deployment_path: deployment model of the app
         """
-        vm_instance_data = HeavenlyCloudServiceWrapper.extract_vm_instance_data(vm_instance)
-        vm_network_data = HeavenlyCloudServiceWrapper.extract_vm_instance_network_data(vm_instance)
+        vm_instance_data = HeavenlyCloudServiceWrapper.extract_vm_instance_data(vm_instance, deployment_path)
+        vm_network_data = HeavenlyCloudServiceWrapper.extract_vm_instance_network_data(vm_instance, deployment_path)
 
         return VmDetailsData(vmInstanceData=vm_instance_data, vmNetworkData=vm_network_data)
 
     @staticmethod
-    def extract_vm_instance_data(vm_instance):
+    def extract_vm_instance_data(vm_instance, deployment_path=None):
         """
         :param HeavenResidentInstance vm_instance:
+        :param str deployment_path: deployment model of the app
+        :rtype: list[VmDetailsProperty]
         """
-        data = [
-            VmDetailsProperty(key='Cloud Size', value='not so big'),
-            VmDetailsProperty(key='Instance Name', value='dummy' if not vm_instance else vm_instance.name),
-            VmDetailsProperty(key='Hidden stuff', value='something not for UI', hidden=True),
-        ]
-
-        return data
+        return template_for(deployment_path).instance_data(vm_instance)
 
     @staticmethod
-    def extract_vm_instance_network_data(vm_instance):
+    def extract_vm_instance_network_data(vm_instance, deployment_path=None):
         """
         :param HeavenResidentInstance vm_instance:
+        :param str deployment_path: deployment model of the app
+        :rtype: list[VmDetailsNetworkInterface]
         """
-        network_interfaces = []
-
-        # get networking data from the cloudprovider and for each network interface extract the data we want to
-        # expose in cloudshell
-        for i in range(2):
-            network_data = [
-                VmDetailsProperty(key='Device Index', value=str(i)),
-                VmDetailsProperty(key='MAC Address', value=str(uuid.uuid4())),
-                VmDetailsProperty(key='Speed', value='1KB'),
-            ]
-
-            current_interface = VmDetailsNetworkInterface(interfaceId=i, networkId=i,
-                                                          isPrimary=i == 0,
-                                                          # specifies whether nic is the primary interface
-                                                          isPredefined=False,
-                                                          # specifies whether network existed before reservation
-                                                          networkData=network_data,
-                                                          privateIpAddress='10.0.0.' + str(i),
-                                                          publicIpAddress='8.8.8.' + str(i))
-            network_interfaces.append(current_interface)
-
-        return network_interfaces
+        return template_for(deployment_path).network_data(vm_instance)
 
     @staticmethod
     def get_vm_details(cloud_provider_resource, cancellation_context, requests_json):
@@ -232,10 +249,35 @@ class HeavenlyCloudServiceWrapper(object):
         :param str requests_json:
         :param str vm_id:
         """
-        check_cancellation_context(cancellation_context)
-        requests = json.loads(requests_json)
+        return list(HeavenlyCloudServiceWrapper.iter_vm_details(cloud_provider_resource, cancellation_context,
+                                                                requests_json))
 
-        results = []
+    @staticmethod
+    def vm_details_request_key(requests):
+        """
+        Normalized GetVmDetails request, the same for requests asking for the same details whatever their json
+        formatting and the deployed app data the details do not depend on
+        :param dict requests: the parsed GetVmDetails requests json
+        :rtype: tuple
+        """
+        key = []
+        for request in requests[u'items']:
+            deployed_app = request[u'deployedAppJson']
+            key.append((deployed_app[u'vmdetails'][u'uid'], deployed_app[u'name'], deployed_app[u'address'],
+                        request.get(u'appRequestJson', {}).get(u'deploymentService', {}).get(u'model')))
+        return tuple(key)
+
+    @staticmethod
+    def iter_vm_details(cloud_provider_resource, cancellation_context, requests_json):
+        """
+        Same as get_vm_details but yields each VmDetailsData as soon as it is built
+        :param L3HeavenlyCloudShell cloud_provider_resource:
+        :param CancellationContext cancellation_context:
+        :param str requests_json: the json, or the dict it was already parsed to
+        :rtype: collections.Iterable[VmDetailsData]
+        """
+        check_cancellation_context(cancellation_context)
+        requests = json.loads(requests_json) if isinstance(requests_json, basestring) else requests_json
 
         for request in requests[u'items']:
 
@@ -246,23 +288,31 @@ class HeavenlyCloudServiceWrapper(object):
             vm_uid = request[u'deployedAppJson'][u'vmdetails'][u'uid']
             address = request[u'deployedAppJson'][u'address']
 
-            vm_instance = HeavenlyCloudService.get_instance(cloud_provider_resource, vm_name, vm_uid, address)
-            vm_instance_data = HeavenlyCloudServiceWrapper.extract_vm_instance_data(vm_instance)
-            vm_network_data = HeavenlyCloudServiceWrapper.extract_vm_instance_network_data(vm_instance)
-
-            # example of reading custom data created via deployed_app_additional_data_dict at delpoy stage
-            # created_by = next((deployed_app_additional_data['value'] for deployed_app_additional_data in request[u'deployedAppJson'][u'vmdetails'][u'vmCustomParams'] if
-            #                    deployed_app_additional_data['name'] == 'CreatedBy'), None)
-            # if created_by:
-            #     vm_instance_data.append(VmDetailsProperty(key='CreatedBy',value=created_by))
-
-            result = VmDetailsData(vmInstanceData=vm_instance_data, vmNetworkData=vm_network_data, appName=vm_name)
-            results.append(result)
+            # the details of an unchanged instance are served from the cache, as long as the app kept its name
+            vm_details = vm_details_cache.get(cloud_provider_resource.name, vm_uid)
+            if vm_details is None or vm_details.appName != vm_name:
+                # details read before a concurrent PowerOff or refresh ip invalidates the instance are not cached
+                cache_generation = vm_details_cache.generation()
+                vm_instance = HeavenlyCloudService.get_instance(cloud_provider_resource, vm_name, vm_uid, address)
+                deployment_path = request.get(u'appRequestJson', {}).get(u'deploymentService', {}).get(u'model')
+                vm_instance_data = HeavenlyCloudServiceWrapper.extract_vm_instance_data(vm_instance, deployment_path)
+                vm_network_data = HeavenlyCloudServiceWrapper.extract_vm_instance_network_data(vm_instance,
+                                                                                               deployment_path)
+
+                # example of reading custom data created via deployed_app_additional_data_dict at delpoy stage
+                # created_by = next((deployed_app_additional_data['value'] for deployed_app_additional_data in request[u'deployedAppJson'][u'vmdetails'][u'vmCustomParams'] if
+                #                    deployed_app_additional_data['name'] == 'CreatedBy'), None)
+                # if created_by:
+                #     vm_instance_data.append(VmDetailsProperty(key='CreatedBy',value=created_by))
+
+                vm_details = VmDetailsData(vmInstanceData=vm_instance_data, vmNetworkData=vm_network_data,
+                                           appName=vm_name)
+                vm_details_cache.put(cloud_provider_resource.name, vm_uid, vm_details, cache_generation)
+
+            yield vm_details
 
             check_cancellation_context(cancellation_context)
 
-        return results
-
     @staticmethod
     def power_on(cloud_provider_resource, vm_id):
         """
@@ -270,6 +320,7 @@ class HeavenlyCloudServiceWrapper(object):
          :param str vm_id:
          """
         HeavenlyCloudService.power_on(cloud_provider_resource, vm_id)
+        vm_details_cache.invalidate(cloud_provider_resource.name, vm_id)
 
     @staticmethod
     def power_off(cloud_provider_resource, vm_id):
@@ -278,6 +329,7 @@ class HeavenlyCloudServiceWrapper(object):
         :param str vm_id:
         """
         HeavenlyCloudService.power_off(cloud_provider_resource, vm_id)
+        vm_details_cache.invalidate(cloud_provider_resource.name, vm_id)
 
     @staticmethod
     def remote_refresh_ip(cloud_provider_resource, cancellation_context, cloudshell_session, resource_full_name, vm_id,
@@ -290,11 +342,14 @@ class HeavenlyCloudServiceWrapper(object):
         :param str vm_id:
         :param str deployed_app_private_ip:
         :param str deployed_app_public_ip:
+        :return: the instance as the cloud provider sees it
+        :rtype: HeavenResidentInstance
         """
 
         check_cancellation_context(cancellation_context)
 
         vm_instance = HeavenlyCloudService.get_instance_full(cloud_provider_resource, resource_full_name, vm_id)
+        vm_details_cache.invalidate(cloud_provider_resource.name, vm_id)
 
         if deployed_app_private_ip != vm_instance.private_ip:
             cloudshell_session.UpdateResourceAddress(resource_full_name, vm_instance.private_ip)
@@ -304,9 +359,12 @@ class HeavenlyCloudServiceWrapper(object):
 
         check_cancellation_context_and_do_rollback(cancellation_context)
 
+        return vm_instance
+
     @staticmethod
     def delete_instance(cloud_provider_resource, vm_id):
         HeavenlyCloudService.delete_instance(cloud_provider_resource, vm_id)
+        vm_details_cache.invalidate(cloud_provider_resource.name, vm_id)
 
     # region L2 methods
     #
@@ -397,7 +455,7 @@ class HeavenlyCloudServiceWrapper(object):
     # region L3 methods
     @staticmethod
     def prepare_sandbox_infra(logger, cloud_provider_resource, prepare_infa_action, create_keys_action,
-                              prepare_subnet_actions, cancellation_context):
+                              prepare_subnet_actions, cancellation_context, reservation_id):
         """
         :param logging.Logger logger:
         :param L3HeavenlyCloudShell cloud_provider_resource:
@@ -405,6 +463,7 @@ class HeavenlyCloudServiceWrapper(object):
         :param CreateKeys create_keys_action:
         :param List[PrepareSubnet] prepare_subnet_actions:
         :param CancellationContext cancellation_context:
+        :param str reservation_id: owner of the address ranges of the sandbox
         :return:
         :rtype:
         """
@@ -413,63 +472,162 @@ class HeavenlyCloudServiceWrapper(object):
 
         check_cancellation_context_and_do_rollback(cancellation_context)
 
-        cidr = prepare_infa_action.actionParams.cidr
-
-        try:
-            # handle PrepareInfraAction - extract sandbox CIDR and create/allocate a network in the cloud provider with
-            # an address range of the provided CIDR
-            logger.info("Received CIDR {0} from server".format(cidr))
-
-            HeavenlyCloudService.prepare_infra(cloud_provider_resource, cidr)
+        # the images of the app templates are copied to the region while the sandbox infra is prepared
+        image_catalog.prefetch(cloud_provider_resource, image_ids(cloud_provider_resource.prefetch_images))
 
-            results.append(PrepareCloudInfraResult(prepare_infa_action.actionId))
-        except:
-            logger.error(traceback.format_exc())
-            results.append(PrepareCloudInfraResult(prepare_infa_action.actionId,
-                                                   success=False,
-                                                   errorMessage=traceback.format_exc()))
-
-        check_cancellation_context_and_do_rollback(cancellation_context)
+        # network, key pair and subnets created by this command are removed if it is cancelled
+        compensation_log = CompensationLog()
 
         try:
-            # handle CreateKeys - generate key pair or get it from the cloud provider and save it in a secure location
-            # that will be accessible from the Deploy method
-            sandbx_ssh_key = HeavenlyCloudService.get_or_create_ssh_key()
-            results.append(CreateKeysActionResult(create_keys_action.actionId, accessKey=sandbx_ssh_key))
-        except:
-            logger.error(traceback.format_exc())
-            results.append(CreateKeysActionResult(create_keys_action.actionId,
-                                                  success=False,
-                                                  errorMessage=traceback.format_exc()))
-
-        check_cancellation_context_and_do_rollback(cancellation_context)
+            cidr = prepare_infa_action.actionParams.cidr
 
-        # handle PrepareSubnetsAction
-        for action in prepare_subnet_actions:
             try:
-                subnet_id = HeavenlyCloudService.prepare_subnet(action.actionParams.cidr,
-                                                                action.actionParams.isPublic,
-                                                                action.actionParams.subnetServiceAttributes)
-                results.append(PrepareSubnetActionResult(action.actionId, subnet_id=subnet_id))
+                # handle PrepareInfraAction - extract sandbox CIDR and create/allocate a network in the cloud provider
+                # with an address range of the provided CIDR
+                logger.info("Received CIDR {0} from server".format(cidr))
+
+                # a cidr overlapping the network of another sandbox fails here rather than in the cloud provider
+                reserved = cidr_allocator.reserve_network(cloud_provider_resource.name, reservation_id, cidr)
+                try:
+                    HeavenlyCloudService.prepare_infra(cloud_provider_resource, cidr)
+                except:
+                    if reserved:
+                        cidr_allocator.release(cloud_provider_resource.name, reservation_id, cidr)
+                    raise
+                compensation_log.record(NETWORK, cidr, HeavenlyCloudServiceWrapper._network_deletion(
+                    cloud_provider_resource, reservation_id, cidr, reserved))
+
+                results.append(PrepareCloudInfraResult(prepare_infa_action.actionId))
             except:
                 logger.error(traceback.format_exc())
-                results.append(PrepareSubnetActionResult(action.actionId,
-                                                         success=False,
-                                                         errorMessage=traceback.format_exc()))
+                results.append(PrepareCloudInfraResult(prepare_infa_action.actionId,
+                                                       success=False,
+                                                       errorMessage=traceback.format_exc()))
 
-        check_cancellation_context_and_do_rollback(cancellation_context)
+            check_cancellation_context_and_do_rollback(cancellation_context, compensation_log)
+
+            try:
+                # handle CreateKeys - generate key pair or get it from the cloud provider and save it in a secure
+                # location that will be accessible from the Deploy method
+                sandbx_ssh_key = key_pair_pool.get_ssh_key(cloud_provider_resource, reservation_id)
+                # only a key pair of the warm pool is assigned to the sandbox, the shared key of the resource is kept.
+                # the key itself is a secret, the rollback report names the sandbox instead
+                compensation_log.record(KEY_PAIR, reservation_id,
+                                        lambda: HeavenlyCloudService.delete_sandbox_ssh_key(cloud_provider_resource,
+                                                                                            reservation_id))
+                results.append(CreateKeysActionResult(create_keys_action.actionId, accessKey=sandbx_ssh_key))
+            except:
+                logger.error(traceback.format_exc())
+                results.append(CreateKeysActionResult(create_keys_action.actionId,
+                                                      success=False,
+                                                      errorMessage=traceback.format_exc()))
+
+            check_cancellation_context_and_do_rollback(cancellation_context, compensation_log)
+
+            # handle PrepareSubnetsAction
+            for action in prepare_subnet_actions:
+                try:
+                    subnet_cidr, reserved = HeavenlyCloudServiceWrapper._reserve_subnet_cidr(
+                        logger, cloud_provider_resource, reservation_id, action)
+                    try:
+                        # a subnet of the warm pool is assigned to the cidr when there is one ready
+                        subnet_id = subnet_pool.prepare_subnet(cloud_provider_resource,
+                                                               subnet_cidr,
+                                                               action.actionParams.isPublic,
+                                                               action.actionParams.subnetServiceAttributes)
+                    except:
+                        if reserved:
+                            cidr_allocator.release(cloud_provider_resource.name, reservation_id, subnet_cidr)
+                        raise
+                    compensation_log.record(SUBNET, subnet_id, HeavenlyCloudServiceWrapper._subnet_deletion(
+                        cloud_provider_resource, subnet_id, reservation_id, subnet_cidr if reserved else None))
+                    results.append(PrepareSubnetActionResult(action.actionId, subnet_id=subnet_id))
+                except:
+                    logger.error(traceback.format_exc())
+                    results.append(PrepareSubnetActionResult(action.actionId,
+                                                             success=False,
+                                                             errorMessage=traceback.format_exc()))
+
+            check_cancellation_context_and_do_rollback(cancellation_context, compensation_log)
+        except OperationCancelledException as e:
+            logger.info('PrepareSandboxInfra cancelled, {0}'.format(e.rollback_report))
+            actions = [prepare_infa_action, create_keys_action] + list(prepare_subnet_actions)
+            return HeavenlyCloudServiceWrapper.failed_action_results(actions, str(e), e.rollback_report)
+
+        compensation_log.commit()
 
         return results
 
     @staticmethod
-    def cleanup_sandbox_infra(cloud_provider_resource, action):
+    def _reserve_subnet_cidr(logger, cloud_provider_resource, reservation_id, action):
+        """
+        :param logging.Logger logger:
+        :param L3HeavenlyCloudShell cloud_provider_resource:
+        :param str reservation_id:
+        :param PrepareSubnet action:
+        :return: the subnet cidr, the one sent by the server or a free one of the sandbox network if it sent none,
+                 and whether it was reserved by this call
+        :rtype: (str, bool)
+        """
+        subnet_cidr = action.actionParams.cidr
+        if not subnet_cidr:
+            subnet_cidr = cidr_allocator.allocate_subnet(cloud_provider_resource.name, reservation_id)
+            logger.info('Allocated CIDR {0} for subnet action {1}'.format(subnet_cidr, action.actionId))
+            return subnet_cidr, True
+        return subnet_cidr, cidr_allocator.reserve_subnet(cloud_provider_resource.name, reservation_id, subnet_cidr)
+
+    @staticmethod
+    def _network_deletion(cloud_provider_resource, reservation_id, cidr, reserved):
+        def delete_network():
+            HeavenlyCloudService.delete_infra(cloud_provider_resource, cidr)
+            if reserved:
+                cidr_allocator.release(cloud_provider_resource.name, reservation_id, cidr)
+
+        return delete_network
+
+    @staticmethod
+    def _subnet_deletion(cloud_provider_resource, subnet_id, reservation_id, subnet_cidr):
+        # bind subnet_id now, the compensations run after the loop creating the subnets has moved on
+        def delete_subnet():
+            HeavenlyCloudService.delete_subnet(cloud_provider_resource, subnet_id)
+            if subnet_cidr:
+                cidr_allocator.release(cloud_provider_resource.name, reservation_id, subnet_cidr)
+
+        return delete_subnet
+
+    @staticmethod
+    def failed_action_results(actions, error_message, rollback_report=None):
+        """
+        :param list[RequestActionBase] actions:
+        :param str error_message:
+        :param compensation_log.RollbackReport rollback_report: the rollback timings are reported in the info message
+        :rtype: list[ActionResultBase]
+        """
+        result_types = {DeployApp: DeployAppResult,
+                        ConnectSubnet: ConnectToSubnetActionResult,
+                        PrepareCloudInfra: PrepareCloudInfraResult,
+                        CreateKeys: CreateKeysActionResult,
+                        PrepareSubnet: PrepareSubnetActionResult}
+        info_message = str(rollback_report) if rollback_report is not None else ''
+
+        return [result_types[action.__class__](actionId=action.actionId, success=False, infoMessage=info_message,
+                                           errorMessage=error_message)
+                for action in actions]
+
+    @staticmethod
+    def cleanup_sandbox_infra(cloud_provider_resource, action, reservation_id):
         """
         :param L3HeavenlyCloudShell cloud_provider_resource:
         :param CleanupNetwork action:
+        :param str reservation_id:
         :return:
         """
         # this is the place were we remove all sandbox infra resources from the cloud provider like network, storage,
         # ssh keys, etc
+        # the address ranges of the sandbox can be handed to the next sandboxes
+        cidr_allocator.release_reservation(cloud_provider_resource.name, reservation_id)
+        # the key pair the sandbox claimed from the warm key pair pool, the shared key of the resource is kept
+        HeavenlyCloudService.delete_sandbox_ssh_key(cloud_provider_resource, reservation_id)
         return CleanupNetworkResult(actionId=action.actionId)
 
     # endregion L3 methods
\ No newline at end of file
@@ -0,0 +1,182 @@
+import threading
+import time
+import traceback
+from multiprocessing.pool import ThreadPool
+
+from sdk.heavenly_cloud_service import HeavenlyCloudError, HeavenlyCloudService
+
+DEFAULT_TTL_SECONDS = 300
+PREFETCH_THREADS = 2
+
+
+class UnknownImageError(Exception):
+    pass
+
+
+def image_ids(value):
+    """
+    :param str value: comma separated image ids, e.g. the Prefetch Images attribute
+    :rtype: list[str]
+    """
+    return [image_id.strip() for image_id in (value or '').split(',') if image_id.strip()]
+
+
+class _RegionImages(object):
+    def __init__(self):
+        self.images = None  # image id -> CloudImage, None until the first listing
+        self.expires = 0
+        self.refresh_lock = threading.Lock()
+
+
+class ImageCatalog(object):
+    """
+    Images of the region of each cloud provider resource, listed from the cloud provider at most once per ttl.
+    Deploy validates the cloud_image_id of its deployment model against it before creating anything, an image
+    missing from a cached listing is looked up again in case it was added since. PrepareSandboxInfra prefetches the
+    Prefetch Images of the resource: they are copied to the region in the background so the first deploy of an
+    image in a region does not wait for the copy.
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL_SECONDS, prefetch_threads=PREFETCH_THREADS):
+        """
+        :param float ttl: seconds a listing of the images of a region is used
+        :param int prefetch_threads: images staged concurrently
+        """
+        self.ttl = ttl
+        self.prefetch_threads = prefetch_threads
+        self._lock = threading.Lock()
+        self._regions = {}  # (cloud provider resource name, region) -> _RegionImages
+        self._prefetch_pool = None
+        self._staging = set()  # (cloud provider resource name, region, image id) being staged
+        self.hits = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self.rejected = 0
+        self.staged = 0
+        self.stage_errors = 0
+        self.last_error = None
+
+    def _region_images(self, cloud_provider_resource):
+        key = (cloud_provider_resource.name, cloud_provider_resource.region)
+        with self._lock:
+            region_images = self._regions.get(key)
+            if region_images is None:
+                region_images = self._regions[key] = _RegionImages()
+        return region_images
+
+    def images(self, cloud_provider_resource, refresh=False):
+        """
+        :param L3HeavenlyCloudShell cloud_provider_resource:
+        :param bool refresh: list the images even if the cached listing did not expire
+        :return: image id -> CloudImage, None if the images could not be listed
+        :rtype: dict[str, CloudImage]
+        """
+        region_images = self._region_images(cloud_provider_resource)
+        if not refresh and region_images.expires > time.time():
+            with self._lock:
+                self.hits += 1
+            return region_images.images
+
+        # concurrent deploys of a region share one listing
+        listed = region_images.expires
+        with region_images.refresh_lock:
+            if region_images.expires != listed and region_images.expires > time.time():
+                return region_images.images
+            try:
+                images = HeavenlyCloudService.list_images(cloud_provider_resource, cloud_provider_resource.region)
+            except HeavenlyCloudError:
+                with self._lock:
+                    self.refresh_errors += 1
+                    self.last_error = traceback.format_exc()
+                return region_images.images
+            region_images.images = dict((image.image_id, image) for image in images)
+            region_images.expires = time.time() + self.ttl
+            with self._lock:
+                self.refreshes += 1
+            return region_images.images
+
+    def validate(self, cloud_provider_resource, image_id):
+        """
+        :param L3HeavenlyCloudShell cloud_provider_resource:
+        :param str image_id: cloud_image_id of a deployment model
+        :raises UnknownImageError: the region has no such image. Images are not validated while the cloud provider
+        fails to list them, the instance creation reports bad images then
+        """
+        images = self.images(cloud_provider_resource)
+        if images is not None and image_id not in images:
+            images = self.images(cloud_provider_resource, refresh=True)
+        if images is None or image_id in images:
+            return
+
+        with self._lock:
+            self.rejected += 1
+        raise UnknownImageError('image {0} is not available in region {1} of {2}, available images: {3}'.format(
+            image_id, cloud_provider_resource.region, cloud_provider_resource.name, ', '.join(sorted(images))))
+
+    def prefetch(self, cloud_provider_resource, image_ids):
+        """
+        Stages the images that are not in the region yet, in the background
+        :param L3HeavenlyCloudShell cloud_provider_resource:
+        :param list[str] image_ids:
+        """
+        if not image_ids:
+            return
+        with self._lock:
+            if self._prefetch_pool is None:
+                self._prefetch_pool = ThreadPool(self.prefetch_threads)
+            self._prefetch_pool.apply_async(self._prefetch, (cloud_provider_resource, list(image_ids)))
+
+    def _prefetch(self, cloud_provider_resource, image_ids):
+        images = self.images(cloud_provider_resource) or {}
+        for image_id in image_ids:
+            image = images.get(image_id)
+            staging_key = (cloud_provider_resource.name, cloud_provider_resource.region, image_id)
+            with self._lock:
+                if image is None or image.staged or staging_key in self._staging:
+                    continue
+                self._staging.add(staging_key)
+            self._stage(cloud_provider_resource, image, staging_key)
+
+    def _stage(self, cloud_provider_resource, image, staging_key):
+        try:
+            HeavenlyCloudService.stage_image(cloud_provider_resource, cloud_provider_resource.region, image.image_id)
+        except Exception:
+            with self._lock:
+                self.stage_errors += 1
+                self.last_error = traceback.format_exc()
+        else:
+            # the cached listing is kept, only the staged flag of the image changes
+            image.staged = True
+            with self._lock:
+                self.staged += 1
+        finally:
+            with self._lock:
+                self._staging.discard(staging_key)
+
+    def clear(self):
+        """
+        Forgets the listings and stops the prefetching
+        """
+        with self._lock:
+            self._regions = {}
+            prefetch_pool = self._prefetch_pool
+            self._prefetch_pool = None
+        if prefetch_pool is not None:
+            prefetch_pool.close()
+
+    def stats(self):
+        """
+        :rtype: dict
+        """
+        with self._lock:
+            return {'regions': len(self._regions),
+                    'hits': self.hits,
+                    'refreshes': self.refreshes,
+                    'refresh_errors': self.refresh_errors,
+                    'rejected': self.rejected,
+                    'staging': len(self._staging),
+                    'staged': self.staged,
+                    'stage_errors': self.stage_errors}
+
+
+image_catalog = ImageCatalog()
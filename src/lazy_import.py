@@ -0,0 +1,54 @@
+import importlib
+
+
+class LazyImport(object):
+    """
+    Stands for a module, or an attribute of a module, that is imported the first time it is called or one of its
+    attributes is read, so importing the driver does not pay for the dependencies of commands that may never run.
+    Use the real object wherever its type matters, e.g. in an except clause or an isinstance check.
+    """
+
+    __slots__ = ('module_name', 'attribute', '_target')
+
+    def __init__(self, module_name, attribute=None):
+        """
+        :param str module_name: e.g. cloudshell.shell.core.session.logging_session
+        :param str attribute: e.g. LoggingSessionContext, None for the module itself
+        """
+        self.module_name = module_name
+        self.attribute = attribute
+        self._target = None
+
+    def resolve(self):
+        """
+        :return: the imported module or attribute
+        """
+        target = self._target
+        if target is None:
+            # concurrent first uses import under the interpreter import lock and get the same object
+            target = importlib.import_module(self.module_name)
+            if self.attribute:
+                target = getattr(target, self.attribute)
+            self._target = target
+        return target
+
+    def __call__(self, *args, **kwargs):
+        return self.resolve()(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.resolve(), name)
+
+    def __repr__(self):
+        return '<lazy {0}{1}>'.format(self.module_name, '.' + self.attribute if self.attribute else '')
+
+
+def lazy_import(module_name, *attributes):
+    """
+    e.g. LoggingSessionContext = lazy_import('cloudshell.shell.core.session.logging_session', 'LoggingSessionContext')
+    :param str module_name:
+    :param str attributes: attributes of the module, none for the module itself
+    :return: a LazyImport, or one per attribute when more than one is given
+    """
+    if len(attributes) > 1:
+        return tuple(LazyImport(module_name, attribute) for attribute in attributes)
+    return LazyImport(module_name, attributes[0] if attributes else None)
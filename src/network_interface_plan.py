@@ -0,0 +1,72 @@
+from cloudshell.cp.core.models import ConnectToSubnetActionResult
+
+
+class NetworkInterfacePlan(object):
+    DEFAULT_SUBNET = 'default_subnet'
+
+    def __init__(self, connect_subnet_actions):
+        """
+        Maps the subnets an instance connects to onto its device indexes.
+        The 'vnicName' of a ConnectSubnet action, when it is a device index, is the requested device index for that
+        subnet, the rest of the subnets, including those whose vnicName is a name like 'eth0', get the lowest free
+        device indexes in request order.
+        :param list[ConnectSubnet] connect_subnet_actions:
+        """
+        self.connect_subnet_actions = connect_subnet_actions
+        self.network_data = {}  # type: dict[str, int]
+
+        if not connect_subnet_actions:
+            # we are in single subnet mode. need to create the instance in the default subnet
+            self.network_data[NetworkInterfacePlan.DEFAULT_SUBNET] = 0
+            return
+
+        taken_indexes = {}  # device index -> subnet id
+        connected_subnet_ids = set()
+        unrequested_subnet_ids = []
+
+        for action in connect_subnet_actions:
+            subnet_id = action.actionParams.subnetId
+            if subnet_id in connected_subnet_ids:
+                raise ValueError('subnet {0} is connected more than once'.format(subnet_id))
+            connected_subnet_ids.add(subnet_id)
+
+            device_index = NetworkInterfacePlan._requested_device_index(action)
+            if device_index is None:
+                unrequested_subnet_ids.append(subnet_id)
+                continue
+
+            if device_index in taken_indexes:
+                raise ValueError('vnic {0} is requested for both subnet {1} and subnet {2}'.format(
+                    device_index, taken_indexes[device_index], subnet_id))
+
+            taken_indexes[device_index] = subnet_id
+            self.network_data[subnet_id] = device_index
+
+        device_index = 0
+        for subnet_id in unrequested_subnet_ids:
+            while device_index in taken_indexes:
+                device_index += 1
+            taken_indexes[device_index] = subnet_id
+            self.network_data[subnet_id] = device_index
+
+    @staticmethod
+    def _requested_device_index(action):
+        vnic_name = action.actionParams.vnicName
+        if vnic_name is None or str(vnic_name).strip() == '':
+            return None
+
+        try:
+            device_index = int(vnic_name)
+        except ValueError:
+            # templates name their vnics too, e.g. eth0, those subnets get a free device index
+            return None
+
+        return device_index if device_index >= 0 else None
+
+    def connect_subnet_results(self):
+        """
+        :return: the result of every ConnectSubnet action with the interface its subnet was mapped to
+        :rtype: list[ConnectToSubnetActionResult]
+        """
+        return [ConnectToSubnetActionResult(action.actionId, interface=self.network_data[action.actionParams.subnetId])
+                for action in self.connect_subnet_actions]
@@ -0,0 +1,104 @@
+import threading
+from contextlib import contextmanager
+
+
+class _ReservationPasswords(object):
+    def __init__(self):
+        """
+        decrypted passwords of a single reservation, shared by all the commands currently running in it
+        """
+        self.lock = threading.Lock()
+        self.passwords = {}  # type: dict[str, str]
+        self.pending = {}  # type: dict[str, threading.Event]
+        self.ref_count = 0
+
+    def wipe(self):
+        with self.lock:
+            # python strings are immutable so we cannot zero the plaintext memory, the best we can do is to drop
+            # every reference we hold so the values are released together with the reservation scope
+            for encrypted_password in self.passwords.keys():
+                self.passwords[encrypted_password] = None
+            self.passwords.clear()
+
+
+class PasswordDecryptionService(object):
+    """
+    Memoizes CloudShell DecryptPassword calls by ciphertext inside a reservation.
+    Concurrent commands of the same reservation share the decrypted values and concurrent requests for the same
+    ciphertext are collapsed into a single DecryptPassword call.
+    Decrypted values live only while at least one command of the reservation is inside reservation_scope.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reservations = {}  # type: dict[str, _ReservationPasswords]
+
+    @contextmanager
+    def reservation_scope(self, reservation_id):
+        """
+        Keeps the decrypted passwords of the reservation available for the duration of a command
+        :param str reservation_id:
+        """
+        with self._lock:
+            reservation_passwords = self._reservations.get(reservation_id)
+            if reservation_passwords is None:
+                reservation_passwords = self._reservations[reservation_id] = _ReservationPasswords()
+            reservation_passwords.ref_count += 1
+
+        try:
+            yield
+        finally:
+            with self._lock:
+                reservation_passwords.ref_count -= 1
+                if reservation_passwords.ref_count == 0:
+                    del self._reservations[reservation_id]
+                    reservation_passwords.wipe()
+
+    def decrypt(self, cloudshell_session, reservation_id, encrypted_password):
+        """
+        :param CloudShellAPISession cloudshell_session:
+        :param str reservation_id:
+        :param str encrypted_password:
+        :return: the decrypted password
+        :rtype: str
+        """
+        with self._lock:
+            reservation_passwords = self._reservations.get(reservation_id)
+
+        if reservation_passwords is None:
+            # not inside a reservation scope - nothing may be kept after the call
+            return cloudshell_session.DecryptPassword(encrypted_password).Value
+
+        with reservation_passwords.lock:
+            if encrypted_password in reservation_passwords.passwords:
+                return reservation_passwords.passwords[encrypted_password]
+
+            in_flight = reservation_passwords.pending.get(encrypted_password)
+            if in_flight is None:
+                in_flight = reservation_passwords.pending[encrypted_password] = threading.Event()
+                is_owner = True
+            else:
+                is_owner = False
+
+        if not is_owner:
+            in_flight.wait()
+            with reservation_passwords.lock:
+                if encrypted_password in reservation_passwords.passwords:
+                    return reservation_passwords.passwords[encrypted_password]
+
+            # the call we waited for failed or the scope was wiped meanwhile, decrypt on our own
+            return cloudshell_session.DecryptPassword(encrypted_password).Value
+
+        try:
+            decrypted_password = cloudshell_session.DecryptPassword(encrypted_password).Value
+            with reservation_passwords.lock:
+                if reservation_passwords.ref_count > 0:
+                    reservation_passwords.passwords[encrypted_password] = decrypted_password
+            return decrypted_password
+        finally:
+            with reservation_passwords.lock:
+                del reservation_passwords.pending[encrypted_password]
+            in_flight.set()
+
+
+password_decryption_service = PasswordDecryptionService()
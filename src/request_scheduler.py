@@ -0,0 +1,237 @@
+import heapq
+import itertools
+import random
+import threading
+import time
+
+from cancellation import cancellation_watcher
+from sdk.heavenly_cloud_service import ThrottlingError
+from tracing import tracer
+
+# lower runs first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BULK = 2
+
+# a user is waiting on GetVmDetails and Refresh IP, power operations and reconciliation scans run in bulk
+OPERATION_PRIORITIES = {
+    'get_instance': PRIORITY_INTERACTIVE,
+    'get_instance_full': PRIORITY_INTERACTIVE,
+    'power_on': PRIORITY_BULK,
+    'power_off': PRIORITY_BULK,
+    'delete_instance': PRIORITY_BULK,
+    'get_instances': PRIORITY_BULK,
+}
+
+# seconds of waiting that raise a queued request by one priority level, so a steady flow of interactive requests
+# delays the bulk ones but cannot starve them
+PRIORITY_AGING_SECONDS = 1.0
+
+MAX_THROTTLING_RETRIES = 5
+BACKOFF_BASE_SECONDS = 0.1
+BACKOFF_MAX_SECONDS = 5.0
+
+
+def _float_attribute(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _wait_timeout(wait, scope):
+    """
+    :param float wait: seconds until the request may be granted, None until another request is granted
+    :param cancellation.CancellationScope scope: of the command, checked again after at most a cancellation poll
+    interval and never waited past its deadline
+    :rtype: float
+    """
+    if scope is None:
+        return wait
+    timeout = cancellation_watcher.poll_interval
+    remaining = scope.remaining()
+    if remaining is not None:
+        timeout = min(timeout, remaining)
+    return timeout if wait is None else min(wait, timeout)
+
+
+class _ResourceQueue(object):
+    def __init__(self, rate, burst):
+        """
+        Requests of one cloud provider resource, granted by priority at the rate of a token bucket
+        :param float rate: requests per second, 0 for no limit
+        :param float burst: bucket capacity
+        """
+        self.rate = rate
+        self.capacity = max(burst, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.time()
+        self.condition = threading.Condition(threading.Lock())
+        self.waiting = []  # heap of (aged priority, sequence)
+
+        self.granted = 0
+        self.throttled = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.max_queue_depth = 0
+
+    def configure(self, rate, burst):
+        with self.condition:
+            self.rate = rate
+            self.capacity = max(burst, 1.0)
+            self.tokens = min(self.tokens, self.capacity)
+
+    def _seconds_until_token(self):
+        # called with the condition held
+        if not self.rate:
+            return 0
+        now = time.time()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def acquire(self, priority, sequence, scope=None, enqueued=None):
+        """
+        Blocks until the request is the most urgent waiting one and a token is available. A request gains a priority
+        level per PRIORITY_AGING_SECONDS it waits, as the waiting requests all age alike their order is fixed by
+        priority * PRIORITY_AGING_SECONDS + enqueue time
+        :param cancellation.CancellationScope scope: of the command, its cancellation or deadline ends the wait with
+        OperationCancelledException or DeadlineExceededException
+        :param float enqueued: time the request was first queued, a retried request keeps its place in line
+        :return: seconds the request waited
+        :rtype: float
+        """
+        start = time.time()
+        entry = (priority * PRIORITY_AGING_SECONDS + (enqueued if enqueued is not None else start), sequence)
+        with self.condition:
+            heapq.heappush(self.waiting, entry)
+            self.max_queue_depth = max(self.max_queue_depth, len(self.waiting))
+            try:
+                while True:
+                    if scope is not None:
+                        scope.check()
+                    wait = None
+                    if self.waiting[0] == entry:
+                        wait = self._seconds_until_token()
+                        if wait <= 0:
+                            break
+                    self.condition.wait(_wait_timeout(wait, scope))
+            except BaseException:
+                self.waiting.remove(entry)
+                heapq.heapify(self.waiting)
+                self.condition.notify_all()
+                raise
+
+            heapq.heappop(self.waiting)
+            if self.rate:
+                self.tokens -= 1
+            waited = time.time() - start
+            self.granted += 1
+            self.wait_seconds += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+            self.condition.notify_all()
+        return waited
+
+    def on_throttled(self):
+        with self.condition:
+            self.throttled += 1
+            # the provider disagrees with our rate, stop everyone queued behind us for a moment as well
+            self.tokens = min(self.tokens, 0)
+
+    def metrics(self):
+        with self.condition:
+            return {'queue_depth': len(self.waiting),
+                    'max_queue_depth': self.max_queue_depth,
+                    'granted': self.granted,
+                    'throttled': self.throttled,
+                    'avg_wait_ms': self.wait_seconds / self.granted * 1000 if self.granted else 0.0,
+                    'max_wait_ms': self.max_wait_seconds * 1000}
+
+
+class RequestScheduler(object):
+    """
+    HeavenlyCloudService interceptor that queues the provider operations of each cloud provider resource behind a
+    token bucket sized by the resource API Rate Limit and API Burst attributes, and grants them by priority
+    (see OPERATION_PRIORITIES) aged by their waiting time. Operations the provider throttles anyway are retried with
+    jittered exponential backoff. A cancelled command, or one past its deadline, stops waiting for its turn and its
+    backoff.
+    """
+
+    def __init__(self, max_retries=MAX_THROTTLING_RETRIES, backoff_base=BACKOFF_BASE_SECONDS,
+                 backoff_max=BACKOFF_MAX_SECONDS):
+        """
+        :param int max_retries: retries of a throttled operation before its ThrottlingError is raised
+        :param float backoff_base: backoff of the first retry
+        :param float backoff_max: backoff cap
+        """
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retries = 0
+        self._lock = threading.Lock()
+        self._queues = {}  # type: dict[str, _ResourceQueue]
+        self._sequence = itertools.count()
+        self._random = random.Random()
+
+    def _queue(self, cloud_provider_resource):
+        rate = _float_attribute(getattr(cloud_provider_resource, 'api_rate_limit', None))
+        burst = _float_attribute(getattr(cloud_provider_resource, 'api_burst', None)) or rate
+        name = getattr(cloud_provider_resource, 'name', None)
+
+        with self._lock:
+            queue = self._queues.get(name)
+            if queue is None:
+                queue = self._queues[name] = _ResourceQueue(rate, burst)
+            sequence = next(self._sequence)
+
+        if (queue.rate, queue.capacity) != (rate, max(burst, 1.0)):
+            # the resource attributes were edited since the queue was created
+            queue.configure(rate, burst)
+        return queue, sequence
+
+    def backoff(self, attempt):
+        """
+        :param int attempt: 0 for the first retry
+        :return: seconds to wait, between half and all of the capped exponential backoff
+        :rtype: float
+        """
+        backoff = min(self.backoff_max, self.backoff_base * 2 ** attempt)
+        with self._lock:
+            return backoff * (0.5 + self._random.random() / 2)
+
+    def __call__(self, operation_name, cloud_provider_resource, proceed):
+        if cloud_provider_resource is None:
+            return proceed()
+
+        queue, sequence = self._queue(cloud_provider_resource)
+        priority = OPERATION_PRIORITIES.get(operation_name, PRIORITY_NORMAL)
+        scope = cancellation_watcher.current()
+        enqueued = time.time()
+
+        attempt = 0
+        while True:
+            with tracer.span('rate_limit_wait', 'sdk', priority=priority):
+                queue.acquire(priority, sequence, scope, enqueued)
+            try:
+                return proceed()
+            except ThrottlingError:
+                queue.on_throttled()
+                if attempt >= self.max_retries:
+                    raise
+                with self._lock:
+                    self.retries += 1
+                with tracer.span('throttling_backoff', 'sdk', attempt=attempt):
+                    cancellation_watcher.sleep(self.backoff(attempt))
+                attempt += 1
+
+    def metrics(self):
+        """
+        :return: cloud provider resource name -> queue depth, wait time and throttling counters
+        :rtype: dict[str, dict]
+        """
+        with self._lock:
+            queues = dict(self._queues)
+        return dict((name, queue.metrics()) for name, queue in queues.items())
+
+
+request_scheduler = RequestScheduler()
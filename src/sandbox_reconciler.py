@@ -0,0 +1,206 @@
+from deployed_app_index import DeployedAppRecord
+from sdk.heavenly_cloud_service import HeavenlyCloudService, POWER_STATE_RUNNING
+from vm_details_cache import vm_details_cache
+
+FULL = 'full'
+INCREMENTAL = 'incremental'
+RECONCILIATION_MODES = [FULL, INCREMENTAL]
+
+LIVE_STATUS_ONLINE = 'Online'
+LIVE_STATUS_OFFLINE = 'Offline'
+LIVE_STATUS_ERROR = 'Error'
+
+# instances fetched per bulk query, big sandboxes are fetched page by page
+MAX_INSTANCES_PER_QUERY = 100
+
+
+class ReconciliationReport(object):
+    def __init__(self, mode):
+        """
+        :param str mode: FULL or INCREMENTAL
+        """
+        self.mode = mode
+        self.checked = 0
+        self.changed = 0
+        self.address_updates = 0
+        self.public_ip_updates = 0
+        self.live_status_updates = 0
+        self.indexed = 0
+        self.missing = []  # type: list[str]
+
+    def __str__(self):
+        summary = '{0} reconciliation checked {1} apps, {2} changed: {3} address, {4} public ip and ' \
+                  '{5} live status updates'.format(self.mode, self.checked, self.changed, self.address_updates,
+                                                   self.public_ip_updates, self.live_status_updates)
+        if self.indexed:
+            summary += ', {0} apps deployed outside of this host indexed'.format(self.indexed)
+        if self.missing:
+            summary += ', instances of {0} no longer exist'.format(', '.join(self.missing))
+        return summary
+
+
+class SandboxReconciler(object):
+    """
+    Brings the deployed apps CloudShell shows in a reservation back in line with the instances in the cloud
+    provider: addresses, Public IP attribute and live status. The instances are fetched in bulk and only the
+    differences are pushed to CloudShell.
+    The apps, their instances and addresses are read from the reservation details CloudShell has. The Public IP and
+    live status are not part of them, they are taken from the deployed app index, which holds what this shell last
+    set. The apps the index does not know or knows with another instance or address, deployed or reconciled by
+    another host, are indexed from the reservation details first and always fully checked.
+    """
+
+    def __init__(self, deployed_app_index):
+        """
+        :param deployed_app_index.DeployedAppIndex deployed_app_index:
+        """
+        self.deployed_app_index = deployed_app_index
+
+    def reconcile(self, cloudshell_session, cloud_provider_resource, reservation_id, mode=FULL):
+        """
+        :param CloudShellAPISession cloudshell_session:
+        :param L3HeavenlyCloudShell cloud_provider_resource:
+        :param str reservation_id:
+        :param str mode: FULL checks every app, INCREMENTAL only the instances changed since the last reconciliation
+        :rtype: ReconciliationReport
+        """
+        if mode not in RECONCILIATION_MODES:
+            raise ValueError('unknown reconciliation mode {0}, use one of {1}'.format(
+                mode, ', '.join(RECONCILIATION_MODES)))
+
+        provider_name = cloud_provider_resource.name
+        report = ReconciliationReport(mode)
+        records, indexed_uids = self._cloudshell_apps(cloudshell_session, provider_name, reservation_id, report)
+        records_by_uid = dict((record.vm_uid, record) for record in records)
+
+        changed_since = None
+        if mode == INCREMENTAL:
+            changed_since = self.deployed_app_index.last_reconciled(reservation_id, provider_name)
+
+        changed_records = []
+        as_of = None
+
+        # the apps indexed just now may differ from their instance since before the last reconciliation, they are
+        # always checked
+        pages = [([record.vm_uid for record in records if record.vm_uid not in indexed_uids], changed_since),
+                 (sorted(indexed_uids), None)]
+        queries = [(vm_ids[page_start:page_start + MAX_INSTANCES_PER_QUERY], since)
+                   for vm_ids, since in pages for page_start in range(0, len(vm_ids), MAX_INSTANCES_PER_QUERY)]
+        for vm_ids, since in queries:
+            query_result = HeavenlyCloudService.get_instances(cloud_provider_resource, vm_ids, since)
+            # the first page is the oldest, the next run must not miss changes made while the pages were fetched
+            as_of = query_result.as_of if as_of is None else min(as_of, query_result.as_of)
+
+            for vm_instance in query_result.instances:
+                record = records_by_uid[vm_instance.id]
+                report.checked += 1
+                if self._push_instance_state(cloudshell_session, record, vm_instance, report):
+                    changed_records.append(record)
+
+            for vm_id in query_result.missing_ids:
+                record = records_by_uid[vm_id]
+                report.checked += 1
+                report.missing.append(record.fullname)
+                if self._push_live_status(cloudshell_session, record, LIVE_STATUS_ERROR,
+                                          'instance {0} no longer exists in the cloud provider'.format(vm_id),
+                                          report):
+                    changed_records.append(record)
+
+        report.changed = len(changed_records)
+        self.deployed_app_index.put_all(changed_records)
+        for record in changed_records:
+            # the cached vm details of the app show what was just pushed away
+            vm_details_cache.invalidate(provider_name, record.vm_uid)
+        if as_of is not None:
+            self.deployed_app_index.set_last_reconciled(reservation_id, provider_name, as_of)
+
+        return report
+
+    def _cloudshell_apps(self, cloudshell_session, provider_name, reservation_id, report):
+        """
+        The deployed apps of the reservation as CloudShell has them. The apps the index does not know, knows with
+        another instance or with another address are indexed, the records of apps no longer in the reservation are
+        removed
+        :param CloudShellAPISession cloudshell_session:
+        :param str provider_name: cloud provider resource name
+        :param str reservation_id:
+        :param ReconciliationReport report:
+        :return: the records of the apps and the vm uids of the apps indexed
+        :rtype: (list[DeployedAppRecord], set[str])
+        """
+        indexed_records = dict((record.fullname, record)
+                               for record in self.deployed_app_index.for_reservation(reservation_id)
+                               if record.cloud_provider == provider_name)
+        reservation = cloudshell_session.GetReservationDetails(reservation_id).ReservationDescription
+
+        records = []
+        indexed_uids = set()
+        updated_records = []
+        for resource in reservation.Resources or []:
+            vm_details = getattr(resource, 'VmDetails', None)
+            if vm_details is None or not vm_details.UID or vm_details.CloudProviderFullName != provider_name:
+                continue
+            record = indexed_records.pop(resource.Name, None)
+            if record is None or record.vm_uid != vm_details.UID:
+                # the Public IP attribute is not part of the reservation details, the check pushes it if any
+                record = DeployedAppRecord(resource.Name, vm_details.UID, resource.FullAddress, None,
+                                           reservation_id, provider_name)
+                report.indexed += 1
+                indexed_uids.add(record.vm_uid)
+            elif record.private_ip != resource.FullAddress:
+                # the address was changed in CloudShell or pushed by the reconciliation of another host
+                record.private_ip = resource.FullAddress
+                indexed_uids.add(record.vm_uid)
+            if record.live_status is None:
+                # read once, so the first reconciliation does not push the live status of every app
+                record.live_status = cloudshell_session.GetResourceLiveStatus(record.fullname).liveStatusName or None
+                updated_records.append(record)
+            elif record.vm_uid in indexed_uids:
+                updated_records.append(record)
+            records.append(record)
+
+        self.deployed_app_index.put_all(updated_records)
+        for record in indexed_records.values():
+            self.deployed_app_index.remove(record.fullname)
+        return records, indexed_uids
+
+    def _push_instance_state(self, cloudshell_session, record, vm_instance, report):
+        """
+        :param CloudShellAPISession cloudshell_session:
+        :param deployed_app_index.DeployedAppRecord record: what CloudShell holds, updated with what was pushed
+        :param HeavenResidentInstance vm_instance: the instance state in the cloud provider
+        :param ReconciliationReport report:
+        :return: whether anything was pushed
+        :rtype: bool
+        """
+        changed = False
+
+        if vm_instance.private_ip and vm_instance.private_ip != record.private_ip:
+            cloudshell_session.UpdateResourceAddress(record.fullname, vm_instance.private_ip)
+            record.private_ip = vm_instance.private_ip
+            report.address_updates += 1
+            changed = True
+
+        if vm_instance.public_ip and vm_instance.public_ip != record.public_ip:
+            cloudshell_session.SetAttributeValue(record.fullname, 'Public IP', vm_instance.public_ip)
+            record.public_ip = vm_instance.public_ip
+            report.public_ip_updates += 1
+            changed = True
+
+        if vm_instance.power_state is not None:
+            live_status = LIVE_STATUS_ONLINE if vm_instance.power_state == POWER_STATE_RUNNING \
+                else LIVE_STATUS_OFFLINE
+            changed = self._push_live_status(cloudshell_session, record, live_status,
+                                             'instance is ' + vm_instance.power_state, report) or changed
+
+        return changed
+
+    @staticmethod
+    def _push_live_status(cloudshell_session, record, live_status, additional_info, report):
+        if live_status == record.live_status:
+            return False
+
+        cloudshell_session.SetResourceLiveStatus(record.fullname, live_status, additional_info)
+        record.live_status = live_status
+        report.live_status_updates += 1
+        return True
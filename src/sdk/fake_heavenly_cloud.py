@@ -0,0 +1,532 @@
+import json
+import math
+import random
+import threading
+import time
+import uuid
+
+from cancellation import cancellation_watcher
+from data_model import HeavenResidentInstance, Cloud
+from sdk.heavenly_cloud_service import HeavenlyCloudError, ThrottlingError, InstanceNotFoundError, \
+    InstanceQueryResult, CloudImage, POWER_STATE_RUNNING, POWER_STATE_STOPPED
+
+# images of every region, none of them staged
+DEFAULT_IMAGES = ['centos', 'ubuntu', 'windows']
+
+
+class LatencyDistribution(object):
+    def __init__(self, sampler, description):
+        """
+        :param sampler: function(random.Random) -> seconds
+        :param str description:
+        """
+        self._sampler = sampler
+        self.description = description
+
+    def sample(self, rng):
+        """
+        :param random.Random rng:
+        :rtype: float
+        """
+        return max(0.0, self._sampler(rng))
+
+    @staticmethod
+    def constant(seconds):
+        return LatencyDistribution(lambda rng: seconds, 'constant({0})'.format(seconds))
+
+    @staticmethod
+    def uniform(low, high):
+        return LatencyDistribution(lambda rng: rng.uniform(low, high), 'uniform({0}, {1})'.format(low, high))
+
+    @staticmethod
+    def lognormal(median, sigma):
+        """
+        long tailed latency, typical for provider APIs
+        :param float median: median latency in seconds
+        :param float sigma: standard deviation of the underlying normal distribution
+        """
+        mu = math.log(median)
+        return LatencyDistribution(lambda rng: rng.lognormvariate(mu, sigma),
+                                   'lognormal({0}, {1})'.format(median, sigma))
+
+    @staticmethod
+    def from_config(config):
+        """
+        :param dict config: e.g. {"distribution": "lognormal", "median": 0.05, "sigma": 0.5}
+        :rtype: LatencyDistribution
+        """
+        if config is None:
+            return LatencyDistribution.constant(0)
+        if isinstance(config, (int, float)):
+            return LatencyDistribution.constant(config)
+
+        distribution = config.get('distribution', 'constant')
+        if distribution == 'constant':
+            return LatencyDistribution.constant(config.get('seconds', 0))
+        if distribution == 'uniform':
+            return LatencyDistribution.uniform(config['low'], config['high'])
+        if distribution == 'lognormal':
+            return LatencyDistribution.lognormal(config['median'], config.get('sigma', 0.5))
+
+        raise ValueError('unknown latency distribution ' + distribution)
+
+
+class TokenBucket(object):
+    def __init__(self, rate, burst=None):
+        """
+        :param float rate: tokens added per second
+        :param float burst: bucket capacity, defaults to rate
+        """
+        self.rate = float(rate)
+        self.capacity = float(burst if burst else max(rate, 1))
+        self._tokens = self.capacity
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+    def try_acquire(self):
+        """
+        :return: True if a token was taken
+        :rtype: bool
+        """
+        with self._lock:
+            now = time.time()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+
+class OperationProfile(object):
+    def __init__(self, latency=None, error_rate=0.0, rate_limit=None, burst=None):
+        """
+        :param LatencyDistribution latency:
+        :param float error_rate: probability of a call failing with HeavenlyCloudError
+        :param float rate_limit: calls per second allowed before ThrottlingError, None for unlimited
+        :param float burst: token bucket capacity of the rate limit
+        """
+        self.latency = latency or LatencyDistribution.constant(0)
+        self.error_rate = error_rate
+        self.rate_limiter = TokenBucket(rate_limit, burst) if rate_limit else None
+
+    @staticmethod
+    def from_config(config):
+        """
+        :param dict config: e.g. {"latency": {...}, "error_rate": 0.01, "rate_limit": 10, "burst": 20}
+        :rtype: OperationProfile
+        """
+        return OperationProfile(latency=LatencyDistribution.from_config(config.get('latency')),
+                                error_rate=config.get('error_rate', 0.0),
+                                rate_limit=config.get('rate_limit'),
+                                burst=config.get('burst'))
+
+
+class FakeInstance(object):
+    def __init__(self, id, name, description, image, cloud_size, private_ip, public_ip, network_data):
+        self.id = id
+        self.name = name
+        self.description = description
+        self.image = image
+        self.cloud_size = cloud_size
+        self.private_ip = private_ip
+        self.public_ip = public_ip
+        self.network_data = dict(network_data or {})
+        self.power_state = POWER_STATE_RUNNING
+        self.changed = time.time()
+
+    def to_resident_instance(self):
+        return HeavenResidentInstance(self.name, self.description, self.image, Cloud(self.cloud_size), self.id,
+                                      self.private_ip, self.public_ip, self.power_state)
+
+
+class FakeHeavenlyCloud(object):
+    """
+    In process HeavenlyCloud provider that keeps real state (instances, subnets, keys, power state) and models
+    provider behaviour per operation: latency distribution, error rate and rate limit,
+    plus a cap on the number of operations the provider serves concurrently.
+    Select it with HeavenlyCloudService.set_backend or the HEAVENLY_CLOUD_BACKEND=fake environment variable
+    to load test the driver offline.
+    """
+
+    def __init__(self, default_profile=None, operation_profiles=None, max_concurrency=None, time_scale=1.0,
+                 seed=None, images=None):
+        """
+        :param OperationProfile default_profile: profile of operations that have no profile of their own
+        :param dict[str, OperationProfile] operation_profiles: operation name -> profile
+        :param int max_concurrency: operations served concurrently, the rest wait for a free slot
+        :param float time_scale: multiplies every sampled latency, e.g. 0.01 to run a scenario 100 times faster
+        :param seed: random seed for reproducible runs
+        :param list[str] images: ids of the images instances can be created from, DEFAULT_IMAGES by default.
+        The first instance of an image in a region also waits for the latency of the stage_image profile
+        """
+        self.default_profile = default_profile or OperationProfile()
+        self.operation_profiles = operation_profiles or {}
+        self.time_scale = time_scale
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        self._concurrency = threading.BoundedSemaphore(max_concurrency) if max_concurrency else None
+        self._lock = threading.RLock()
+
+        self.instances = {}  # type: dict[str, FakeInstance]
+        self.subnets = {}  # type: dict[str, dict]
+        self.networks = {}  # type: dict[str, str]
+        self.ssh_keys = {}  # type: dict[str, str]
+        self.ssh_key_reservations = {}  # type: dict[str, str]
+        self.images = list(images or DEFAULT_IMAGES)
+        self.staged_images = set()  # type: set[tuple[str, str]]
+        self.calls = {}  # type: dict[str, int]
+        self._next_ip = 1
+
+    @staticmethod
+    def from_config(config):
+        """
+        :param dict config: {"seed": 1, "time_scale": 1.0, "max_concurrency": 50,
+                             "default": {<operation profile>}, "operations": {"<operation name>": {<profile>}}}
+        :rtype: FakeHeavenlyCloud
+        """
+        config = config or {}
+        return FakeHeavenlyCloud(
+            default_profile=OperationProfile.from_config(config.get('default', {})),
+            operation_profiles=dict((name, OperationProfile.from_config(profile))
+                                    for name, profile in config.get('operations', {}).items()),
+            max_concurrency=config.get('max_concurrency'),
+            time_scale=config.get('time_scale', 1.0),
+            seed=config.get('seed'),
+            images=config.get('images'))
+
+    @staticmethod
+    def from_config_file(path):
+        """
+        :param str path: json config file, see from_config. None for a zero latency, error free provider
+        :rtype: FakeHeavenlyCloud
+        """
+        if not path:
+            return FakeHeavenlyCloud()
+
+        with open(path) as config_file:
+            return FakeHeavenlyCloud.from_config(json.load(config_file))
+
+    # region provider behaviour
+
+    def _random(self):
+        with self._rng_lock:
+            return self._rng.random()
+
+    def _sample_latency(self, profile):
+        with self._rng_lock:
+            return profile.latency.sample(self._rng) * self.time_scale
+
+    def _call(self, operation_name):
+        """
+        Applies the operation profile: rate limit, latency and injected errors
+        """
+        profile = self.operation_profiles.get(operation_name, self.default_profile)
+
+        with self._lock:
+            self.calls[operation_name] = self.calls.get(operation_name, 0) + 1
+
+        if profile.rate_limiter and not profile.rate_limiter.try_acquire():
+            raise ThrottlingError('{0} rate limit exceeded'.format(operation_name))
+
+        if self._concurrency:
+            self._concurrency.acquire()
+        try:
+            latency = self._sample_latency(profile)
+            if latency:
+                self._sleep(latency)
+        finally:
+            if self._concurrency:
+                self._concurrency.release()
+
+        if profile.error_rate and self._random() < profile.error_rate:
+            raise HeavenlyCloudError('{0} failed (injected error)'.format(operation_name))
+
+    def _sleep(self, seconds):
+        # the latency of an operation of a cancelled command ends early, like a provider call aborted by the sdk
+        cancellation_watcher.sleep(seconds)
+
+    def _use_image(self, cloud_provider_resource, image):
+        """
+        Fails for unknown images and copies the image to the region of the resource if it is not there yet
+        """
+        if image not in self.images:
+            raise HeavenlyCloudError('image {0} does not exist'.format(image))
+        staged_image = (getattr(cloud_provider_resource, 'region', None), image)
+        with self._lock:
+            if staged_image in self.staged_images:
+                return
+        profile = self.operation_profiles.get('stage_image')
+        if profile is not None:
+            self._sleep(self._sample_latency(profile))
+        with self._lock:
+            self.staged_images.add(staged_image)
+
+    def _allocate_ip(self, prefix):
+        with self._lock:
+            ip_number = self._next_ip
+            self._next_ip += 1
+        return '{0}.{1}.{2}'.format(prefix, (ip_number // 250) % 250, ip_number % 250 + 1)
+
+    def _get(self, vm_id):
+        instance = self.instances.get(vm_id)
+        if instance is None:
+            raise InstanceNotFoundError('instance {0} does not exist'.format(vm_id))
+        return instance
+
+    # endregion
+
+    # region state helpers
+
+    def seed_instances(self, count, name_prefix='seeded'):
+        """
+        Creates instances directly in the provider state, bypassing the operation profiles
+        :param int count:
+        :param str name_prefix:
+        :return: the created instances
+        :rtype: list[FakeInstance]
+        """
+        created = []
+        for _ in range(count):
+            instance = self._create_instance(name_prefix + '_' + str(uuid.uuid4())[:6], 'seeded instance', 'centos',
+                                             'small', None, True)
+            created.append(instance)
+        return created
+
+    def add_instance(self, vm_id, name, private_ip=None, public_ip=None):
+        """
+        Creates an instance with a given id directly in the provider state, e.g. one recorded traffic refers to
+        :param str vm_id:
+        :param str name:
+        :param str private_ip: allocated by default
+        :param str public_ip: allocated by default
+        :rtype: FakeInstance
+        """
+        instance = FakeInstance(vm_id, name, 'added instance', 'centos', 'small',
+                                private_ip or self._allocate_ip('192.168'), public_ip or self._allocate_ip('8.8'),
+                                None)
+        with self._lock:
+            self.instances[vm_id] = instance
+        return instance
+
+    def change_instance(self, vm_id, private_ip=None, public_ip=None, power_state=None):
+        """
+        Changes an instance behind the driver's back, like a user working in the provider console would
+        :param str vm_id:
+        :param str private_ip:
+        :param str public_ip:
+        :param str power_state:
+        """
+        with self._lock:
+            instance = self._get(vm_id)
+            instance.private_ip = private_ip or instance.private_ip
+            instance.public_ip = public_ip or instance.public_ip
+            instance.power_state = power_state or instance.power_state
+            instance.changed = time.time()
+
+    def _create_instance(self, name, description, image, cloud_size, network_data, has_public_ip):
+        instance = FakeInstance(str(uuid.uuid4()), name, description, image, cloud_size,
+                                self._allocate_ip('192.168'), self._allocate_ip('8.8') if has_public_ip else None,
+                                network_data)
+        with self._lock:
+            self.instances[instance.id] = instance
+        return instance
+
+    # endregion
+
+    # region provider operations
+
+    def get_prefered_cloud_color(self):
+        self._call('get_prefered_cloud_color')
+        return 'pink'
+
+    def can_connect(self, user, password, address):
+        self._call('can_connect')
+        return True
+
+    def power_on(self, cloud_provider_resource, vm_id):
+        self._call('power_on')
+        with self._lock:
+            instance = self._get(vm_id)
+            instance.power_state = POWER_STATE_RUNNING
+            instance.changed = time.time()
+
+    def power_off(self, cloud_provider_resource, vm_id):
+        self._call('power_off')
+        with self._lock:
+            instance = self._get(vm_id)
+            instance.power_state = POWER_STATE_STOPPED
+            instance.changed = time.time()
+
+    def delete_instance(self, cloud_provider_resource, vm_id):
+        self._call('delete_instance')
+        with self._lock:
+            self._get(vm_id)
+            del self.instances[vm_id]
+
+    def create_new_password(self, cloud_provider_resource, user, password):
+        self._call('create_new_password')
+        return str(uuid.uuid4())
+
+    def create_man_instance(self, login_user, login_pass, cloud_provider_resource, name, height, weight, cloud_size,
+                            image, network_data):
+        self._call('create_man_instance')
+        self._use_image(cloud_provider_resource, image)
+        return self._create_instance(name, 'height {0} weight {1}'.format(height, weight), image, cloud_size,
+                                     network_data, True).to_resident_instance()
+
+    def create_angel_instance(self, login_user, login_pass, cloud_provider_resource, name, wing_count, flight_speed,
+                              cloud_size, image, network_data):
+        self._call('create_angel_instance')
+        self._use_image(cloud_provider_resource, image)
+        return self._create_instance(name, 'wing count {0} flight speed {1}'.format(wing_count, flight_speed),
+                                     image, cloud_size, network_data, False).to_resident_instance()
+
+    def create_stopped_angel_instance(self, cloud_provider_resource, wing_count, flight_speed, cloud_size, image):
+        self._call('create_stopped_angel_instance')
+        self._use_image(cloud_provider_resource, image)
+        instance = self._create_instance('stopped_' + str(uuid.uuid4())[:6],
+                                         'wing count {0} flight speed {1}'.format(wing_count, flight_speed), image,
+                                         cloud_size, None, False)
+        return self._stop(instance)
+
+    def create_stopped_man_instance(self, cloud_provider_resource, height, weight, cloud_size, image):
+        self._call('create_stopped_man_instance')
+        self._use_image(cloud_provider_resource, image)
+        instance = self._create_instance('stopped_' + str(uuid.uuid4())[:6],
+                                         'height {0} weight {1}'.format(height, weight), image, cloud_size, None,
+                                         True)
+        return self._stop(instance)
+
+    def _stop(self, instance):
+        with self._lock:
+            instance.power_state = POWER_STATE_STOPPED
+        return instance.id
+
+    def activate_instance(self, cloud_provider_resource, vm_id, name, login_user, login_pass, network_data):
+        self._call('activate_instance')
+        with self._lock:
+            instance = self._get(vm_id)
+            if instance.power_state != POWER_STATE_STOPPED:
+                raise HeavenlyCloudError('instance {0} is already in use'.format(vm_id))
+            instance.name = name
+            instance.network_data = dict(network_data or {})
+            instance.power_state = POWER_STATE_RUNNING
+            instance.changed = time.time()
+            return instance.to_resident_instance()
+
+    def get_instance(self, cloud_provider_resource, name, id, address):
+        self._call('get_instance')
+        with self._lock:
+            return self._get(id).to_resident_instance()
+
+    def get_instance_full(self, cloud_provider_resource, name, id):
+        self._call('get_instance_full')
+        with self._lock:
+            return self._get(id).to_resident_instance()
+
+    def get_instances(self, cloud_provider_resource, vm_ids, changed_since=None):
+        self._call('get_instances')
+        instances = []
+        missing_ids = []
+        with self._lock:
+            # changes made after the query are stamped later than as_of, so the next query returns them
+            as_of = time.time()
+            for vm_id in vm_ids:
+                instance = self.instances.get(vm_id)
+                if instance is None:
+                    missing_ids.append(vm_id)
+                elif changed_since is None or instance.changed >= changed_since:
+                    instances.append(instance.to_resident_instance())
+        return InstanceQueryResult(instances, missing_ids, as_of)
+
+    def list_images(self, cloud_provider_resource, region):
+        self._call('list_images')
+        with self._lock:
+            return [CloudImage(image_id, image_id, (region, image_id) in self.staged_images)
+                    for image_id in self.images]
+
+    def stage_image(self, cloud_provider_resource, region, image_id):
+        self._call('stage_image')
+        if image_id not in self.images:
+            raise HeavenlyCloudError('image {0} does not exist'.format(image_id))
+        with self._lock:
+            self.staged_images.add((region, image_id))
+
+    def set_auth(self, cloud_provider_resource, user, password):
+        self._call('set_auth')
+
+    def prepare_infra(self, cloud_provider_resource, cidr):
+        self._call('prepare_infra')
+        with self._lock:
+            self.networks[cidr] = 'network_id_{0}'.format(str(uuid.uuid4())[:8])
+
+    def get_or_create_ssh_key(self, cloud_provider_resource):
+        self._call('get_or_create_ssh_key')
+        with self._lock:
+            return self.ssh_keys.setdefault(cloud_provider_resource.name, 'ssh_key_{0}'.format(uuid.uuid4()))
+
+    def create_ssh_key(self, cloud_provider_resource):
+        self._call('create_ssh_key')
+        ssh_key = 'ssh_key_{0}'.format(uuid.uuid4())
+        with self._lock:
+            self.ssh_keys[ssh_key] = ssh_key
+        return ssh_key
+
+    def assign_ssh_key(self, cloud_provider_resource, ssh_key, reservation_id):
+        self._call('assign_ssh_key')
+        with self._lock:
+            if ssh_key not in self.ssh_keys:
+                raise HeavenlyCloudError('ssh key {0} does not exist'.format(ssh_key))
+            self.ssh_key_reservations[ssh_key] = reservation_id
+
+    def delete_ssh_key(self, cloud_provider_resource, ssh_key):
+        self._call('delete_ssh_key')
+        with self._lock:
+            self.ssh_keys.pop(ssh_key, None)
+            self.ssh_key_reservations.pop(ssh_key, None)
+
+    def delete_sandbox_ssh_key(self, cloud_provider_resource, reservation_id):
+        self._call('delete_sandbox_ssh_key')
+        with self._lock:
+            for ssh_key, assigned_reservation_id in list(self.ssh_key_reservations.items()):
+                if assigned_reservation_id == reservation_id:
+                    del self.ssh_key_reservations[ssh_key]
+                    self.ssh_keys.pop(ssh_key, None)
+
+    def prepare_subnet(self, cloud_provider_resource, subnet_cidr, is_public, attributes):
+        self._call('prepare_subnet')
+        subnet_id = 'subnet_id_{0}'.format(str(uuid.uuid4())[:8])
+        with self._lock:
+            self.subnets[subnet_id] = {'cidr': subnet_cidr, 'is_public': is_public}
+        return subnet_id
+
+    def create_unassigned_subnet(self, cloud_provider_resource, prefix_length):
+        self._call('create_unassigned_subnet')
+        subnet_id = 'subnet_id_{0}'.format(str(uuid.uuid4())[:8])
+        with self._lock:
+            self.subnets[subnet_id] = {'cidr': None, 'is_public': None, 'prefix_length': prefix_length}
+        return subnet_id
+
+    def assign_subnet(self, cloud_provider_resource, subnet_id, subnet_cidr, is_public, attributes):
+        self._call('assign_subnet')
+        with self._lock:
+            subnet = self.subnets.get(subnet_id)
+            if subnet is None:
+                raise HeavenlyCloudError('subnet {0} does not exist'.format(subnet_id))
+            if subnet['cidr'] is not None:
+                raise HeavenlyCloudError('subnet {0} is already assigned to {1}'.format(subnet_id, subnet['cidr']))
+            subnet.update(cidr=subnet_cidr, is_public=is_public)
+
+    def delete_subnet(self, cloud_provider_resource, subnet_id):
+        self._call('delete_subnet')
+        with self._lock:
+            if self.subnets.pop(subnet_id, None) is None:
+                raise HeavenlyCloudError('subnet {0} does not exist'.format(subnet_id))
+
+    def delete_infra(self, cloud_provider_resource, cidr):
+        self._call('delete_infra')
+        with self._lock:
+            self.networks.pop(cidr, None)
+
+    # endregion
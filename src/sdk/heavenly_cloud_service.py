@@ -1,18 +1,137 @@
+import inspect
 import random
+import os
+import time
+from functools import wraps, partial
 from data_model import HeavenResidentInstance, Cloud
 from typing import List, Dict
 from cloudshell.cp.core.models import ConnectSubnet
+from network_interface_plan import NetworkInterfacePlan
 import uuid
 
+# set to 'fake' to serve every provider operation from an in process FakeHeavenlyCloud,
+# HEAVENLY_CLOUD_FAKE_CONFIG may point to a json file with its latency/error/rate limit profiles
+BACKEND_ENV_VAR = 'HEAVENLY_CLOUD_BACKEND'
+FAKE_CONFIG_ENV_VAR = 'HEAVENLY_CLOUD_FAKE_CONFIG'
+
+POWER_STATE_RUNNING = 'running'
+POWER_STATE_STOPPED = 'stopped'
+
+
+class HeavenlyCloudError(Exception):
+    pass
+
+
+class ThrottlingError(HeavenlyCloudError):
+    pass
+
+
+class InstanceNotFoundError(HeavenlyCloudError):
+    pass
+
+
+class InstanceQueryResult(object):
+    def __init__(self, instances, missing_ids, as_of):
+        """
+        :param list[HeavenResidentInstance] instances: the queried instances, only the changed ones when the query
+        had a changed_since
+        :param list[str] missing_ids: queried ids of instances that no longer exist
+        :param float as_of: provider time of the query, pass it as changed_since to get the next changes
+        """
+        self.instances = instances
+        self.missing_ids = missing_ids
+        self.as_of = as_of
+
+
+class CloudImage(object):
+    def __init__(self, image_id, name, staged):
+        """
+        :param str image_id: the cloud_image_id of deployment models
+        :param str name:
+        :param bool staged: whether the image is copied to the region, instances of an image that is not are created
+        after the copy
+        """
+        self.image_id = image_id
+        self.name = name
+        self.staged = staged
+
+
+def provider_operation(func):
+    """
+    Marks a HeavenlyCloudService method as a call to the cloud provider,
+    when a backend is selected the call is served by the method of the same name on it.
+    The call goes through the interceptors added with HeavenlyCloudService.add_interceptor, the first added is the
+    outermost
+    """
+    operation_name = func.__name__
+    arg_names = inspect.getargspec(func).args
+    resource_index = arg_names.index('cloud_provider_resource') if 'cloud_provider_resource' in arg_names else None
+
+    @wraps(func)
+    def call_provider(*args, **kwargs):
+        backend = HeavenlyCloudService.get_backend()
+        target = getattr(backend, operation_name) if backend is not None else func
+
+        interceptors = HeavenlyCloudService.interceptors
+        if not interceptors:
+            return target(*args, **kwargs)
+
+        cloud_provider_resource = kwargs.get('cloud_provider_resource')
+        if cloud_provider_resource is None and resource_index is not None and resource_index < len(args):
+            cloud_provider_resource = args[resource_index]
+
+        call = partial(target, *args, **kwargs)
+        for interceptor in reversed(interceptors):
+            call = partial(interceptor, operation_name, cloud_provider_resource, call)
+        return call()
+
+    return staticmethod(call_provider)
+
 
 # represents cloud SDK
 class HeavenlyCloudService(object):
 
+    backend = None
+    interceptors = []
+
+    @staticmethod
+    def add_interceptor(interceptor, outermost=False):
+        """
+        :param interceptor: function(operation_name, cloud_provider_resource, proceed) wrapping every provider
+        operation, it calls proceed() to run the operation and returns its result. Adding it twice has no effect
+        :param bool outermost: wrap the interceptors already added instead of being wrapped by them
+        """
+        if interceptor in HeavenlyCloudService.interceptors:
+            return
+        if outermost:
+            HeavenlyCloudService.interceptors = [interceptor] + HeavenlyCloudService.interceptors
+        else:
+            HeavenlyCloudService.interceptors = HeavenlyCloudService.interceptors + [interceptor]
+
     @staticmethod
+    def remove_interceptor(interceptor):
+        HeavenlyCloudService.interceptors = [registered for registered in HeavenlyCloudService.interceptors
+                                             if registered != interceptor]
+
+    @staticmethod
+    def set_backend(backend):
+        """
+        :param backend: object implementing the provider operations, e.g. FakeHeavenlyCloud. None restores the stub
+        """
+        HeavenlyCloudService.backend = backend
+
+    @staticmethod
+    def get_backend():
+        if HeavenlyCloudService.backend is None and os.environ.get(BACKEND_ENV_VAR) == 'fake':
+            from sdk.fake_heavenly_cloud import FakeHeavenlyCloud
+            HeavenlyCloudService.backend = FakeHeavenlyCloud.from_config_file(os.environ.get(FAKE_CONFIG_ENV_VAR))
+        return HeavenlyCloudService.backend
+
+    @provider_operation
     def get_prefered_cloud_color():
         return 'pink'
 
-    @staticmethod
+    @provider_operation
     def can_connect(user, password, address):
         return True
 
@@ -24,19 +143,19 @@ class HeavenlyCloudService(object):
     def do_other_stuff():
         pass
 
-    @staticmethod
+    @provider_operation
     def power_on(cloud_provider_resource, vm_id):
         pass
 
-    @staticmethod
+    @provider_operation
     def power_off(cloud_provider_resource, vm_id):
         pass
 
-    @staticmethod
+    @provider_operation
     def delete_instance(cloud_provider_resource, vm_id):
         pass
 
-    @staticmethod
+    @provider_operation
     def create_new_password(cloud_provider_resource, user, password):
         return str(uuid.uuid4())
 
@@ -48,7 +167,7 @@ class HeavenlyCloudService(object):
     def rollback():
         pass
 
-    @staticmethod
+    @provider_operation
     def create_man_instance(login_user, login_pass, cloud_provider_resource, name, height, weight, cloud_size, image, network_data):
         # connect to cloudprovider
         HeavenlyCloudService.connect(cloud_provider_resource.user, cloud_provider_resource.password,
@@ -60,7 +179,7 @@ class HeavenlyCloudService(object):
                                       '192.168.10.{}'.format(str(random.randint(1, 253))),
                                       '8.8.8.{}'.format(str(random.randint(1, 253))))
 
-    @staticmethod
+    @provider_operation
     def create_angel_instance(login_user, login_pass, cloud_provider_resource, name, wing_count, flight_speed,
                               cloud_size, image, network_data):
         # connect to cloudprovider
@@ -71,52 +190,155 @@ class HeavenlyCloudService(object):
         return HeavenResidentInstance(name, 'wing count {0} flight speed {1}'.format(wing_count, flight_speed), image,
                                       Cloud(cloud_size), str(uuid.uuid4()),
                                       '192.168.0.{}'.format(str(random.randint(1, 253))), None)
-    @staticmethod
+    @provider_operation
+    def create_stopped_angel_instance(cloud_provider_resource, wing_count, flight_speed, cloud_size, image):
+        """
+        Creates a stopped angel instance without network interfaces, activate_instance hands it to a deploy
+        :return: id of the instance
+        :rtype: str
+        """
+        return str(uuid.uuid4())
+
+    @provider_operation
+    def create_stopped_man_instance(cloud_provider_resource, height, weight, cloud_size, image):
+        """
+        Creates a stopped man instance without network interfaces, activate_instance hands it to a deploy
+        :return: id of the instance
+        :rtype: str
+        """
+        return str(uuid.uuid4())
+
+    @provider_operation
+    def activate_instance(cloud_provider_resource, vm_id, name, login_user, login_pass, network_data):
+        """
+        Renames a stopped instance, sets its credentials, attaches its network interfaces and powers it on
+        :rtype: HeavenResidentInstance
+        """
+        return HeavenResidentInstance(name, 'instance {0}'.format(name), 'centos', Cloud(0), vm_id,
+                                      '192.168.0.{}'.format(str(random.randint(1, 253))), None)
+
+    @provider_operation
     def get_instance(cloud_provider_resource, name, id, address):
         return HeavenResidentInstance(name, 'instance {0} {1}'.format(name, id), 'centos', Cloud(0), str(id), address,
                                       None)
 
-    @staticmethod
+    @provider_operation
     def get_instance_full(cloud_provider_resource, name ,id):
         return HeavenResidentInstance(name= name,descrpition= 'instance {0} {1}'.format(name ,id),image='centos',
                                       cloud= Cloud(0),id=str(id),
                                       private_ip='192.168.5.{}'.format(str(random.randint(1, 253))),
                                       public_ip='1.1.1.{}'.format(str(random.randint(1, 253))))
-    @staticmethod
+    @provider_operation
+    def get_instances(cloud_provider_resource, vm_ids, changed_since=None):
+        """
+        Bulk query of instance state
+        :param list[str] vm_ids:
+        :param float changed_since: only return instances changed after this provider time, see InstanceQueryResult
+        :rtype: InstanceQueryResult
+        """
+        instances = [HeavenResidentInstance(name=vm_id, descrpition='instance {0}'.format(vm_id), image='centos',
+                                            cloud=Cloud(0), id=str(vm_id),
+                                            private_ip='192.168.5.{}'.format(str(random.randint(1, 253))),
+                                            public_ip='1.1.1.{}'.format(str(random.randint(1, 253))),
+                                            power_state=POWER_STATE_RUNNING)
+                     for vm_id in vm_ids]
+        return InstanceQueryResult(instances, [], time.time())
+
+    @provider_operation
+    def list_images(cloud_provider_resource, region):
+        """
+        :param str region:
+        :return: the images instances of the region can be created from
+        :rtype: list[CloudImage]
+        """
+        return [CloudImage(image_id, image_id, True) for image_id in ('centos', 'ubuntu', 'windows')]
+
+    @provider_operation
+    def stage_image(cloud_provider_resource, region, image_id):
+        """
+        Copies the image to the region ahead of the first instance created from it
+        """
+        pass
+
+    @provider_operation
     def set_auth(cloud_provider_resource, user, password):
         pass
 
-    @staticmethod
+    @provider_operation
     def prepare_infra(cloud_provider_resource, cidr):
         pass
 
-    @staticmethod
-    def get_or_create_ssh_key():
+    @provider_operation
+    def get_or_create_ssh_key(cloud_provider_resource):
         return 'sandbox_ssh_key'
 
-    @staticmethod
-    def prepare_subnet(subnet_cidr, is_public, attributes):
+    @provider_operation
+    def create_ssh_key(cloud_provider_resource):
+        """
+        :return: a new key pair, unlike the one get_or_create_ssh_key shares between the sandboxes
+        :rtype: str
+        """
+        return 'ssh_key_{0}'.format(uuid.uuid4())
+
+    @provider_operation
+    def assign_ssh_key(cloud_provider_resource, ssh_key, reservation_id):
+        """
+        Tags a key pair created by create_ssh_key with the sandbox it was handed to, see delete_sandbox_ssh_key
+        """
+        pass
+
+    @provider_operation
+    def delete_ssh_key(cloud_provider_resource, ssh_key):
+        pass
+
+    @provider_operation
+    def delete_sandbox_ssh_key(cloud_provider_resource, reservation_id):
+        """
+        Deletes the key pair assigned to the sandbox, if any. The key get_or_create_ssh_key shares between the
+        sandboxes is never assigned and is kept
+        """
+        pass
+
+    @provider_operation
+    def prepare_subnet(cloud_provider_resource, subnet_cidr, is_public, attributes):
+        return 'subnet_id_{}'.format(str(uuid.uuid4())[:8])
+
+    @provider_operation
+    def create_unassigned_subnet(cloud_provider_resource, prefix_length):
+        """
+        Creates a subnet of the given size that is not in a sandbox network yet, see assign_subnet
+        :param int prefix_length: e.g. 24 for a subnet of 256 addresses
+        :return: subnet id
+        :rtype: str
+        """
         return 'subnet_id_{}'.format(str(uuid.uuid4())[:8])
 
+    @provider_operation
+    def assign_subnet(cloud_provider_resource, subnet_id, subnet_cidr, is_public, attributes):
+        """
+        Moves a subnet created by create_unassigned_subnet to a cidr of the sandbox network, much faster than
+        creating it
+        """
+        pass
+
+    @provider_operation
+    def delete_subnet(cloud_provider_resource, subnet_id):
+        pass
+
+    @provider_operation
+    def delete_infra(cloud_provider_resource, cidr):
+        pass
+
 
     @staticmethod
     def prepare_network_for_instance(connect_subnet_actions):
         """
         :param List[ConnectSubnet] connect_subnet_actions:
-        :return:
-        :rtype: Dict
+        :return: the subnet to device index mapping of the instance, its network_data is what create_*_instance
+                 expects
+        :rtype: NetworkInterfacePlan
         """
-        if not connect_subnet_actions:
-            # we are in single subnet mode. need to create the instance in the default subnet
-            return {'default_subnet': 0}
-        else:
-            result = {}
-            for index, action in enumerate(connect_subnet_actions):
-                # Note:
-                # The 'vnicName' prop is the requested vnic to be associated with the given subnet.
-                # Here we might want to inspect the vnicName prop to decide how to map subnet ids to instance interfaces.
-                # vnic_name = action.actionParams.vnicName
-                result[action.actionParams.subnetId] = index
-
-            return result
-
+        # Note:
+        # The 'vnicName' prop is the requested vnic to be associated with the given subnet.
+        # NetworkInterfacePlan honors it when it is a device index and fails on conflicting requests.
+        return NetworkInterfacePlan(connect_subnet_actions)
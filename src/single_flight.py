@@ -0,0 +1,67 @@
+import sys
+import threading
+
+
+class _Flight(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.exc_info = None
+
+
+class SingleFlight(object):
+    """
+    Runs a function once for all the concurrent calls made with the same key: the first call executes it, the
+    calls arriving while it runs wait for it and get its result, or its exception.
+    A call arriving after the execution ended runs the function again, results are never cached.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}  # key -> _Flight in progress
+        self.executions = 0
+        self.shared = 0
+
+    def do(self, key, func):
+        """
+        :param key: hashable identity of the work, e.g. command name and normalized request
+        :param func: function without arguments doing the work
+        :return: the result of func, computed by this call or by the call in progress with the same key
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = _Flight()
+                self.executions += 1
+                leader = True
+            else:
+                self.shared += 1
+                leader = False
+
+        if not leader:
+            flight.done.wait()
+            if flight.exc_info is not None:
+                raise flight.exc_info[0], flight.exc_info[1], flight.exc_info[2]
+            return flight.result
+
+        try:
+            flight.result = func()
+            return flight.result
+        except BaseException:
+            flight.exc_info = sys.exc_info()
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def stats(self):
+        """
+        :return: executions, calls that shared the result of an execution and executions in progress
+        :rtype: dict
+        """
+        with self._lock:
+            return {'executions': self.executions, 'shared': self.shared, 'in_flight': len(self._flights)}
+
+
+single_flight = SingleFlight()
@@ -0,0 +1,142 @@
+from cStringIO import StringIO
+from json.encoder import encode_basestring_ascii
+
+from cloudshell.cp.core.models import VmDetailsData, VmDetailsProperty, VmDetailsNetworkInterface
+from vm_details_template import FrozenVmDetailsProperty
+
+INFINITY = float('inf')
+
+# class -> ([field names sorted the way json sort_keys sorts them], [pre-encoded '"name":' key prefixes])
+_class_fields = {}
+
+
+def register_class(cls, fields=None):
+    """
+    Precomputes the json field list of a class so its instances are serialized without __dict__ reflection
+    :param type cls: the class to register
+    :param list[str] fields: the instance attribute names, by default taken from an instance created without arguments
+    """
+    if fields is None:
+        fields = cls().__dict__.keys()
+
+    fields = sorted(fields)
+    _class_fields[cls] = (fields, [encode_basestring_ascii(field) + ':' for field in fields])
+
+
+def _encode_float(value):
+    if value != value:
+        return 'NaN'
+    if value == INFINITY:
+        return 'Infinity'
+    if value == -INFINITY:
+        return '-Infinity'
+    return repr(value)
+
+
+def _encode_key(key):
+    if isinstance(key, basestring):
+        return encode_basestring_ascii(key)
+    if key is True:
+        return '"true"'
+    if key is False:
+        return '"false"'
+    if key is None:
+        return '"null"'
+    if isinstance(key, float):
+        return '"' + _encode_float(key) + '"'
+    return '"' + str(key) + '"'
+
+
+def _encode(value, parts):
+    """
+    Appends the json of value to parts, matching
+    json.dumps(value, default=lambda o: o.__dict__, sort_keys=True, separators=(',', ':')) byte for byte
+    """
+    if isinstance(value, basestring):
+        parts.append(encode_basestring_ascii(value))
+    elif value is None:
+        parts.append('null')
+    elif value is True:
+        parts.append('true')
+    elif value is False:
+        parts.append('false')
+    elif isinstance(value, (int, long)):
+        parts.append(str(value))
+    elif isinstance(value, float):
+        parts.append(_encode_float(value))
+    elif isinstance(value, (list, tuple)):
+        parts.append('[')
+        for index, item in enumerate(value):
+            if index:
+                parts.append(',')
+            _encode(item, parts)
+        parts.append(']')
+    elif isinstance(value, dict):
+        _encode_dict(value, parts)
+    else:
+        class_fields = _class_fields.get(type(value))
+        attributes = value.__dict__
+        if class_fields is None or len(class_fields[0]) != len(attributes):
+            # unregistered class or an instance that got extra attributes, fall back to reflection
+            _encode_dict(attributes, parts)
+            return
+
+        fields, keys = class_fields
+        parts.append('{')
+        for index, field in enumerate(fields):
+            if index:
+                parts.append(',')
+            parts.append(keys[index])
+            _encode(attributes[field], parts)
+        parts.append('}')
+
+
+def _encode_dict(value, parts):
+    parts.append('{')
+    for index, key in enumerate(sorted(value)):
+        if index:
+            parts.append(',')
+        parts.append(_encode_key(key))
+        parts.append(':')
+        _encode(value[key], parts)
+    parts.append('}')
+
+
+class StreamingJsonWriter(object):
+    def __init__(self, stream):
+        """
+        Writes json arrays item by item, the output is identical to
+        json.dumps(items, default=lambda o: o.__dict__, sort_keys=True, separators=(',', ':'))
+        :param stream: file like object to write to
+        """
+        self._stream = stream
+
+    def write_array(self, items):
+        """
+        Serializes each item and writes it to the stream as soon as the iterable produces it,
+        so the whole array never has to be held in memory
+        :param items: iterable of objects to serialize
+        """
+        write = self._stream.write
+        write('[')
+        for index, item in enumerate(items):
+            parts = [','] if index else []
+            _encode(item, parts)
+            write(''.join(parts))
+        write(']')
+
+    @staticmethod
+    def dumps_array(items):
+        """
+        :param items: iterable of objects to serialize
+        :rtype: str
+        """
+        stream = StringIO()
+        StreamingJsonWriter(stream).write_array(items)
+        return stream.getvalue()
+
+
+register_class(VmDetailsData)
+register_class(VmDetailsProperty)
+register_class(VmDetailsNetworkInterface)
+register_class(FrozenVmDetailsProperty, ['key', 'value', 'hidden'])
@@ -0,0 +1,198 @@
+import json
+import os
+import thread
+import threading
+import time
+from contextlib import contextmanager
+
+# path of the trace file, spans are only recorded while it is set
+TRACE_FILE_ENV_VAR = 'HEAVENLY_CLOUD_TRACE_FILE'
+
+# span arguments the nested spans inherit, so every span of a deploy can be filtered by its reservation and action
+CONTEXT_ARGS = ('reservation_id', 'action_id')
+
+
+class Span(object):
+    def __init__(self, name, category, args):
+        """
+        :param str name:
+        :param str category: 'command', 'driver' or 'sdk'
+        :param dict args: reservation id, action id and whatever else describes the span
+        """
+        self.name = name
+        self.category = category
+        self.args = args
+        self.start = time.time()
+
+
+class _NoSpan(object):
+    """
+    Context manager of the spans of a disabled tracer
+    """
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+class Tracer(object):
+    """
+    Nested spans from the driver commands down to the provider operations, written as complete events ("ph": "X")
+    of the Chrome trace event format, one per line: the file opens with "[" and every event ends with a comma, the
+    array format without its optional closing bracket that chrome://tracing and Perfetto load as is.
+    The open spans of each thread are kept on a thread local stack, a span inherits the reservation and action ids of
+    the spans it is nested in. Registered as a HeavenlyCloudService interceptor it records a span per provider
+    operation, outermost so the rate limit wait of the operation is part of it.
+    """
+
+    def __init__(self, path=None):
+        """
+        :param str path: trace file, by default the HEAVENLY_CLOUD_TRACE_FILE environment variable
+        """
+        self.path = path if path is not None else os.environ.get(TRACE_FILE_ENV_VAR)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._file = None
+        self._pid = os.getpid()
+        self.spans = 0
+        self.write_errors = 0
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def span(self, name, category='driver', **args):
+        """
+        :param str name: e.g. the command, step or provider operation name
+        :param str category:
+        :param args: json serializable span arguments
+        :return: context manager timing the code it wraps, a no-op one when tracing is disabled
+        """
+        if not self.path:
+            return _NO_SPAN
+        return self._span(name, category, args)
+
+    @contextmanager
+    def _span(self, name, category, args):
+        stack = self._stack()
+        if stack:
+            parent_args = stack[-1].args
+            for key in CONTEXT_ARGS:
+                if key in parent_args and key not in args:
+                    args[key] = parent_args[key]
+
+        span = Span(name, category, args)
+        stack.append(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.args['error'] = type(e).__name__
+            raise
+        finally:
+            stack.pop()
+            self._write(span, time.time())
+
+    def open_spans(self):
+        """
+        :return: the open spans of the thread, outermost first, for the threads doing work on its behalf
+        :rtype: list[Span]
+        """
+        return list(getattr(self._local, 'stack', None) or ())
+
+    @contextmanager
+    def continued(self, spans):
+        """
+        Nests the spans the code it wraps opens in the spans another thread handed over, so they inherit its
+        reservation and action ids
+        :param list[Span] spans: open_spans() of the other thread
+        """
+        outer_stack = getattr(self._local, 'stack', None)
+        self._local.stack = list(spans)
+        try:
+            yield
+        finally:
+            self._local.stack = outer_stack
+
+    def annotate(self, **args):
+        """
+        Adds arguments to the innermost open span of the thread, e.g. the action id once the request is parsed
+        """
+        stack = getattr(self._local, 'stack', None)
+        if stack:
+            stack[-1].args.update(args)
+
+    def __call__(self, operation_name, cloud_provider_resource, proceed):
+        if not self.path:
+            return proceed()
+        with self._span(operation_name, 'sdk', {'resource': getattr(cloud_provider_resource, 'name', None)}):
+            return proceed()
+
+    def _write(self, span, end):
+        event = {'name': span.name,
+                 'cat': span.category,
+                 'ph': 'X',
+                 'ts': int(span.start * 1000000),
+                 'dur': int((end - span.start) * 1000000),
+                 'pid': self._pid,
+                 'tid': thread.get_ident(),
+                 'args': span.args}
+        try:
+            line = json.dumps(event, default=str) + ',\n'
+            with self._lock:
+                if self._file is None:
+                    empty = not os.path.exists(self.path) or not os.path.getsize(self.path)
+                    self._file = open(self.path, 'a')
+                    if empty:
+                        self._file.write('[\n')
+                self._file.write(line)
+                self._file.flush()
+                self.spans += 1
+        except (IOError, OSError, TypeError, ValueError):
+            with self._lock:
+                self.write_errors += 1
+
+    def configure(self, path):
+        """
+        :param str path: trace file to write the next spans to, None or '' to stop tracing. The tracer is added as
+        the outermost HeavenlyCloudService interceptor while tracing, and removed when tracing stops
+        """
+        from sdk.heavenly_cloud_service import HeavenlyCloudService
+
+        self.close()
+        self.path = path
+        if path:
+            HeavenlyCloudService.add_interceptor(self, outermost=True)
+        else:
+            HeavenlyCloudService.remove_interceptor(self)
+
+    def close(self):
+        """
+        Closes the trace file, the next span opens it again
+        """
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def stats(self):
+        """
+        :rtype: dict
+        """
+        with self._lock:
+            return {'enabled': bool(self.path),
+                    'spans': self.spans,
+                    'write_errors': self.write_errors}
+
+
+tracer = Tracer()
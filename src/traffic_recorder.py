@@ -0,0 +1,222 @@
+import gzip
+import json
+import os
+import threading
+import time
+import types
+from contextlib import contextmanager
+
+# path of the traffic file, commands are only recorded while it is set. A path ending with .gz is gzip compressed
+RECORD_FILE_ENV_VAR = 'HEAVENLY_CLOUD_RECORD_FILE'
+
+# key of the encoded objects holding the name of their class
+TYPE_KEY = '__type__'
+
+# context fields that are not recorded, the replay runs against a fake CloudShell API session
+SECRET_FIELDS = ('admin_auth_token',)
+
+# attributes whose values are not recorded, in the resource attributes of the context and in the json requests and
+# deployed apps, with or without their model or deployment path prefix
+SECRET_ATTRIBUTES = ('Password',)
+
+
+def _secret_attribute(name):
+    return isinstance(name, basestring) and name.rsplit('.', 1)[-1] in SECRET_ATTRIBUTES
+
+
+def _scrub(value):
+    # the attributes of the requests are {"attributeName", "attributeValue"}, the ones of the deployed apps
+    # {"name", "value"}
+    if isinstance(value, list):
+        return [_scrub(item) for item in value]
+    if isinstance(value, dict):
+        scrubbed = dict((key, _scrub(item)) for key, item in value.items())
+        if _secret_attribute(value.get('attributeName', value.get('name'))):
+            for key in ('attributeValue', 'value'):
+                if key in scrubbed:
+                    scrubbed[key] = ''
+        return scrubbed
+    return value
+
+
+def _scrub_json(text):
+    try:
+        value = json.loads(text)
+    except ValueError:
+        return text
+    scrubbed = _scrub(value)
+    # unchanged json keeps its recorded text
+    return json.dumps(scrubbed) if scrubbed != value else text
+
+
+def encode(obj):
+    """
+    :return: json serializable copy of obj, objects become dicts of their attributes with their class name under
+    TYPE_KEY so decode can create them again. The secret fields and attributes are recorded empty
+    """
+    if isinstance(obj, (list, tuple)):
+        return [encode(item) for item in obj]
+    if isinstance(obj, dict):
+        return dict((key, '' if _secret_attribute(key) else encode(value)) for key, value in obj.items())
+    if hasattr(obj, '__dict__'):
+        encoded = dict((name, '' if name in SECRET_FIELDS else encode(value))
+                       for name, value in vars(obj).items())
+        encoded[TYPE_KEY] = obj.__class__.__name__
+        return encoded
+    if isinstance(obj, basestring) and obj.startswith(('{', '[')):
+        return _scrub_json(obj)
+    return obj
+
+
+def _new(cls):
+    # the cloudshell context classes are old style classes in python 2, they have no __new__
+    if isinstance(cls, types.ClassType):
+        return types.InstanceType(cls)
+    return cls.__new__(cls)
+
+
+def decode(value, classes):
+    """
+    :param value: an encoded value
+    :param dict classes: class name -> class of the encoded objects, the objects of other classes stay dicts
+    :return: value with its objects created again, without calling their __init__
+    """
+    if isinstance(value, list):
+        return [decode(item, classes) for item in value]
+    if isinstance(value, dict):
+        decoded = dict((key, decode(item, classes)) for key, item in value.items() if key != TYPE_KEY)
+        cls = classes.get(value.get(TYPE_KEY))
+        if cls is None:
+            return decoded
+        obj = _new(cls)
+        obj.__dict__.update(decoded)
+        return obj
+    return value
+
+
+def _open(path, mode):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 'b')
+    return open(path, mode)
+
+
+def read_records(path):
+    """
+    :param str path: traffic file written by TrafficRecorder
+    :return: the recorded commands in the order they started
+    :rtype: list[dict]
+    """
+    records = []
+    with _open(path, 'r') as traffic_file:
+        for line in traffic_file:
+            line = line.strip()
+            if line:
+                records.append(json.loads(line))
+    records.sort(key=lambda record: record['ts'])
+    return records
+
+
+class _NoRecord(object):
+    """
+    Context manager of the commands of a disabled recorder
+    """
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+
+_NO_RECORD = _NoRecord()
+
+
+class TrafficRecorder(object):
+    """
+    Records the commands CloudShell runs on the driver so the production traffic can be replayed offline, see
+    benchmarks/replay_traffic.py. Each command is a json line written once it ends: its name, start time, duration,
+    the type of the error it failed with and its context and arguments, encoded with encode. The context is encoded
+    when the command starts, before the command changes anything.
+    """
+
+    def __init__(self, path=None):
+        """
+        :param str path: traffic file, by default the HEAVENLY_CLOUD_RECORD_FILE environment variable
+        """
+        self.path = path if path is not None else os.environ.get(RECORD_FILE_ENV_VAR)
+        self._lock = threading.Lock()
+        self._file = None
+        self.records = 0
+        self.write_errors = 0
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    def record(self, command_name, context, *args):
+        """
+        :param str command_name: driver method name, the replay calls it with the recorded context and arguments
+        :param context: the command context
+        :param args: the other arguments of the command
+        :return: context manager timing the command it wraps, a no-op one when recording is disabled
+        """
+        if not self.path:
+            return _NO_RECORD
+        return self._record(command_name, context, args)
+
+    @contextmanager
+    def _record(self, command_name, context, args):
+        record = {'command': command_name,
+                  'context': encode(context),
+                  'args': encode(args),
+                  'error': None}
+        record['ts'] = time.time()
+        try:
+            yield record
+        except BaseException as e:
+            record['error'] = type(e).__name__
+            raise
+        finally:
+            record['duration'] = time.time() - record['ts']
+            self._write(record)
+
+    def _write(self, record):
+        try:
+            line = json.dumps(record, default=str, separators=(',', ':')) + '\n'
+            with self._lock:
+                if self._file is None:
+                    self._file = _open(self.path, 'a')
+                self._file.write(line)
+                self._file.flush()
+                self.records += 1
+        except (IOError, OSError, TypeError, ValueError):
+            with self._lock:
+                self.write_errors += 1
+
+    def configure(self, path):
+        """
+        :param str path: traffic file to write the next commands to, None or '' to stop recording
+        """
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self.path = path
+
+    def close(self):
+        """
+        Closes the traffic file, the next command opens it again
+        """
+        self.configure(self.path)
+
+    def stats(self):
+        """
+        :rtype: dict
+        """
+        with self._lock:
+            return {'enabled': bool(self.path),
+                    'records': self.records,
+                    'write_errors': self.write_errors}
+
+
+traffic_recorder = TrafficRecorder()
@@ -0,0 +1,121 @@
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_TTL_SECONDS = 30
+DEFAULT_MAX_ENTRIES = 10000
+
+
+class VmDetailsCache(object):
+    """
+    Short lived cache of the VmDetailsData built by GetVmDetails, keyed by cloud provider resource name and vm uid.
+    Users refresh the VM details panel of the same sandbox over and over, the commands changing an instance
+    invalidate its entry and the ttl bounds how stale an entry changed outside of this process can get.
+    Least recently used entries are evicted above max_entries.
+    Details read from the cloud provider before an invalidation of their instance are not stored, the reader takes a
+    generation() before the read and passes it to put.
+    Cached VmDetailsData objects are shared between commands and must not be modified.
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL_SECONDS, max_entries=DEFAULT_MAX_ENTRIES):
+        """
+        :param float ttl: seconds an entry is served after it was stored
+        :param int max_entries:
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # (resource name, vm uid) -> (expires, VmDetailsData), oldest use first
+        self._generation = 0  # bumped by every invalidation
+        self._invalidations = OrderedDict()  # (resource name, vm uid) -> generation of its last invalidation
+        self._forgotten_generation = 0  # newest generation dropped from _invalidations
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stale_puts = 0
+
+    def get(self, cloud_provider_name, vm_uid):
+        """
+        :param str cloud_provider_name:
+        :param str vm_uid:
+        :rtype: VmDetailsData
+        """
+        key = (cloud_provider_name, vm_uid)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[0] < time.time():
+                self.misses += 1
+                return None
+
+            # re-inserting moves the entry to the most recently used end
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[1]
+
+    def generation(self):
+        """
+        :return: generation to pass to put, taken before the details are read from the cloud provider
+        :rtype: int
+        """
+        with self._lock:
+            return self._generation
+
+    def put(self, cloud_provider_name, vm_uid, vm_details, generation=None):
+        """
+        :param str cloud_provider_name:
+        :param str vm_uid:
+        :param VmDetailsData vm_details:
+        :param int generation: of the cache when the details were read, they are dropped if the instance was
+        invalidated since. None stores them unconditionally
+        """
+        key = (cloud_provider_name, vm_uid)
+        with self._lock:
+            if generation is not None and (self._invalidations.get(key, 0) > generation or
+                                           self._forgotten_generation > generation):
+                self.stale_puts += 1
+                return
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time() + self.ttl, vm_details)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, cloud_provider_name, vm_uid):
+        """
+        The instance changed, the next GetVmDetails of it asks the cloud provider
+        :param str cloud_provider_name:
+        :param str vm_uid:
+        """
+        key = (cloud_provider_name, vm_uid)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._generation += 1
+            self._invalidations.pop(key, None)
+            self._invalidations[key] = self._generation
+            while len(self._invalidations) > self.max_entries:
+                # a put of a read older than the forgotten invalidation might be stale, it is dropped
+                _, self._forgotten_generation = self._invalidations.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+            self._invalidations.clear()
+            self._forgotten_generation = self._generation
+
+    def stats(self):
+        """
+        :return: hits, misses, hit rate, evictions, dropped stale puts and current number of entries
+        :rtype: dict
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_rate': float(self.hits) / lookups if lookups else 0.0,
+                    'evictions': self.evictions,
+                    'stale_puts': self.stale_puts,
+                    'entries': len(self._entries)}
+
+
+vm_details_cache = VmDetailsCache()
@@ -0,0 +1,146 @@
+import zlib
+
+from cloudshell.cp.core.models import VmDetailsProperty, VmDetailsNetworkInterface
+
+ANGEL_DEPLOYMENT_PATH = 'L3HeavenlyCloudShell.HeavenlyCloudAngelDeployment'
+MAN_DEPLOYMENT_PATH = 'L3HeavenlyCloudShell.HeavenlyCloudManDeployment'
+
+
+class FrozenVmDetailsProperty(VmDetailsProperty):
+    """
+    VmDetailsProperty with a value that is the same for every instance of a deployment model.
+    One object is shared by all the VmDetailsData built from a template so it cannot be modified.
+    Serializes exactly like a VmDetailsProperty.
+    """
+
+    def __init__(self, key, value, hidden=False):
+        self.__dict__.update(key=key, value=value, hidden=hidden)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('{0} is shared between vm details and cannot be modified'.format(self.key))
+
+    __delattr__ = __setattr__
+
+
+class InstanceProperty(object):
+    def __init__(self, key, get_value, hidden=False):
+        """
+        A VmDetailsProperty with a value read from the instance, built for each VmDetailsData
+        :param str key:
+        :param get_value: function of the HeavenResidentInstance, None when the instance is unknown, to the value
+        :param bool hidden:
+        """
+        self.key = key
+        self.get_value = get_value
+        self.hidden = hidden
+
+    def build(self, vm_instance):
+        """
+        :param HeavenResidentInstance vm_instance:
+        :rtype: VmDetailsProperty
+        """
+        return VmDetailsProperty(key=self.key, value=self.get_value(vm_instance), hidden=self.hidden)
+
+
+def mac_address(vm_id, interface_index):
+    """
+    Stable locally administered MAC address of an instance interface, the same every time the details are built
+    :param str vm_id:
+    :param int interface_index:
+    :rtype: str
+    """
+    checksum = zlib.crc32(vm_id or '') & 0xffffffff
+    return '02:{0:02x}:{1:02x}:{2:02x}:{3:02x}:{4:02x}'.format(interface_index & 0xff, checksum >> 24,
+                                                               (checksum >> 16) & 0xff, (checksum >> 8) & 0xff,
+                                                               checksum & 0xff)
+
+
+class _InterfaceTemplate(object):
+    def __init__(self, index, speed):
+        self.index = index
+        self.is_primary = index == 0
+        self.private_ip = '10.0.0.' + str(index)
+        self.public_ip = '8.8.8.' + str(index)
+        self.device_index_property = FrozenVmDetailsProperty(key='Device Index', value=str(index))
+        self.speed_property = FrozenVmDetailsProperty(key='Speed', value=speed)
+
+    def build(self, vm_id):
+        network_data = [self.device_index_property,
+                        VmDetailsProperty(key='MAC Address', value=mac_address(vm_id, self.index)),
+                        self.speed_property]
+
+        return VmDetailsNetworkInterface(interfaceId=self.index, networkId=self.index,
+                                         isPrimary=self.is_primary,
+                                         # specifies whether nic is the primary interface
+                                         isPredefined=False,
+                                         # specifies whether network existed before reservation
+                                         networkData=network_data,
+                                         privateIpAddress=self.private_ip,
+                                         publicIpAddress=self.public_ip)
+
+
+class VmDetailsTemplate(object):
+    """
+    Layout of the VM details of a deployment model, compiled once.
+    The properties that are the same for every instance are FrozenVmDetailsProperty objects shared by all the
+    VmDetailsData built from the template, only the per instance values are allocated for each instance.
+    """
+
+    def __init__(self, instance_properties, interface_count=2, interface_speed='1KB'):
+        """
+        :param list instance_properties: FrozenVmDetailsProperty and InstanceProperty, in display order
+        :param int interface_count: network interfaces of an instance
+        :param str interface_speed:
+        """
+        self._instance_properties = [(None, prop) if isinstance(prop, InstanceProperty) else (prop, None)
+                                     for prop in instance_properties]
+        self._interfaces = [_InterfaceTemplate(i, interface_speed) for i in range(interface_count)]
+
+    def instance_data(self, vm_instance):
+        """
+        :param HeavenResidentInstance vm_instance:
+        :rtype: list[VmDetailsProperty]
+        """
+        return [shared if shared is not None else prop.build(vm_instance)
+                for shared, prop in self._instance_properties]
+
+    def network_data(self, vm_instance):
+        """
+        :param HeavenResidentInstance vm_instance:
+        :rtype: list[VmDetailsNetworkInterface]
+        """
+        # get networking data from the cloudprovider and for each network interface extract the data we want to
+        # expose in cloudshell
+        vm_id = vm_instance.id if vm_instance else None
+        return [interface.build(vm_id) for interface in self._interfaces]
+
+
+_templates = {}
+
+
+def register_template(deployment_path, template):
+    """
+    :param str deployment_path: e.g. L3HeavenlyCloudShell.HeavenlyCloudAngelDeployment
+    :param VmDetailsTemplate template:
+    """
+    _templates[deployment_path] = template
+
+
+def template_for(deployment_path):
+    """
+    :param str deployment_path: deployment model of the app, None when the request does not say
+    :return: the template of the deployment model, the default one for unknown models
+    :rtype: VmDetailsTemplate
+    """
+    return _templates.get(deployment_path, DEFAULT_TEMPLATE)
+
+
+DEFAULT_TEMPLATE = VmDetailsTemplate([
+    FrozenVmDetailsProperty(key='Cloud Size', value='not so big'),
+    InstanceProperty('Instance Name', lambda vm_instance: 'dummy' if not vm_instance else vm_instance.name),
+    FrozenVmDetailsProperty(key='Hidden stuff', value='something not for UI', hidden=True),
+])
+
+# both deployments show the same details today, a deployment that needs different ones registers its own template
+register_template(ANGEL_DEPLOYMENT_PATH, DEFAULT_TEMPLATE)
+register_template(MAN_DEPLOYMENT_PATH, DEFAULT_TEMPLATE)
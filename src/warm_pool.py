@@ -0,0 +1,366 @@
+import math
+import threading
+import time
+import traceback
+from collections import deque
+from multiprocessing.pool import ThreadPool
+
+from cancellation import cancellation_watcher
+from cidr_allocator import parse_cidr, prefix_length
+from sdk.heavenly_cloud_service import HeavenlyCloudService
+
+DEFAULT_REFILL_THREADS = 2
+
+# weight of the newest measurement in the smoothed creation time of the items of a key
+SMOOTHING = 0.3
+
+# deploys closer together than this are counted as this far apart when sizing the instance pools
+MIN_DEPLOY_INTERVAL_SECONDS = 0.01
+
+
+def _int_attribute(value):
+    try:
+        return max(int(value), 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+class _Bucket(object):
+    def __init__(self):
+        """
+        Items of one pool key and how to create more of them
+        """
+        self.ready = deque()
+        self.target_size = 0
+        self.create = None
+        self.destroy = None
+        self.pending = 0  # refills in flight
+        self.create_seconds = None  # smoothed time the creation of an item takes
+        self.unfilled_claims = deque()  # times of the claims whose replacement is not ready yet
+
+
+class WarmPool(object):
+    """
+    Cloud objects created ahead of demand so commands claim a ready one instead of waiting on the cloud provider.
+    Items are kept per key, e.g. cloud provider resource and subnet size, and every claim, hit or miss, refills its
+    key up to the target size in background threads. The refill lag is the time from a claim until the item
+    replacing it is ready, a lag longer than the time between claims means the pool runs dry.
+    """
+
+    def __init__(self, refill_threads=DEFAULT_REFILL_THREADS):
+        """
+        :param int refill_threads: items created concurrently
+        """
+        self.refill_threads = refill_threads
+        self._lock = threading.Lock()
+        self._buckets = {}  # key -> _Bucket
+        self._refill_pool = None
+        self.claims = 0
+        self.hits = 0
+        self.misses = 0
+        self.refills = 0
+        self.refill_errors = 0
+        self.last_refill_error = None
+        self.refill_lag_seconds = 0.0
+        self.max_refill_lag_seconds = 0.0
+
+    def claim(self, key, target_size, create, destroy=None):
+        """
+        :param key: hashable pool key
+        :param int target_size: items to keep ready for the key, the items above it are destroyed
+        :param create: function creating one item for the key, called by the refills
+        :param destroy: function(item) releasing an item that was never claimed, called by close
+        :return: a ready item, None if there was none and the caller has to create one itself
+        """
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if not target_size:
+                    return None
+                bucket = self._buckets[key] = _Bucket()
+            bucket.target_size = target_size
+            bucket.create = create
+            bucket.destroy = destroy
+
+            self.claims += 1
+            item = bucket.ready.popleft() if bucket.ready else None
+            if item is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            if target_size:
+                bucket.unfilled_claims.append(time.time())
+            self._schedule_refills(key, bucket)
+        return item
+
+    def _refill_pool_started(self):
+        # called with self._lock held
+        if self._refill_pool is None:
+            self._refill_pool = ThreadPool(self.refill_threads)
+        return self._refill_pool
+
+    def _schedule_refills(self, key, bucket):
+        # called with self._lock held
+        while len(bucket.ready) > bucket.target_size:
+            self._refill_pool_started().apply_async(self._destroy, (bucket, bucket.ready.pop()))
+        missing = bucket.target_size - len(bucket.ready) - bucket.pending
+        for _ in range(max(missing, 0)):
+            bucket.pending += 1
+            self._refill_pool_started().apply_async(self._refill, (key, bucket))
+
+    def _refill(self, key, bucket):
+        with self._lock:
+            if self._buckets.get(key) is not bucket:
+                # the pool was closed before the refill started
+                bucket.pending -= 1
+                return
+        start = time.time()
+        try:
+            item = bucket.create()
+        except Exception:
+            with self._lock:
+                bucket.pending -= 1
+                self.refill_errors += 1
+                self.last_refill_error = traceback.format_exc()
+            return
+
+        with self._lock:
+            bucket.pending -= 1
+            self._record_creation(bucket, time.time() - start)
+            closed = self._buckets.get(key) is not bucket
+            if not closed:
+                bucket.ready.append(item)
+                self._record_refill(bucket)
+        if closed:
+            # the pool was closed while the item was created
+            self._destroy(bucket, item)
+
+    @staticmethod
+    def _record_creation(bucket, seconds):
+        # called with self._lock held
+        if bucket.create_seconds is None:
+            bucket.create_seconds = seconds
+        else:
+            bucket.create_seconds += SMOOTHING * (seconds - bucket.create_seconds)
+
+    def _record_refill(self, bucket):
+        # called with self._lock held
+        self.refills += 1
+        if bucket.unfilled_claims:
+            lag = time.time() - bucket.unfilled_claims.popleft()
+            self.refill_lag_seconds += lag
+            self.max_refill_lag_seconds = max(self.max_refill_lag_seconds, lag)
+
+    @staticmethod
+    def _destroy(bucket, item):
+        if bucket.destroy is None:
+            return
+        try:
+            bucket.destroy(item)
+        except Exception:
+            pass
+
+    def ready(self, key):
+        """
+        :return: number of ready items of the key
+        :rtype: int
+        """
+        with self._lock:
+            bucket = self._buckets.get(key)
+            return len(bucket.ready) if bucket else 0
+
+    def close(self):
+        """
+        Stops the refills, waits for the ones in flight and destroys the items that were never claimed, so no refill
+        reaches the cloud provider once it returns
+        """
+        with self._lock:
+            buckets = self._buckets.values()
+            self._buckets = {}
+            refill_pool = self._refill_pool
+            self._refill_pool = None
+        if refill_pool is not None:
+            # the queued refills are skipped, the ones in flight destroy the item they create
+            refill_pool.close()
+            refill_pool.join()
+        for bucket in buckets:
+            while bucket.ready:
+                self._destroy(bucket, bucket.ready.popleft())
+
+    def stats(self):
+        """
+        :rtype: dict
+        """
+        with self._lock:
+            return {'claims': self.claims,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_rate': float(self.hits) / self.claims if self.claims else 0.0,
+                    'ready': sum(len(bucket.ready) for bucket in self._buckets.values()),
+                    'refilling': sum(bucket.pending for bucket in self._buckets.values()),
+                    'refills': self.refills,
+                    'refill_errors': self.refill_errors,
+                    'average_refill_lag_seconds': self.refill_lag_seconds / self.refills if self.refills else 0.0,
+                    'max_refill_lag_seconds': self.max_refill_lag_seconds}
+
+
+class SubnetPool(WarmPool):
+    """
+    Subnets created without a cidr, per cloud provider resource and subnet size, that PrepareSandboxInfra assigns
+    to the cidr of a sandbox subnet. The pool keeps Warm Subnet Pool Size subnets of every size the sandboxes of the
+    resource asked for
+    """
+
+    def prepare_subnet(self, cloud_provider_resource, subnet_cidr, is_public, attributes):
+        """
+        Assigns a ready subnet, or creates one when the pool is disabled or empty
+        :param L3HeavenlyCloudShell cloud_provider_resource:
+        :param str subnet_cidr:
+        :param bool is_public:
+        :param attributes: subnet service attributes
+        :return: subnet id
+        :rtype: str
+        """
+        subnet_prefix_length = prefix_length(*parse_cidr(subnet_cidr))
+        subnet_id = self.claim((cloud_provider_resource.name, subnet_prefix_length),
+                               _int_attribute(cloud_provider_resource.warm_subnet_pool_size),
+                               lambda: HeavenlyCloudService.create_unassigned_subnet(cloud_provider_resource,
+                                                                                     subnet_prefix_length),
+                               lambda ready_subnet_id: HeavenlyCloudService.delete_subnet(cloud_provider_resource,
+                                                                                          ready_subnet_id))
+        if subnet_id is None:
+            return HeavenlyCloudService.prepare_subnet(cloud_provider_resource, subnet_cidr, is_public, attributes)
+
+        try:
+            HeavenlyCloudService.assign_subnet(cloud_provider_resource, subnet_id, subnet_cidr, is_public, attributes)
+        except Exception:
+            # the claimed subnet is neither in the pool nor in the sandbox, also when the command was cancelled
+            with cancellation_watcher.shielded():
+                HeavenlyCloudService.delete_subnet(cloud_provider_resource, subnet_id)
+            raise
+        return subnet_id
+
+
+class KeyPairPool(WarmPool):
+    """
+    Key pairs created ahead of the sandboxes of a cloud provider resource, each sandbox claims its own and it is
+    assigned to the sandbox, CleanupSandboxInfra deletes it. Without Warm Key Pair Pool Size the sandboxes share the
+    key of the resource
+    """
+
+    def get_ssh_key(self, cloud_provider_resource, reservation_id):
+        """
+        :param L3HeavenlyCloudShell cloud_provider_resource:
+        :param str reservation_id: of the sandbox
+        :return: access key of the sandbox
+        :rtype: str
+        """
+        target_size = _int_attribute(cloud_provider_resource.warm_key_pair_pool_size)
+        ssh_key = self.claim(cloud_provider_resource.name, target_size,
+                             lambda: HeavenlyCloudService.create_ssh_key(cloud_provider_resource),
+                             lambda ready_ssh_key: HeavenlyCloudService.delete_ssh_key(cloud_provider_resource,
+                                                                                       ready_ssh_key))
+        if ssh_key is None:
+            if not target_size:
+                return HeavenlyCloudService.get_or_create_ssh_key(cloud_provider_resource)
+            ssh_key = HeavenlyCloudService.create_ssh_key(cloud_provider_resource)
+
+        try:
+            HeavenlyCloudService.assign_ssh_key(cloud_provider_resource, ssh_key, reservation_id)
+        except Exception:
+            # the key is neither in the pool nor in the sandbox, also when the command was cancelled
+            with cancellation_watcher.shielded():
+                HeavenlyCloudService.delete_ssh_key(cloud_provider_resource, ssh_key)
+            raise
+        return ssh_key
+
+
+class InstancePool(WarmPool):
+    """
+    Stopped instances per cloud provider resource and deployment configuration, the deployment model with its
+    cloud size, image and model attributes, that Deploy activates instead of creating an instance. The pool of a
+    configuration keeps as many instances as are deployed while one is created, from the smoothed time between its
+    deploys and the smoothed creation time of its instances, at most Warm Instance Pool Max Size. The pool of a
+    configuration deployed less often shrinks on its next deploy, the ready instances are deleted when the runtime
+    shuts down.
+    """
+
+    def __init__(self, refill_threads=DEFAULT_REFILL_THREADS):
+        super(InstancePool, self).__init__(refill_threads)
+        self._demand = {}  # key -> [time of the last deploy, smoothed seconds between deploys]
+
+    def _target_size(self, key, max_size):
+        now = time.time()
+        with self._lock:
+            demand = self._demand.get(key)
+            if demand is None:
+                self._demand[key] = [now, None]
+                return min(max_size, 1)
+            interval = now - demand[0]
+            demand[0] = now
+            demand[1] = interval if demand[1] is None else demand[1] + SMOOTHING * (interval - demand[1])
+            bucket = self._buckets.get(key)
+            create_seconds = bucket.create_seconds if bucket is not None else None
+        if not create_seconds:
+            return min(max_size, 1)
+        # the deploys expected while a refill creates an instance, plus one for a burst
+        return min(max_size, int(math.ceil(create_seconds / max(demand[1], MIN_DEPLOY_INTERVAL_SECONDS))) + 1)
+
+    def deploy_instance(self, cloud_provider_resource, configuration, create_stopped, create, login_user, login_pass,
+                        name, network_data):
+        """
+        :param L3HeavenlyCloudShell cloud_provider_resource:
+        :param tuple configuration: deployment model name, cloud size, image and model attributes
+        :param create_stopped: function creating a stopped instance of the configuration, returns its id
+        :param create: function creating the instance of the deploy, returns a HeavenResidentInstance
+        :param str login_user:
+        :param str login_pass:
+        :param str name: name of the deployed instance
+        :param dict network_data: network interfaces of the deployed instance
+        :rtype: HeavenResidentInstance
+        """
+        key = (cloud_provider_resource.name,) + tuple(configuration)
+        max_size = _int_attribute(cloud_provider_resource.warm_instance_pool_max_size)
+        vm_id = self.claim(key, self._target_size(key, max_size) if max_size else 0, create_stopped,
+                           lambda ready_vm_id: HeavenlyCloudService.delete_instance(cloud_provider_resource,
+                                                                                    ready_vm_id))
+        if vm_id is None:
+            start = time.time()
+            vm_instance = create()
+            with self._lock:
+                bucket = self._buckets.get(key)
+                if bucket is not None:
+                    self._record_creation(bucket, time.time() - start)
+            return vm_instance
+
+        try:
+            return HeavenlyCloudService.activate_instance(cloud_provider_resource, vm_id, name, login_user,
+                                                          login_pass, network_data)
+        except Exception:
+            # the claimed instance is neither in the pool nor deployed, also when the deploy was cancelled
+            with cancellation_watcher.shielded():
+                HeavenlyCloudService.delete_instance(cloud_provider_resource, vm_id)
+            raise
+
+    def stats(self):
+        """
+        :return: the pool stats with the ready instances, refills in flight, target size and smoothed deploys per
+                 minute of every configuration
+        :rtype: dict
+        """
+        stats = super(InstancePool, self).stats()
+        configurations = stats['configurations'] = {}
+        with self._lock:
+            for key, bucket in self._buckets.items():
+                interval = self._demand.get(key, [None, None])[1]
+                configurations['/'.join(str(part) for part in key)] = {
+                    'ready': len(bucket.ready),
+                    'refilling': bucket.pending,
+                    'target_size': bucket.target_size,
+                    'deploys_per_minute': 60.0 / max(interval, MIN_DEPLOY_INTERVAL_SECONDS) if interval else 0.0}
+        return stats
+
+
+subnet_pool = SubnetPool()
+key_pair_pool = KeyPairPool()
+instance_pool = InstancePool()
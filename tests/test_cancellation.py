@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for `CancellationWatcher`
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from mock import Mock
+
+from benchmarks import driver_harness, request_factory
+from cancellation import CancellationWatcher, OperationCancelledException
+from driver_runtime import driver_runtime
+from sdk.fake_heavenly_cloud import FakeHeavenlyCloud, LatencyDistribution, OperationProfile
+from sdk.heavenly_cloud_service import HeavenlyCloudService
+from tracing import tracer
+
+
+def cancel_after(cancellation_context, seconds):
+    def cancel():
+        cancellation_context.is_cancelled = True
+
+    timer = threading.Timer(seconds, cancel)
+    timer.start()
+    return timer
+
+
+class TestCancellationWatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.watcher = CancellationWatcher(poll_interval=0.01)
+        self.addCleanup(self.watcher.close)
+        self.cancellation_context = Mock(is_cancelled=False)
+
+    def test_cancelled_command_stops_waiting_for_its_operation(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        timer = cancel_after(self.cancellation_context, 0.05)
+        self.addCleanup(timer.cancel)
+
+        start = time.time()
+        with self.assertRaises(OperationCancelledException):
+            with self.watcher.scope(self.cancellation_context):
+                self.watcher('power_on', None, release.wait)
+
+        self.assertLess(time.time() - start, 1)
+        self.assertEqual(self.watcher.stats()['abandoned_operations'], 1)
+
+    def test_instance_created_by_an_abandoned_operation_is_deleted(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        fake = FakeHeavenlyCloud()
+        HeavenlyCloudService.set_backend(fake)
+        self.addCleanup(HeavenlyCloudService.set_backend, None)
+        instance, = fake.seed_instances(1)
+        timer = cancel_after(self.cancellation_context, 0.05)
+        self.addCleanup(timer.cancel)
+
+        def create_angel_instance():
+            release.wait()
+            return instance
+
+        with self.assertRaises(OperationCancelledException):
+            with self.watcher.scope(self.cancellation_context):
+                self.watcher('create_angel_instance', Mock(), create_angel_instance)
+        release.set()
+
+        deadline = time.time() + 1
+        while fake.instances and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(fake.instances, {})
+
+    def test_operations_run_normally_until_cancelled(self):
+        with self.watcher.scope(self.cancellation_context):
+            self.assertEqual(self.watcher('power_on', None, lambda: 'powered on'), 'powered on')
+            with self.assertRaises(ZeroDivisionError):
+                self.watcher('power_on', None, lambda: 1 / 0)
+
+            self.cancellation_context.is_cancelled = True
+            called = []
+            with self.assertRaises(OperationCancelledException):
+                self.watcher('power_on', None, lambda: called.append(True))
+            self.assertEqual(called, [])
+
+    def test_operations_continue_the_spans_of_their_command(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.addCleanup(tracer.configure, tracer.path)
+        tracer.configure(os.path.join(directory, 'trace.json'))
+
+        with tracer.span('PowerOn', 'command', reservation_id='r1'), self.watcher.scope(self.cancellation_context):
+            spans = self.watcher('power_on', None, tracer.open_spans)
+
+        self.assertEqual([(span.name, span.args) for span in spans], [('PowerOn', {'reservation_id': 'r1'})])
+        self.assertEqual(tracer.open_spans(), [])
+
+    def test_shielded_code_is_not_cancelled(self):
+        self.cancellation_context.is_cancelled = True
+
+        with self.watcher.scope(self.cancellation_context):
+            with self.watcher.shielded():
+                self.assertEqual(self.watcher('delete_instance', None, lambda: 'deleted'), 'deleted')
+
+    def test_sleep_ends_on_cancellation(self):
+        timer = cancel_after(self.cancellation_context, 0.05)
+        self.addCleanup(timer.cancel)
+
+        start = time.time()
+        with self.assertRaises(OperationCancelledException):
+            with self.watcher.scope(self.cancellation_context):
+                self.watcher.sleep(5)
+
+        self.assertLess(time.time() - start, 1)
+
+    def test_commands_without_cancellation_context(self):
+        with self.watcher.scope(None) as scope:
+            self.assertIsNone(scope)
+            self.assertEqual(self.watcher('power_on', None, lambda: 'powered on'), 'powered on')
+        self.assertEqual(self.watcher.stats()['operation_threads'], 0)
+
+    def test_close_ends_its_threads(self):
+        with self.watcher.scope(self.cancellation_context):
+            self.watcher('power_on', None, lambda: 'powered on')
+        threads = [self.watcher._thread] + list(self.watcher._operation_threads._workers)
+        self.assertEqual(len(threads), 2)
+
+        self.watcher.close()
+
+        self.assertEqual([thread for thread in threads if thread.is_alive()], [])
+        with self.watcher.scope(self.cancellation_context):
+            self.assertEqual(self.watcher('power_on', None, lambda: 'powered on'), 'powered on')
+        self.watcher.close()
+
+
+class TestDriverCancellation(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = FakeHeavenlyCloud()
+        self.fake.operation_profiles['create_angel_instance'] = OperationProfile(
+            latency=LatencyDistribution.constant(10))
+        HeavenlyCloudService.set_backend(self.fake)
+        self.addCleanup(HeavenlyCloudService.set_backend, None)
+
+    def test_cancelled_deploy_returns_before_the_provider_call(self):
+        self.addCleanup(driver_runtime.shutdown)
+        driver = driver_harness.create_driver()
+        self.addCleanup(driver.cleanup)
+        cancellation_context = driver_harness.cancellation_context()
+        timer = cancel_after(cancellation_context, 0.2)
+        self.addCleanup(timer.cancel)
+
+        start = time.time()
+        with driver_harness.fake_cloudshell_session():
+            response = driver.Deploy(driver_harness.resource_context(), request_factory.deploy_request(1),
+                                     cancellation_context)
+
+        self.assertLess(time.time() - start, 2)
+        deploy_result = json.loads(response)['driverResponse']['actionResults'][0]
+        self.assertFalse(deploy_result['success'])
+        self.assertEqual(deploy_result['errorMessage'], 'Operation cancelled')
+        self.assertEqual(self.fake.instances, {})
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for `CidrAllocator`
+"""
+
+import unittest
+
+from mock import Mock, patch
+
+from cidr_allocator import CidrAllocator, CidrConflictError, RangeSet, format_cidr, parse_cidr
+from heavenly_cloud_service_wrapper import HeavenlyCloudServiceWrapper
+
+
+class TestRangeSet(unittest.TestCase):
+
+    def test_parses_and_formats_cidrs(self):
+        self.assertEqual(parse_cidr('10.0.1.7/24'), (167772416, 167772671))
+        self.assertEqual(format_cidr(*parse_cidr('10.0.1.7/24')), '10.0.1.0/24')
+        self.assertEqual(format_cidr(*parse_cidr('0.0.0.0/0')), '0.0.0.0/0')
+        self.assertRaises(ValueError, parse_cidr, '10.0.0.0/33')
+        self.assertRaises(ValueError, parse_cidr, 'subnet')
+
+    def test_finds_overlapping_ranges(self):
+        ranges = RangeSet()
+        ranges.add(10, 19, 'a')
+        ranges.add(30, 39, 'b')
+
+        self.assertIsNone(ranges.overlapping(20, 29))
+        self.assertEqual(ranges.range_at(ranges.overlapping(0, 10)), (10, 19, 'a'))
+        self.assertEqual(ranges.range_at(ranges.overlapping(15, 35))[2], 'b')
+        self.assertRaises(CidrConflictError, ranges.add, 39, 40, 'c')
+
+    def test_finds_aligned_free_ranges(self):
+        ranges = RangeSet()
+        ranges.add(0, 3, 'a')
+        ranges.add(5, 5, 'b')
+        ranges.add(16, 31, 'c')
+
+        self.assertEqual(ranges.find_free(4, 0, 63), 8)
+        self.assertEqual(ranges.find_free(8, 0, 63), 8)
+        self.assertEqual(ranges.find_free(16, 0, 63), 32)
+        self.assertIsNone(ranges.find_free(32, 0, 47))
+
+        self.assertEqual(ranges.remove(16), 'c')
+        self.assertEqual(ranges.find_free(16, 0, 63), 16)
+
+
+class TestCidrAllocator(unittest.TestCase):
+
+    def setUp(self):
+        self.allocator = CidrAllocator()
+
+    def test_sandbox_networks_of_a_resource_do_not_overlap(self):
+        self.assertTrue(self.allocator.reserve_network('heaven', 'r1', '10.0.0.0/16'))
+        self.assertFalse(self.allocator.reserve_network('heaven', 'r1', '10.0.0.0/16'))
+        self.assertTrue(self.allocator.reserve_network('hell', 'r2', '10.0.0.0/16'))
+
+        self.assertRaises(CidrConflictError, self.allocator.reserve_network, 'heaven', 'r2', '10.0.128.0/24')
+        self.assertRaises(CidrConflictError, self.allocator.reserve_network, 'heaven', 'r2', '10.0.0.0/8')
+        self.assertTrue(self.allocator.reserve_network('heaven', 'r2', '10.1.0.0/16'))
+        self.assertEqual(self.allocator.stats(), {'networks': 3, 'subnets': 0, 'conflicts': 2})
+
+    def test_subnets_are_inside_the_sandbox_network(self):
+        self.allocator.reserve_network('heaven', 'r1', '10.0.0.0/16')
+        self.allocator.reserve_network('heaven', 'r2', '10.1.0.0/16')
+
+        self.assertTrue(self.allocator.reserve_subnet('heaven', 'r1', '10.0.1.0/24'))
+        self.assertFalse(self.allocator.reserve_subnet('heaven', 'r1', '10.0.1.0/24'))
+        self.assertRaises(CidrConflictError, self.allocator.reserve_subnet, 'heaven', 'r1', '10.0.0.0/23')
+        self.assertRaises(CidrConflictError, self.allocator.reserve_subnet, 'heaven', 'r1', '10.1.1.0/24')
+        self.assertRaises(CidrConflictError, self.allocator.reserve_subnet, 'heaven', 'r3', '10.0.2.0/24')
+
+    def test_allocates_free_subnets(self):
+        self.allocator.reserve_network('heaven', 'r1', '10.0.0.0/22')
+        self.allocator.reserve_subnet('heaven', 'r1', '10.0.0.0/24')
+
+        self.assertEqual(self.allocator.allocate_subnet('heaven', 'r1'), '10.0.1.0/24')
+        self.assertEqual(self.allocator.allocate_subnet('heaven', 'r1', 23), '10.0.2.0/23')
+        self.assertRaises(CidrConflictError, self.allocator.allocate_subnet, 'heaven', 'r1', 28)
+        self.assertRaises(CidrConflictError, self.allocator.allocate_subnet, 'heaven', 'r2')
+
+    def test_releases_ranges(self):
+        self.allocator.reserve_network('heaven', 'r1', '10.0.0.0/16')
+        self.allocator.reserve_subnet('heaven', 'r1', '10.0.1.0/24')
+
+        self.allocator.release('heaven', 'r2', '10.0.1.0/24')
+        self.allocator.release('heaven', 'r1', '10.0.1.0/24')
+        self.assertEqual(self.allocator.allocate_subnet('heaven', 'r1'), '10.0.0.0/24')
+        self.assertEqual(self.allocator.allocate_subnet('heaven', 'r1'), '10.0.1.0/24')
+
+        self.assertEqual(self.allocator.release_reservation('heaven', 'r1'), ['10.0.0.0/16'])
+        self.assertEqual(self.allocator.release_reservation('heaven', 'r1'), [])
+        self.assertTrue(self.allocator.reserve_network('heaven', 'r2', '10.0.0.0/8'))
+        self.assertEqual(self.allocator.stats()['networks'], 1)
+
+
+class TestPrepareSandboxInfraCidrs(unittest.TestCase):
+
+    def setUp(self):
+        self.allocator = CidrAllocator()
+        for target, replacement in (('heavenly_cloud_service_wrapper.cidr_allocator', self.allocator),
+                                    ('heavenly_cloud_service_wrapper.HeavenlyCloudService', Mock())):
+            patcher = patch(target, replacement)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.resource = Mock(prefetch_images='')
+        self.resource.name = 'heaven'
+
+    @staticmethod
+    def _subnet_action(cidr):
+        action = Mock()
+        action.actionParams.cidr = cidr
+        return action
+
+    def _prepare(self, reservation_id, cidr, subnet_cidrs):
+        infra_action = Mock()
+        infra_action.actionParams.cidr = cidr
+        return HeavenlyCloudServiceWrapper.prepare_sandbox_infra(
+            Mock(), self.resource, infra_action, Mock(), [self._subnet_action(c) for c in subnet_cidrs],
+            Mock(is_cancelled=False), reservation_id)
+
+    def test_conflicting_cidrs_fail_their_actions(self):
+        self._prepare('r1', '10.0.0.0/16', ['10.0.0.0/24'])
+        results = self._prepare('r2', '10.0.0.0/16', [])
+        self.assertFalse(results[0].success)
+        self.assertIn('overlaps 10.0.0.0/16 of reservation r1', results[0].errorMessage)
+
+        results = self._prepare('r1', '10.0.0.0/16', ['10.0.0.0/23', ''])
+        self.assertEqual([result.success for result in results], [True, True, False, True])
+        self.assertEqual(self.allocator.stats(), {'networks': 1, 'subnets': 2, 'conflicts': 2})
+
+    def test_cleanup_releases_the_sandbox_ranges(self):
+        self._prepare('r1', '10.0.0.0/16', ['10.0.0.0/24'])
+
+        HeavenlyCloudServiceWrapper.cleanup_sandbox_infra(self.resource, Mock(), 'r1')
+
+        self.assertTrue(all(result.success for result in self._prepare('r2', '10.0.0.0/16', ['10.0.0.0/24'])))
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for `CommandProfiler`
+"""
+
+import os
+import pstats
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from mock import Mock, patch
+
+import command_profiler as command_profiler_module
+from benchmarks import driver_harness
+from cancellation import cancellation_watcher
+from command_profiler import CommandProfiler, command_profiler
+from data_model import L3HeavenlyCloudShell
+from driver_runtime import driver_runtime
+from sdk.fake_heavenly_cloud import FakeHeavenlyCloud
+from sdk.heavenly_cloud_service import HeavenlyCloudService
+
+
+def busy(seconds):
+    end = time.time() + seconds
+    while time.time() < end:
+        pass
+
+
+class TestCommandProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def _profiler(self, **kwargs):
+        kwargs.setdefault('commands', '')
+        return CommandProfiler(self.directory, sample_interval=0.001, **kwargs)
+
+    def _context(self, reservation_id='r1', **attributes):
+        return driver_harness.resource_context(reservation_id,
+                                               driver_harness.cloud_provider_attributes(**attributes))
+
+    def test_profiles_commands_named_by_the_resource(self):
+        profiler = self._profiler()
+
+        with profiler.profile('Deploy', self._context(**{'Profile Commands': 'Deploy, GetVmDetails'})):
+            busy(0.05)
+        with profiler.profile('PowerOn', self._context(**{'Profile Commands': 'Deploy, GetVmDetails'})):
+            pass
+
+        profile_file, = os.listdir(self.directory)
+        self.assertTrue(profile_file.endswith('_Deploy_r1.folded'))
+        with open(os.path.join(self.directory, profile_file)) as folded:
+            lines = folded.read().splitlines()
+        self.assertTrue(any('busy (test_command_profiler.py' in line for line in lines))
+        self.assertTrue(all(line.rsplit(' ', 1)[1].isdigit() for line in lines))
+
+    def test_samples_the_provider_operations_of_the_command(self):
+        profiler = self._profiler()
+        self.addCleanup(cancellation_watcher.close)
+
+        with profiler.profile('Deploy', self._context(**{'Profile Commands': 'Deploy'})), \
+                cancellation_watcher.scope(Mock(is_cancelled=False)):
+            cancellation_watcher('power_on', None, lambda: busy(0.05))
+
+        profile_file, = os.listdir(self.directory)
+        with open(os.path.join(self.directory, profile_file)) as folded:
+            lines = folded.read().splitlines()
+        self.assertTrue(any(line.startswith('provider-operation;') and 'busy (test_command_profiler.py' in line
+                            for line in lines))
+        self.assertEqual(cancellation_watcher.operation_thread_ids(threading.current_thread().ident), [])
+
+    def test_environment_commands_and_cprofile(self):
+        profiler = self._profiler(commands='*', profiler='cprofile')
+
+        with profiler.profile('PowerOn', self._context()):
+            busy(0.01)
+
+        profile_file, = os.listdir(self.directory)
+        self.assertTrue(profile_file.endswith('_PowerOn_r1.prof'))
+        stats = pstats.Stats(os.path.join(self.directory, profile_file))
+        self.assertTrue(any(function_name == 'busy' for _, _, function_name in stats.stats))
+
+    def test_writes_the_profile_of_failed_commands(self):
+        profiler = self._profiler(commands='Deploy')
+
+        with self.assertRaises(ValueError):
+            with profiler.profile('Deploy', self._context()):
+                raise ValueError('bad request')
+
+        self.assertEqual(profiler.stats()['profiles'], 1)
+
+    def test_removes_the_oldest_profiles_above_the_max_size(self):
+        profiler = self._profiler(commands='Deploy', profiler='cprofile', max_bytes=1)
+        with open(os.path.join(self.directory, 'notes.txt'), 'w') as other_file:
+            other_file.write('not a profile')
+
+        for reservation_id in ('r1', 'r2'):
+            with profiler.profile('Deploy', self._context(reservation_id)):
+                pass
+
+        self.assertEqual(os.listdir(self.directory), ['notes.txt'])
+        self.assertEqual(profiler.stats()['removed'], 2)
+
+    @unittest.skipIf(command_profiler_module.tracemalloc is None, 'tracemalloc is not available')
+    def test_allocation_snapshot(self):
+        profiler = self._profiler(commands='GetVmDetails,Deploy', allocations='True')
+
+        for command_name in ('GetVmDetails', 'Deploy'):
+            with profiler.profile(command_name, self._context()):
+                [str(i) for i in range(1000)]
+
+        snapshots = [file_name for file_name in os.listdir(self.directory) if file_name.endswith('.tracemalloc')]
+        self.assertEqual(len(snapshots), 1)
+        self.assertIn('_GetVmDetails_', snapshots[0])
+        self.assertFalse(command_profiler_module.tracemalloc.is_tracing())
+
+    def test_commands_that_are_not_profiled(self):
+        profiler = self._profiler()
+
+        with profiler.profile('Deploy', self._context()) as profile:
+            pass
+
+        self.assertIsNone(profile)
+        self.assertEqual(os.listdir(self.directory), [])
+
+
+class TestDriverProfiling(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        patcher = patch.object(command_profiler, 'directory', directory)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.directory = directory
+
+        fake_cloud = FakeHeavenlyCloud()
+        HeavenlyCloudService.set_backend(fake_cloud)
+        self.addCleanup(HeavenlyCloudService.set_backend, None)
+        self.instance, = fake_cloud.seed_instances(1)
+
+    def test_remote_command_profile_is_tagged_with_the_reservation(self):
+        self.addCleanup(driver_runtime.shutdown)
+        driver = driver_harness.create_driver()
+        self.addCleanup(driver.cleanup)
+        attributes = driver_harness.cloud_provider_attributes(**{'Profile Commands': 'PowerOff'})
+
+        driver.PowerOff(driver_harness.remote_context(self.instance.name, self.instance.id, reservation_id='r7',
+                                                      attributes=attributes), [])
+
+        profile_file, = os.listdir(self.directory)
+        self.assertTrue(profile_file.endswith('_PowerOff_r7.folded'))
+
+    def test_command_reads_its_resource_once(self):
+        self.addCleanup(driver_runtime.shutdown)
+        driver = driver_harness.create_driver()
+        self.addCleanup(driver.cleanup)
+        attributes = driver_harness.cloud_provider_attributes(**{'Profile Commands': 'PowerOff',
+                                                                 'Command Timeout': '60'})
+
+        with patch.object(L3HeavenlyCloudShell, 'create_from_context',
+                          side_effect=L3HeavenlyCloudShell.create_from_context) as create_from_context:
+            driver.PowerOff(driver_harness.remote_context(self.instance.name, self.instance.id,
+                                                          attributes=attributes), [])
+
+        self.assertEqual(create_from_context.call_count, 1)
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
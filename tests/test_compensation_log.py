@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for `CompensationLog`
+"""
+
+import time
+import unittest
+
+from cloudshell.cp.core.models import DeployApp
+from mock import Mock, PropertyMock
+
+from compensation_log import CompensationLog, INSTANCE, KEY_PAIR, SUBNET, NETWORK
+from heavenly_cloud_service_wrapper import HeavenlyCloudServiceWrapper
+from sdk.fake_heavenly_cloud import FakeHeavenlyCloud
+from sdk.heavenly_cloud_service import HeavenlyCloudService
+from tests.test_network_interface_plan import connect_subnet_action
+
+
+class TestCompensationLog(unittest.TestCase):
+
+    def test_rolls_back_in_reverse_dependency_order(self):
+        undone = []
+        log = CompensationLog()
+        log.record(NETWORK, 'network', lambda: undone.append('network'))
+        log.record(SUBNET, 'subnet', lambda: undone.append('subnet'))
+        log.record(KEY_PAIR, 'key pair', lambda: undone.append('key pair'))
+        log.record(INSTANCE, 'instance', lambda: undone.append('instance'))
+
+        report = log.rollback()
+
+        self.assertEqual(undone, ['instance', 'key pair', 'subnet', 'network'])
+        self.assertTrue(report.success)
+        self.assertEqual(len(log), 0)
+
+    def test_compensates_objects_of_a_kind_concurrently(self):
+        log = CompensationLog()
+        for i in range(4):
+            log.record(INSTANCE, 'instance_{0}'.format(i), lambda: time.sleep(0.05))
+
+        report = log.rollback()
+
+        self.assertEqual(len(report.compensations), 4)
+        self.assertLess(report.seconds, 0.15)
+
+    def test_reports_failures_and_keeps_rolling_back(self):
+        undone = []
+        log = CompensationLog()
+        log.record(SUBNET, 'subnet', lambda: undone.append('subnet'))
+        log.record(INSTANCE, 'instance', Mock(side_effect=Exception('still running')))
+
+        report = log.rollback()
+
+        self.assertEqual(undone, ['subnet'])
+        self.assertFalse(report.success)
+        self.assertIn('still running', report.errors[0])
+        self.assertIn('instance instance', str(report))
+
+    def test_commit_forgets_created_objects(self):
+        undo = Mock()
+        log = CompensationLog()
+        log.record(INSTANCE, 'instance', undo)
+
+        log.commit()
+
+        self.assertEqual(str(log.rollback()), 'nothing to roll back')
+        undo.assert_not_called()
+
+    def test_rejects_unknown_kinds(self):
+        self.assertRaises(ValueError, CompensationLog().record, 'volume', 'volume', Mock())
+
+
+class TestDeployRollback(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = FakeHeavenlyCloud(seed=1)
+        HeavenlyCloudService.set_backend(self.fake)
+
+        self.deploy_app_action = DeployApp()
+        self.deploy_app_action.actionId = 'deploy'
+        self.deploy_app_action.actionParams = Mock()
+        self.deploy_app_action.actionParams.appName = 'angel'
+        self.deploy_app_action.actionParams.deployment.customModel.cloud_image_id = 'centos'
+        self.deploy_app_action.actionParams.appResource.attributes = {'User': 'admin', 'Password': 'encrypted'}
+        self.cloudshell_session = Mock()
+        self.cloudshell_session.DecryptPassword.return_value.Value = 'password'
+
+    def tearDown(self):
+        HeavenlyCloudService.set_backend(None)
+
+    def test_cancelled_deploy_deletes_the_instance(self):
+        cancellation_context = Mock()
+        type(cancellation_context).is_cancelled = PropertyMock(side_effect=[False, True])
+
+        results = HeavenlyCloudServiceWrapper.deploy_angel(Mock(), self.cloudshell_session, Mock(),
+                                                           self.deploy_app_action, [], cancellation_context)
+
+        self.assertEqual(len(results), 1)
+        self.assertFalse(results[0].success)
+        self.assertEqual(results[0].errorMessage, 'Operation cancelled')
+        self.assertTrue(results[0].infoMessage.startswith('rolled back 1 objects'))
+        self.assertEqual(self.fake.instances, {})
+
+    def test_deployed_instance_is_kept(self):
+        cancellation_context = Mock(is_cancelled=False)
+
+        results = HeavenlyCloudServiceWrapper.deploy_angel(Mock(), self.cloudshell_session, Mock(),
+                                                           self.deploy_app_action, [], cancellation_context)
+
+        self.assertTrue(results[0].success)
+        self.assertEqual(list(self.fake.instances), [results[0].vmUuid])
+
+    def test_conflicting_subnet_requests_fail_before_creating_the_instance(self):
+        connect_subnet_actions = [connect_subnet_action('a', '1'), connect_subnet_action('b', '1')]
+
+        results = HeavenlyCloudServiceWrapper.deploy_angel(Mock(), self.cloudshell_session, Mock(),
+                                                           self.deploy_app_action, connect_subnet_actions,
+                                                           Mock(is_cancelled=False))
+
+        self.assertEqual([result.success for result in results], [False, False, False])
+        self.assertEqual(results[0].errorMessage, 'vnic 1 is requested for both subnet a and subnet b')
+        self.assertEqual(self.fake.instances, {})
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for `CpuWorkPool`
+"""
+
+import os
+import unittest
+
+from cloudshell.cp.core.models import DeployApp, ConnectSubnet, ConnectToSubnetActionResult
+from mock import patch
+
+from cpu_work_pool import CpuWorkPool, WORKERS_ENV_VAR, dumps
+from data_model import HeavenlyCloudAngelDeploymentModel, L3HeavenlyCloudShell
+from driver_request_index import IndexedDriverRequestParser
+from tests.test_driver_request_index import REQUEST
+
+
+class TestCpuWorkPool(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # every input is offloaded, so the worker process path is the one tested
+        cls.pool = CpuWorkPool(processes=1, min_offload_request_bytes=0, min_offload_items=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.close()
+
+    def setUp(self):
+        self.parser = IndexedDriverRequestParser()
+        self.parser.add_deployment_model(HeavenlyCloudAngelDeploymentModel)
+
+    def test_parses_requests_in_a_worker(self):
+        offloaded = self.pool.offloaded
+
+        actions = self.pool.parse_request(self.parser, REQUEST)
+
+        self.assertEqual(self.pool.offloaded, offloaded + 1)
+        self.assertEqual([action.actionId for action in actions.of_type(ConnectSubnet)], ['c1', 'c2'])
+        self.assertEqual(actions.count(ConnectSubnet), 2)
+        deploy_action = actions.single(DeployApp)
+        self.assertIsInstance(deploy_action.actionParams.deployment.customModel, HeavenlyCloudAngelDeploymentModel)
+        self.assertEqual(deploy_action.actionParams.deployment.customModel.wing_count, '4')
+        self.assertEqual(dumps(actions.build_all()), dumps(self.parser.parse(REQUEST).build_all()))
+
+    def test_serializes_in_a_worker(self):
+        action_results = [ConnectToSubnetActionResult(actionId=str(i), interface='nic') for i in range(3)]
+
+        self.assertEqual(self.pool.driver_response_json(action_results),
+                         CpuWorkPool(processes=0).driver_response_json(action_results))
+        self.assertEqual(self.pool.dumps(action_results), dumps(action_results))
+
+    def test_objects_that_cannot_be_pickled_are_serialized_in_the_calling_thread(self):
+        offloaded = self.pool.offloaded
+        unpicklable = [{'value': 1, 'callback': lambda: None}]
+
+        self.assertEqual(self.pool.dumps(unpicklable), dumps(unpicklable))
+        self.assertEqual(self.pool.dumps([{'value': 1}]), '[{"value":1}]')
+        self.assertEqual(self.pool.offloaded, offloaded + 2)
+
+    def test_builds_autoload_details_in_a_worker(self):
+        resource = L3HeavenlyCloudShell('cloud')
+        resource.attributes['L3HeavenlyCloudShell.Region'] = 'heaven'
+        resource.add_sub_resource('1', L3HeavenlyCloudShell('child'))
+
+        details = self.pool.autoload_details(resource)
+
+        self.assertEqual([(r.name, r.relative_address) for r in details.resources], [('child', '1')])
+        self.assertEqual(dumps(details), dumps(resource.create_autoload_details()))
+
+    def test_disabled_pool_never_starts_workers(self):
+        pool = CpuWorkPool(processes=0, min_offload_request_bytes=0, min_offload_items=0)
+
+        pool.parse_request(self.parser, REQUEST)
+        pool.dumps([1, 2])
+
+        self.assertEqual(pool.offloaded, 0)
+        self.assertIsNone(pool._pool)
+
+    def test_worker_count_from_environment(self):
+        with patch.dict(os.environ, {WORKERS_ENV_VAR: '3'}):
+            self.assertEqual(CpuWorkPool().processes, 3)
+        with patch.dict(os.environ, {WORKERS_ENV_VAR: 'many'}):
+            self.assertFalse(CpuWorkPool().enabled)
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
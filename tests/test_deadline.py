@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for `Deadline` and the command timeouts
+"""
+
+import json
+import threading
+import time
+import unittest
+
+from mock import Mock
+
+from benchmarks import driver_harness, request_factory
+from cancellation import CancellationWatcher, DeadlineExceededException
+from deadline import Deadline, command_deadline
+from driver_runtime import driver_runtime
+from sdk.fake_heavenly_cloud import FakeHeavenlyCloud, LatencyDistribution, OperationProfile
+from sdk.heavenly_cloud_service import HeavenlyCloudService
+
+
+class TestCommandDeadline(unittest.TestCase):
+
+    def _context(self, **attributes):
+        return driver_harness.resource_context(attributes=driver_harness.cloud_provider_attributes(**attributes))
+
+    def test_command_timeout_and_overrides(self):
+        context = self._context(**{'Command Timeout': '900', 'Command Timeouts': 'Deploy=1800, GetVmDetails = 60'})
+
+        self.assertEqual(command_deadline('Deploy', context).seconds, 1800)
+        self.assertEqual(command_deadline('GetVmDetails', context).seconds, 60)
+        self.assertEqual(command_deadline('PowerOn', context).seconds, 900)
+
+    def test_commands_without_timeout(self):
+        self.assertIsNone(command_deadline('Deploy', self._context()))
+        self.assertIsNone(command_deadline('Deploy', self._context(**{'Command Timeout': '0'})))
+        self.assertIsNone(command_deadline('Deploy', self._context(**{'Command Timeout': '900',
+                                                                      'Command Timeouts': 'Deploy=0'})))
+
+    def test_remaining(self):
+        deadline = Deadline('Deploy', 0.05)
+
+        self.assertFalse(deadline.expired)
+        self.assertLessEqual(deadline.remaining(), 0.05)
+        time.sleep(0.06)
+        self.assertTrue(deadline.expired)
+        self.assertEqual(deadline.remaining(), 0)
+
+
+class TestDeadlineWatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.watcher = CancellationWatcher(poll_interval=0.01)
+        self.addCleanup(self.watcher.close)
+
+    def test_operation_gets_the_remaining_budget_as_timeout(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        start = time.time()
+        with self.assertRaises(DeadlineExceededException) as raised:
+            with self.watcher.scope(None, Deadline('PowerOn', 0.1)):
+                self.watcher('power_on', None, release.wait)
+
+        self.assertLess(time.time() - start, 1)
+        self.assertEqual(str(raised.exception), 'PowerOn timed out after 0.1 seconds')
+        stats = self.watcher.stats()
+        self.assertEqual(stats['expired_scopes'], 1)
+        self.assertEqual(stats['abandoned_operations'], 1)
+
+    def test_fails_fast_once_the_budget_is_spent(self):
+        called = []
+
+        with self.watcher.scope(Mock(is_cancelled=False), Deadline('Deploy', 0.01)):
+            time.sleep(0.02)
+            with self.assertRaises(DeadlineExceededException):
+                self.watcher.check()
+            with self.assertRaises(DeadlineExceededException):
+                self.watcher('power_on', None, lambda: called.append(True))
+
+        self.assertEqual(called, [])
+
+    def test_sleep_ends_at_the_deadline(self):
+        start = time.time()
+        with self.assertRaises(DeadlineExceededException):
+            with self.watcher.scope(None, Deadline('Deploy', 0.05)):
+                self.watcher.sleep(5)
+
+        self.assertLess(time.time() - start, 1)
+
+    def test_operations_within_the_budget(self):
+        with self.watcher.scope(None, Deadline('PowerOn', 10)):
+            self.assertEqual(self.watcher('power_on', None, lambda: 'powered on'), 'powered on')
+            self.watcher.sleep(0.01)
+        self.assertEqual(self.watcher.stats()['expired_scopes'], 0)
+
+
+class TestDriverDeadline(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = FakeHeavenlyCloud()
+        for operation_name in ('create_angel_instance', 'power_on'):
+            self.fake.operation_profiles[operation_name] = OperationProfile(latency=LatencyDistribution.constant(10))
+        HeavenlyCloudService.set_backend(self.fake)
+        self.addCleanup(HeavenlyCloudService.set_backend, None)
+        self.addCleanup(driver_runtime.shutdown)
+        self.driver = driver_harness.create_driver()
+        self.addCleanup(self.driver.cleanup)
+
+    def test_timed_out_deploy_returns_a_failed_result(self):
+        attributes = driver_harness.cloud_provider_attributes(**{'Command Timeout': '0.2'})
+
+        start = time.time()
+        with driver_harness.fake_cloudshell_session():
+            response = self.driver.Deploy(driver_harness.resource_context(attributes=attributes),
+                                          request_factory.deploy_request(1), driver_harness.cancellation_context())
+
+        self.assertLess(time.time() - start, 2)
+        deploy_result = json.loads(response)['driverResponse']['actionResults'][0]
+        self.assertFalse(deploy_result['success'])
+        self.assertEqual(deploy_result['errorMessage'], 'Deploy timed out after 0.2 seconds')
+        self.assertEqual(self.fake.instances, {})
+
+    def test_power_on_override(self):
+        instance, = self.fake.seed_instances(1)
+        attributes = driver_harness.cloud_provider_attributes(**{'Command Timeout': '900',
+                                                                 'Command Timeouts': 'PowerOn=0.2'})
+
+        start = time.time()
+        with self.assertRaises(DeadlineExceededException):
+            self.driver.PowerOn(driver_harness.remote_context(instance.name, instance.id, attributes=attributes), [])
+
+        self.assertLess(time.time() - start, 2)
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
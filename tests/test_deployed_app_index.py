@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for `DeployedAppIndex`
+"""
+
+import json
+import unittest
+
+from mock import Mock
+
+from benchmarks import driver_harness, request_factory
+from deployed_app_index import DeployedAppIndex, DeployedAppRecord, extract_deployed_app_fields
+from driver_runtime import driver_runtime
+from sdk.fake_heavenly_cloud import FakeHeavenlyCloud
+from sdk.heavenly_cloud_service import HeavenlyCloudService
+
+
+def deployed_app_json(uid, attributes):
+    return json.dumps({'name': 'app', 'address': '10.0.0.1', 'attributes': attributes,
+                       'vmdetails': {'id': 'details', 'uid': uid, 'vmCustomParams': []}})
+
+
+def remote_endpoint(fullname, address, uid, public_ip):
+    resource_ep = Mock(fullname=fullname, address=address)
+    resource_ep.app_context.deployed_app_json = deployed_app_json(uid, [{'name': 'Public IP', 'value': public_ip}])
+    return resource_ep
+
+
+class TestExtractDeployedAppFields(unittest.TestCase):
+
+    def test_extracts_uid_and_public_ip(self):
+        app_json = deployed_app_json('vm-1', [{'name': 'User', 'value': 'admin'},
+                                              {'name': 'Public IP', 'value': '8.8.8.8'}])
+
+        self.assertEqual(extract_deployed_app_fields(app_json), ('vm-1', '8.8.8.8'))
+
+    def test_public_ip_is_optional(self):
+        self.assertEqual(extract_deployed_app_fields(deployed_app_json('vm-1', [])), ('vm-1', None))
+
+    def test_unescapes_values(self):
+        self.assertEqual(extract_deployed_app_fields(deployed_app_json(u'vm-é"1', []))[0], u'vm-é"1')
+
+    def test_falls_back_to_full_parse_when_ambiguous(self):
+        app_json = deployed_app_json('vm-1', [{'name': 'Public IP', 'value': '8.8.8.8', 'uid': 'not the vm'}])
+
+        self.assertEqual(extract_deployed_app_fields(app_json), ('vm-1', '8.8.8.8'))
+
+
+class TestDeployedAppIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = DeployedAppIndex(':memory:')
+
+    def test_put_and_lookups(self):
+        record = DeployedAppRecord('app', 'vm-1', '10.0.0.1', '8.8.8.8', 'reservation', 'heaven')
+        self.index.put(record)
+
+        self.assertEqual(self.index.get('app'), record)
+        self.assertEqual(self.index.find_by_vm_uid('vm-1'), record)
+        self.assertEqual(self.index.for_reservation('reservation'), [record])
+
+        self.index.remove('app')
+        self.assertIsNone(self.index.get('app'))
+
+    def test_record_of_a_remote_endpoint(self):
+        record = DeployedAppRecord.from_remote_endpoint(remote_endpoint('app', '10.0.0.1', 'vm-1', '8.8.8.8'),
+                                                        'reservation', 'heaven')
+
+        self.assertEqual(record, DeployedAppRecord('app', 'vm-1', '10.0.0.1', '8.8.8.8', 'reservation', 'heaven'))
+
+
+class TestDriverDeployedAppIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = FakeHeavenlyCloud()
+        HeavenlyCloudService.set_backend(self.fake)
+        self.addCleanup(HeavenlyCloudService.set_backend, None)
+        self.addCleanup(driver_runtime.shutdown)
+        self.driver = driver_harness.create_driver()
+        self.addCleanup(self.driver.cleanup)
+
+    def test_deploy_indexes_the_addresses_of_the_created_instance(self):
+        with driver_harness.fake_cloudshell_session():
+            response = self.driver.Deploy(driver_harness.resource_context(), request_factory.deploy_request(1),
+                                          driver_harness.cancellation_context())
+
+        deploy_result = json.loads(response)['driverResponse']['actionResults'][0]
+        instance = self.fake.instances[deploy_result['vmUuid']]
+        record = self.driver.runtime.deployed_app_index.get(deploy_result['vmName'])
+        self.assertEqual((record.vm_uid, record.private_ip, record.public_ip),
+                         (instance.id, instance.private_ip, instance.public_ip))
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Smoke tests for the driver benchmark suite, so the scenarios keep running against the current driver
+"""
+
+import unittest
+
+from benchmarks import bench_driver
+
+
+class TestDriverBenchmark(unittest.TestCase):
+
+    def test_every_scenario_runs_without_errors(self):
+        small_scenarios = [scenario for scenario in bench_driver.SCENARIOS
+                           if not scenario.name.startswith(('get_vm_details_1000', 'prepare_sandbox_infra_1000'))]
+
+        results = bench_driver.run(small_scenarios, iterations=2)
+
+        self.assertEqual([result.name for result in results], [scenario.name for scenario in small_scenarios])
+        for result in results:
+            self.assertEqual(result.errors, 0, result.name + ' failed')
+            self.assertEqual(result.count, 2)
+
+    def test_compare_flags_regressions(self):
+        result = bench_driver.ScenarioResult('deploy_angel', [0.010, 0.011, 0.012], 0.033, 0)
+        baseline = {'commit': 'abc', 'scenarios': {'deploy_angel': {'p50_ms': 5.0, 'p90_ms': 6.0}}}
+
+        comparison = bench_driver.compare([result], baseline)
+
+        self.assertEqual([(compared.name, regressed) for compared, _, regressed in comparison],
+                         [('deploy_angel', True)])
+
+    def test_percentile(self):
+        values = range(1, 101)
+
+        self.assertEqual(bench_driver.percentile(values, 50), 50)
+        self.assertEqual(bench_driver.percentile(values, 99), 99)
+        self.assertEqual(bench_driver.percentile([], 50), 0)
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for `IndexedDriverRequestParser`
+"""
+
+import json
+import unittest
+
+from cloudshell.cp.core import DriverRequestParser
+from cloudshell.cp.core.models import DeployApp, ConnectSubnet, PrepareSubnet
+
+from data_model import HeavenlyCloudAngelDeploymentModel
+from driver_request_index import IndexedDriverRequestParser
+
+REQUEST = json.dumps({'driverRequest': {'actions': [
+    {'type': 'connectSubnet', 'actionId': 'c1',
+     'actionParams': {'type': 'connectToSubnetParams', 'subnetId': 's1', 'vnicName': '1'}},
+    {'type': 'deployApp', 'actionId': 'd1',
+     'actionParams': {'type': 'deployAppParams', 'appName': 'app',
+                      'deployment': {'type': 'deployAppDeploymentInfo',
+                                     'deploymentPath': 'L3HeavenlyCloudShell.HeavenlyCloudAngelDeployment',
+                                     'attributes': [{'attributeName': 'L3HeavenlyCloudShell.'
+                                                                      'HeavenlyCloudAngelDeployment.wing_count',
+                                                     'attributeValue': '4'}]},
+                      'appResource': {'type': 'appResourceInfo',
+                                      'attributes': [{'attributeName': 'User', 'attributeValue': 'admin'}]}}},
+    {'type': 'connectSubnet', 'actionId': 'c2',
+     'actionParams': {'type': 'connectToSubnetParams', 'subnetId': 's2', 'vnicName': ''}}]}})
+
+
+class TestIndexedDriverRequestParser(unittest.TestCase):
+
+    def setUp(self):
+        self.parser = IndexedDriverRequestParser()
+        self.parser.add_deployment_model(HeavenlyCloudAngelDeploymentModel)
+
+    def test_indexes_actions_by_type_in_request_order(self):
+        actions = self.parser.parse(REQUEST)
+
+        self.assertEqual([a.actionId for a in actions.of_type(ConnectSubnet)], ['c1', 'c2'])
+        self.assertEqual([a.actionParams.subnetId for a in actions.of_type(ConnectSubnet)], ['s1', 's2'])
+        self.assertEqual(actions.count(ConnectSubnet), 2)
+        self.assertEqual(actions.of_type(PrepareSubnet), [])
+
+    def test_builds_same_actions_as_driver_request_parser(self):
+        original_parser = DriverRequestParser()
+        original_parser.add_deployment_model(HeavenlyCloudAngelDeploymentModel)
+        original = [a for a in original_parser.convert_driver_request_to_actions(REQUEST) if isinstance(a, DeployApp)]
+
+        deploy_action = self.parser.parse(REQUEST).single(DeployApp)
+
+        self.assertEqual(deploy_action.actionParams.appResource.attributes, {'User': 'admin'})
+        self.assertEqual(deploy_action.actionParams.deployment.customModel.wing_count, '4')
+        self.assertEqual(deploy_action.actionParams.deployment.customModel.__dict__,
+                         original[0].actionParams.deployment.customModel.__dict__)
+
+    def test_builds_actions_once_and_only_when_accessed(self):
+        actions = self.parser.parse(REQUEST)
+        self.assertEqual(actions._actions_by_type, {})
+
+        self.assertIs(actions.single(DeployApp), actions.single(DeployApp))
+        self.assertEqual(actions._actions_by_type.keys(), ['DeployApp'])
+
+    def test_single_raises_when_action_is_missing(self):
+        actions = self.parser.parse(json.dumps({'driverRequest': {'actions': []}}))
+
+        self.assertRaises(ValueError, actions.single, DeployApp)
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
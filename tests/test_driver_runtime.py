@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for `DriverRuntime`
+"""
+
+import time
+import unittest
+
+from mock import Mock, call, patch
+
+from driver import L3HeavenlyCloudShellDriver
+from driver_runtime import DriverRuntime, driver_runtime
+
+
+class TestDriverRuntime(unittest.TestCase):
+
+    def setUp(self):
+        service_patch = patch('sdk.heavenly_cloud_service.HeavenlyCloudService')
+        self.service = service_patch.start()
+        self.addCleanup(service_patch.stop)
+
+    def _runtime(self, linger):
+        runtime = DriverRuntime(linger)
+        for component in ('deployed_app_index', 'vm_details_cache', 'cancellation_watcher', 'cpu_work_pool'):
+            setattr(runtime, component, Mock())
+        return runtime
+
+    def test_warms_up_once_for_all_drivers(self):
+        runtime = self._runtime(linger=60)
+
+        runtime.acquire()
+        runtime.acquire()
+        runtime.release()
+
+        self.assertTrue(runtime.warm)
+        self.assertEqual(runtime.warmups, 1)
+        self.assertEqual(self.service.add_interceptor.call_args_list,
+                         [call(runtime.request_scheduler), call(runtime.cancellation_watcher)])
+        runtime.deployed_app_index.open.assert_called_once_with()
+        runtime.cpu_work_pool.start.assert_called_once_with()
+
+    def test_shuts_down_after_the_last_release(self):
+        runtime = self._runtime(linger=0)
+
+        runtime.acquire()
+        runtime.release()
+
+        self.assertFalse(runtime.warm)
+        self.assertEqual(self.service.remove_interceptor.call_args_list,
+                         [call(runtime.request_scheduler), call(runtime.cancellation_watcher)])
+        runtime.cancellation_watcher.close.assert_called_once_with()
+        runtime.cpu_work_pool.close.assert_called_once_with()
+        runtime.deployed_app_index.close.assert_called_once_with()
+        runtime.vm_details_cache.clear.assert_called_once_with()
+
+    def test_stays_warm_while_lingering(self):
+        runtime = self._runtime(linger=0.05)
+
+        runtime.acquire()
+        runtime.release()
+        # a driver recycled within the linger time finds the runtime warm
+        runtime.acquire()
+        time.sleep(0.1)
+        self.assertTrue(runtime.warm)
+
+        runtime.release()
+        time.sleep(0.1)
+        self.assertFalse(runtime.warm)
+        self.assertEqual(runtime.stats()['shutdowns'], 1)
+
+        runtime.acquire()
+        self.assertEqual((runtime.warm, runtime.warmups), (True, 2))
+        runtime.shutdown()
+
+    def test_drivers_share_the_process_runtime(self):
+        first = L3HeavenlyCloudShellDriver()
+        second = L3HeavenlyCloudShellDriver()
+
+        self.assertIs(first.runtime, driver_runtime)
+        self.assertIs(first.runtime.request_parser, second.runtime.request_parser)
+        self.assertIn('driver', driver_runtime.stats()['import_seconds'])
+
+    def test_driver_releases_the_runtime_it_acquired(self):
+        driver = L3HeavenlyCloudShellDriver()
+        driver.runtime = Mock()
+
+        driver.cleanup()
+        driver.initialize(Mock())
+        driver.initialize(Mock())
+        driver.cleanup()
+        driver.cleanup()
+
+        driver.runtime.acquire.assert_called_once_with()
+        driver.runtime.release.assert_called_once_with()
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
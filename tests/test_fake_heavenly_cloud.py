@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for `FakeHeavenlyCloud`
+"""
+
+import os
+import time
+import unittest
+
+from mock import Mock, patch
+
+from sdk.fake_heavenly_cloud import FakeHeavenlyCloud, OperationProfile, LatencyDistribution, POWER_STATE_STOPPED
+from sdk.heavenly_cloud_service import HeavenlyCloudService, HeavenlyCloudError, ThrottlingError, \
+    InstanceNotFoundError
+
+
+class TestFakeHeavenlyCloud(unittest.TestCase):
+
+    def setUp(self):
+        self.cloud_provider_resource = Mock()
+        self.cloud_provider_resource.name = 'heaven'
+        self.fake = FakeHeavenlyCloud(seed=1)
+        HeavenlyCloudService.set_backend(self.fake)
+
+    def tearDown(self):
+        HeavenlyCloudService.set_backend(None)
+
+    def test_keeps_instance_state(self):
+        instance = HeavenlyCloudService.create_man_instance('user', 'pass', self.cloud_provider_resource, 'man',
+                                                            180, 80, 'small', 'centos', {'default_subnet': 0})
+
+        HeavenlyCloudService.power_off(self.cloud_provider_resource, instance.id)
+        self.assertEqual(self.fake.instances[instance.id].power_state, POWER_STATE_STOPPED)
+
+        fetched = HeavenlyCloudService.get_instance_full(self.cloud_provider_resource, 'man', instance.id)
+        self.assertEqual((fetched.private_ip, fetched.public_ip), (instance.private_ip, instance.public_ip))
+
+        HeavenlyCloudService.delete_instance(self.cloud_provider_resource, instance.id)
+        self.assertRaises(InstanceNotFoundError, HeavenlyCloudService.get_instance,
+                          self.cloud_provider_resource, 'man', instance.id, None)
+
+    def test_keeps_subnets_and_keys(self):
+        subnet_id = HeavenlyCloudService.prepare_subnet(self.cloud_provider_resource, '10.0.1.0/24', True, {})
+
+        self.assertEqual(self.fake.subnets[subnet_id]['cidr'], '10.0.1.0/24')
+        self.assertEqual(HeavenlyCloudService.get_or_create_ssh_key(self.cloud_provider_resource),
+                         HeavenlyCloudService.get_or_create_ssh_key(self.cloud_provider_resource))
+
+    def test_injects_errors(self):
+        self.fake.operation_profiles['power_on'] = OperationProfile(error_rate=1.0)
+        instance = self.fake.seed_instances(1)[0]
+
+        self.assertRaises(HeavenlyCloudError, HeavenlyCloudService.power_on, self.cloud_provider_resource,
+                          instance.id)
+
+    def test_rate_limits(self):
+        self.fake.operation_profiles['get_prefered_cloud_color'] = OperationProfile(rate_limit=1, burst=2)
+
+        HeavenlyCloudService.get_prefered_cloud_color()
+        HeavenlyCloudService.get_prefered_cloud_color()
+        self.assertRaises(ThrottlingError, HeavenlyCloudService.get_prefered_cloud_color)
+
+    def test_latency(self):
+        self.fake.operation_profiles['can_connect'] = OperationProfile(latency=LatencyDistribution.constant(0.05))
+
+        start = time.time()
+        HeavenlyCloudService.can_connect('user', 'pass', 'address')
+
+        self.assertGreaterEqual(time.time() - start, 0.05)
+
+    def test_from_config(self):
+        fake = FakeHeavenlyCloud.from_config({
+            'seed': 3, 'time_scale': 0.5,
+            'default': {'latency': {'distribution': 'lognormal', 'median': 0.01, 'sigma': 0.2}},
+            'operations': {'power_on': {'latency': {'distribution': 'uniform', 'low': 1, 'high': 2},
+                                        'error_rate': 0.5, 'rate_limit': 10}}})
+
+        self.assertEqual(fake.time_scale, 0.5)
+        self.assertEqual(fake.operation_profiles['power_on'].error_rate, 0.5)
+        self.assertEqual(fake.operation_profiles['power_on'].latency.description, 'uniform(1, 2)')
+        self.assertEqual(fake.default_profile.latency.description, 'lognormal(0.01, 0.2)')
+
+    def test_selected_from_environment(self):
+        HeavenlyCloudService.set_backend(None)
+
+        with patch.dict(os.environ, {'HEAVENLY_CLOUD_BACKEND': 'fake'}):
+            self.assertIsInstance(HeavenlyCloudService.get_backend(), FakeHeavenlyCloud)
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for `ImageCatalog`
+"""
+
+import time
+import unittest
+
+from mock import Mock, patch
+
+from image_catalog import ImageCatalog, UnknownImageError, image_ids
+from sdk.fake_heavenly_cloud import FakeHeavenlyCloud, LatencyDistribution, OperationProfile
+from sdk.heavenly_cloud_service import HeavenlyCloudService
+
+
+def cloud_provider_resource(region='narnia'):
+    resource = Mock(region=region)
+    resource.name = 'heaven'
+    return resource
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.005)
+    return condition()
+
+
+class TestImageCatalog(unittest.TestCase):
+
+    def setUp(self):
+        self.fake_cloud = FakeHeavenlyCloud(images=['centos', 'ubuntu'])
+        HeavenlyCloudService.set_backend(self.fake_cloud)
+        self.addCleanup(HeavenlyCloudService.set_backend, None)
+        self.catalog = ImageCatalog(ttl=60)
+        self.addCleanup(self.catalog.clear)
+
+    def test_lists_the_images_of_a_region_once_per_ttl(self):
+        self.catalog.validate(cloud_provider_resource(), 'centos')
+        self.catalog.validate(cloud_provider_resource(), 'ubuntu')
+        self.catalog.validate(cloud_provider_resource('archenland'), 'centos')
+        self.assertEqual(self.fake_cloud.calls['list_images'], 2)
+
+        with patch('image_catalog.time.time', return_value=time.time() + 61):
+            self.catalog.validate(cloud_provider_resource(), 'centos')
+        self.assertEqual(self.fake_cloud.calls['list_images'], 3)
+
+    def test_rejects_unknown_images(self):
+        with self.assertRaises(UnknownImageError) as raised:
+            self.catalog.validate(cloud_provider_resource(), 'windows')
+
+        self.assertIn('available images: centos, ubuntu', str(raised.exception))
+        self.assertEqual(self.catalog.stats()['rejected'], 1)
+
+    def test_looks_up_images_added_since_the_listing(self):
+        self.catalog.validate(cloud_provider_resource(), 'centos')
+        self.fake_cloud.images.append('windows')
+
+        self.catalog.validate(cloud_provider_resource(), 'windows')
+
+        self.assertEqual(self.fake_cloud.calls['list_images'], 2)
+
+    def test_does_not_validate_while_the_images_cannot_be_listed(self):
+        self.fake_cloud.operation_profiles['list_images'] = OperationProfile(error_rate=1.0)
+
+        self.catalog.validate(cloud_provider_resource(), 'windows')
+
+        self.assertEqual(self.catalog.stats()['refresh_errors'], 1)
+        self.assertIsNone(self.catalog.images(cloud_provider_resource()))
+
+    def test_prefetch_stages_images_in_the_background(self):
+        resource = cloud_provider_resource()
+        self.fake_cloud.operation_profiles['stage_image'] = OperationProfile(
+            latency=LatencyDistribution.constant(0.05))
+
+        start = time.time()
+        self.catalog.prefetch(resource, image_ids(' centos, windows,,ubuntu'))
+        self.assertLess(time.time() - start, 0.05)
+
+        self.assertTrue(wait_for(lambda: self.catalog.stats()['staged'] == 2))
+        self.assertEqual(self.fake_cloud.staged_images, {('narnia', 'centos'), ('narnia', 'ubuntu')})
+
+        # the first deploy of a staged image does not wait for the copy
+        start = time.time()
+        self.fake_cloud.create_angel_instance('user', 'pass', resource, 'angel', 2, 10, 'small', 'centos', {})
+        self.assertLess(time.time() - start, 0.05)
+
+        self.catalog.prefetch(resource, ['centos'])
+        self.assertTrue(wait_for(lambda: self.fake_cloud.calls['list_images'] == 1))
+        self.assertEqual(self.fake_cloud.calls['stage_image'], 2)
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
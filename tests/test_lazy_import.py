@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for `LazyImport`
+"""
+
+import os
+import subprocess
+import sys
+import unittest
+
+from lazy_import import lazy_import
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+
+
+class TestLazyImport(unittest.TestCase):
+
+    def test_imports_on_first_use(self):
+        OrderedDict = lazy_import('collections', 'OrderedDict')
+
+        self.assertEqual(OrderedDict([('a', 1)]).keys(), ['a'])
+        self.assertEqual(OrderedDict.__name__, 'OrderedDict')
+        self.assertIs(OrderedDict.resolve(), sys.modules['collections'].OrderedDict)
+
+    def test_module_and_several_attributes(self):
+        path = lazy_import('os.path')
+        join, basename = lazy_import('os.path', 'join', 'basename')
+
+        self.assertEqual(path.join('a', 'b'), join('a', 'b'))
+        self.assertEqual(basename('/a/b'), 'b')
+        self.assertEqual(repr(join), '<lazy os.path.join>')
+
+    def test_missing_attribute_fails_on_use(self):
+        missing = lazy_import('os.path', 'missing')
+
+        self.assertRaises(AttributeError, missing)
+
+    def test_importing_the_driver_defers_command_dependencies(self):
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join([SRC_DIR] + sys.path)
+        loaded = subprocess.check_output(
+            [sys.executable, '-c', 'import sys, driver; driver.L3HeavenlyCloudShellDriver(); '
+                                   'sys.stdout.write(" ".join(sys.modules))'], env=env, cwd=SRC_DIR).split()
+
+        for module_name in ('cloudshell.api.cloudshell_api', 'cloudshell.cp.core.models', 'data_model',
+                            'heavenly_cloud_service_wrapper', 'sdk.heavenly_cloud_service', 'sqlite3'):
+            self.assertNotIn(module_name, loaded)
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for `NetworkInterfacePlan`
+"""
+
+import unittest
+
+from cloudshell.cp.core.models import ConnectSubnet, ConnectToSubnetParams
+
+from network_interface_plan import NetworkInterfacePlan
+
+
+def connect_subnet_action(subnet_id, vnic_name=''):
+    action = ConnectSubnet()
+    action.actionId = 'connect_' + subnet_id
+    action.actionParams = ConnectToSubnetParams()
+    action.actionParams.subnetId = subnet_id
+    action.actionParams.vnicName = vnic_name
+    return action
+
+
+class TestNetworkInterfacePlan(unittest.TestCase):
+
+    def test_single_subnet_mode(self):
+        plan = NetworkInterfacePlan([])
+
+        self.assertEqual(plan.network_data, {'default_subnet': 0})
+        self.assertEqual(plan.connect_subnet_results(), [])
+
+    def test_maps_subnets_in_request_order(self):
+        plan = NetworkInterfacePlan([connect_subnet_action('a'), connect_subnet_action('b')])
+
+        self.assertEqual(plan.network_data, {'a': 0, 'b': 1})
+
+    def test_honors_requested_vnics(self):
+        plan = NetworkInterfacePlan([connect_subnet_action('a'), connect_subnet_action('b', '0'),
+                                     connect_subnet_action('c', '3'), connect_subnet_action('d')])
+
+        self.assertEqual(plan.network_data, {'a': 1, 'b': 0, 'c': 3, 'd': 2})
+
+    def test_connect_subnet_results(self):
+        plan = NetworkInterfacePlan([connect_subnet_action('a', '1'), connect_subnet_action('b')])
+
+        results = plan.connect_subnet_results()
+
+        self.assertEqual([(r.actionId, r.interface, r.type) for r in results],
+                         [('connect_a', 1, 'ConnectToSubnet'), ('connect_b', 0, 'ConnectToSubnet')])
+
+    def test_conflicting_vnic_requests(self):
+        self.assertRaises(ValueError, NetworkInterfacePlan,
+                          [connect_subnet_action('a', '1'), connect_subnet_action('b', '1')])
+
+    def test_subnet_connected_twice(self):
+        self.assertRaises(ValueError, NetworkInterfacePlan, [connect_subnet_action('a'), connect_subnet_action('a')])
+
+    def test_vnic_names_that_are_not_device_indexes(self):
+        plan = NetworkInterfacePlan([connect_subnet_action('a', 'eth0'), connect_subnet_action('b', '0'),
+                                     connect_subnet_action('c', '-1')])
+
+        self.assertEqual(plan.network_data, {'a': 1, 'b': 0, 'c': 2})
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
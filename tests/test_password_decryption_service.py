@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for `PasswordDecryptionService`
+"""
+
+import threading
+import time
+import unittest
+
+from mock import Mock
+
+from password_decryption_service import PasswordDecryptionService
+
+
+class TestPasswordDecryptionService(unittest.TestCase):
+
+    def setUp(self):
+        self.service = PasswordDecryptionService()
+        self.cloudshell_session = Mock()
+        self.cloudshell_session.DecryptPassword.side_effect = lambda encrypted: Mock(Value='plain_' + encrypted)
+
+    def test_memoizes_inside_reservation_scope(self):
+        with self.service.reservation_scope('res1'):
+            self.assertEqual(self.service.decrypt(self.cloudshell_session, 'res1', 'abc'), 'plain_abc')
+            self.assertEqual(self.service.decrypt(self.cloudshell_session, 'res1', 'abc'), 'plain_abc')
+            self.assertEqual(self.service.decrypt(self.cloudshell_session, 'res1', 'xyz'), 'plain_xyz')
+
+        self.assertEqual(self.cloudshell_session.DecryptPassword.call_count, 2)
+
+    def test_does_not_cache_outside_reservation_scope(self):
+        self.service.decrypt(self.cloudshell_session, 'res1', 'abc')
+        self.service.decrypt(self.cloudshell_session, 'res1', 'abc')
+
+        self.assertEqual(self.cloudshell_session.DecryptPassword.call_count, 2)
+
+    def test_wipes_passwords_when_last_command_of_reservation_ends(self):
+        with self.service.reservation_scope('res1'):
+            with self.service.reservation_scope('res1'):
+                self.service.decrypt(self.cloudshell_session, 'res1', 'abc')
+            # another command of the reservation is still running
+            self.service.decrypt(self.cloudshell_session, 'res1', 'abc')
+            self.assertEqual(self.cloudshell_session.DecryptPassword.call_count, 1)
+
+        self.assertEqual(self.service._reservations, {})
+
+        with self.service.reservation_scope('res1'):
+            self.service.decrypt(self.cloudshell_session, 'res1', 'abc')
+
+        self.assertEqual(self.cloudshell_session.DecryptPassword.call_count, 2)
+
+    def test_collapses_concurrent_identical_requests(self):
+        def slow_decrypt(encrypted):
+            time.sleep(0.1)
+            return Mock(Value='plain_' + encrypted)
+
+        self.cloudshell_session.DecryptPassword.side_effect = slow_decrypt
+        results = []
+
+        def decrypt():
+            results.append(self.service.decrypt(self.cloudshell_session, 'res1', 'abc'))
+
+        with self.service.reservation_scope('res1'):
+            threads = [threading.Thread(target=decrypt) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(results, ['plain_abc'] * 8)
+        self.assertEqual(self.cloudshell_session.DecryptPassword.call_count, 1)
+
+    def test_waiters_retry_when_shared_call_fails(self):
+        calls = []
+
+        def flaky_decrypt(encrypted):
+            calls.append(encrypted)
+            if len(calls) == 1:
+                time.sleep(0.1)
+                raise Exception('CloudShell API error')
+            return Mock(Value='plain_' + encrypted)
+
+        self.cloudshell_session.DecryptPassword.side_effect = flaky_decrypt
+        results = []
+        errors = []
+
+        def decrypt():
+            try:
+                results.append(self.service.decrypt(self.cloudshell_session, 'res1', 'abc'))
+            except Exception as e:
+                errors.append(e)
+
+        with self.service.reservation_scope('res1'):
+            owner = threading.Thread(target=decrypt)
+            owner.start()
+            time.sleep(0.02)
+            waiter = threading.Thread(target=decrypt)
+            waiter.start()
+            owner.join()
+            waiter.join()
+
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(results, ['plain_abc'])
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for `RequestScheduler`
+"""
+
+import threading
+import time
+import unittest
+
+from mock import Mock, patch
+
+from cancellation import DeadlineExceededException, OperationCancelledException, cancellation_watcher
+from deadline import Deadline
+from request_scheduler import RequestScheduler
+from sdk.fake_heavenly_cloud import FakeHeavenlyCloud, OperationProfile
+from sdk.heavenly_cloud_service import HeavenlyCloudService, ThrottlingError
+
+
+def cloud_provider_resource(rate='', burst=''):
+    resource = Mock(api_rate_limit=rate, api_burst=burst)
+    resource.name = 'heaven'
+    return resource
+
+
+class TestRequestScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.scheduler = RequestScheduler(backoff_base=0.001)
+
+    def test_limits_the_rate(self):
+        resource = cloud_provider_resource(rate='100', burst='1')
+
+        start = time.time()
+        for _ in range(6):
+            self.scheduler('power_on', resource, lambda: None)
+
+        self.assertGreaterEqual(time.time() - start, 0.045)
+        self.assertEqual(self.scheduler.metrics()['heaven']['granted'], 6)
+
+    def test_grants_interactive_operations_first(self):
+        resource = cloud_provider_resource(rate='20', burst='1')
+        order = []
+        self.scheduler('power_on', resource, lambda: None)  # empty the bucket
+
+        threads = [threading.Thread(target=self.scheduler, args=('power_on', resource, lambda: order.append('bulk')))
+                   for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.01)
+        interactive = threading.Thread(target=self.scheduler,
+                                       args=('get_instance', resource, lambda: order.append('interactive')))
+        interactive.start()
+        for thread in threads + [interactive]:
+            thread.join()
+
+        self.assertEqual(order[0], 'interactive')
+        self.assertGreaterEqual(self.scheduler.metrics()['heaven']['max_queue_depth'], 3)
+
+    @patch('request_scheduler.PRIORITY_AGING_SECONDS', 0.01)
+    def test_long_waiting_bulk_operations_are_not_starved(self):
+        resource = cloud_provider_resource(rate='20', burst='1')
+        order = []
+        self.scheduler('power_on', resource, lambda: None)  # empty the bucket
+
+        bulk = threading.Thread(target=self.scheduler, args=('power_on', resource, lambda: order.append('bulk')))
+        bulk.start()
+        time.sleep(0.03)
+        interactive = threading.Thread(target=self.scheduler,
+                                       args=('get_instance', resource, lambda: order.append('interactive')))
+        interactive.start()
+        for thread in (bulk, interactive):
+            thread.join()
+
+        self.assertEqual(order, ['bulk', 'interactive'])
+
+    def test_retried_operations_keep_their_place_in_line(self):
+        resource = cloud_provider_resource(rate='20', burst='1')
+        order = []
+        throttling = threading.Event()
+
+        def throttled_once():
+            if not throttling.is_set():
+                throttling.set()
+                time.sleep(0.02)
+                raise ThrottlingError()
+            order.append('retried')
+
+        retried = threading.Thread(target=self.scheduler, args=('power_on', resource, throttled_once))
+        retried.start()
+        throttling.wait()
+        later = threading.Thread(target=self.scheduler, args=('power_on', resource, lambda: order.append('later')))
+        later.start()
+        for thread in (retried, later):
+            thread.join()
+
+        self.assertEqual(order, ['retried', 'later'])
+
+    def test_cancelled_command_stops_waiting_for_its_turn(self):
+        resource = cloud_provider_resource(rate='0.1', burst='1')
+        self.scheduler('power_on', resource, lambda: None)  # empty the bucket
+        called = []
+        cancellation_context = Mock(is_cancelled=False)
+        threading.Timer(0.05, setattr, (cancellation_context, 'is_cancelled', True)).start()
+        self.addCleanup(cancellation_watcher.close)
+
+        start = time.time()
+        with self.assertRaises(OperationCancelledException):
+            with cancellation_watcher.scope(cancellation_context):
+                self.scheduler('power_on', resource, lambda: called.append(True))
+
+        self.assertLess(time.time() - start, 1)
+        self.assertEqual(called, [])
+        self.assertEqual(self.scheduler.metrics()['heaven']['queue_depth'], 0)
+
+    def test_command_past_its_deadline_stops_waiting_for_its_turn(self):
+        resource = cloud_provider_resource(rate='0.1', burst='1')
+        self.scheduler('power_on', resource, lambda: None)  # empty the bucket
+        called = []
+        self.addCleanup(cancellation_watcher.close)
+
+        start = time.time()
+        with self.assertRaises(DeadlineExceededException):
+            with cancellation_watcher.scope(None, Deadline('PowerOn', 0.1)):
+                self.scheduler('power_on', resource, lambda: called.append(True))
+
+        self.assertLess(time.time() - start, 1)
+        self.assertEqual(called, [])
+        self.assertEqual(self.scheduler.metrics()['heaven']['queue_depth'], 0)
+
+    def test_retries_throttled_operations(self):
+        operation = Mock(side_effect=[ThrottlingError(), ThrottlingError(), 'done'])
+
+        self.assertEqual(self.scheduler('power_on', cloud_provider_resource(), operation), 'done')
+        self.assertEqual(self.scheduler.retries, 2)
+        self.assertEqual(self.scheduler.metrics()['heaven']['throttled'], 2)
+
+    def test_gives_up_after_max_retries(self):
+        self.scheduler.max_retries = 1
+        operation = Mock(side_effect=ThrottlingError())
+
+        self.assertRaises(ThrottlingError, self.scheduler, 'power_on', cloud_provider_resource(), operation)
+        self.assertEqual(operation.call_count, 2)
+
+    def test_backoff_is_jittered_and_capped(self):
+        scheduler = RequestScheduler(backoff_base=1, backoff_max=4)
+
+        self.assertTrue(0.5 <= scheduler.backoff(0) <= 1)
+        self.assertTrue(2 <= scheduler.backoff(5) <= 4)
+
+    def test_intercepts_provider_operations(self):
+        fake = FakeHeavenlyCloud(seed=1)
+        fake.operation_profiles['power_on'] = OperationProfile(rate_limit=1000, burst=1)
+        instance = fake.seed_instances(1)[0]
+        HeavenlyCloudService.set_backend(fake)
+        HeavenlyCloudService.add_interceptor(self.scheduler)
+        try:
+            for _ in range(5):
+                HeavenlyCloudService.power_on(cloud_provider_resource(), instance.id)
+        finally:
+            HeavenlyCloudService.remove_interceptor(self.scheduler)
+            HeavenlyCloudService.set_backend(None)
+
+        self.assertEqual(self.scheduler.metrics()['heaven']['granted'], 5 + self.scheduler.retries)
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for `SandboxReconciler`
+"""
+
+import unittest
+
+from mock import Mock
+
+from deployed_app_index import DeployedAppIndex, DeployedAppRecord
+from sandbox_reconciler import SandboxReconciler, FULL, INCREMENTAL, LIVE_STATUS_ONLINE, LIVE_STATUS_OFFLINE, \
+    LIVE_STATUS_ERROR
+from sdk.fake_heavenly_cloud import FakeHeavenlyCloud
+from sdk.heavenly_cloud_service import HeavenlyCloudService, POWER_STATE_STOPPED
+from vm_details_cache import vm_details_cache
+
+
+def reserved_app(name, address, vm_uid, cloud_provider='heaven'):
+    return Mock(Name=name, FullAddress=address, VmDetails=Mock(UID=vm_uid, CloudProviderFullName=cloud_provider))
+
+
+class TestSandboxReconciler(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = FakeHeavenlyCloud(seed=1)
+        HeavenlyCloudService.set_backend(self.fake)
+
+        self.cloud_provider_resource = Mock()
+        self.cloud_provider_resource.name = 'heaven'
+        self.index = DeployedAppIndex(':memory:')
+        self.instances = self.fake.seed_instances(3)
+        self.cloudshell_session = Mock()
+        self.reserved_apps = [reserved_app(instance.name, instance.private_ip, instance.id)
+                              for instance in self.instances]
+        self.cloudshell_session.GetReservationDetails.return_value.ReservationDescription.Resources = \
+            self.reserved_apps
+        self.index.put_all([DeployedAppRecord(instance.name, instance.id, instance.private_ip, instance.public_ip,
+                                              'reservation', 'heaven', LIVE_STATUS_ONLINE)
+                            for instance in self.instances])
+        self.reconciler = SandboxReconciler(self.index)
+
+    def tearDown(self):
+        HeavenlyCloudService.set_backend(None)
+
+    def reconcile(self, mode):
+        return self.reconciler.reconcile(self.cloudshell_session, self.cloud_provider_resource, 'reservation', mode)
+
+    def test_pushes_nothing_without_drift(self):
+        report = self.reconcile(FULL)
+
+        self.assertEqual((report.checked, report.changed), (3, 0))
+        self.assertEqual([name for name, _, _ in self.cloudshell_session.method_calls], ['GetReservationDetails'])
+
+    def test_pushes_only_the_deltas(self):
+        drifted, stopped = self.instances[0], self.instances[1]
+        self.fake.change_instance(drifted.id, private_ip='192.168.9.9', public_ip='8.8.9.9')
+        self.fake.change_instance(stopped.id, power_state=POWER_STATE_STOPPED)
+
+        report = self.reconcile(FULL)
+
+        self.assertEqual(report.changed, 2)
+        self.cloudshell_session.UpdateResourceAddress.assert_called_once_with(drifted.name, '192.168.9.9')
+        self.cloudshell_session.SetAttributeValue.assert_called_once_with(drifted.name, 'Public IP', '8.8.9.9')
+        self.cloudshell_session.SetResourceLiveStatus.assert_called_once_with(stopped.name, LIVE_STATUS_OFFLINE,
+                                                                              'instance is stopped')
+        self.assertEqual(self.index.get(drifted.name).private_ip, '192.168.9.9')
+        self.assertEqual(self.index.get(stopped.name).live_status, LIVE_STATUS_OFFLINE)
+
+    def test_invalidates_the_vm_details_of_changed_apps(self):
+        drifted, unchanged = self.instances[0], self.instances[1]
+        self.addCleanup(vm_details_cache.clear)
+        for instance in (drifted, unchanged):
+            vm_details_cache.put('heaven', instance.id, Mock())
+        self.fake.change_instance(drifted.id, private_ip='192.168.9.9')
+
+        self.reconcile(FULL)
+
+        self.assertIsNone(vm_details_cache.get('heaven', drifted.id))
+        self.assertIsNotNone(vm_details_cache.get('heaven', unchanged.id))
+
+    def test_marks_deleted_instances_once(self):
+        del self.fake.instances[self.instances[2].id]
+
+        report = self.reconcile(FULL)
+        self.reconcile(FULL)
+
+        self.assertEqual(report.missing, [self.instances[2].name])
+        self.cloudshell_session.SetResourceLiveStatus.assert_called_once()
+        self.assertEqual(self.cloudshell_session.SetResourceLiveStatus.call_args[0][1], LIVE_STATUS_ERROR)
+
+    def test_incremental_checks_only_changed_instances(self):
+        self.reconcile(INCREMENTAL)
+        self.fake.change_instance(self.instances[0].id, power_state=POWER_STATE_STOPPED)
+
+        report = self.reconcile(INCREMENTAL)
+
+        self.assertEqual((report.checked, report.changed), (1, 1))
+
+    def test_indexes_apps_deployed_outside_of_this_host(self):
+        self.reconcile(INCREMENTAL)
+        other, = self.fake.seed_instances(1)
+        self.fake.change_instance(other.id, power_state=POWER_STATE_STOPPED)
+        self.reserved_apps.extend([reserved_app(other.name, other.private_ip, other.id),
+                                   reserved_app('other provider app', '10.0.0.1', 'vm', 'hell')])
+        self.cloudshell_session.GetResourceLiveStatus.return_value.liveStatusName = LIVE_STATUS_ONLINE
+
+        report = self.reconcile(INCREMENTAL)
+
+        self.assertEqual((report.indexed, report.checked), (1, 1))
+        self.assertIn('1 apps deployed outside of this host indexed', str(report))
+        self.cloudshell_session.GetResourceLiveStatus.assert_called_once_with(other.name)
+        self.assertEqual(self.index.get(other.name).live_status, LIVE_STATUS_OFFLINE)
+        self.assertIsNone(self.index.get('other provider app'))
+
+    def test_checks_apps_whose_address_changed_in_cloudshell(self):
+        self.reconcile(INCREMENTAL)
+        changed = self.instances[0]
+        self.reserved_apps[0].FullAddress = '10.9.9.9'
+
+        report = self.reconcile(INCREMENTAL)
+
+        self.assertEqual((report.indexed, report.checked, report.changed), (0, 1, 1))
+        self.cloudshell_session.UpdateResourceAddress.assert_called_once_with(changed.name, changed.private_ip)
+        self.assertEqual(self.index.get(changed.name).private_ip, changed.private_ip)
+
+    def test_first_reconciliation_pushes_only_what_changed(self):
+        self.index.put_all([DeployedAppRecord(instance.name, instance.id, instance.private_ip, instance.public_ip,
+                                              'reservation', 'heaven') for instance in self.instances])
+        self.cloudshell_session.GetResourceLiveStatus.return_value.liveStatusName = LIVE_STATUS_ONLINE
+
+        self.reconcile(FULL)
+        self.reconcile(FULL)
+
+        self.assertEqual(self.cloudshell_session.GetResourceLiveStatus.call_count, 3)
+        self.cloudshell_session.SetResourceLiveStatus.assert_not_called()
+
+    def test_forgets_apps_removed_from_the_reservation(self):
+        removed = self.reserved_apps.pop()
+
+        report = self.reconcile(FULL)
+
+        self.assertEqual(report.checked, 2)
+        self.assertIsNone(self.index.get(removed.Name))
+
+    def test_rejects_unknown_modes(self):
+        self.assertRaises(ValueError, self.reconcile, 'partial')
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
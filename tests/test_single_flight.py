@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for `SingleFlight`
+"""
+
+import threading
+import unittest
+
+from mock import Mock
+
+from driver import L3HeavenlyCloudShellDriver
+from heavenly_cloud_service_wrapper import HeavenlyCloudServiceWrapper, OperationCancelledException
+from single_flight import SingleFlight
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def setUp(self):
+        self.single_flight = SingleFlight()
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def _blocking(self, result):
+        def func():
+            self.started.set()
+            self.release.wait(5)
+            if isinstance(result, Exception):
+                raise result
+            return result
+        return func
+
+    def _join_flight(self, key, func, outcomes):
+        def call():
+            try:
+                outcomes.append(self.single_flight.do(key, func))
+            except Exception as e:
+                outcomes.append(e)
+
+        thread = threading.Thread(target=call)
+        thread.start()
+        return thread
+
+    def _wait_for_followers(self, count):
+        while self.single_flight.stats()['shared'] < count:
+            self.release.wait(0.001)
+
+    def test_concurrent_calls_share_one_execution(self):
+        func = Mock(side_effect=self._blocking('details'))
+        outcomes = []
+
+        threads = [self._join_flight('key', func, outcomes)]
+        self.started.wait(5)
+        threads += [self._join_flight('key', func, outcomes) for _ in range(3)]
+        self._wait_for_followers(3)
+        self.release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(outcomes, ['details'] * 4)
+        self.assertEqual(func.call_count, 1)
+        self.assertEqual(self.single_flight.stats(), {'executions': 1, 'shared': 3, 'in_flight': 0})
+
+    def test_exceptions_are_shared(self):
+        error = ValueError('provider is down')
+        outcomes = []
+
+        threads = [self._join_flight('key', self._blocking(error), outcomes)]
+        self.started.wait(5)
+        threads.append(self._join_flight('key', Mock(), outcomes))
+        self._wait_for_followers(1)
+        self.release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(outcomes, [error, error])
+
+    def test_different_keys_and_later_calls_run_again(self):
+        func = Mock(return_value='details')
+
+        self.single_flight.do('vm1', func)
+        self.single_flight.do('vm2', func)
+        self.single_flight.do('vm1', func)
+
+        self.assertEqual(func.call_count, 3)
+
+
+class TestDriverSingleFlight(unittest.TestCase):
+
+    def setUp(self):
+        self.driver = L3HeavenlyCloudShellDriver()
+
+    def test_cancelled_command_raises(self):
+        cancellation_context = Mock(is_cancelled=True)
+
+        self.assertRaises(OperationCancelledException, self.driver._single_flight, 'key', cancellation_context,
+                          Mock(side_effect=OperationCancelledException()))
+
+    def test_command_sharing_a_cancelled_execution_runs_on_its_own(self):
+        self.driver.runtime = Mock()
+        # what the shared execution returned after its command was cancelled
+        self.driver.runtime.single_flight.do.return_value = (None, OperationCancelledException(), True)
+        self.driver.runtime.cancellation_watcher.current.return_value = None
+        func = Mock(return_value='details')
+
+        self.assertEqual(self.driver._single_flight('key', Mock(is_cancelled=False), func), 'details')
+        self.assertRaises(OperationCancelledException, self.driver._single_flight, 'key', Mock(is_cancelled=True),
+                          func)
+        self.assertEqual(func.call_count, 1)
+
+    def test_command_past_its_deadline_does_not_run_again(self):
+        self.driver.runtime = Mock()
+        self.driver.runtime.single_flight.do.return_value = (None, OperationCancelledException(), True)
+        self.driver.runtime.cancellation_watcher.current.return_value = Mock(is_expired=True)
+        func = Mock(return_value='details')
+
+        self.assertRaises(OperationCancelledException, self.driver._single_flight, 'key', Mock(is_cancelled=False),
+                          func)
+        func.assert_not_called()
+
+    def test_vm_details_request_key_ignores_unrelated_fields(self):
+        def requests(extra):
+            deployed_app = {'name': 'vm1', 'address': '10.0.0.1', 'vmdetails': {'uid': 'uid1'}}
+            deployed_app.update(extra)
+            return {'items': [{'deployedAppJson': deployed_app}]}
+
+        self.assertEqual(HeavenlyCloudServiceWrapper.vm_details_request_key(requests({})),
+                         HeavenlyCloudServiceWrapper.vm_details_request_key(requests({'family': 'Generic'})))
+        self.assertNotEqual(HeavenlyCloudServiceWrapper.vm_details_request_key(requests({})),
+                            HeavenlyCloudServiceWrapper.vm_details_request_key(requests({'name': 'vm2'})))
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for `StreamingJsonWriter`
+"""
+
+import json
+import unittest
+
+from cloudshell.cp.core.models import VmDetailsData, VmDetailsProperty, VmDetailsNetworkInterface
+
+from heavenly_cloud_service_wrapper import HeavenlyCloudServiceWrapper
+from sdk.heavenly_cloud_service import HeavenlyCloudService
+from streaming_json_writer import StreamingJsonWriter
+
+
+def dumps(obj):
+    return json.dumps(obj, default=lambda o: o.__dict__, sort_keys=True, separators=(',', ':'))
+
+
+class Unregistered(object):
+    def __init__(self):
+        self.b = [1, 2.5, None]
+        self.a = {'z': True, 'y': False, 3: u'א'}
+
+
+class TestStreamingJsonWriter(unittest.TestCase):
+
+    def test_vm_details_output_is_identical_to_json_dumps(self):
+        vm_details = []
+        for i in range(20):
+            vm_instance = HeavenlyCloudService.get_instance(None, 'vm' + str(i), 'uid' + str(i), '10.0.0.' + str(i))
+            vm_details.append(VmDetailsData(
+                vmInstanceData=HeavenlyCloudServiceWrapper.extract_vm_instance_data(vm_instance),
+                vmNetworkData=HeavenlyCloudServiceWrapper.extract_vm_instance_network_data(vm_instance),
+                appName='vm' + str(i)))
+
+        self.assertEqual(StreamingJsonWriter.dumps_array(iter(vm_details)), dumps(vm_details))
+
+    def test_primitives_and_unregistered_classes(self):
+        items = [u'caf\xe9', 'caf\xc3\xa9', '"quoted"\n', 0, -7, 10 ** 20, 1.1, float('inf'), float('nan'), True,
+                 None, [], {}, (1, 2), Unregistered(), VmDetailsProperty(key=u'א', value=None, hidden=True)]
+
+        self.assertEqual(StreamingJsonWriter.dumps_array(items), dumps(items))
+
+    def test_instance_with_extra_attributes_falls_back_to_reflection(self):
+        network_interface = VmDetailsNetworkInterface(interfaceId=1)
+        network_interface.extra = 'value'
+
+        self.assertEqual(StreamingJsonWriter.dumps_array([network_interface]), dumps([network_interface]))
+
+    def test_empty_array(self):
+        self.assertEqual(StreamingJsonWriter.dumps_array([]), '[]')
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
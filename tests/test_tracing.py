@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for `Tracer`
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from mock import Mock, patch
+
+from benchmarks import driver_harness, request_factory
+from driver_runtime import driver_runtime
+from sdk.fake_heavenly_cloud import FakeHeavenlyCloud
+from sdk.heavenly_cloud_service import HeavenlyCloudService
+from tracing import Tracer, tracer
+
+
+def read_trace(path):
+    """
+    :return: the events of the trace file, parsed the way trace viewers do
+    :rtype: list[dict]
+    """
+    with open(path) as trace_file:
+        content = trace_file.read()
+    return json.loads(content.rstrip().rstrip(',') + ']')
+
+
+class TestTracer(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'trace.json')
+        self.tracer = Tracer(self.path)
+        self.addCleanup(self.tracer.close)
+
+    def test_nested_spans_inherit_the_reservation_and_action(self):
+        resource = Mock()
+        resource.name = 'heaven'
+
+        with self.tracer.span('Deploy', 'command', reservation_id='r1'):
+            self.tracer.annotate(action_id='a1')
+            with self.tracer.span('DecryptPassword'):
+                pass
+            self.tracer('create_angel_instance', resource, lambda: None)
+
+        events = dict((event['name'], event) for event in read_trace(self.path))
+        self.assertEqual(events['DecryptPassword']['args'], {'reservation_id': 'r1', 'action_id': 'a1'})
+        self.assertEqual(events['create_angel_instance']['cat'], 'sdk')
+        self.assertEqual(events['create_angel_instance']['args']['resource'], 'heaven')
+        self.assertEqual(events['create_angel_instance']['args']['action_id'], 'a1')
+        deploy = events['Deploy']
+        self.assertEqual((deploy['ph'], deploy['args']), ('X', {'reservation_id': 'r1', 'action_id': 'a1'}))
+        for name in ('DecryptPassword', 'create_angel_instance'):
+            self.assertGreaterEqual(events[name]['ts'], deploy['ts'])
+            self.assertLessEqual(events[name]['ts'] + events[name]['dur'], deploy['ts'] + deploy['dur'])
+
+    def test_threads_have_their_own_span_stack(self):
+        def other_command():
+            with self.tracer.span('PowerOn', 'command', reservation_id='r2'):
+                with self.tracer.span('power_on'):
+                    pass
+
+        with self.tracer.span('Deploy', 'command', reservation_id='r1'):
+            thread = threading.Thread(target=other_command)
+            thread.start()
+            thread.join()
+
+        events = dict((event['name'], event) for event in read_trace(self.path))
+        self.assertEqual(events['power_on']['args'], {'reservation_id': 'r2'})
+        self.assertNotEqual(events['power_on']['tid'], events['Deploy']['tid'])
+
+    def test_records_errors(self):
+        with self.assertRaises(ValueError):
+            with self.tracer.span('Deploy'):
+                raise ValueError('bad request')
+
+        self.assertEqual(read_trace(self.path)[0]['args'], {'error': 'ValueError'})
+
+    def test_appends_to_an_existing_trace(self):
+        with self.tracer.span('first'):
+            pass
+        self.tracer.close()
+        with Tracer(self.path).span('second'):
+            pass
+
+        self.assertEqual([event['name'] for event in read_trace(self.path)], ['first', 'second'])
+
+    def test_traces_the_provider_operations_outermost_while_tracing(self):
+        scheduler = Mock()
+        with patch.object(HeavenlyCloudService, 'interceptors', [scheduler]):
+            self.tracer.configure(self.path)
+            self.assertEqual(HeavenlyCloudService.interceptors, [self.tracer, scheduler])
+
+            self.tracer.configure(None)
+            self.assertEqual(HeavenlyCloudService.interceptors, [scheduler])
+
+    def test_disabled_tracer_records_nothing(self):
+        disabled = Tracer('')
+
+        with disabled.span('Deploy', reservation_id='r1') as span:
+            disabled.annotate(action_id='a1')
+        result = disabled('power_on', None, lambda: 'proceeded')
+
+        self.assertIsNone(span)
+        self.assertEqual(result, 'proceeded')
+        self.assertEqual(disabled.stats(), {'enabled': False, 'spans': 0, 'write_errors': 0})
+
+
+class TestDeployTrace(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'trace.json')
+        self.addCleanup(tracer.configure, tracer.path)
+        # outermost whatever interceptors the driver runtime added
+        tracer.configure(self.path)
+
+        HeavenlyCloudService.set_backend(FakeHeavenlyCloud())
+        self.addCleanup(HeavenlyCloudService.set_backend, None)
+
+    def test_deploy_spans_reach_the_provider_operations(self):
+        self.addCleanup(driver_runtime.shutdown)
+        driver = driver_harness.create_driver()
+        self.addCleanup(driver.cleanup)
+        with driver_harness.fake_cloudshell_session():
+            driver.Deploy(driver_harness.resource_context(reservation_id='r1'), request_factory.deploy_request(2),
+                          driver_harness.cancellation_context())
+        tracer.close()
+
+        events = [event for event in read_trace(self.path) if event['args'].get('reservation_id') == 'r1']
+        names = [event['name'] for event in events]
+        for name in ('Deploy', 'cloudshell_session_login', 'parse_request', 'DecryptPassword',
+                     'prepare_network_for_instance', 'create_angel_instance', 'driver_response_json'):
+            self.assertIn(name, names)
+        create_instance = events[names.index('create_angel_instance')]
+        self.assertEqual(create_instance['args']['resource'], driver_harness.CLOUD_PROVIDER_NAME)
+        self.assertTrue(create_instance['args']['action_id'])
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for `TrafficRecorder` and the replay of the traffic it records
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from cloudshell.shell.core.driver_context import ResourceCommandContext, ReservationContextDetails
+
+from benchmarks import driver_harness, replay_traffic, request_factory
+from driver_runtime import driver_runtime
+from sdk.fake_heavenly_cloud import FakeHeavenlyCloud
+from sdk.heavenly_cloud_service import HeavenlyCloudService
+from traffic_recorder import TrafficRecorder, decode, encode, read_records, traffic_recorder
+
+
+class TestTrafficRecorder(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def _recorder(self, file_name):
+        recorder = TrafficRecorder(os.path.join(self.directory, file_name))
+        self.addCleanup(recorder.close)
+        return recorder
+
+    def test_records_command_context_and_arguments(self):
+        recorder = self._recorder('traffic.jsonl')
+        context = driver_harness.resource_context(reservation_id='r1')
+
+        with recorder.record('Deploy', context, '{"driverRequest": {}}', None):
+            pass
+        recorder.close()
+
+        record, = read_records(recorder.path)
+        self.assertEqual(record['command'], 'Deploy')
+        self.assertEqual(record['args'], ['{"driverRequest": {}}', None])
+        self.assertIsNone(record['error'])
+        self.assertGreaterEqual(record['duration'], 0)
+        self.assertEqual(record['context']['__type__'], 'ResourceCommandContext')
+        self.assertEqual(record['context']['reservation']['reservation_id'], 'r1')
+
+    def test_does_not_record_secrets(self):
+        recorder = self._recorder('traffic.jsonl')
+
+        with recorder.record('get_inventory', driver_harness.autoload_context()):
+            pass
+        with recorder.record('Deploy', driver_harness.resource_context(), request_factory.deploy_request(2), None):
+            pass
+        recorder.close()
+
+        inventory, deploy = read_records(recorder.path)
+        self.assertEqual(inventory['context']['connectivity']['admin_auth_token'], '')
+        self.assertEqual(deploy['context']['resource']['attributes']['L3HeavenlyCloudShell.Password'], '')
+        self.assertNotIn('encrypted_password', deploy['args'][0])
+        actions = json.loads(deploy['args'][0])['driverRequest']['actions']
+        passwords = [attribute['attributeValue'] for action in actions if action['type'] == 'deployApp'
+                     for attribute in action['actionParams']['appResource']['attributes']
+                     if attribute['attributeName'] == 'Password']
+        self.assertEqual(passwords, [''])
+
+    def test_records_errors(self):
+        recorder = self._recorder('traffic.jsonl')
+
+        with self.assertRaises(ValueError):
+            with recorder.record('PowerOn', driver_harness.resource_context(), []):
+                raise ValueError('no such instance')
+        recorder.close()
+
+        self.assertEqual(read_records(recorder.path)[0]['error'], 'ValueError')
+
+    def test_gzip_traffic_file(self):
+        recorder = self._recorder('traffic.jsonl.gz')
+
+        for command_name in ('PowerOn', 'PowerOff'):
+            with recorder.record(command_name, driver_harness.resource_context(), []):
+                pass
+            # every close ends a gzip member, the reader reads them one after the other
+            recorder.close()
+
+        self.assertEqual([record['command'] for record in read_records(recorder.path)], ['PowerOn', 'PowerOff'])
+
+    def test_decode_creates_the_context_objects_again(self):
+        context = driver_harness.resource_context(reservation_id='r1')
+
+        decoded = decode(encode(context), {'ResourceCommandContext': ResourceCommandContext,
+                                           'ReservationContextDetails': ReservationContextDetails})
+
+        self.assertIsInstance(decoded, ResourceCommandContext)
+        self.assertEqual(decoded.reservation.reservation_id, 'r1')
+        # objects of classes decode does not know stay dicts, the secrets stay empty
+        self.assertEqual(decoded.resource['attributes'],
+                         dict(context.resource.attributes, **{'L3HeavenlyCloudShell.Password': ''}))
+
+    def test_disabled_recorder_records_nothing(self):
+        disabled = TrafficRecorder('')
+
+        with disabled.record('Deploy', driver_harness.resource_context()) as record:
+            pass
+
+        self.assertIsNone(record)
+        self.assertEqual(disabled.stats(), {'enabled': False, 'records': 0, 'write_errors': 0})
+
+
+class TestReplayTraffic(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'traffic.jsonl.gz')
+        self.addCleanup(traffic_recorder.configure, traffic_recorder.path)
+        traffic_recorder.configure(self.path)
+
+    def _record_traffic(self):
+        fake_cloud = FakeHeavenlyCloud()
+        HeavenlyCloudService.set_backend(fake_cloud)
+        self.addCleanup(HeavenlyCloudService.set_backend, None)
+        instance, = fake_cloud.seed_instances(1)
+
+        self.addCleanup(driver_runtime.shutdown)
+        driver = driver_harness.create_driver()
+        self.addCleanup(driver.cleanup)
+        with driver_harness.fake_cloudshell_session():
+            driver.Deploy(driver_harness.resource_context(), request_factory.deploy_request(2),
+                          driver_harness.cancellation_context())
+            driver.PowerOff(driver_harness.remote_context(instance.name, instance.id), [])
+            driver.GetVmDetails(driver_harness.resource_context(), driver_harness.vm_details_request([instance]),
+                                driver_harness.cancellation_context())
+        traffic_recorder.close()
+        return instance
+
+    def test_replays_recorded_commands(self):
+        instance = self._record_traffic()
+        records = read_records(self.path)
+
+        result = replay_traffic.replay(records, speed=0, concurrency=2)
+
+        self.assertEqual([(command.name, command.count, command.errors) for command in result.results],
+                         [('Deploy', 1, 0), ('GetVmDetails', 1, 0), ('PowerOff', 1, 0)])
+        self.assertEqual(sorted(result.recorded), ['Deploy', 'GetVmDetails', 'PowerOff'])
+        self.assertEqual([vm_id for vm_id, name, address in replay_traffic.recorded_instances(records[1])],
+                         [instance.id])
+        # the replay is not recorded again
+        self.assertEqual(len(read_records(self.path)), 3)
+
+    def test_replay_keeps_the_recorded_pace(self):
+        self._record_traffic()
+        records = read_records(self.path)
+        for index, record in enumerate(records):
+            record['ts'] = index * 0.2
+
+        start = time.time()
+        result = replay_traffic.replay(records, speed=2, concurrency=3)
+
+        # the last command is scheduled 0.4 recorded seconds after the first
+        self.assertGreaterEqual(time.time() - start, 0.2)
+        self.assertEqual(sum(command.count for command in result.results), 3)
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for `VmDetailsCache`
+"""
+
+import json
+import unittest
+
+from mock import Mock, patch
+
+from heavenly_cloud_service_wrapper import HeavenlyCloudServiceWrapper
+from sdk.fake_heavenly_cloud import FakeHeavenlyCloud
+from sdk.heavenly_cloud_service import HeavenlyCloudService
+from vm_details_cache import VmDetailsCache
+
+
+class TestVmDetailsCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = VmDetailsCache(ttl=30, max_entries=2)
+
+    def test_counts_hits_and_misses(self):
+        vm_details = Mock()
+        self.assertIsNone(self.cache.get('heaven', 'vm-1'))
+        self.cache.put('heaven', 'vm-1', vm_details)
+
+        self.assertIs(self.cache.get('heaven', 'vm-1'), vm_details)
+        self.assertIsNone(self.cache.get('hell', 'vm-1'))
+        self.assertEqual(self.cache.stats(), {'hits': 1, 'misses': 2, 'hit_rate': 1 / 3.0, 'evictions': 0,
+                                              'stale_puts': 0, 'entries': 1})
+
+    def test_entries_expire(self):
+        self.cache.put('heaven', 'vm-1', Mock())
+
+        with patch('vm_details_cache.time.time', return_value=1e12):
+            self.assertIsNone(self.cache.get('heaven', 'vm-1'))
+
+    def test_evicts_least_recently_used(self):
+        self.cache.put('heaven', 'vm-1', Mock())
+        self.cache.put('heaven', 'vm-2', Mock())
+        self.cache.get('heaven', 'vm-1')
+        self.cache.put('heaven', 'vm-3', Mock())
+
+        self.assertIsNotNone(self.cache.get('heaven', 'vm-1'))
+        self.assertIsNone(self.cache.get('heaven', 'vm-2'))
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+
+    def test_invalidate(self):
+        self.cache.put('heaven', 'vm-1', Mock())
+        self.cache.invalidate('heaven', 'vm-1')
+
+        self.assertIsNone(self.cache.get('heaven', 'vm-1'))
+
+    def test_details_read_before_an_invalidation_are_not_stored(self):
+        generation = self.cache.generation()
+        self.cache.invalidate('heaven', 'vm-1')
+        self.cache.put('heaven', 'vm-1', Mock(), generation)
+        self.cache.put('heaven', 'vm-2', Mock(), generation)
+
+        self.assertIsNone(self.cache.get('heaven', 'vm-1'))
+        self.assertIsNotNone(self.cache.get('heaven', 'vm-2'))
+        self.assertEqual(self.cache.stats()['stale_puts'], 1)
+
+    def test_forgotten_invalidations_drop_older_reads(self):
+        generation = self.cache.generation()
+        for vm_uid in ('vm-1', 'vm-2', 'vm-3'):
+            self.cache.invalidate('heaven', vm_uid)
+        self.cache.put('heaven', 'vm-1', Mock(), generation)
+
+        self.assertIsNone(self.cache.get('heaven', 'vm-1'))
+
+
+class TestCachedVmDetails(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = FakeHeavenlyCloud(seed=1)
+        HeavenlyCloudService.set_backend(self.fake)
+        self.instance = self.fake.seed_instances(1)[0]
+        self.cloud_provider_resource = Mock()
+        self.cloud_provider_resource.name = 'heaven'
+        self.requests_json = json.dumps({'items': [{'deployedAppJson': {
+            'name': self.instance.name, 'address': self.instance.private_ip,
+            'vmdetails': {'uid': self.instance.id}}}]})
+        self.cache_patch = patch('heavenly_cloud_service_wrapper.vm_details_cache', VmDetailsCache())
+        self.cache_patch.start()
+
+    def tearDown(self):
+        self.cache_patch.stop()
+        HeavenlyCloudService.set_backend(None)
+
+    def get_vm_details(self):
+        return HeavenlyCloudServiceWrapper.get_vm_details(self.cloud_provider_resource, Mock(is_cancelled=False),
+                                                          self.requests_json)
+
+    def test_repeated_requests_are_served_from_cache(self):
+        first = self.get_vm_details()
+        second = self.get_vm_details()
+
+        self.assertIs(first[0], second[0])
+        self.assertEqual(self.fake.calls['get_instance'], 1)
+
+    def test_power_operations_invalidate(self):
+        self.get_vm_details()
+        HeavenlyCloudServiceWrapper.power_off(self.cloud_provider_resource, self.instance.id)
+        self.get_vm_details()
+
+        self.assertEqual(self.fake.calls['get_instance'], 2)
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for `VmDetailsTemplate`
+"""
+
+import json
+import unittest
+
+from cloudshell.cp.core.models import VmDetailsProperty
+
+from data_model import HeavenResidentInstance
+from vm_details_template import VmDetailsTemplate, FrozenVmDetailsProperty, InstanceProperty, DEFAULT_TEMPLATE, \
+    ANGEL_DEPLOYMENT_PATH, template_for, register_template, mac_address
+
+
+def instance(vm_id, name, private_ip):
+    return HeavenResidentInstance(name, 'description', 'image', 'cloud', vm_id, private_ip, '8.8.8.8')
+
+
+def dumps(obj):
+    return json.dumps(obj, default=lambda o: o.__dict__, sort_keys=True)
+
+
+class TestVmDetailsTemplate(unittest.TestCase):
+
+    def setUp(self):
+        self.vm_instance = instance('uid1', 'vm1', '10.0.0.1')
+
+    def test_static_properties_are_shared_between_instances(self):
+        other_instance = instance('uid2', 'vm2', '10.0.0.2')
+
+        first = DEFAULT_TEMPLATE.instance_data(self.vm_instance)
+        second = DEFAULT_TEMPLATE.instance_data(other_instance)
+
+        self.assertIs(first[0], second[0])
+        self.assertIs(first[2], second[2])
+        self.assertEqual((first[1].value, second[1].value), ('vm1', 'vm2'))
+        self.assertIs(DEFAULT_TEMPLATE.network_data(self.vm_instance)[0].networkData[0],
+                      DEFAULT_TEMPLATE.network_data(other_instance)[0].networkData[0])
+
+    def test_shared_properties_cannot_be_modified(self):
+        shared = DEFAULT_TEMPLATE.instance_data(self.vm_instance)[0]
+
+        with self.assertRaises(AttributeError):
+            shared.value = 'huge'
+        self.assertEqual(shared.value, 'not so big')
+
+    def test_output_matches_the_per_instance_construction(self):
+        instance_data = DEFAULT_TEMPLATE.instance_data(self.vm_instance)
+
+        self.assertEqual(dumps(instance_data), dumps([
+            VmDetailsProperty(key='Cloud Size', value='not so big'),
+            VmDetailsProperty(key='Instance Name', value='vm1'),
+            VmDetailsProperty(key='Hidden stuff', value='something not for UI', hidden=True)]))
+
+        network_data = DEFAULT_TEMPLATE.network_data(self.vm_instance)
+        self.assertEqual([(nic.interfaceId, nic.isPrimary, nic.privateIpAddress, nic.publicIpAddress)
+                          for nic in network_data], [(0, True, '10.0.0.0', '8.8.8.0'), (1, False, '10.0.0.1', '8.8.8.1')])
+        self.assertEqual([prop.key for prop in network_data[1].networkData], ['Device Index', 'MAC Address', 'Speed'])
+
+    def test_mac_address_is_stable_per_instance_interface(self):
+        self.assertEqual(mac_address('uid1', 1), mac_address('uid1', 1))
+        self.assertNotEqual(mac_address('uid1', 0), mac_address('uid1', 1))
+        self.assertNotEqual(mac_address('uid1', 0), mac_address('uid2', 0))
+        self.assertRegexpMatches(mac_address(None, 0), r'^02(:[0-9a-f]{2}){5}$')
+
+    def test_unknown_instance(self):
+        self.assertEqual(DEFAULT_TEMPLATE.instance_data(None)[1].value, 'dummy')
+        self.assertEqual(len(DEFAULT_TEMPLATE.network_data(None)), 2)
+
+    def test_template_per_deployment_model(self):
+        template = VmDetailsTemplate([FrozenVmDetailsProperty(key='Kind', value='custom'),
+                                      InstanceProperty('Address', lambda vm_instance: vm_instance.private_ip)],
+                                     interface_count=1)
+        register_template('Custom.Deployment', template)
+
+        self.assertIs(template_for('Custom.Deployment'), template)
+        self.assertIs(template_for(ANGEL_DEPLOYMENT_PATH), DEFAULT_TEMPLATE)
+        self.assertIs(template_for(None), DEFAULT_TEMPLATE)
+        self.assertEqual([prop.value for prop in template.instance_data(self.vm_instance)], ['custom', '10.0.0.1'])
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for `WarmPool`
+"""
+
+import json
+import threading
+import time
+import unittest
+
+from cloudshell.cp.core.models import CreateKeys, PrepareCloudInfra
+from mock import Mock, PropertyMock, patch
+
+from benchmarks import driver_harness, request_factory
+from cancellation import OperationCancelledException, cancellation_watcher
+from driver_runtime import driver_runtime
+from heavenly_cloud_service_wrapper import HeavenlyCloudServiceWrapper
+from sdk.fake_heavenly_cloud import FakeHeavenlyCloud, LatencyDistribution, OperationProfile
+from sdk.heavenly_cloud_service import HeavenlyCloudService
+from warm_pool import InstancePool, KeyPairPool, SubnetPool, WarmPool
+
+
+def cloud_provider_resource(subnet_pool_size='0', key_pair_pool_size='0', instance_pool_max_size='0'):
+    resource = Mock(warm_subnet_pool_size=subnet_pool_size, warm_key_pair_pool_size=key_pair_pool_size,
+                    warm_instance_pool_max_size=instance_pool_max_size)
+    resource.name = 'heaven'
+    return resource
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.005)
+    return condition()
+
+
+class TestWarmPool(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = WarmPool()
+        self.addCleanup(self.pool.close)
+        self.created = []
+
+    def create(self):
+        self.created.append('item{0}'.format(len(self.created)))
+        return self.created[-1]
+
+    def test_refills_after_claims(self):
+        self.assertIsNone(self.pool.claim('key', 2, self.create))
+        self.assertTrue(wait_for(lambda: self.pool.ready('key') == 2))
+
+        self.assertIn(self.pool.claim('key', 2, self.create), ['item0', 'item1'])
+        self.assertTrue(wait_for(lambda: self.pool.ready('key') == 2))
+
+        stats = self.pool.stats()
+        self.assertEqual((stats['claims'], stats['hits'], stats['misses'], stats['refills']), (2, 1, 1, 3))
+        self.assertEqual(stats['hit_rate'], 0.5)
+        self.assertGreater(stats['max_refill_lag_seconds'], 0)
+
+    def test_disabled_pool_does_not_create(self):
+        self.assertIsNone(self.pool.claim('key', 0, self.create))
+
+        self.assertEqual(self.created, [])
+        self.assertEqual(self.pool.stats()['claims'], 0)
+
+    def test_counts_refill_errors(self):
+        self.pool.claim('key', 1, Mock(side_effect=ValueError('quota exceeded')))
+
+        self.assertTrue(wait_for(lambda: self.pool.stats()['refill_errors'] == 1))
+        self.assertIn('quota exceeded', self.pool.last_refill_error)
+        self.assertEqual(self.pool.ready('key'), 0)
+
+    def test_close_destroys_ready_items(self):
+        destroyed = []
+        self.pool.claim('key', 2, self.create, destroyed.append)
+        wait_for(lambda: self.pool.ready('key') == 2)
+
+        self.pool.close()
+
+        self.assertEqual(sorted(destroyed), ['item0', 'item1'])
+        self.assertEqual(self.pool.stats()['ready'], 0)
+
+    def test_close_waits_for_the_refills_in_flight(self):
+        created = threading.Event()
+        release = threading.Event()
+        destroyed = []
+
+        def slow_create():
+            created.set()
+            release.wait(2)
+            return 'late'
+
+        self.pool.claim('key', 1, slow_create, destroyed.append)
+        created.wait(2)
+        threading.Timer(0.05, release.set).start()
+        self.pool.close()
+
+        self.assertEqual(destroyed, ['late'])
+
+
+class TestSandboxPools(unittest.TestCase):
+
+    def setUp(self):
+        self.fake_cloud = FakeHeavenlyCloud()
+        HeavenlyCloudService.set_backend(self.fake_cloud)
+        self.addCleanup(HeavenlyCloudService.set_backend, None)
+
+    def test_assigns_ready_subnets(self):
+        pool = SubnetPool()
+        self.addCleanup(pool.close)
+        resource = cloud_provider_resource(subnet_pool_size='2')
+
+        first_id = pool.prepare_subnet(resource, '10.0.0.0/24', True, [])
+        self.assertTrue(wait_for(lambda: pool.ready(('heaven', 24)) == 2))
+        second_id = pool.prepare_subnet(resource, '10.0.1.0/24', False, [])
+
+        self.assertEqual(self.fake_cloud.calls['prepare_subnet'], 1)
+        self.assertEqual(self.fake_cloud.subnets[first_id]['cidr'], '10.0.0.0/24')
+        self.assertEqual(self.fake_cloud.subnets[second_id], {'cidr': '10.0.1.0/24', 'is_public': False,
+                                                               'prefix_length': 24})
+        self.assertEqual(pool.ready(('heaven', 16)), 0)
+
+        # the ready subnets, and the one a refill may still be creating, are deleted
+        pool.close()
+        self.assertTrue(wait_for(lambda: len(self.fake_cloud.subnets) == 2))
+
+    def test_disabled_subnet_pool_prepares_subnets(self):
+        pool = SubnetPool()
+
+        pool.prepare_subnet(cloud_provider_resource(), '10.0.0.0/24', True, [])
+
+        self.assertEqual(self.fake_cloud.calls, {'prepare_subnet': 1})
+
+    def test_sandboxes_get_their_own_key_pair(self):
+        pool = KeyPairPool()
+        self.addCleanup(pool.close)
+
+        shared_key = pool.get_ssh_key(cloud_provider_resource(), 'r1')
+        self.assertEqual(pool.get_ssh_key(cloud_provider_resource(), 'r2'), shared_key)
+
+        resource = cloud_provider_resource(key_pair_pool_size='1')
+        keys = [pool.get_ssh_key(resource, 'r3')]
+        wait_for(lambda: pool.ready('heaven') == 1)
+        keys.append(pool.get_ssh_key(resource, 'r4'))
+
+        self.assertEqual(len(set(keys + [shared_key])), 3)
+        self.assertEqual(pool.stats()['hits'], 1)
+        self.assertEqual(self.fake_cloud.ssh_key_reservations, {keys[0]: 'r3', keys[1]: 'r4'})
+
+    def test_sandbox_key_pairs_are_deleted(self):
+        pool = KeyPairPool()
+        resource = cloud_provider_resource(key_pair_pool_size='1')
+        shared_key = pool.get_ssh_key(cloud_provider_resource(), 'r1')
+        sandbox_key = pool.get_ssh_key(resource, 'r2')
+        self.assertTrue(wait_for(lambda: pool.ready('heaven') == 1))
+
+        HeavenlyCloudService.delete_sandbox_ssh_key(resource, 'r1')
+        HeavenlyCloudService.delete_sandbox_ssh_key(resource, 'r2')
+        pool.close()
+
+        self.assertEqual(list(self.fake_cloud.ssh_keys.values()), [shared_key])
+        self.assertNotIn(sandbox_key, self.fake_cloud.ssh_keys)
+
+    def test_claimed_key_pair_is_deleted_when_its_command_is_cancelled(self):
+        pool = KeyPairPool()
+        self.addCleanup(pool.close)
+        resource = cloud_provider_resource(key_pair_pool_size='1')
+        pool.get_ssh_key(resource, 'r1')
+        self.assertTrue(wait_for(lambda: pool.ready('heaven') == 1))
+        ready_key, = set(self.fake_cloud.ssh_keys) - set(self.fake_cloud.ssh_key_reservations)
+        HeavenlyCloudService.add_interceptor(cancellation_watcher)
+        self.addCleanup(HeavenlyCloudService.remove_interceptor, cancellation_watcher)
+        self.addCleanup(cancellation_watcher.close)
+
+        with self.assertRaises(OperationCancelledException):
+            with cancellation_watcher.scope(Mock(is_cancelled=True)):
+                pool.get_ssh_key(resource, 'r2')
+
+        self.assertNotIn(ready_key, self.fake_cloud.ssh_keys)
+
+    def test_cancelled_prepare_sandbox_infra_deletes_its_key_pair(self):
+        pool = KeyPairPool()
+        self.addCleanup(pool.close)
+        resource = cloud_provider_resource(key_pair_pool_size='1')
+        resource.prefetch_images = ''
+        infra_action = PrepareCloudInfra()
+        infra_action.actionId = 'infra'
+        infra_action.actionParams = Mock(cidr='10.0.0.0/16')
+        create_keys_action = CreateKeys()
+        create_keys_action.actionId = 'keys'
+        cancellation_context = Mock()
+        checks = []
+        # cancelled once the keys are created, at the third check
+        type(cancellation_context).is_cancelled = PropertyMock(side_effect=lambda: checks.append(True) or
+                                                               len(checks) > 2)
+
+        with patch('heavenly_cloud_service_wrapper.key_pair_pool', pool):
+            results = HeavenlyCloudServiceWrapper.prepare_sandbox_infra(Mock(), resource, infra_action,
+                                                                        create_keys_action, [],
+                                                                        cancellation_context, 'cancelled sandbox')
+
+        self.assertEqual([result.success for result in results], [False, False])
+        self.assertIn('key pair cancelled sandbox', results[1].infoMessage)
+        self.assertEqual(self.fake_cloud.ssh_key_reservations, {})
+
+    def _deploy(self, pool, resource, name, configuration=('angel', 'small', 'centos', 2, 10)):
+        return pool.deploy_instance(
+            resource, configuration,
+            lambda: HeavenlyCloudService.create_stopped_angel_instance(resource, 2, 10, 'small', 'centos'),
+            lambda: HeavenlyCloudService.create_angel_instance('user', 'pass', resource, name, 2, 10, 'small',
+                                                               'centos', {}),
+            'user', 'pass', name, {'subnet': 0})
+
+    def test_deploys_activate_stopped_instances(self):
+        pool = InstancePool()
+        self.addCleanup(pool.close)
+        resource = cloud_provider_resource(instance_pool_max_size='4')
+        key = ('heaven', 'angel', 'small', 'centos', 2, 10)
+
+        self.assertEqual(self._deploy(pool, resource, 'first').name, 'first')
+        self.assertTrue(wait_for(lambda: pool.ready(key) == 1))
+        vm_instance = self._deploy(pool, resource, 'second')
+
+        fake_instance = self.fake_cloud.instances[vm_instance.id]
+        self.assertEqual((fake_instance.name, fake_instance.power_state, fake_instance.network_data),
+                         ('second', 'running', {'subnet': 0}))
+        self.assertEqual(self.fake_cloud.calls['create_angel_instance'], 1)
+        self.assertEqual(self.fake_cloud.calls['activate_instance'], 1)
+        self.assertIn('heaven/angel/small/centos/2/10', pool.stats()['configurations'])
+
+    def test_pool_follows_the_deploy_rate(self):
+        pool = InstancePool()
+        self.addCleanup(pool.close)
+        resource = cloud_provider_resource(instance_pool_max_size='3')
+        key = ('heaven', 'angel', 'small', 'centos', 2, 10)
+        for operation_name in ('create_angel_instance', 'create_stopped_angel_instance'):
+            self.fake_cloud.operation_profiles[operation_name] = OperationProfile(
+                latency=LatencyDistribution.constant(0.05))
+
+        deploys = [threading.Thread(target=self._deploy, args=(pool, resource, 'app{0}'.format(index)))
+                   for index in range(4)]
+        for deploy in deploys:
+            deploy.start()
+        for deploy in deploys:
+            deploy.join()
+        self._deploy(pool, resource, 'app4')
+
+        # several deploys while an instance is created need several ready instances
+        configuration = pool.stats()['configurations']['/'.join(str(part) for part in key)]
+        self.assertEqual(configuration['target_size'], 3)
+        self.assertGreater(configuration['deploys_per_minute'], 60)
+
+    def test_disabled_instance_pool_creates_instances(self):
+        pool = InstancePool()
+
+        self._deploy(pool, cloud_provider_resource(), 'app')
+        self._deploy(pool, cloud_provider_resource(), 'app')
+
+        self.assertEqual(self.fake_cloud.calls, {'create_angel_instance': 2})
+
+    def test_man_deploys_activate_stopped_man_instances(self):
+        self.addCleanup(driver_runtime.shutdown)
+        driver = driver_harness.create_driver()
+        self.addCleanup(driver.cleanup)
+        context = driver_harness.resource_context(attributes=driver_harness.cloud_provider_attributes(
+            **{'Warm Instance Pool Max Size': '4'}))
+        request = request_factory.deploy_request(deployment_path=request_factory.MAN_DEPLOYMENT_PATH)
+
+        with driver_harness.fake_cloudshell_session():
+            driver.Deploy(context, request, driver_harness.cancellation_context())
+            self.assertTrue(wait_for(lambda: any(instance.power_state == 'stopped'
+                                                 for instance in self.fake_cloud.instances.values())))
+            response = driver.Deploy(context, request, driver_harness.cancellation_context())
+
+        self.assertTrue(json.loads(response)['driverResponse']['actionResults'][0]['success'])
+        self.assertEqual(self.fake_cloud.calls['create_man_instance'], 1)
+        self.assertEqual(self.fake_cloud.calls['activate_instance'], 1)
+        self.assertNotIn('create_angel_instance', self.fake_cloud.calls)
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())